@@ -0,0 +1,157 @@
+"""
+Async Video Integration
+asyncio facade over EduNabhaVideoIntegration: database work, and the file
+I/O the integration does along with it, runs on dedicated executor threads so
+an async server never blocks its event loop on SQLite or the disk
+"""
+
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from instrumentation import get_logger
+from video_database_integration import EduNabhaVideoIntegration
+
+
+logger = get_logger('async_integration')
+
+
+# Integration methods that only read the database; they run on the reader
+# pool, each reader thread with its own connection. Everything else goes to
+# the single writer thread, in submission order.
+READ_METHODS = frozenset([
+    'get_offline_videos_for_react',
+    'get_storage_info_enhanced',
+    'search_videos_enhanced',
+    'get_recommendations',
+    'get_similar_videos',
+    'get_course_playlist',
+    'get_upload_status',
+    'get_download_plan',
+    'select_rendition_for_device',
+    'plan_prefetch',
+    'export_study_data',
+    'get_trash_listing',
+])
+
+
+class AsyncEduNabhaVideoIntegration:
+    """
+    Awaitable version of every EduNabhaVideoIntegration method
+
+    SQLite connections cannot be shared across threads, so the writer thread
+    and each reader thread open their own integration on db_path. Use as
+    ``async with AsyncEduNabhaVideoIntegration(path) as integration:`` and then
+    ``await integration.add_downloaded_video(...)`` etc.
+    """
+
+    def __init__(self, db_path: str = "edunabha_videos.db", upload_dir: str = None,
+                 read_workers: int = 4):
+        """
+        Args:
+            db_path: Video database path
+            upload_dir: Upload directory (see EduNabhaVideoIntegration)
+            read_workers: Threads serving read-only queries concurrently
+        """
+        self.db_path = db_path
+        self.upload_dir = upload_dir
+        self.read_workers = read_workers
+        self._writer_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='edunabha-db')
+        self._reader_executor = ThreadPoolExecutor(max_workers=read_workers,
+                                                   thread_name_prefix='edunabha-read')
+        self._local = threading.local()
+        self._integration = None
+        self._open_lock = asyncio.Lock()
+
+    async def open(self):
+        """Open the writer connection (creating the schema and upload directory)"""
+        if self._integration is None:
+            # Concurrent first calls must not each open (and leak) a writer integration
+            async with self._open_lock:
+                if self._integration is None:
+                    self._integration = await self._run(
+                        self._writer_executor, EduNabhaVideoIntegration, self.db_path, self.upload_dir
+                    )
+                    self.upload_dir = self._integration.upload_dir
+        return self
+
+    async def close(self):
+        """Close every connection and stop the executor threads"""
+        if self._integration is not None:
+            await self._run(self._writer_executor, self._integration.close)
+            self._integration = None
+        # Waiting on the reader threads blocks, so it runs on the loop's default executor
+        await self._run(None, self._shutdown_readers)
+        self._writer_executor.shutdown(wait=True)
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    def __getattr__(self, name):
+        if name.startswith('_') or not callable(getattr(EduNabhaVideoIntegration, name, None)):
+            raise AttributeError(name)
+
+        async def method(*args, **kwargs):
+            if name in READ_METHODS:
+                return await self.read(name, *args, **kwargs)
+            return await self.write(name, *args, **kwargs)
+
+        method.__name__ = name
+        return method
+
+    async def write(self, name: str, *args, **kwargs):
+        """Run an integration method on the writer thread"""
+        await self.open()
+        return await self._run(self._writer_executor, getattr(self._integration, name), *args, **kwargs)
+
+    async def read(self, name: str, *args, **kwargs):
+        """Run a read-only integration method on a reader thread"""
+        await self.open()
+        return await self._run(self._reader_executor, self._call_reader, name, args, kwargs)
+
+    async def get_study_dashboard(self) -> dict:
+        """Study dashboard with its independent queries run concurrently"""
+        await self.open()
+        names = list(EduNabhaVideoIntegration.DASHBOARD_QUERIES)
+        results = await asyncio.gather(*[
+            self._run(self._reader_executor, self._query_reader, name) for name in names
+        ])
+        return EduNabhaVideoIntegration.build_study_dashboard(dict(zip(names, results)))
+
+    # Internal helpers
+    @staticmethod
+    async def _run(executor, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
+
+    def _reader(self) -> EduNabhaVideoIntegration:
+        if not hasattr(self._local, 'integration'):
+            self._local.integration = EduNabhaVideoIntegration(self.db_path, self.upload_dir, read_only=True)
+        return self._local.integration
+
+    def _call_reader(self, name: str, args: tuple, kwargs: dict):
+        return getattr(self._reader(), name)(*args, **kwargs)
+
+    def _query_reader(self, name: str):
+        return EduNabhaVideoIntegration.DASHBOARD_QUERIES[name](self._reader().db)
+
+    def _shutdown_readers(self):
+        # Each reader connection is closed on the thread that opened it; the
+        # barrier holds every thread until all of them have picked up a task
+        barrier = threading.Barrier(self.read_workers)
+
+        def close_local():
+            integration = getattr(self._local, 'integration', None)
+            barrier.wait()
+            if integration is not None:
+                integration.close()
+                del self._local.integration
+
+        futures = [self._reader_executor.submit(close_local) for _ in range(self.read_workers)]
+        for future in futures:
+            future.result()
+        self._reader_executor.shutdown(wait=True)
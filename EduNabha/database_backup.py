@@ -0,0 +1,450 @@
+"""
+Database Backup
+Point-in-time snapshots of the video database, copied with SQLite's online
+backup API a few pages at a time so writers are only ever blocked for one
+step. Snapshots are gzip-compressed with a JSON manifest holding SHA-256
+digests, pruned by a retention policy, restored in place, and can be opened
+read-only so heavy reports do not contend with the live database.
+
+Usage: python database_backup.py --db edunabha_videos.db [create|list|prune|restore NAME]
+"""
+
+import argparse
+import datetime
+import gzip
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Dict, List
+from urllib.parse import quote
+
+from instrumentation import configure_logging, connect, get_logger
+
+
+logger = get_logger('database_backup')
+
+SNAPSHOT_SUFFIX = '.db.gz'
+MANIFEST_SUFFIX = '.json'
+OPEN_DIR = '.open'  # Decompressed snapshots opened for reports
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+class BackupError(Exception):
+    """Snapshot missing, corrupt or not restorable; status_code is the HTTP status to report"""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class SnapshotReader:
+    """
+    Read-only connection to a decompressed snapshot
+
+    Has the db_path/conn pair that VideoAnalytics and the other report
+    classes read, so they can run against a snapshot instead of the live file.
+    """
+
+    def __init__(self, path: str, name: str):
+        self.db_path = path
+        self.name = name
+        # immutable: the file never changes, so SQLite skips locking entirely
+        self.conn = connect(f"file:{quote(os.path.abspath(path))}?mode=ro&immutable=1",
+                            uri=True)
+        self.conn.row_factory = sqlite3.Row
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class BackupManager:
+    """Snapshots of a VideoDatabase kept in backup_dir"""
+
+    def __init__(self, db, backup_dir: str, pages_per_step: int = 256, step_pause: float = 0.002,
+                 max_restarts: int = 3, compress_level: int = 6):
+        """
+        Args:
+            db: VideoDatabase instance to back up and restore into
+            backup_dir: Where snapshots and their manifests are written
+            pages_per_step: Pages copied while holding the read lock
+            step_pause: Seconds between steps, leaving writers a window
+            max_restarts: Restarts caused by other writers before the copy is
+                finished in one step (blocking writers for its duration)
+            compress_level: gzip level for the snapshot files
+        """
+        self.db = db
+        self.backup_dir = backup_dir
+        self.pages_per_step = pages_per_step
+        self.step_pause = step_pause
+        self.max_restarts = max_restarts
+        self.compress_level = compress_level
+
+    # Snapshots
+    def create(self, label: str = None) -> Dict:
+        """
+        Take a snapshot of the live database
+
+        Returns:
+            The snapshot's manifest
+        """
+        os.makedirs(self.backup_dir, exist_ok=True)
+        started = time.perf_counter()
+        created = datetime.datetime.now(datetime.timezone.utc)
+        name = f"edunabha-{created.strftime('%Y%m%dT%H%M%S%fZ')}"
+        raw_path = os.path.join(self.backup_dir, f".{name}.db")
+        steps = restarts = 0
+        previous = None
+
+        def progress(status, remaining, total):
+            nonlocal steps, restarts, previous
+            steps += 1
+            if status == sqlite3.SQLITE_OK and previous is not None and remaining >= previous:
+                restarts += 1  # Another connection wrote; SQLite started over
+                if restarts > self.max_restarts:
+                    raise _TooBusy()
+            previous = remaining
+            if remaining and self.step_pause:
+                time.sleep(self.step_pause)
+
+        target = sqlite3.connect(raw_path)
+        try:
+            # Changes made through this connection meanwhile are copied as they
+            # happen; a write from another connection restarts the copy, so
+            # when that keeps happening the rest is copied in a single step
+            try:
+                self.db.conn.backup(target, pages=self.pages_per_step, progress=progress)
+            except _TooBusy:
+                logger.info("Database busy; finishing snapshot %s in one step", name,
+                            extra={'restarts': restarts})
+                self.db.conn.backup(target)
+            check = target.execute("PRAGMA quick_check").fetchone()[0]
+            user_version = target.execute("PRAGMA user_version").fetchone()[0]
+            page_count = target.execute("PRAGMA page_count").fetchone()[0]
+            videos = target.execute("SELECT COUNT(*) FROM videos").fetchone()[0]
+        finally:
+            target.close()
+        try:
+            if check != 'ok':
+                raise BackupError(f"Snapshot failed its integrity check: {check}", 500)
+            manifest = {
+                'name': name,
+                'label': label,
+                'created': created.isoformat(),
+                'userVersion': user_version,
+                'pages': page_count,
+                'videos': videos,
+                **self._compress(raw_path, self._path(name))
+            }
+        finally:
+            os.remove(raw_path)
+        self._write_manifest(manifest)
+        logger.info("Snapshot %s written", name, extra={
+            'snapshot': name, 'bytes': manifest['compressedSize'], 'steps': steps,
+            'duration_ms': round((time.perf_counter() - started) * 1000, 1)
+        })
+        return manifest
+
+    def list(self) -> List[Dict]:
+        """Manifests of every snapshot, newest first"""
+        if not os.path.isdir(self.backup_dir):
+            return []
+        manifests = []
+        for entry in os.scandir(self.backup_dir):
+            if entry.name.endswith(MANIFEST_SUFFIX) and not entry.name.startswith('.'):
+                try:
+                    with open(entry.path, encoding='utf-8') as f:
+                        manifests.append(json.load(f))
+                except (OSError, ValueError) as e:
+                    logger.warning("Unreadable snapshot manifest %s: %s", entry.path, e)
+        return sorted(manifests, key=lambda m: m['created'], reverse=True)
+
+    def get(self, name: str = 'latest') -> Dict:
+        """Manifest of a snapshot by name, or the newest for 'latest'"""
+        snapshots = self.list()
+        if name == 'latest':
+            if not snapshots:
+                raise BackupError("No snapshots have been taken", 404)
+            return snapshots[0]
+        for manifest in snapshots:
+            if manifest['name'] == name:
+                return manifest
+        raise BackupError(f"Snapshot not found: {name}", 404)
+
+    def verify(self, name: str = 'latest') -> Dict:
+        """Check a snapshot file against its manifest without decompressing it"""
+        manifest = self.get(name)
+        digest = self._file_sha256(self._path(manifest['name']))
+        if digest != manifest['compressedSha256']:
+            raise BackupError(f"Snapshot {manifest['name']} does not match its checksum", 422)
+        return manifest
+
+    # Schedule and retention
+    def run_scheduled(self, interval_hours: float = 24, keep_last: int = 7, keep_daily: int = 14) -> Dict:
+        """
+        Snapshot if the newest one is older than interval_hours, then prune
+
+        Meant to be called often (cron, BackupThread); it only does work when due.
+        """
+        snapshots = self.list()
+        created = None
+        if snapshots:
+            age = datetime.datetime.now(datetime.timezone.utc) - \
+                datetime.datetime.fromisoformat(snapshots[0]['created'])
+        if not snapshots or age >= datetime.timedelta(hours=interval_hours):
+            created = self.create(label='scheduled')
+        return {'created': created, 'removed': self.prune(keep_last, keep_daily)}
+
+    def prune(self, keep_last: int = 7, keep_daily: int = 14) -> List[str]:
+        """
+        Delete snapshots outside the retention policy
+
+        Args:
+            keep_last: Newest snapshots always kept
+            keep_daily: Days (counting back from the newest snapshot) for which
+                the last snapshot of the day is kept
+
+        Returns:
+            Names of the removed snapshots
+        """
+        snapshots = self.list()
+        keep = {m['name'] for m in snapshots[:max(keep_last, 1)]}
+        if snapshots and keep_daily:
+            newest_day = snapshots[0]['created'][:10]
+            cutoff = (datetime.date.fromisoformat(newest_day) - datetime.timedelta(days=keep_daily - 1)).isoformat()
+            days = set()
+            for manifest in snapshots:
+                day = manifest['created'][:10]
+                if day >= cutoff and day not in days:
+                    days.add(day)
+                    keep.add(manifest['name'])
+
+        removed = []
+        for manifest in snapshots:
+            if manifest['name'] not in keep:
+                self._delete(manifest['name'])
+                removed.append(manifest['name'])
+        if removed:
+            logger.info("Pruned %d snapshots", len(removed), extra={'removed': removed})
+        return removed
+
+    # Restore and read
+    def restore(self, name: str = 'latest', safety_snapshot: bool = True) -> Dict:
+        """
+        Replace the live database's contents with a snapshot
+
+        The pages are copied into the open connection in one backup step, so
+        other connections see either the old or the restored database. The
+        schema is then brought up to date (the snapshot may predate migrations).
+
+        Args:
+            name: Snapshot name or 'latest'
+            safety_snapshot: Snapshot the current contents first
+
+        Returns:
+            {'restored': manifest, 'safetySnapshot': manifest or None}
+        """
+        manifest = self.get(name)
+        started = time.perf_counter()
+        raw_path = os.path.join(self.backup_dir, f".restore-{manifest['name']}.db")
+        self._decompress(manifest, raw_path)
+        try:
+            source = sqlite3.connect(raw_path)
+            try:
+                check = source.execute("PRAGMA quick_check").fetchone()[0]
+                if check != 'ok':
+                    raise BackupError(f"Snapshot {manifest['name']} is not a valid database: {check}", 422)
+                safety = self.create(label='pre-restore') if safety_snapshot else None
+                self.db.conn.commit()
+                source.backup(self.db.conn)
+            finally:
+                source.close()
+        finally:
+            os.remove(raw_path)
+        self.db.initialize_database()
+        logger.info("Restored snapshot %s", manifest['name'], extra={
+            'snapshot': manifest['name'],
+            'duration_ms': round((time.perf_counter() - started) * 1000, 1)
+        })
+        return {'restored': manifest, 'safetySnapshot': safety}
+
+    def open(self, name: str = 'latest') -> SnapshotReader:
+        """
+        Open a snapshot read-only; the decompressed copy is kept for the next
+        report until the snapshot is pruned
+        """
+        manifest = self.get(name)
+        path = os.path.join(self.backup_dir, OPEN_DIR, f"{manifest['name']}.db")
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._decompress(manifest, path + '.tmp')
+            os.replace(path + '.tmp', path)
+        return SnapshotReader(path, manifest['name'])
+
+    # Files
+    def _path(self, name: str) -> str:
+        return os.path.join(self.backup_dir, name + SNAPSHOT_SUFFIX)
+
+    def _write_manifest(self, manifest: Dict):
+        path = os.path.join(self.backup_dir, manifest['name'] + MANIFEST_SUFFIX)
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(path + '.tmp', path)
+
+    def _delete(self, name: str):
+        for path in (os.path.join(self.backup_dir, name + MANIFEST_SUFFIX), self._path(name),
+                     os.path.join(self.backup_dir, OPEN_DIR, f"{name}.db"),
+                     os.path.join(self.backup_dir, OPEN_DIR, f"{name}.db.analytics")):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _compress(self, raw_path: str, path: str) -> Dict:
+        """gzip raw_path to path, hashing both sides in the same pass"""
+        raw_digest = hashlib.sha256()
+        with open(raw_path, 'rb') as src, open(path + '.tmp', 'wb') as out:
+            with gzip.GzipFile(fileobj=out, mode='wb', compresslevel=self.compress_level, mtime=0) as gz:
+                while True:
+                    block = src.read(COPY_BUFFER_SIZE)
+                    if not block:
+                        break
+                    raw_digest.update(block)
+                    gz.write(block)
+        os.replace(path + '.tmp', path)
+        return {
+            'size': os.path.getsize(raw_path),
+            'sha256': raw_digest.hexdigest(),
+            'compressedSize': os.path.getsize(path),
+            'compressedSha256': self._file_sha256(path)
+        }
+
+    def _decompress(self, manifest: Dict, raw_path: str):
+        """Decompress a snapshot to raw_path, checking both digests"""
+        path = self._path(manifest['name'])
+        if not os.path.exists(path):
+            raise BackupError(f"Snapshot file missing: {path}", 404)
+        compressed_digest, raw_digest = hashlib.sha256(), hashlib.sha256()
+        try:
+            with open(path, 'rb') as src, open(raw_path, 'wb') as out:
+                with gzip.GzipFile(fileobj=_HashingReader(src, compressed_digest), mode='rb') as gz:
+                    while True:
+                        block = gz.read(COPY_BUFFER_SIZE)
+                        if not block:
+                            break
+                        raw_digest.update(block)
+                        out.write(block)
+                compressed_digest.update(src.read())  # Anything gzip left unread
+            if compressed_digest.hexdigest() != manifest['compressedSha256'] or \
+                    raw_digest.hexdigest() != manifest['sha256']:
+                raise BackupError(f"Snapshot {manifest['name']} does not match its checksum", 422)
+        except (OSError, EOFError, zlib.error) as e:
+            os.remove(raw_path)
+            raise BackupError(f"Snapshot {manifest['name']} is unreadable: {e}", 422)
+        except BackupError:
+            os.remove(raw_path)
+            raise
+
+    @staticmethod
+    def _file_sha256(path: str) -> str:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(COPY_BUFFER_SIZE), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+
+class _TooBusy(Exception):
+    """Raised from the backup progress callback to abandon a stepped copy"""
+
+
+class _HashingReader:
+    """File wrapper feeding everything read through a digest"""
+
+    def __init__(self, f, digest):
+        self._f = f
+        self._digest = digest
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._f.read(size)
+        self._digest.update(data)
+        return data
+
+
+class BackupThread(threading.Thread):
+    """Calls BackupManager.run_scheduled in the background with its own connection"""
+
+    def __init__(self, db_path: str, interval_hours: float = 24, check_every: float = 300, **retention):
+        super().__init__(name='edunabha-backup', daemon=True)
+        self.db_path = db_path
+        self.interval_hours = interval_hours
+        self.check_every = check_every
+        self.retention = retention
+        self._stop_event = threading.Event()
+
+    def run(self):
+        from video_database import VideoDatabase
+        db = VideoDatabase(self.db_path)
+        manager = BackupManager(db, f"{self.db_path}.backups")
+        try:
+            while not self._stop_event.is_set():
+                try:
+                    manager.run_scheduled(self.interval_hours, **self.retention)
+                except Exception as e:
+                    logger.exception("Scheduled backup failed: %s", e)
+                self._stop_event.wait(self.check_every)
+        finally:
+            db.close()
+
+    def stop(self, timeout: float = None):
+        self._stop_event.set()
+        self.join(timeout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Snapshot and restore the video database')
+    parser.add_argument('--db', default='edunabha_videos.db')
+    parser.add_argument('--backup-dir', default=None, help="Defaults to '<db>.backups'")
+    parser.add_argument('action', choices=['create', 'list', 'prune', 'scheduled', 'verify', 'restore'])
+    parser.add_argument('name', nargs='?', default='latest')
+    parser.add_argument('--interval-hours', type=float, default=24)
+    parser.add_argument('--keep-last', type=int, default=7)
+    parser.add_argument('--keep-daily', type=int, default=14)
+    args = parser.parse_args()
+    configure_logging()
+
+    from video_database import VideoDatabase
+    db = VideoDatabase(args.db)
+    manager = BackupManager(db, args.backup_dir or f"{args.db}.backups")
+    try:
+        if args.action == 'create':
+            result = manager.create(label='manual')
+        elif args.action == 'list':
+            result = manager.list()
+        elif args.action == 'prune':
+            result = manager.prune(args.keep_last, args.keep_daily)
+        elif args.action == 'scheduled':
+            result = manager.run_scheduled(args.interval_hours, args.keep_last, args.keep_daily)
+        elif args.action == 'verify':
+            result = manager.verify(args.name)
+        else:
+            result = manager.restore(args.name)
+        print(json.dumps(result, indent=2))
+    except BackupError as e:
+        print(json.dumps({'error': str(e)}))
+        raise SystemExit(1)
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,440 @@
+#!/usr/bin/env python3
+"""
+Fuzzy Search
+Typo-tolerant, multilingual title search. Titles and descriptions are
+normalized (Unicode NFKD, accents stripped, casefolded), Hindi (Devanagari)
+and Punjabi (Gurmukhi) text is transliterated to Latin, and common
+romanization variants are folded together (aa/a, ee/i, w/v, doubled
+letters), so "विज्ञान", "vigyaan" and "vigyan" are the same word. Each query
+word is matched against the indexed words through a trigram index, checked
+with a bounded edit distance, and videos are ranked by how closely their
+words match.
+
+The index lives in the search_postings/search_trigrams tables. Triggers queue
+every added, edited or deleted video in search_dirty; sync() indexes the
+queue, and a reader that cannot write scores the few queued videos directly.
+
+Usage: python fuzzy_search.py --db edunabha_videos.db [--rebuild] [query ...]
+"""
+
+import argparse
+import json
+import re
+import time
+import unicodedata
+from functools import lru_cache
+from typing import Dict, List, Set, Tuple
+
+from instrumentation import configure_logging, get_logger
+
+
+logger = get_logger('fuzzy_search')
+
+
+TITLE_WEIGHT = 1.0
+DESCRIPTION_WEIGHT = 0.5
+PREFIX_MIN_LENGTH = 3  # Shorter query words only match whole words
+SYNC_BATCH = 500  # Videos indexed per transaction
+
+# Romanization variants folded to one spelling, applied in order before
+# doubled letters are collapsed
+SPELLING_FOLDS = (('ph', 'f'), ('w', 'v'), ('z', 'j'), ('q', 'k'), ('ee', 'i'), ('oo', 'u'))
+
+# Devanagari and Gurmukhi to Latin. Consonants carry an inherent "a" that a
+# vowel sign replaces and a virama removes; speakers drop it at the end of a
+# word and between syllables (see _pronounce)
+CONSONANTS = {
+    # Devanagari
+    'क': 'k', 'ख': 'kh', 'ग': 'g', 'घ': 'gh', 'ङ': 'n', 'च': 'ch', 'छ': 'chh', 'ज': 'j', 'झ': 'jh',
+    'ञ': 'n', 'ट': 't', 'ठ': 'th', 'ड': 'd', 'ढ': 'dh', 'ण': 'n', 'त': 't', 'थ': 'th', 'द': 'd',
+    'ध': 'dh', 'न': 'n', 'ऩ': 'n', 'प': 'p', 'फ': 'ph', 'ब': 'b', 'भ': 'bh', 'म': 'm', 'य': 'y',
+    'र': 'r', 'ऱ': 'r', 'ल': 'l', 'ळ': 'l', 'ऴ': 'l', 'व': 'v', 'श': 'sh', 'ष': 'sh', 'स': 's',
+    'ह': 'h',
+    # Gurmukhi
+    'ਕ': 'k', 'ਖ': 'kh', 'ਗ': 'g', 'ਘ': 'gh', 'ਙ': 'n', 'ਚ': 'ch', 'ਛ': 'chh', 'ਜ': 'j', 'ਝ': 'jh',
+    'ਞ': 'n', 'ਟ': 't', 'ਠ': 'th', 'ਡ': 'd', 'ਢ': 'dh', 'ਣ': 'n', 'ਤ': 't', 'ਥ': 'th', 'ਦ': 'd',
+    'ਧ': 'dh', 'ਨ': 'n', 'ਪ': 'p', 'ਫ': 'ph', 'ਬ': 'b', 'ਭ': 'bh', 'ਮ': 'm', 'ਯ': 'y', 'ਰ': 'r',
+    'ਲ': 'l', 'ਵ': 'v', 'ਸ': 's', 'ਹ': 'h', 'ੜ': 'r',
+}
+VOWELS = {
+    'अ': 'a', 'आ': 'a', 'इ': 'i', 'ई': 'i', 'उ': 'u', 'ऊ': 'u', 'ऋ': 'ri', 'ए': 'e', 'ऐ': 'ai',
+    'ओ': 'o', 'औ': 'au', 'ऍ': 'e', 'ऑ': 'o', 'ॐ': 'om',
+    'ਅ': 'a', 'ਆ': 'a', 'ਇ': 'i', 'ਈ': 'i', 'ਉ': 'u', 'ਊ': 'u', 'ਏ': 'e', 'ਐ': 'ai', 'ਓ': 'o',
+    'ਔ': 'au', 'ੲ': '', 'ੳ': '',  # Vowel bearers; their vowel sign follows
+}
+VOWEL_SIGNS = {
+    'ा': 'a', 'ि': 'i', 'ी': 'i', 'ु': 'u', 'ू': 'u', 'ृ': 'ri', 'े': 'e', 'ै': 'ai', 'ो': 'o',
+    'ौ': 'au', 'ॅ': 'e', 'ॉ': 'o',
+    'ਾ': 'a', 'ਿ': 'i', 'ੀ': 'i', 'ੁ': 'u', 'ੂ': 'u', 'ੇ': 'e', 'ੈ': 'ai', 'ੋ': 'o', 'ੌ': 'au',
+}
+NASALS = {'ं': 'n', 'ँ': 'n', 'ः': 'h', 'ਂ': 'n', 'ੰ': 'n', 'ਃ': 'h'}
+VIRAMAS = {'्', '੍'}
+NUKTAS = {'़', '਼'}
+NUKTA_FORMS = {'j': 'z', 'ph': 'f', 's': 'sh'}  # Others are romanized like the plain letter
+SILENT = {'ੱ', 'ऽ'}  # Gurmukhi addak (doubles the next consonant), avagraha
+CONJUNCTS = (('ज्ञ', 'ग्य'),)  # Spelled as pronounced ("gyan", not "jnan")
+
+_INDIC = re.compile('[\u0900-\u0a7f]')
+_WORD = re.compile(r'\w+')
+_DOUBLED = re.compile(r'(.)\1+')
+
+
+def transliterate(text: str) -> str:
+    """Romanize the Devanagari and Gurmukhi in NFD/NFKD text, leaving other characters as they are"""
+    if not _INDIC.search(text):
+        return text
+    for written, spoken in CONJUNCTS:
+        text = text.replace(written, spoken)
+    out = []
+    word = []  # (kind, roman) of the Indic word being read: c(onsonant), v(owel), s(chwa), n(asal)
+    for char in text:
+        if char in CONSONANTS:
+            word += [('c', CONSONANTS[char]), ('s', 'a')]
+        elif char in VOWEL_SIGNS:
+            if word and word[-1][0] == 's':
+                word.pop()
+            word.append(('v', VOWEL_SIGNS[char]))
+        elif char in VIRAMAS:
+            if word and word[-1][0] == 's':
+                word.pop()
+        elif char in NUKTAS:
+            if len(word) >= 2 and word[-1][0] == 's':
+                word[-2] = ('c', NUKTA_FORMS.get(word[-2][1], word[-2][1]))
+        elif char in NASALS:
+            word.append(('n', NASALS[char]))
+        elif char in VOWELS:
+            word.append(('v', VOWELS[char]))
+        elif char not in SILENT:
+            if word:
+                out.append(_pronounce(word))
+                word = []
+            if 'ऀ' <= char <= '੿' and unicodedata.decimal(char, None) is not None:
+                char = str(unicodedata.decimal(char))
+            elif char in '।॥':
+                char = ' '
+            out.append(char)
+    if word:
+        out.append(_pronounce(word))
+    return ''.join(out)
+
+
+def _pronounce(word: List[Tuple[str, str]]) -> str:
+    """
+    Spell a transliterated word without the inherent vowels that are not
+    spoken: the last one unless it follows a cluster or is the only vowel
+    (राम ram, कमल kamal, but छात्र chhatra, क ka), and, right to left, one
+    between a vowel-consonant and a consonant-vowel (कमला kamla, समझना samajhna)
+    """
+    kinds = [kind for kind, _ in word]
+    if kinds[-1] == 's' and sum(kind in 'vs' for kind in kinds) > 1 and kinds[-3:-2] != ['c']:
+        del word[-1], kinds[-1]
+    for i in range(len(word) - 3, 1, -1):
+        if kinds[i] == 's' and kinds[i - 1] == kinds[i + 1] == 'c' \
+                and kinds[i - 2] in 'vs' and kinds[i + 2] in 'vs':
+            del word[i], kinds[i]
+    return ''.join(roman for _, roman in word)
+
+
+@lru_cache(maxsize=65536)
+def fold(word: str) -> str:
+    """Collapse romanization variants of a lowercase Latin word"""
+    for variant, spelling in SPELLING_FOLDS:
+        word = word.replace(variant, spelling)
+    return _DOUBLED.sub(r'\1', word)
+
+
+def tokenize(text: str) -> List[str]:
+    """Normalized, transliterated and folded words of text, in order"""
+    text = text or ''
+    if not text.isascii():
+        text = transliterate(unicodedata.normalize('NFKD', text))
+        text = ''.join(char for char in text if not unicodedata.combining(char))
+    return [fold(word) for word in _WORD.findall(text.casefold())]
+
+
+def trigrams(term: str) -> Set[str]:
+    """Trigrams of a term padded with two leading and one trailing space"""
+    padded = f"  {term} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def max_edits(term: str) -> int:
+    """Typos tolerated in a query word of this length"""
+    if len(term) <= 3:
+        return 0
+    return 1 if len(term) <= 7 else 2
+
+
+def shared_trigrams_needed(term: str) -> int:
+    """
+    Fewest trigrams an indexed term within max_edits(term) must share with term
+
+    An adjacent swap changes the four trigrams that overlap the swapped
+    pair, more than any other single edit:
+
+    >>> len(trigrams('pyhton') & trigrams('python')) >= shared_trigrams_needed('pyhton')
+    True
+    """
+    return max(1, len(trigrams(term)) - 4 * max_edits(term))
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """Optimal string alignment distance (adjacent swaps count once), or limit + 1 once it exceeds limit"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous, current = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        before, previous = previous, current
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], before[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+    return min(current[-1], limit + 1)
+
+
+def similarity(query: str, term: str) -> float:
+    """How well an indexed term matches a query word: 1 for the same word, 0 for no match"""
+    if query == term:
+        return 1.0
+    limit = max_edits(query)
+    if limit:
+        distance = edit_distance(query, term, limit)
+        if distance <= limit:
+            return 1 - distance / max(len(query), len(term))
+    if len(query) >= PREFIX_MIN_LENGTH and term.startswith(query):
+        return 0.5 + 0.5 * len(query) / len(term)  # Still being typed
+    return 0.0
+
+
+def document_terms(title: str, description: str = None) -> Dict[str, float]:
+    """{term: weight} of a video; a word in both fields keeps its title weight"""
+    terms = {term: DESCRIPTION_WEIGHT for term in tokenize(description)}
+    terms.update((term, TITLE_WEIGHT) for term in tokenize(title))
+    return terms
+
+
+class FuzzySearchIndex:
+    """Trigram/term index of video titles and descriptions, stored in the database"""
+
+    def __init__(self, db, read_only: bool = False):
+        """
+        Args:
+            db: VideoDatabase instance
+            read_only: Never write; queued videos are scored directly instead of indexed
+        """
+        self.db = db
+        self.read_only = read_only
+
+    def attach(self):
+        """Index videos as soon as the change that queued them commits"""
+        self.db.subscribe('video_added', self.on_video_changed)
+        self.db.subscribe('video_updated', self.on_video_changed)
+        self.db.subscribe('video_trashed', self.on_video_changed)
+        self.db.subscribe('video_deleted', self.on_video_changed)
+
+    def on_video_changed(self, video_id: int, fields: list = None, **kwargs):
+        if fields is None or 'title' in fields or 'description' in fields:
+            self.sync()
+
+    def sync(self, limit: int = None) -> int:
+        """
+        Index the queued videos, SYNC_BATCH per transaction
+
+        Returns:
+            Number of videos indexed (or removed from the index)
+        """
+        done = 0
+        while limit is None or done < limit:
+            size = SYNC_BATCH if limit is None else min(SYNC_BATCH, limit - done)
+            video_ids = [row[0] for row in self.db.conn.execute(
+                "SELECT video_id FROM search_dirty ORDER BY video_id LIMIT ?", (size,))]
+            if not video_ids:
+                break
+            with self.db.transaction():
+                self._index(video_ids)
+            done += len(video_ids)
+        if done:
+            logger.debug("Search index synced", extra={'videos': done})
+        return done
+
+    def rebuild(self) -> int:
+        """Drop the index and queue every video again"""
+        with self.db.transaction():
+            self.db.conn.execute("DELETE FROM search_postings")
+            self.db.conn.execute("DELETE FROM search_trigrams")
+            self.db.conn.execute("INSERT OR IGNORE INTO search_dirty (video_id) SELECT id FROM videos")
+        return self.sync()
+
+    def _index(self, video_ids: List[int]):
+        conn = self.db.conn
+        batch = json.dumps(video_ids)
+        removed = {row[0] for row in conn.execute(
+            "SELECT DISTINCT term FROM search_postings WHERE video_id IN (SELECT value FROM json_each(?))",
+            (batch,))}
+        conn.execute("DELETE FROM search_postings WHERE video_id IN (SELECT value FROM json_each(?))", (batch,))
+
+        postings, added = [], set()
+        for video_id, title, description in conn.execute(
+                "SELECT id, title, description FROM videos WHERE id IN (SELECT value FROM json_each(?))",
+                (batch,)).fetchall():
+            for term, weight in document_terms(title, description).items():
+                postings.append((term, video_id, weight))
+                added.add(term)
+        # Terms other videos (or these, before) already had keep their stored trigrams
+        known = removed | {row[0] for row in conn.execute(
+            "SELECT DISTINCT term FROM search_postings WHERE term IN (SELECT value FROM json_each(?))",
+            (json.dumps(sorted(added - removed)),))}
+        conn.executemany("INSERT INTO search_postings (term, video_id, weight) VALUES (?, ?, ?)", postings)
+        conn.executemany(
+            "INSERT OR IGNORE INTO search_trigrams (trigram, term) VALUES (?, ?)",
+            [(trigram, term) for term in added - known for trigram in trigrams(term)]
+        )
+        unused = [term for term in removed - added if conn.execute(
+            "SELECT 1 FROM search_postings WHERE term = ? LIMIT 1", (term,)).fetchone() is None]
+        if unused:
+            conn.executemany(
+                "DELETE FROM search_trigrams WHERE trigram = ? AND term = ?",
+                [(trigram, term) for term in unused for trigram in trigrams(term)]
+            )
+        conn.execute("DELETE FROM search_dirty WHERE video_id IN (SELECT value FROM json_each(?))", (batch,))
+
+    # Queries
+    def search(self, query: str, limit: int = None) -> List[Tuple[int, float]]:
+        """
+        Videos matching a free-text query, best first
+
+        Every query word must match a word of the video (exactly, within the
+        typos max_edits allows, or as a prefix); if no video matches them all,
+        videos matching any of them are returned. A video's score is the sum
+        over the query words of its best match, weighted by field.
+
+        Returns:
+            [(video_id, score)]; trashed videos are included (callers filter them)
+        """
+        started = time.perf_counter()
+        words = list(dict.fromkeys(tokenize(query)))
+        if not words:
+            return []
+        if not self.read_only:
+            self.sync()
+
+        pending = self._pending_documents()
+        matches = [self._term_matches(word) for word in words]
+        # Rarest word first, so the others are only looked up for its videos
+        order = sorted(range(len(words)), key=lambda index: self._posting_count(matches[index]))
+        scores = None
+        for index in order:
+            found = self._score_word(words[index], matches[index], pending,
+                                     None if scores is None else list(scores))
+            scores = found if scores is None else \
+                {video_id: scores[video_id] + score for video_id, score in found.items() if video_id in scores}
+            if not scores:
+                break
+        if not scores and len(words) > 1:
+            scores = {}
+            for index, word in enumerate(words):
+                for video_id, score in self._score_word(word, matches[index], pending).items():
+                    scores[video_id] = scores.get(video_id, 0.0) + score
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], -item[0]))
+        if limit is not None:
+            ranked = ranked[:limit]
+        logger.debug("Fuzzy search", extra={
+            'query': query, 'results': len(ranked),
+            'duration_ms': round((time.perf_counter() - started) * 1000, 2)
+        })
+        return [(video_id, round(score, 4)) for video_id, score in ranked]
+
+    def _term_matches(self, word: str) -> Dict[str, float]:
+        """{indexed term: similarity} of the terms close enough to a query word"""
+        grams = trigrams(word)
+        needed = shared_trigrams_needed(word)
+        if len(word) >= PREFIX_MIN_LENGTH:
+            needed = min(needed, len(grams) - 1)  # A prefix lacks only the trailing-space trigram
+        matches = {}
+        for term, in self.db.conn.execute(
+                "SELECT term FROM search_trigrams WHERE trigram IN (SELECT value FROM json_each(?)) "
+                "GROUP BY term HAVING COUNT(*) >= ?", (json.dumps(sorted(grams)), needed)):
+            score = similarity(word, term)
+            if score:
+                matches[term] = score
+        return matches
+
+    def _posting_count(self, matches: Dict[str, float]) -> int:
+        if not matches:
+            return 0
+        return self.db.conn.execute(
+            "SELECT COUNT(*) FROM search_postings WHERE term IN (SELECT value FROM json_each(?))",
+            (json.dumps(list(matches)),)).fetchone()[0]
+
+    def _score_word(self, word: str, matches: Dict[str, float], pending: Dict[int, Dict[str, float]],
+                    video_ids: List[int] = None) -> Dict[int, float]:
+        """{video_id: best weighted similarity of its terms to word}, optionally among video_ids"""
+        scores = {}
+        if matches:
+            sql = ("SELECT term, video_id, weight FROM search_postings "
+                   "WHERE term IN (SELECT value FROM json_each(?))")
+            params = [json.dumps(list(matches))]
+            if video_ids is not None:
+                sql += " AND video_id IN (SELECT value FROM json_each(?))"
+                params.append(json.dumps(video_ids))
+            for term, video_id, weight in self.db.conn.execute(sql, params):
+                if video_id not in pending:
+                    score = matches[term] * weight
+                    if score > scores.get(video_id, 0.0):
+                        scores[video_id] = score
+        wanted = None if video_ids is None else set(video_ids)
+        for video_id, terms in pending.items():
+            if terms and (wanted is None or video_id in wanted):
+                score = max((similarity(word, term) * weight for term, weight in terms.items()), default=0.0)
+                if score:
+                    scores[video_id] = score
+        return scores
+
+    def _pending_documents(self) -> Dict[int, Dict[str, float]]:
+        """{video_id: terms} of the queued videos, which the stored postings may not describe"""
+        rows = self.db.conn.execute(
+            "SELECT d.video_id, v.title, v.description FROM search_dirty d "
+            "LEFT JOIN videos v ON v.id = d.video_id").fetchall()
+        return {video_id: document_terms(title, description) if title is not None else {}
+                for video_id, title, description in rows}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fuzzy multilingual search over video titles')
+    parser.add_argument('--db', default='edunabha_videos.db')
+    parser.add_argument('--rebuild', action='store_true', help='Re-index every video')
+    parser.add_argument('--limit', type=int, default=10)
+    parser.add_argument('query', nargs='*')
+    args = parser.parse_args()
+    configure_logging()
+
+    from video_database import VideoDatabase
+    db = VideoDatabase(args.db)
+    try:
+        index = FuzzySearchIndex(db)
+        if args.rebuild:
+            started = time.perf_counter()
+            count = index.rebuild()
+            print(json.dumps({'indexed': count, 'seconds': round(time.perf_counter() - started, 2)}))
+        if args.query:
+            query = ' '.join(args.query)
+            started = time.perf_counter()
+            ranked = index.search(query, args.limit)
+            videos = {video_id: db.get_video(video_id) for video_id, _ in ranked}
+            print(json.dumps({
+                'query': query, 'terms': tokenize(query),
+                'durationMs': round((time.perf_counter() - started) * 1000, 2),
+                'results': [{'id': video_id, 'score': score, 'title': videos[video_id]['title']}
+                            for video_id, score in ranked if videos[video_id]]  # Trashed or purged since
+            }, indent=2, ensure_ascii=False))
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
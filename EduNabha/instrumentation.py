@@ -0,0 +1,429 @@
+"""
+Instrumentation
+Structured logging, per-method and per-query timing histograms, row counters
+and slow-query capture for the video layer, exported in Prometheus text format
+"""
+
+import bisect
+import datetime
+import functools
+import json
+import logging
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+import types
+from collections import deque
+from typing import Dict, List, Optional
+
+
+LOGGER_NAME = 'edunabha'
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SLOW_QUERY_SECONDS = float(os.environ.get('EDUNABHA_SLOW_QUERY_MS', '100')) / 1000
+SLOW_QUERY_KEEP = 500  # Rows kept in the slow_queries table
+METRICS_ENABLED = os.environ.get('EDUNABHA_METRICS', '1') != '0'
+FLUSH_INTERVAL_SECONDS = float(os.environ.get('EDUNABHA_METRICS_FLUSH_SECONDS', '60'))
+
+METRIC_HELP = {
+    'edunabha_method_duration_seconds': ('histogram', 'Time spent in database and integration methods'),
+    'edunabha_query_duration_seconds': ('histogram', 'SQL execution time up to the first fetch, by statement'),
+    'edunabha_query_rows_total': ('counter', 'Rows returned by SQL statements'),
+    'edunabha_slow_queries_total': ('counter', 'Statements slower than the slow-query threshold'),
+    'edunabha_http_request_duration_seconds': ('histogram', 'Video API request handling time'),
+}
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Logger under the 'edunabha' namespace (e.g. get_logger('video_database'))"""
+    return logging.getLogger(f"{LOGGER_NAME}.{name}")
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; keys passed with extra={...} are included"""
+
+    RESERVED = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': datetime.datetime.utcfromtimestamp(record.created).isoformat(timespec='milliseconds') + 'Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        # An extra key named like one of these cannot replace the record's own value
+        entry.update({k: v for k, v in vars(record).items() if k not in self.RESERVED and k not in entry})
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level: str = None, log_file: str = None, json_format: bool = True) -> logging.Logger:
+    """
+    Send edunabha logs to stderr or a file (stdout stays free for command output)
+
+    Args:
+        level: Log level name (defaults to $EDUNABHA_LOG_LEVEL or INFO)
+        log_file: Append to this file instead of stderr (defaults to $EDUNABHA_LOG_FILE)
+        json_format: Structured JSON lines instead of plain text
+    """
+    level = (level or os.environ.get('EDUNABHA_LOG_LEVEL') or 'INFO').upper()
+    log_file = log_file or os.environ.get('EDUNABHA_LOG_FILE')
+
+    logger = logging.getLogger(LOGGER_NAME)
+    for handler in list(logger.handlers):
+        if getattr(handler, 'edunabha_handler', False):
+            logger.removeHandler(handler)
+            handler.close()
+
+    handler = logging.FileHandler(log_file, encoding='utf-8') if log_file else logging.StreamHandler(sys.stderr)
+    handler.edunabha_handler = True
+    handler.setFormatter(JsonFormatter() if json_format
+                         else logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    logger.addHandler(handler)
+    logger.setLevel(level)
+    logger.propagate = False
+    return logger
+
+
+class Histogram:
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """
+    Process-local metrics
+
+    flush() adds them into the metric_* tables so short-lived wrapper
+    processes and the long-running API server report into one place. Each
+    flush is a write transaction, so writers flush when flush_due() says so:
+    once per process, then at most every flush_interval seconds.
+    """
+
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS, slow_query_seconds: float = SLOW_QUERY_SECONDS,
+                 flush_interval: float = FLUSH_INTERVAL_SECONDS):
+        self.buckets = buckets
+        self.slow_query_seconds = slow_query_seconds
+        self.flush_interval = flush_interval
+        self._last_flush = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._histograms = {}
+        self._counters = {}
+        self._slow_queries = deque(maxlen=SLOW_QUERY_KEEP)
+        self._listeners = []
+
+    @property
+    def recording(self) -> bool:
+        return METRICS_ENABLED and not getattr(self._local, 'suspended', False)
+
+    def observe(self, name: str, labels: tuple, value: float):
+        with self._lock:
+            key = (name, labels)
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    def inc(self, name: str, labels: tuple, amount: float = 1):
+        with self._lock:
+            key = (name, labels)
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def add_listener(self, callback):
+        """Call callback(sql, params, seconds) for every statement recorded"""
+        self._listeners = self._listeners + [callback]
+
+    def remove_listener(self, callback):
+        self._listeners = [c for c in self._listeners if c != callback]
+
+    def record_query(self, sql: str, params, seconds: float, rows: int):
+        for listener in self._listeners:
+            listener(sql, params, seconds)
+        label = (('statement', statement_label(sql)),)
+        self.observe('edunabha_query_duration_seconds', label, seconds)
+        if rows:
+            self.inc('edunabha_query_rows_total', label, rows)
+        if seconds >= self.slow_query_seconds:
+            self.inc('edunabha_slow_queries_total', label)
+            with self._lock:
+                self._slow_queries.append({
+                    'sql': ' '.join(sql.split()),
+                    'params': _format_params(params),
+                    'durationMs': round(seconds * 1000, 2),
+                    'createdAt': datetime.datetime.utcnow().isoformat(timespec='seconds')
+                })
+            get_logger('slow_query').warning(
+                "Slow query", extra={'sql': ' '.join(sql.split()), 'params': _format_params(params),
+                                     'duration_ms': round(seconds * 1000, 2)}
+            )
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+            self._slow_queries.clear()
+
+    def flush_due(self) -> bool:
+        """Whether this process has never flushed or last did so flush_interval seconds ago"""
+        return self._last_flush is None or time.monotonic() - self._last_flush >= self.flush_interval
+
+    def flush(self, conn: sqlite3.Connection):
+        """Add the in-memory metrics to the metric_* tables and reset them"""
+        with self._lock:
+            self._last_flush = time.monotonic()
+            histograms, self._histograms = self._histograms, {}
+            counters, self._counters = self._counters, {}
+            slow_queries = list(self._slow_queries)
+            self._slow_queries.clear()
+        if not (histograms or counters or slow_queries):
+            return
+
+        self._local.suspended = True
+        try:
+            if not conn.in_transaction:
+                conn.execute("BEGIN IMMEDIATE")
+            for (name, labels), histogram in histograms.items():
+                labels_json = json.dumps(dict(labels), sort_keys=True)
+                row = conn.execute(
+                    "SELECT bucket_counts, sum, count FROM metric_histograms WHERE name = ? AND labels = ?",
+                    (name, labels_json)
+                ).fetchone()
+                counts, total, count = histogram.counts, histogram.sum, histogram.count
+                if row:
+                    stored = json.loads(row[0])
+                    if len(stored) == len(counts):
+                        counts = [a + b for a, b in zip(stored, counts)]
+                        total += row[1]
+                        count += row[2]
+                conn.execute(
+                    """INSERT OR REPLACE INTO metric_histograms (name, labels, bucket_counts, sum, count)
+                       VALUES (?, ?, ?, ?, ?)""",
+                    (name, labels_json, json.dumps(counts), total, count)
+                )
+            conn.executemany(
+                """INSERT INTO metric_counters (name, labels, value) VALUES (?, ?, ?)
+                   ON CONFLICT (name, labels) DO UPDATE SET value = value + excluded.value""",
+                [(name, json.dumps(dict(labels), sort_keys=True), value)
+                 for (name, labels), value in counters.items()]
+            )
+            conn.executemany(
+                "INSERT INTO slow_queries (sql, params, duration_ms, created_at) VALUES (?, ?, ?, ?)",
+                [(q['sql'], q['params'], q['durationMs'], q['createdAt']) for q in slow_queries]
+            )
+            conn.execute(
+                "DELETE FROM slow_queries WHERE id <= (SELECT MAX(id) FROM slow_queries) - ?",
+                (SLOW_QUERY_KEEP,)
+            )
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        finally:
+            self._local.suspended = False
+
+    def render_prometheus(self, conn: sqlite3.Connection = None) -> str:
+        """
+        Prometheus text exposition of the metrics
+
+        With conn, the metrics persisted in that database are rendered (call
+        flush first to include this process); without it, only this process.
+        """
+        if conn is not None:
+            histograms = [(r[0], json.loads(r[1]), json.loads(r[2]), r[3], r[4]) for r in conn.execute(
+                "SELECT name, labels, bucket_counts, sum, count FROM metric_histograms ORDER BY name, labels"
+            )]
+            counters = [(r[0], json.loads(r[1]), r[2]) for r in conn.execute(
+                "SELECT name, labels, value FROM metric_counters ORDER BY name, labels"
+            )]
+        else:
+            with self._lock:
+                histograms = sorted((name, dict(labels), list(h.counts), h.sum, h.count)
+                                    for (name, labels), h in self._histograms.items())
+                counters = sorted((name, dict(labels), value) for (name, labels), value in self._counters.items())
+
+        lines = []
+        described = set()
+
+        def describe(name):
+            if name not in described:
+                described.add(name)
+                metric_type, help_text = METRIC_HELP.get(name, ('untyped', name))
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {metric_type}")
+
+        for name, labels, counts, total, count in histograms:
+            describe(name)
+            cumulative = 0
+            for bound, bucket_count in zip(list(self.buckets) + ['+Inf'], counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{_labels({**labels, 'le': bound})} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labels)} {total:.6f}")
+            lines.append(f"{name}_count{_labels(labels)} {count}")
+        for name, labels, value in counters:
+            describe(name)
+            lines.append(f"{name}{_labels(labels)} {value:g}")
+        return '\n'.join(lines) + '\n'
+
+    def slow_queries(self, conn: sqlite3.Connection = None, limit: int = 50) -> List[Dict]:
+        """Most recent slow queries, persisted ones when conn is given"""
+        if conn is None:
+            with self._lock:
+                return list(self._slow_queries)[-limit:][::-1]
+        cursor = conn.execute(
+            "SELECT sql, params, duration_ms, created_at FROM slow_queries ORDER BY id DESC LIMIT ?", (limit,)
+        )
+        return [{'sql': r[0], 'params': r[1], 'durationMs': r[2], 'createdAt': r[3]} for r in cursor]
+
+
+METRICS = MetricsRegistry()
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Cursor reporting statement time, rows fetched and slow statements to METRICS"""
+
+    _label = None  # Statement label of a query whose rows are being fetched
+
+    def execute(self, sql, parameters=()):
+        # sqlite3 steps to the first row inside execute(), so this covers the
+        # query plan and most of the work for typical statements
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._track(sql, parameters, started)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._track(sql, None, started)
+
+    def fetchone(self):
+        row = super().fetchone()
+        if row is not None:
+            self._fetched(1)
+        return row
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._fetched(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        self._fetched(len(rows))
+        return rows
+
+    def _track(self, sql, parameters, started):
+        elapsed = time.perf_counter() - started
+        self._label = None
+        if METRICS.recording:
+            METRICS.record_query(sql, parameters, elapsed, 0)
+            if self.description is not None:
+                self._label = statement_label(sql)
+
+    def _fetched(self, rows: int):
+        # Rows consumed by plain iteration are not counted, keeping large
+        # scans free of per-row Python overhead
+        if rows and self._label is not None:
+            METRICS.inc('edunabha_query_rows_total', (('statement', self._label),), rows)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """sqlite3 connection factory whose cursors are InstrumentedCursor"""
+
+    def cursor(self, factory=None):
+        return super().cursor(factory or InstrumentedCursor)
+
+    # Connection.execute* build a plain sqlite3.Cursor internally
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def connect(db_path: str, **kwargs) -> sqlite3.Connection:
+    """sqlite3.connect with instrumentation (unless EDUNABHA_METRICS=0)"""
+    if METRICS_ENABLED:
+        kwargs.setdefault('factory', InstrumentedConnection)
+    return sqlite3.connect(db_path, **kwargs)
+
+
+def timed(label: str):
+    """Decorator recording a call's duration under method=label"""
+    labels = (('method', label),)
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                if METRICS_ENABLED:
+                    METRICS.observe('edunabha_method_duration_seconds', labels, time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+def instrument_methods(cls):
+    """Class decorator timing every public method defined directly on cls"""
+    for name, value in list(vars(cls).items()):
+        if not name.startswith('_') and isinstance(value, types.FunctionType):
+            setattr(cls, name, timed(f"{cls.__name__}.{name}")(value))
+    return cls
+
+
+@functools.lru_cache(maxsize=2048)
+def statement_label(sql: str) -> str:
+    """Low-cardinality label for a statement, e.g. 'SELECT videos'"""
+    words = sql.split(None, 1)
+    operation = words[0].upper() if words else ''
+    match = _TABLE_PATTERN.search(sql)
+    return f"{operation} {match.group(1)}" if match else operation
+
+
+_TABLE_PATTERN = re.compile(r'\b(?:FROM|INTO|UPDATE|TABLE)\s+([A-Za-z_]\w*)', re.IGNORECASE)
+
+
+def _labels(labels: Dict) -> str:
+    if not labels:
+        return ''
+    escaped = (f'{k}="{_escape_label(v)}"' for k, v in labels.items())
+    return '{' + ','.join(escaped) + '}'
+
+
+def _escape_label(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_params(params) -> Optional[str]:
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        values = {k: _short(v) for k, v in params.items()}
+    else:
+        values = [_short(v) for v in params]
+    return json.dumps(values, default=str)
+
+
+def _short(value):
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return f"<{len(value)} bytes>"
+    if isinstance(value, str) and len(value) > 200:
+        return value[:200] + '...'
+    return value
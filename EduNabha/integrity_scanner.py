@@ -0,0 +1,306 @@
+"""
+Integrity Scanner
+Reconciles the videos table with the files on disk: finds videos whose file
+is missing, files under the upload directory no video references, and files
+whose size or content no longer matches, and repairs them in bulk
+"""
+
+import hashlib
+import os
+import stat
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, List, Optional, Tuple
+
+from instrumentation import get_logger
+
+
+logger = get_logger('integrity')
+
+HASH_BUFFER_SIZE = 1024 * 1024  # 1MB
+# Upload directory entries managed elsewhere: in-progress uploads, packaged
+# renditions (indexed in rendition_segments) and files already set aside
+SKIP_DIRS = ('.partial', 'renditions', '.quarantine')
+
+
+def normalize_path(path: str) -> str:
+    return os.path.normcase(os.path.abspath(path))
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for block in iter(lambda: fh.read(HASH_BUFFER_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _stat(path: str) -> Optional[Tuple[int, int]]:
+    try:
+        info = os.stat(path)
+    except OSError:
+        return None
+    return (info.st_size, info.st_mtime_ns) if stat.S_ISREG(info.st_mode) else None
+
+
+class IntegrityScanner:
+    """Parallel scan of the upload directory checked against the videos table"""
+
+    def __init__(self, db, upload_dir: str, workers: int = 4, quarantine_dir: str = None):
+        """
+        Args:
+            db: VideoDatabase instance
+            upload_dir: Directory scanned for video files
+            workers: Threads listing directories, stat'ing and hashing files
+            quarantine_dir: Where repair() moves files it sets aside
+                (defaults to '.quarantine' inside the upload directory)
+        """
+        self.db = db
+        self.upload_dir = upload_dir
+        self.workers = workers
+        self.quarantine_dir = quarantine_dir or os.path.join(upload_dir, '.quarantine')
+
+    # Scanning
+    def scan(self, verify: bool = False) -> Dict:
+        """
+        Compare the database with the filesystem
+
+        Every file is stat'ed; files whose (size, mtime) matches the cached
+        fingerprint are not examined further. With verify, files without a
+        digest for their current size/mtime are hashed and compared with the
+        known-good digest (the upload checksum, else the first verification).
+
+        Returns:
+            {'missing', 'orphaned', 'corrupted'} lists plus scan statistics
+        """
+        started = time.perf_counter()
+        videos = [dict(row) for row in self.db.conn.execute(
+            "SELECT id, title, file_path, file_size, deleted_at FROM videos ORDER BY id"
+        )]
+        cache = {row['path']: dict(row) for row in self.db.conn.execute("SELECT * FROM file_fingerprints")}
+        upload_checksums = {row[0]: row[1] for row in self.db.conn.execute(
+            """SELECT video_id, final_checksum FROM upload_sessions
+               WHERE status = 'completed' AND video_id IS NOT NULL
+                 AND COALESCE(checksum_algorithm, 'sha256') = 'sha256'"""
+        )}
+
+        with ThreadPoolExecutor(self.workers, thread_name_prefix='edunabha-integrity') as executor:
+            files = self.walk(executor)
+            # Videos stored outside the upload directory are stat'ed one by one
+            outside = [video for video in videos
+                       if video['file_path'] and normalize_path(video['file_path']) not in files]
+            for video, info in zip(outside, executor.map(_stat, [v['file_path'] for v in outside])):
+                if info:
+                    files[normalize_path(video['file_path'])] = (video['file_path'],) + info
+
+            fingerprints, changed = {}, set()
+            for key, (_, size, mtime_ns) in files.items():
+                cached = cache.get(key)
+                if cached and cached['size'] == size and cached['mtime_ns'] == mtime_ns:
+                    fingerprints[key] = cached
+                    continue
+                fingerprints[key] = {'path': key, 'size': size, 'mtime_ns': mtime_ns, 'sha256': None,
+                                     'reference_sha256': cached['reference_sha256'] if cached else None}
+                changed.add(key)
+
+            # Files of trashed videos are referenced (not orphans) but not checked
+            referenced = {normalize_path(v['file_path']): v for v in videos if v['file_path']}
+            to_hash = [key for key, video in referenced.items() if key in fingerprints
+                       and not fingerprints[key]['sha256'] and not video['deleted_at']] if verify else []
+            for key, digest in zip(to_hash, executor.map(self._hash, [files[key][0] for key in to_hash])):
+                if digest:
+                    fingerprints[key]['sha256'] = digest
+                    changed.add(key)
+
+        report = {'missing': [], 'orphaned': [], 'corrupted': []}
+        for key, video in referenced.items():
+            if video['deleted_at']:
+                continue
+            fingerprint = fingerprints.get(key)
+            entry = {'videoId': str(video['id']), 'title': video['title'], 'path': video['file_path']}
+            if fingerprint is None:
+                report['missing'].append(entry)
+                continue
+            if video['file_size'] and video['file_size'] != fingerprint['size']:
+                report['corrupted'].append(dict(entry, reason='size_mismatch',
+                                                expected=video['file_size'], actual=fingerprint['size']))
+                continue
+            if not fingerprint['sha256']:
+                continue
+            if not fingerprint['reference_sha256']:
+                # The upload checksum if there is one, else trust the first verification
+                fingerprint['reference_sha256'] = upload_checksums.get(video['id']) or fingerprint['sha256']
+                changed.add(key)
+            if fingerprint['sha256'] != fingerprint['reference_sha256']:
+                report['corrupted'].append(dict(entry, reason='checksum_mismatch',
+                                                expected=fingerprint['reference_sha256'],
+                                                actual=fingerprint['sha256']))
+        for key, (path, size, _) in sorted(files.items()):
+            if key not in referenced:
+                report['orphaned'].append({'path': path, 'size': size})
+
+        self._save_fingerprints([fingerprints[key] for key in changed],
+                                [key for key in cache if key not in fingerprints])
+        report.update({
+            'scannedFiles': len(files),
+            'videos': len(videos),
+            'changedFiles': len(changed),
+            'hashedFiles': len(to_hash),
+            'durationMs': round((time.perf_counter() - started) * 1000, 1)
+        })
+        logger.info("Integrity scan finished", extra={
+            'files': len(files), 'missing': len(report['missing']), 'orphaned': len(report['orphaned']),
+            'corrupted': len(report['corrupted']), 'duration_ms': report['durationMs']
+        })
+        return report
+
+    def walk(self, executor: ThreadPoolExecutor) -> Dict[str, Tuple[str, int, int]]:
+        """{normalized path: (path, size, mtime_ns)} of the files under the upload directory"""
+        files = {}
+        if not os.path.isdir(self.upload_dir):
+            return files
+        skip = {normalize_path(os.path.join(self.upload_dir, name)) for name in SKIP_DIRS}
+        skip.add(normalize_path(self.quarantine_dir))
+        pending = {executor.submit(self._scan_directory, self.upload_dir, skip)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                entries, subdirectories = future.result()
+                files.update(entries)
+                pending.update(executor.submit(self._scan_directory, path, skip) for path in subdirectories)
+        return files
+
+    @staticmethod
+    def _scan_directory(path: str, skip: set) -> Tuple[Dict, List[str]]:
+        entries, subdirectories = {}, []
+        try:
+            with os.scandir(path) as iterator:
+                for entry in iterator:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if normalize_path(entry.path) not in skip:
+                                subdirectories.append(entry.path)
+                        elif entry.is_file():
+                            info = entry.stat()
+                            entries[normalize_path(entry.path)] = (entry.path, info.st_size, info.st_mtime_ns)
+                    except OSError:
+                        continue  # Removed while we were listing
+        except OSError as e:
+            logger.warning("Could not scan %s: %s", path, e)
+        return entries, subdirectories
+
+    @staticmethod
+    def _hash(path: str) -> Optional[str]:
+        try:
+            return file_sha256(path)
+        except OSError as e:
+            logger.warning("Could not hash %s: %s", path, e)
+            return None
+
+    def _save_fingerprints(self, rows: List[Dict], removed: List[str]):
+        if not rows and not removed:
+            return
+        conn = self.db.conn
+        with self.db.transaction():
+            conn.executemany(
+                """INSERT OR REPLACE INTO file_fingerprints
+                   (path, size, mtime_ns, sha256, reference_sha256, scanned_at)
+                   VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)""",
+                [(r['path'], r['size'], r['mtime_ns'], r['sha256'], r['reference_sha256']) for r in rows]
+            )
+            conn.executemany("DELETE FROM file_fingerprints WHERE path = ?", [(key,) for key in removed])
+
+    # Repair
+    def repair(self, report: Dict = None, missing: str = None, orphaned: str = None,
+               corrupted: str = None) -> Dict:
+        """
+        Fix the problems of a scan; a category left as None is not touched
+
+        Args:
+            report: Result of scan(); a fresh scan is run if omitted
+            missing: 'remove' deletes the videos whose file is gone (trashed and
+                purged at once, like the trash reclaimer, with their dependent rows)
+            orphaned: 'quarantine' moves unreferenced files to quarantine_dir,
+                'delete' removes them
+            corrupted: 'accept' records the file's current size and digest as
+                correct, 'quarantine' moves the file aside and deletes the video
+        """
+        for name, value, allowed in (('missing', missing, ('remove',)),
+                                     ('orphaned', orphaned, ('quarantine', 'delete')),
+                                     ('corrupted', corrupted, ('accept', 'quarantine'))):
+            if value is not None and value not in allowed:
+                raise ValueError(f"Unknown {name} action {value!r} (expected one of {', '.join(allowed)})")
+        report = report if report is not None else self.scan(verify=corrupted is not None)
+        result = {'removedVideos': 0, 'quarantinedFiles': [], 'deletedFiles': 0, 'acceptedFiles': 0, 'errors': []}
+        remove_ids, forget_paths = [], []
+
+        if missing == 'remove':
+            remove_ids.extend(int(entry['videoId']) for entry in report['missing'])
+            forget_paths.extend(normalize_path(entry['path']) for entry in report['missing'])
+
+        if orphaned:
+            for entry in report['orphaned']:
+                if self._set_aside(entry['path'], orphaned, result):
+                    forget_paths.append(normalize_path(entry['path']))
+
+        if corrupted == 'accept':
+            self._accept(report['corrupted'])
+            result['acceptedFiles'] = len(report['corrupted'])
+        elif corrupted == 'quarantine':
+            for entry in report['corrupted']:
+                if self._set_aside(entry['path'], 'quarantine', result):
+                    remove_ids.append(int(entry['videoId']))
+                    forget_paths.append(normalize_path(entry['path']))
+
+        if remove_ids:
+            # Their files are gone or quarantined, so they skip the restore window
+            with self.db.transaction():
+                trashed = self.db.trash_videos(remove_ids)
+                result['removedVideos'] = len(self.db.purge_trash(trashed))
+        if forget_paths:
+            self._save_fingerprints([], forget_paths)
+        result['success'] = not result['errors']
+        logger.info("Integrity repair finished", extra={
+            'removed_videos': result['removedVideos'], 'quarantined': len(result['quarantinedFiles']),
+            'deleted_files': result['deletedFiles'], 'accepted': result['acceptedFiles'],
+            'errors': len(result['errors'])
+        })
+        return result
+
+    def _set_aside(self, path: str, action: str, result: Dict) -> bool:
+        """Quarantine or delete one file, recording the outcome in result"""
+        try:
+            if action == 'delete':
+                os.remove(path)
+                result['deletedFiles'] += 1
+                return True
+            relative = os.path.relpath(os.path.abspath(path), os.path.abspath(self.upload_dir))
+            if relative.startswith(os.pardir):
+                relative = os.path.basename(path)  # Outside the upload directory
+            target = os.path.join(self.quarantine_dir, relative)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(path, target)
+            result['quarantinedFiles'].append({'path': path, 'quarantinedAs': target})
+            return True
+        except OSError as e:
+            logger.warning("Could not %s %s: %s", action, path, e)
+            result['errors'].append({'path': path, 'error': str(e)})
+            return False
+
+    def _accept(self, entries: List[Dict]):
+        """Take the files' current size and digest as the correct ones, in one transaction"""
+        if not entries:
+            return
+        digests = {}
+        for entry in entries:
+            digests[entry['videoId']] = self._hash(entry['path'])
+        conn = self.db.conn
+        with self.db.transaction():
+            for entry in entries:
+                if entry['reason'] == 'size_mismatch':
+                    conn.execute("UPDATE videos SET file_size = ? WHERE id = ?",
+                                 (entry['actual'], int(entry['videoId'])))
+                conn.execute(
+                    "UPDATE file_fingerprints SET sha256 = ?, reference_sha256 = ? WHERE path = ?",
+                    (digests[entry['videoId']], digests[entry['videoId']], normalize_path(entry['path']))
+                )
@@ -0,0 +1,592 @@
+#!/usr/bin/env python3
+"""
+Classroom Load Generator
+Drives a mixed classroom workload (progress heartbeats from students watching,
+library listings, searches, the teacher's dashboard, the odd delete and
+restore) either in-process, with one EduNabhaVideoIntegration per worker
+thread as the API server keeps one per connection, or through
+video_integration_wrapper.py, one process per call as Node does. Both go
+through the wrapper's command handlers, so they run the same code paths.
+
+Load steps up through the given numbers of concurrent students (closed loop:
+each waits a think time between requests) or arrival rates (open loop:
+Poisson arrivals served by a fixed pool, latency counted from the scheduled
+arrival so queueing shows up). Every step reports throughput, latency
+percentiles and errors, with "database is locked" failures counted
+separately, and the saturation point is the last step at which throughput
+still kept up with the added load.
+
+Usage: python load_generator.py [--target inprocess|wrapper] [--users 10,20,40 | --rate 20,50,100]
+                                [--duration 20] [--think 2.0] [--mix heartbeat=70,search=10]
+"""
+
+import argparse
+import json
+import os
+import queue
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional
+
+from instrumentation import configure_logging, get_logger
+
+
+logger = get_logger('load_generator')
+
+
+WRAPPER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'video_integration_wrapper.py')
+SCHEMA_FILE = 'video_database_schema.sql'
+DB_FILE = 'edunabha_videos.db'  # The wrapper always opens this name in its working directory
+
+# Relative weights of the operations in the default classroom mix
+DEFAULT_MIX = {'heartbeat': 70, 'list': 10, 'search': 10, 'dashboard': 5, 'delete': 3, 'restore': 2}
+SEARCH_TERMS = ('algebra', 'biology', 'chemistry', 'exam', 'lab', 'lecture', 'physics', 'revision')
+COURSES = ('Mathematics', 'Biology', 'Chemistry', 'Physics')
+LOCK_ERRORS = ('database is locked', 'database table is locked', 'database schema is locked')
+
+# A step is past saturation when its throughput grew by less than this share
+# of the load added over the previous step, when it served less than
+# OFFERED_SHARE of an open loop's arrivals, or when more than MAX_ERROR_RATE
+# of its requests failed
+SATURATION_GAIN = 0.5
+OFFERED_SHARE = 0.9
+MAX_ERROR_RATE = 0.01
+
+
+class Student:
+    """A simulated student working through videos one heartbeat at a time"""
+
+    def __init__(self, student_id: str, heartbeat_seconds: int):
+        self.student_id = student_id
+        self.heartbeat_seconds = heartbeat_seconds
+        self.video_id = None
+        self.position = 0
+        self.lock = threading.Lock()
+
+    def heartbeat(self, library: 'Library', rng: random.Random) -> Optional[tuple]:
+        with self.lock:
+            if self.video_id is None:
+                self.video_id, self.position = library.watch(rng), 0
+                if self.video_id is None:
+                    return None
+            self.position += self.heartbeat_seconds
+            completed = self.position >= library.duration
+            data = {'videoId': str(self.video_id), 'watchTime': min(self.position, library.duration),
+                    'completed': completed, 'studentId': self.student_id}
+            if not completed:
+                return 'update_progress', [json.dumps(data)]
+            video_id, self.video_id = self.video_id, None
+        return 'update_progress', [json.dumps(data)], lambda: library.unwatch(video_id)
+
+
+class Library:
+    """
+    Video ids shared by all workers
+
+    A video someone is watching is never deleted, and a deleted video is only
+    offered for restoring (and a restored one for watching) once the call
+    that moved it has returned, so the workload itself never asks for a
+    video that is not there.
+    """
+
+    def __init__(self, video_ids: List[int], duration: int):
+        self.duration = duration
+        self._live = set(video_ids)
+        self._watching = {}  # {video_id: students watching it}
+        self._trashed = []
+        self._moving = 0  # Deletes and restores in flight
+        self._lock = threading.Lock()
+
+    def watch(self, rng: random.Random) -> Optional[int]:
+        with self._lock:
+            if not self._live:
+                return None
+            video_id = rng.choice(tuple(self._live))
+            self._watching[video_id] = self._watching.get(video_id, 0) + 1
+            return video_id
+
+    def unwatch(self, video_id: int):
+        with self._lock:
+            self._watching[video_id] -= 1
+            if not self._watching[video_id]:
+                del self._watching[video_id]
+
+    def trash(self, rng: random.Random) -> Optional[int]:
+        """Take an unwatched video for deletion, keeping most of the library live"""
+        with self._lock:
+            candidates = [video_id for video_id in self._live if video_id not in self._watching]
+            if not candidates or len(self._live) <= (len(self._trashed) + self._moving) * 4:
+                return None
+            video_id = rng.choice(candidates)
+            self._live.discard(video_id)
+            self._moving += 1
+            return video_id
+
+    def trashed(self, video_id: int):
+        with self._lock:
+            self._moving -= 1
+            self._trashed.append(video_id)
+
+    def restore(self, rng: random.Random) -> Optional[int]:
+        with self._lock:
+            if not self._trashed:
+                return None
+            self._moving += 1
+            return self._trashed.pop(rng.randrange(len(self._trashed)))
+
+    def restored(self, video_id: int):
+        with self._lock:
+            self._moving -= 1
+            self._live.add(video_id)
+
+
+def _heartbeat(student, library, rng):
+    return student.heartbeat(library, rng)
+
+
+def _list(student, library, rng):
+    return 'get_offline_videos', []
+
+
+def _search(student, library, rng):
+    return 'search_videos', [json.dumps({'query': rng.choice(SEARCH_TERMS)})]
+
+
+def _dashboard(student, library, rng):
+    return 'get_study_dashboard', []
+
+
+def _delete(student, library, rng):
+    video_id = library.trash(rng)
+    if video_id is None:
+        return None
+    return 'delete_video', [str(video_id)], lambda: library.trashed(video_id)
+
+
+def _restore(student, library, rng):
+    video_id = library.restore(rng)
+    if video_id is None:
+        return None
+    return 'restore_videos', [json.dumps({'videoIds': [str(video_id)]})], lambda: library.restored(video_id)
+
+
+# {operation: build(student, library, rng) -> (wrapper command, args[, done])};
+# None skips the operation, done() runs once the call has returned
+OPERATIONS = {
+    'heartbeat': _heartbeat,
+    'list': _list,
+    'search': _search,
+    'dashboard': _dashboard,
+    'delete': _delete,
+    'restore': _restore,
+}
+
+
+class InProcessTarget:
+    """
+    Runs wrapper commands on an integration per worker thread
+
+    SQLite connections belong to the thread that opened them, so each worker
+    calls prepare() before its first request and release() when it stops.
+    """
+
+    name = 'inprocess'
+
+    def __init__(self, workdir: str):
+        from video_integration_wrapper import COMMANDS
+        self.commands = COMMANDS
+        self.db_path = os.path.join(workdir, DB_FILE)
+        self.upload_dir = os.path.join(workdir, 'uploads')
+        self._local = threading.local()
+
+    def prepare(self):
+        """Open this thread's integration, so its first request is not timed with the setup"""
+        if getattr(self._local, 'integration', None) is None:
+            from video_database_integration import EduNabhaVideoIntegration
+            self._local.integration = EduNabhaVideoIntegration(self.db_path, self.upload_dir)
+
+    def call(self, command: str, args: list):
+        self.prepare()
+        handler, read_only = self.commands[command]
+        return handler(self._local.integration, args)
+
+    def release(self):
+        integration = getattr(self._local, 'integration', None)
+        if integration is not None:
+            self._local.integration = None
+            integration.close()
+
+
+class WrapperTarget:
+    """Runs each command as its own video_integration_wrapper.py process"""
+
+    name = 'wrapper'
+
+    def __init__(self, workdir: str, timeout: float = 60):
+        self.workdir = workdir
+        self.timeout = timeout
+
+    def call(self, command: str, args: list):
+        process = subprocess.run(
+            [sys.executable, WRAPPER, command, *args], cwd=self.workdir,
+            capture_output=True, text=True, timeout=self.timeout
+        )
+        if not process.stdout.strip():
+            raise RuntimeError(process.stderr.strip().splitlines()[-1] if process.stderr.strip()
+                               else f"exit status {process.returncode}")
+        return json.loads(process.stdout)
+
+    def prepare(self):
+        pass
+
+    def release(self):
+        pass
+
+
+class StepStats:
+    """Latencies and outcomes of the requests made during one load step"""
+
+    def __init__(self):
+        self.latencies = {}  # {operation: [seconds]}
+        self.errors = {}  # {operation: count}
+        self.lock_errors = {}
+        self.samples = []  # First few error messages, to tell failures apart
+        self.unserved = 0  # Open-loop arrivals still queued when the step ended
+        self._lock = threading.Lock()
+
+    def record(self, operation: str, seconds: float, error: str = None):
+        with self._lock:
+            self.latencies.setdefault(operation, []).append(seconds)
+            if error is None:
+                return
+            if any(message in error for message in LOCK_ERRORS):
+                self.lock_errors[operation] = self.lock_errors.get(operation, 0) + 1
+            else:
+                self.errors[operation] = self.errors.get(operation, 0) + 1
+            if len(self.samples) < 5:
+                self.samples.append(f"{operation}: {error}")
+
+    def summary(self, level, wall_seconds: float, offered: float = None) -> Dict:
+        every = [seconds for samples in self.latencies.values() for seconds in samples]
+        requests = len(every)
+        failed = sum(self.errors.values()) + sum(self.lock_errors.values())
+        result = {
+            'level': level,
+            'requests': requests,
+            'throughput': round(requests / wall_seconds, 2) if wall_seconds else 0,
+            'latencyMs': _latency_summary(every),
+            'errors': sum(self.errors.values()),
+            'lockErrors': sum(self.lock_errors.values()),
+            'errorRate': round(failed / requests, 4) if requests else 0,
+            'operations': {
+                operation: {'requests': len(samples), **_latency_summary(samples),
+                            'errors': self.errors.get(operation, 0),
+                            'lockErrors': self.lock_errors.get(operation, 0)}
+                for operation, samples in sorted(self.latencies.items())
+            }
+        }
+        if offered is not None:
+            result['offeredRate'] = offered
+            result['unserved'] = self.unserved
+        if self.samples:
+            result['errorSamples'] = self.samples
+        return result
+
+
+def _latency_summary(samples: List[float]) -> Dict:
+    if not samples:
+        return {'p50': 0, 'p95': 0, 'p99': 0, 'max': 0}
+    ordered = sorted(samples)
+
+    def percentile(p):
+        return round(ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] * 1000, 2)
+
+    return {'p50': percentile(50), 'p95': percentile(95), 'p99': percentile(99),
+            'max': round(ordered[-1] * 1000, 2)}
+
+
+def _failure(result) -> Optional[str]:
+    """The error an integration result reports, if any"""
+    if isinstance(result, dict) and (result.get('success') is False or 'error' in result):
+        return str(result.get('error') or 'unsuccessful')
+    return None
+
+
+class LoadGenerator:
+    """Steps a classroom workload up against a target and finds where it saturates"""
+
+    def __init__(self, target, library: Library, students: int = 40, mix: Dict[str, float] = None,
+                 think_seconds: float = 2.0, heartbeat_seconds: int = 10, seed: int = None):
+        """
+        Args:
+            target: InProcessTarget or WrapperTarget
+            library: Video ids to work on (see seed_library)
+            students: Student ids spread over the requests of an open-loop step
+            mix: {operation: weight}, operations from OPERATIONS
+            think_seconds: Mean pause between a closed-loop student's requests
+                (exponentially distributed; 0 for none)
+            heartbeat_seconds: Playback position advanced per heartbeat
+            seed: Random seed, for repeatable runs
+        """
+        mix = DEFAULT_MIX if mix is None else mix
+        unknown = set(mix) - set(OPERATIONS)
+        if unknown:
+            raise ValueError(f"Unknown operations: {', '.join(sorted(unknown))}")
+        self.target = target
+        self.library = library
+        self.think_seconds = think_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self.operations = [operation for operation, weight in mix.items() if weight > 0]
+        self.weights = [mix[operation] for operation in self.operations]
+        self.seed = seed
+        self.students = [self._student(index) for index in range(students)]
+
+    def _student(self, index: int) -> Student:
+        return Student(f"student-{index + 1:03d}", self.heartbeat_seconds)
+
+    def request(self, student: Student, rng: random.Random, stats: StepStats, scheduled: float = None):
+        """Issue one request of the mix; latency runs from scheduled (default: now)"""
+        operation = rng.choices(self.operations, self.weights)[0]
+        call = OPERATIONS[operation](student, self.library, rng)
+        if call is None:
+            operation, call = 'list', OPERATIONS['list'](student, self.library, rng)
+        started = time.perf_counter() if scheduled is None else scheduled
+        try:
+            error = _failure(self.target.call(call[0], call[1]))
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        finally:
+            if len(call) > 2:
+                call[2]()
+        stats.record(operation, time.perf_counter() - started, error)
+
+    def run_users(self, users: int, duration: float) -> Dict:
+        """
+        Closed loop: users students, all starting at the same moment, each
+        sending a request, thinking, and sending the next until duration ends
+        """
+        while len(self.students) < users:
+            self.students.append(self._student(len(self.students)))
+        stats = StepStats()
+        start = threading.Barrier(users + 1)
+        deadline = [None]
+
+        def student_loop(student, rng):
+            try:
+                self.target.prepare()
+                start.wait()
+                while time.perf_counter() < deadline[0]:
+                    self.request(student, rng, stats)
+                    if self.think_seconds:
+                        time.sleep(min(rng.expovariate(1 / self.think_seconds),
+                                       max(0.0, deadline[0] - time.perf_counter())))
+            finally:
+                self.target.release()
+
+        threads = [threading.Thread(target=student_loop, args=(student, self._rng(index)), daemon=True)
+                   for index, student in enumerate(self.students[:users])]
+        for thread in threads:
+            thread.start()
+        started = time.perf_counter()
+        deadline[0] = started + duration
+        start.wait()
+        for thread in threads:
+            thread.join()
+        return stats.summary(users, time.perf_counter() - started)
+
+    def run_rate(self, rate: float, duration: float, concurrency: int) -> Dict:
+        """
+        Open loop: Poisson arrivals at rate per second served by concurrency
+        workers; requests still queued when duration ends count as unserved
+        """
+        stats = StepStats()
+        rng = self._rng(-1)
+        arrivals = queue.Queue()
+        start = threading.Barrier(concurrency + 1)
+        deadline = [None]
+
+        def worker():
+            try:
+                self.target.prepare()
+                start.wait()
+                while True:
+                    item = arrivals.get()
+                    if item is None:
+                        return
+                    student, request_rng, scheduled = item
+                    if time.perf_counter() < deadline[0]:
+                        self.request(student, request_rng, stats, scheduled)
+                    else:
+                        stats.unserved += 1
+            finally:
+                self.target.release()
+
+        threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        started = arrival = time.perf_counter()
+        deadline[0] = started + duration
+        start.wait()
+        while True:
+            arrival += rng.expovariate(rate)
+            if arrival >= deadline[0]:
+                break
+            pause = arrival - time.perf_counter()
+            if pause > 0:
+                time.sleep(pause)
+            arrivals.put((rng.choice(self.students), self._rng(rng.random()), arrival))
+        for _ in threads:
+            arrivals.put(None)
+        for thread in threads:
+            thread.join()
+        return stats.summary(rate, time.perf_counter() - started, offered=rate)
+
+    def _rng(self, salt) -> random.Random:
+        return random.Random(None if self.seed is None else f"{self.seed}:{salt}")
+
+    def run(self, levels: List[float], duration: float, open_loop: bool = False,
+            concurrency: int = 40) -> Dict:
+        """
+        Run one step per load level and report where throughput stopped scaling
+
+        Args:
+            levels: Concurrent students per step, or arrival rates with open_loop
+            duration: Seconds per step
+            open_loop: Treat levels as arrival rates per second
+            concurrency: Workers serving an open loop's arrivals
+
+        Returns:
+            {'target', 'mode', 'steps': [...], 'saturation'}
+        """
+        steps = []
+        for level in levels:
+            if open_loop:
+                step = self.run_rate(level, duration, concurrency)
+            else:
+                step = self.run_users(int(level), duration)
+            steps.append(step)
+            logger.info("Load step finished", extra={
+                'load_level': level, 'throughput': step['throughput'], 'p95_ms': step['latencyMs']['p95'],
+                'errors': step['errors'], 'lock_errors': step['lockErrors']
+            })
+        return {
+            'target': self.target.name,
+            'mode': 'rate' if open_loop else 'users',
+            'steps': steps,
+            'saturation': find_saturation(steps)
+        }
+
+
+def find_saturation(steps: List[Dict]) -> Dict:
+    """
+    The last step that still scaled, and why the one after it did not
+
+    Returns:
+        {'level', 'throughput', 'reason'}; level is None when even the first
+        step was saturated, and reason is None when no step was
+    """
+    last = None
+    for step in steps:
+        reason = None
+        if step['errorRate'] > MAX_ERROR_RATE:
+            reason = f"{step['errorRate']:.1%} of requests failed at {step['level']}"
+        elif step.get('unserved', 0) > (step['requests'] + step.get('unserved', 0)) * (1 - OFFERED_SHARE):
+            reason = (f"{step['unserved']} of {step['requests'] + step['unserved']} arrivals "
+                      f"were still queued at the end of {step['level']}/s")
+        elif last is not None and step['level'] > last['level'] and last['throughput']:
+            added = step['level'] / last['level'] - 1
+            gained = step['throughput'] / last['throughput'] - 1
+            if gained < added * SATURATION_GAIN:
+                reason = (f"throughput grew {gained:.0%} for {added:.0%} more load "
+                          f"at {step['level']}, p95 {step['latencyMs']['p95']}ms")
+        if reason:
+            return {'level': last['level'] if last else None,
+                    'throughput': last['throughput'] if last else None, 'reason': reason}
+        last = step
+    return {'level': last['level'] if last else None,
+            'throughput': last['throughput'] if last else None, 'reason': None}
+
+
+def seed_library(workdir: str, videos: int = 200, duration: int = 600) -> List[int]:
+    """
+    Create a scratch database in workdir with videos lecture files (empty
+    files, so integrity checks see them); returns the video ids
+    """
+    from video_database_integration import EduNabhaVideoIntegration
+    upload_dir = os.path.join(workdir, 'uploads')
+    if os.path.exists(SCHEMA_FILE):
+        shutil.copy(SCHEMA_FILE, os.path.join(workdir, SCHEMA_FILE))  # For wrapper processes
+    integration = EduNabhaVideoIntegration(os.path.join(workdir, DB_FILE), upload_dir)
+    rng = random.Random(videos)
+    try:
+        video_ids = []
+        with integration.db.transaction():
+            for index in range(videos):
+                course = COURSES[index % len(COURSES)]
+                file_name = f"lecture-{index + 1:04d}.mp4"
+                open(os.path.join(upload_dir, file_name), 'wb').close()
+                video = integration.add_downloaded_video({
+                    'title': f"{course} {rng.choice(SEARCH_TERMS)} {rng.choice(SEARCH_TERMS)} {index + 1}",
+                    'course': {'title': course, 'category': 'Lectures'},
+                    'duration': duration,
+                    'filePath': file_name
+                })
+                video_ids.append(int(video['id']))
+        return video_ids
+    finally:
+        integration.close()
+
+
+def _levels(text: str) -> List[float]:
+    return [float(level) for level in text.split(',') if level.strip()]
+
+
+def _mix(text: str) -> Dict[str, float]:
+    mix = dict(DEFAULT_MIX)
+    for part in text.split(','):
+        if part.strip():
+            operation, _, weight = part.partition('=')
+            mix[operation.strip()] = float(weight)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulate a classroom against the video integration')
+    parser.add_argument('--target', choices=['inprocess', 'wrapper'], default='inprocess')
+    parser.add_argument('--users', default='5,10,20,40', help='Concurrent students per step (closed loop)')
+    parser.add_argument('--rate', default=None, help='Arrivals per second per step (open loop, instead of --users)')
+    parser.add_argument('--concurrency', type=int, default=40, help='Workers serving an open loop')
+    parser.add_argument('--duration', type=float, default=20, help='Seconds per step')
+    parser.add_argument('--think', type=float, default=2.0, help='Mean think time between requests (s)')
+    parser.add_argument('--mix', default='', help='Weights overriding the default mix, e.g. heartbeat=50,delete=0')
+    parser.add_argument('--videos', type=int, default=200, help='Videos in the scratch library')
+    parser.add_argument('--workdir', default=None, help='Scratch directory (default: a new temporary one)')
+    parser.add_argument('--keep', action='store_true', help='Keep the scratch directory')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+    configure_logging()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='edunabha-load-')
+    os.makedirs(workdir, exist_ok=True)
+    try:
+        library = Library(seed_library(workdir, args.videos), duration=600)
+        target = WrapperTarget(workdir) if args.target == 'wrapper' else InProcessTarget(workdir)
+        generator = LoadGenerator(target, library, students=args.concurrency, mix=_mix(args.mix),
+                                  think_seconds=args.think, seed=args.seed)
+        report = generator.run(_levels(args.rate or args.users), args.duration,
+                               open_loop=args.rate is not None, concurrency=args.concurrency)
+        print(json.dumps(report, indent=2))
+    finally:
+        if args.keep:
+            logger.info("Scratch database kept", extra={'workdir': workdir})
+        elif not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+"""
+Schema Migrations
+Ordered, recorded schema changes applied on top of video_database_schema.sql,
+for changes CREATE ... IF NOT EXISTS cannot express (dropping or replacing
+indexes, altering tables) and for indexes applied by the query advisor
+"""
+
+import json
+import sqlite3
+import time
+import zlib
+from typing import Callable, Dict, List, Optional, Sequence, Union
+
+from instrumentation import get_logger
+
+
+logger = get_logger('migrations')
+
+
+# (name, statements) in the order they are applied. Statements are SQL strings
+# or a callable taking the connection; never edit a migration once released,
+# add a new one instead.
+MIGRATIONS = [
+    ('0001_hot_query_indexes', [
+        # get_pending_videos / count_pending_videos: only unwatched videos, newest first
+        "CREATE INDEX IF NOT EXISTS idx_videos_pending ON videos(download_date DESC) WHERE watch_count = 0",
+        # search_videos(category_id=...) reads the category already sorted by date
+        "DROP INDEX IF EXISTS idx_videos_category",
+        "CREATE INDEX IF NOT EXISTS idx_videos_category_date ON videos(category_id, download_date DESC)",
+        # get_course_progress groups by the course parsed out of the description;
+        # must stay identical to the CASE expression in that query
+        "CREATE INDEX IF NOT EXISTS idx_videos_course ON videos(CASE WHEN description LIKE 'Course:%' "
+        "THEN TRIM(SUBSTR(description, 8, INSTR(description||'|', '|') - 8)) ELSE 'Unknown Course' END)",
+    ]),
+    ('0002_soft_delete', [
+        # Trashed videos keep their row and file until the reclaimer purges them;
+        # every catalog query filters on deleted_at IS NULL
+        "ALTER TABLE videos ADD COLUMN deleted_at DATETIME",
+        "CREATE INDEX IF NOT EXISTS idx_videos_deleted ON videos(deleted_at) WHERE deleted_at IS NOT NULL",
+    ]),
+    ('0003_fuzzy_search_backfill', [
+        # Videos from before the search triggers existed are indexed on the next sync
+        "INSERT OR IGNORE INTO search_dirty (video_id) SELECT id FROM videos",
+    ]),
+    ('0004_delete_video_orphans', [
+        # Foreign keys are off, so earlier hard deletes left these rows behind;
+        # VideoDatabase now deletes them together with the video
+        "DELETE FROM video_renditions WHERE video_id NOT IN (SELECT id FROM videos)",
+        "DELETE FROM rendition_segments WHERE rendition_id NOT IN (SELECT id FROM video_renditions)",
+        "DELETE FROM video_downloads WHERE video_id NOT IN (SELECT id FROM videos)",
+        "DELETE FROM download_segment_hashes WHERE video_id NOT IN (SELECT video_id FROM video_downloads)",
+        "DELETE FROM watch_events WHERE video_id NOT IN (SELECT id FROM videos)",
+        "DELETE FROM video_tags WHERE video_id NOT IN (SELECT id FROM videos)",
+        "DELETE FROM playlist_videos WHERE video_id NOT IN (SELECT id FROM videos)",
+        "DELETE FROM review_cards WHERE video_id NOT IN (SELECT id FROM videos)",
+        "UPDATE upload_sessions SET video_id = NULL WHERE video_id NOT IN (SELECT id FROM videos)",
+    ]),
+    ('0005_upload_final_path', [
+        # Recorded before the finished upload is renamed, so completion can be resumed
+        "ALTER TABLE upload_sessions ADD COLUMN final_path TEXT",
+    ]),
+]
+
+Migration = Union[Sequence[str], Callable[[sqlite3.Connection], None]]
+
+
+def schema_version(schema: str, migrations: list = None) -> int:
+    """
+    PRAGMA user_version identifying a schema script plus the migration list
+
+    VideoDatabase stores it after a full initialization; a database already at
+    this version skips the schema script and the migration check on open.
+    """
+    names = [name for name, _ in (MIGRATIONS if migrations is None else migrations)]
+    return zlib.crc32('\n'.join([schema] + names).encode('utf-8')) & 0x7fffffff
+
+
+def applied_migrations(conn: sqlite3.Connection) -> List[Dict]:
+    """Applied migrations, oldest first"""
+    cursor = conn.execute(
+        "SELECT name, statements, details, applied_at FROM schema_migrations ORDER BY id"
+    )
+    return [{
+        'name': row[0],
+        'statements': json.loads(row[1]),
+        'details': json.loads(row[2]) if row[2] else None,
+        'appliedAt': row[3]
+    } for row in cursor.fetchall()]
+
+
+def pending_migrations(conn: sqlite3.Connection, migrations: list = None) -> List[str]:
+    applied = {row[0] for row in conn.execute("SELECT name FROM schema_migrations")}
+    return [name for name, _ in (MIGRATIONS if migrations is None else migrations) if name not in applied]
+
+
+def migrate(conn: sqlite3.Connection, migrations: list = None) -> List[str]:
+    """
+    Apply every migration not yet recorded in schema_migrations
+
+    Returns:
+        Names of the migrations applied by this call
+    """
+    migrations = MIGRATIONS if migrations is None else migrations
+    if not pending_migrations(conn, migrations):
+        return []
+    applied = []
+    for name, migration in migrations:
+        if apply_migration(conn, name, migration):
+            applied.append(name)
+    return applied
+
+
+def apply_migration(conn: sqlite3.Connection, name: str, migration: Migration,
+                    details: Dict = None) -> bool:
+    """
+    Run one migration and record it, atomically
+
+    Args:
+        conn: Database connection
+        name: Unique migration name
+        migration: SQL statements, or a callable doing the work on conn
+        details: Extra JSON stored with the record (e.g. benchmark numbers)
+
+    Returns:
+        False if the migration had already been applied
+    """
+    started = time.perf_counter()
+    if conn.in_transaction:
+        conn.commit()
+    conn.execute("BEGIN IMMEDIATE")  # Serializes processes opening the database together
+    try:
+        if conn.execute("SELECT 1 FROM schema_migrations WHERE name = ?", (name,)).fetchone():
+            conn.rollback()
+            return False
+        if callable(migration):
+            migration(conn)
+            statements = [f"<{getattr(migration, '__name__', 'callable')}>"]
+        else:
+            statements = list(migration)
+            for statement in statements:
+                conn.execute(statement)
+        details = dict(details or {}, durationMs=round((time.perf_counter() - started) * 1000, 2))
+        conn.execute(
+            "INSERT INTO schema_migrations (name, statements, details) VALUES (?, ?, ?)",
+            (name, json.dumps(statements), json.dumps(details))
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    logger.info("Applied migration %s", name, extra={'migration': name, 'duration_ms': details['durationMs']})
+    return True
+
+
+def annotate_migration(conn: sqlite3.Connection, name: str, **details):
+    """Merge keys into a recorded migration's details (e.g. timings taken after it ran)"""
+    row = conn.execute("SELECT details FROM schema_migrations WHERE name = ?", (name,)).fetchone()
+    if row is None:
+        return
+    merged = dict(json.loads(row[0]) if row[0] else {}, **details)
+    conn.execute("UPDATE schema_migrations SET details = ? WHERE name = ?", (json.dumps(merged), name))
+    conn.commit()
+
+
+def migration_status(conn: sqlite3.Connection) -> Dict:
+    applied = applied_migrations(conn)
+    return {
+        'applied': [m['name'] for m in applied],
+        'pending': pending_migrations(conn),
+        'lastAppliedAt': applied[-1]['appliedAt'] if applied else None
+    }
+
+
+def format_migration(name: str, statements: Sequence[str], comment: Optional[str] = None) -> str:
+    """Python source for a MIGRATIONS entry (to make an advisor migration permanent)"""
+    lines = [f"    ({name!r}, ["]
+    if comment:
+        lines.append(f"        # {comment}")
+    lines.extend(f"        {statement!r}," for statement in statements)
+    lines.append("    ]),")
+    return '\n'.join(lines)
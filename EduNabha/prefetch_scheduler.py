@@ -0,0 +1,341 @@
+"""
+Prefetch Scheduler
+Plans which videos to pre-download (urgency tags, pending status, playlist
+order, storage budget) and runs the transfers inside a bandwidth/time window
+"""
+
+import datetime
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from segmented_downloads import DownloadTracker
+from video_database import VideoDatabase
+
+
+# Score contributions per tag name
+TAG_WEIGHTS = {
+    'High Priority': 50,
+    'Exam Material': 30,
+    'Important': 20,
+    'Assignment Related': 15,
+    'Review Later': 10,
+    'Optional': -15,
+    'Completed': -40,
+}
+PENDING_WEIGHT = 25  # Not watched yet
+PARTIAL_WEIGHT = 10  # Already partly downloaded
+PLAYLIST_WEIGHT = 30  # Next lecture in a course playlist (decays with distance)
+
+
+def parse_window(window: tuple, now: datetime.datetime = None) -> tuple:
+    """
+    Resolve a daily time window such as ('22:00', '06:00') to concrete datetimes
+
+    Returns:
+        (start, end) of the current window if now falls inside it, else of the next one
+    """
+    now = now or datetime.datetime.now()
+    start_time = datetime.datetime.strptime(window[0], '%H:%M').time()
+    end_time = datetime.datetime.strptime(window[1], '%H:%M').time()
+
+    start = datetime.datetime.combine(now.date(), start_time)
+    end = datetime.datetime.combine(now.date(), end_time)
+    if end <= start:
+        end += datetime.timedelta(days=1)
+    # An overnight window that started yesterday may still be open
+    if start - datetime.timedelta(days=1) <= now < end - datetime.timedelta(days=1):
+        return start - datetime.timedelta(days=1), end - datetime.timedelta(days=1)
+    if now >= end:
+        start += datetime.timedelta(days=1)
+        end += datetime.timedelta(days=1)
+    return start, end
+
+
+class PrefetchPlanner:
+    """Ranks videos for pre-download and fits them to storage and bandwidth budgets"""
+
+    def __init__(self, db):
+        """
+        Args:
+            db: StudentVideoManager instance
+        """
+        self.db = db
+
+    def rank_candidates(self) -> List[Dict]:
+        """Videos that are not fully on the device, highest score first"""
+        cursor = self.db.conn.execute("""
+            SELECT v.id, v.title, v.file_path, v.file_size, v.duration, v.watch_count,
+                   d.status as download_status, d.total_size, d.segment_size,
+                   d.completed_segments, d.segment_count,
+                   (SELECT GROUP_CONCAT(t.name, '|') FROM video_tags vt
+                    JOIN tags t ON vt.tag_id = t.id WHERE vt.video_id = v.id) as tag_names
+            FROM videos v
+            LEFT JOIN video_downloads d ON d.video_id = v.id
+            WHERE (d.status IS NULL OR d.status != 'completed') AND v.deleted_at IS NULL
+        """)
+        playlist_bonus = self._playlist_bonuses()
+
+        candidates = []
+        for row in cursor.fetchall():
+            video = dict(row)
+            if video['download_status'] is None and video['file_path'] and os.path.exists(video['file_path']):
+                continue  # Stored as a whole file already
+
+            tags = video['tag_names'].split('|') if video['tag_names'] else []
+            score = sum(TAG_WEIGHTS.get(tag, 0) for tag in tags)
+            reasons = [tag for tag in tags if TAG_WEIGHTS.get(tag, 0) > 0]
+            if not video['watch_count']:
+                score += PENDING_WEIGHT
+                reasons.append('Pending')
+            if video['download_status'] and video['completed_segments']:
+                score += PARTIAL_WEIGHT
+                reasons.append('Partly downloaded')
+            if video['id'] in playlist_bonus:
+                score += playlist_bonus[video['id']]
+                reasons.append('Next in course')
+
+            candidates.append({
+                'videoId': video['id'],
+                'title': video['title'],
+                'score': round(score, 2),
+                'reasons': reasons,
+                'remainingBytes': self._remaining_bytes(video),
+                'duration': video['duration']
+            })
+
+        candidates.sort(key=lambda c: (-c['score'], c['remainingBytes']))
+        return candidates
+
+    def plan(self, storage_budget_bytes: int, bandwidth_kbps: float = None,
+             window: tuple = None, now: datetime.datetime = None,
+             efficiency: float = 0.8, max_items: int = None) -> Dict:
+        """
+        Build a download queue
+
+        Args:
+            storage_budget_bytes: Free space the prefetch may use
+            bandwidth_kbps: Expected link speed; with a window this caps total bytes
+            window: Daily time window such as ('22:00', '06:00') for school Wi-Fi
+            now: Reference time (defaults to the current time)
+            efficiency: Fraction of the nominal bandwidth expected in practice
+            max_items: Optional cap on queue length
+
+        Returns:
+            {'queue', 'skipped', 'bytesPlanned', 'windowStart', 'windowEnd', 'transferBudgetBytes'}
+        """
+        window_start = window_end = None
+        transfer_budget = None
+        if window:
+            window_start, window_end = parse_window(window, now)
+            usable_seconds = (window_end - max(window_start, now or datetime.datetime.now())).total_seconds()
+            if bandwidth_kbps:
+                transfer_budget = int(bandwidth_kbps * 1000 / 8 * usable_seconds * efficiency)
+
+        queue, skipped = [], []
+        storage_left = storage_budget_bytes
+        transfer_left = transfer_budget
+        for candidate in self.rank_candidates():
+            if max_items is not None and len(queue) >= max_items:
+                skipped.append({**candidate, 'skipReason': 'queue full'})
+                continue
+            size = candidate['remainingBytes']
+            if size > storage_left:
+                skipped.append({**candidate, 'skipReason': 'storage budget'})
+                continue
+            if transfer_left is not None and size > transfer_left:
+                skipped.append({**candidate, 'skipReason': 'transfer window'})
+                continue
+            storage_left -= size
+            if transfer_left is not None:
+                transfer_left -= size
+            item = dict(candidate)
+            if bandwidth_kbps:
+                item['estimatedSeconds'] = round(size * 8 / (bandwidth_kbps * 1000 * efficiency), 1)
+            queue.append(item)
+
+        return {
+            'queue': queue,
+            'skipped': skipped,
+            'bytesPlanned': storage_budget_bytes - storage_left,
+            'windowStart': window_start.isoformat() if window_start else None,
+            'windowEnd': window_end.isoformat() if window_end else None,
+            'transferBudgetBytes': transfer_budget
+        }
+
+    # Internal helpers
+    def _playlist_bonuses(self) -> Dict[int, float]:
+        """Bonus for the next unwatched lectures of each playlist, decaying with distance"""
+        cursor = self.db.conn.execute("""
+            SELECT pv.playlist_id, pv.video_id
+            FROM playlist_videos pv
+            JOIN videos v ON v.id = pv.video_id
+            WHERE v.watch_count = 0 AND v.deleted_at IS NULL
+            ORDER BY pv.playlist_id, pv.position
+        """)
+        bonuses = {}
+        current_playlist, rank = None, 0
+        for row in cursor.fetchall():
+            if row['playlist_id'] != current_playlist:
+                current_playlist, rank = row['playlist_id'], 0
+            bonus = PLAYLIST_WEIGHT / (1 + rank)
+            bonuses[row['video_id']] = max(bonuses.get(row['video_id'], 0), bonus)
+            rank += 1
+        return bonuses
+
+    @staticmethod
+    def _remaining_bytes(video: Dict) -> int:
+        if video['download_status'] is None:
+            return video['file_size'] or 0
+        if not video['segment_count']:
+            return 0
+        missing = video['segment_count'] - (video['completed_segments'] or 0)
+        return min(missing * video['segment_size'], video['total_size'])
+
+
+class TokenBucket:
+    """Thread-safe byte-rate limiter shared by concurrent transfers"""
+
+    def __init__(self, rate_bytes_per_second: float, burst_bytes: float = None):
+        self.rate = rate_bytes_per_second
+        self.capacity = burst_bytes or rate_bytes_per_second
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, amount: int):
+        """Block until amount bytes may be transferred"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                needed = min(amount, self.capacity)
+                if self._tokens >= needed:
+                    self._tokens -= needed
+                    amount -= needed
+                    if amount <= 0:
+                        return
+                    wait = 0
+                else:
+                    wait = (needed - self._tokens) / self.rate
+            if wait:
+                time.sleep(wait)
+
+
+class PrefetchExecutor:
+    """Runs a prefetch queue with concurrent transfers, retries and backoff"""
+
+    def __init__(self, transfer: Callable[[Dict], None], max_workers: int = 3,
+                 max_retries: int = 4, backoff_base: float = 2.0, backoff_cap: float = 300.0,
+                 deadline: datetime.datetime = None, sleep: Callable[[float], None] = time.sleep):
+        """
+        Args:
+            transfer: Called with a queue item; raises on failure
+            max_workers: Concurrent transfers
+            max_retries: Retries per item after the first attempt
+            backoff_base: Base delay in seconds (doubles per retry, with full jitter)
+            backoff_cap: Maximum delay between attempts
+            deadline: Stop starting new attempts after this time (e.g. window end)
+            sleep: Sleep function (injectable for tests)
+        """
+        self.transfer = transfer
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.deadline = deadline
+        self.sleep = sleep
+        self._stop = threading.Event()
+
+    def stop(self):
+        """Stop scheduling new attempts; running transfers finish"""
+        self._stop.set()
+
+    def run(self, queue: List[Dict]) -> Dict:
+        """
+        Transfer every item in queue order (highest priority first)
+
+        Returns:
+            {'completed': [...], 'failed': [...], 'notStarted': [...]}
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            results = list(pool.map(self._run_item, queue))
+
+        summary = {'completed': [], 'failed': [], 'notStarted': []}
+        for item, (state, detail) in zip(queue, results):
+            summary[state].append({**item, **detail})
+        return summary
+
+    def _run_item(self, item: Dict) -> tuple:
+        attempts = 0
+        last_error = None
+        while attempts <= self.max_retries:
+            if self._stopped():
+                state = 'notStarted' if attempts == 0 else 'failed'
+                return state, {'attempts': attempts, 'error': last_error or 'window closed'}
+            attempts += 1
+            try:
+                self.transfer(item)
+                return 'completed', {'attempts': attempts}
+            except Exception as e:
+                last_error = str(e)
+                if attempts > self.max_retries:
+                    break
+                delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** (attempts - 1)))
+                if self.deadline:
+                    delay = min(delay, max(0.0, (self.deadline - datetime.datetime.now()).total_seconds()))
+                self.sleep(delay)
+        return 'failed', {'attempts': attempts, 'error': last_error}
+
+    def _stopped(self) -> bool:
+        return self._stop.is_set() or bool(self.deadline and datetime.datetime.now() >= self.deadline)
+
+
+class SegmentHttpTransfer:
+    """
+    Transfer function fetching missing segments with HTTP Range requests.
+    SQLite connections cannot be shared across threads, so each worker
+    thread opens its own connection to db_path.
+    """
+
+    def __init__(self, db_path: str, url_for_video: Callable[[int], str],
+                 limiter: Optional[TokenBucket] = None, timeout: float = 60):
+        """
+        Args:
+            db_path: Video database recording segment completion
+            url_for_video: Maps a video ID to its download URL
+            limiter: Shared TokenBucket enforcing the bandwidth cap
+            timeout: Socket timeout per request
+        """
+        self.db_path = db_path
+        self.url_for_video = url_for_video
+        self.limiter = limiter
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _tracker(self) -> DownloadTracker:
+        if not hasattr(self._local, 'tracker'):
+            self._local.tracker = DownloadTracker(VideoDatabase(self.db_path))
+        return self._local.tracker
+
+    def __call__(self, item: Dict):
+        import urllib.request  # Only fetching needs it; planning alone stays cheap to import
+        tracker = self._tracker()
+        video_id = item['videoId']
+        progress = tracker.start_download(video_id)
+        for index in tracker.prioritize_segments(video_id):
+            start = index * progress['segmentSize']
+            end = min(start + progress['segmentSize'], progress['totalBytes']) - 1
+            request = urllib.request.Request(
+                self.url_for_video(video_id), headers={'Range': f"bytes={start}-{end}"}
+            )
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                data = response.read()
+            if self.limiter:
+                self.limiter.consume(len(data))
+            if not tracker.write_segment(video_id, index, data):
+                raise IOError(f"Segment {index} of video {video_id} failed verification")
@@ -0,0 +1,373 @@
+"""
+Profiling
+Opt-in CPU and allocation profiles for wrapper commands, API requests and
+integration methods. A sampled call is run under cProfile, a stack sampler
+and tracemalloc, and leaves flamegraph-compatible files behind:
+
+    <dir>/<time>-<label>-<pid>-<n>.pstats        cProfile stats (pstats, snakeviz)
+    <dir>/<time>-<label>-<pid>-<n>.cpu.folded    sampled stacks (flamegraph.pl, speedscope)
+    <dir>/<time>-<label>-<pid>-<n>.alloc.folded  live allocations by stack, in bytes
+    <dir>/<time>-<label>-<pid>-<n>.json          wall/CPU time, peak memory, top functions
+
+Environment:
+    EDUNABHA_PROFILE              1 (cpu and memory), cpu, memory; unset disables
+    EDUNABHA_PROFILE_SAMPLE       Fraction of calls profiled (default 1.0)
+    EDUNABHA_PROFILE_DIR          Output directory (default ./profiles)
+    EDUNABHA_PROFILE_INTERVAL_MS  Stack sampling interval (default 1)
+    EDUNABHA_PROFILE_KEEP         Profiles kept in the directory (default 200)
+
+cProfile, pstats and tracemalloc are imported on first use, so processes that
+never profile (most wrapper commands) do not pay for them at startup.
+"""
+
+import functools
+import io
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+import types
+from collections import Counter
+from typing import Dict, List, Optional
+
+from instrumentation import get_logger
+
+
+logger = get_logger('profiling')
+
+
+ALLOC_FRAMES = 25  # Stack depth recorded per allocation
+TOP_FUNCTIONS = 25
+
+
+def _parse_modes(value: str) -> frozenset:
+    value = (value or '').strip().lower()
+    if value in ('', '0', 'false', 'off', 'no'):
+        return frozenset()
+    if value in ('1', 'true', 'on', 'yes', 'all'):
+        return frozenset(['cpu', 'memory'])
+    return frozenset(part.strip() for part in value.split(',') if part.strip() in ('cpu', 'memory'))
+
+
+class ProfileConfig:
+    """Profiling settings, read from the environment unless given"""
+
+    def __init__(self, modes: frozenset = None, sample_rate: float = None, output_dir: str = None,
+                 interval: float = None, keep: int = None):
+        env = os.environ
+        self.modes = _parse_modes(env.get('EDUNABHA_PROFILE', '')) if modes is None else frozenset(modes)
+        self.sample_rate = float(env.get('EDUNABHA_PROFILE_SAMPLE', '1')) if sample_rate is None else sample_rate
+        self.output_dir = output_dir or env.get('EDUNABHA_PROFILE_DIR') or 'profiles'
+        self.interval = (float(env.get('EDUNABHA_PROFILE_INTERVAL_MS', '1')) / 1000
+                         if interval is None else interval)
+        self.keep = int(env.get('EDUNABHA_PROFILE_KEEP', '200')) if keep is None else keep
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.modes)
+
+
+CONFIG = ProfileConfig()
+_active = threading.local()
+_sequence = itertools.count(1)
+_tracemalloc_lock = threading.Lock()
+_tracemalloc_users = 0  # Concurrent profiles share one process-wide tracemalloc session
+
+
+def should_profile(force: bool = False, config: ProfileConfig = None) -> bool:
+    """Whether the next call is profiled: forced, or sampled when profiling is on"""
+    config = config or CONFIG
+    if force or (config.enabled and config.sample_rate >= 1):
+        return True
+    if not config.enabled:
+        return False
+    import random
+    return random.random() < config.sample_rate
+
+
+class CommandProfile:
+    """
+    One profiled call
+
+    start() and stop() must run on the same thread; stop() writes the files
+    and returns their paths.
+    """
+
+    def __init__(self, label: str, config: ProfileConfig = None, modes: frozenset = None):
+        self.label = label
+        self.config = config or CONFIG
+        self.modes = modes or self.config.modes or frozenset(['cpu', 'memory'])
+        self.paths = {}
+        self._profiler = None
+        self._sampler = None
+        self._tracing = False
+
+    def start(self) -> 'CommandProfile':
+        import cProfile  # Before the clocks start, so the import is not in the profile
+        _active.profile = self
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        if 'memory' in self.modes:
+            _start_tracing()
+            self._tracing = True
+        if 'cpu' in self.modes:
+            self._sampler = StackSampler(threading.get_ident(), self.config.interval).start()
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        return self
+
+    def stop(self) -> Dict[str, str]:
+        if getattr(_active, 'profile', None) is not self:
+            return self.paths
+        try:
+            if self._profiler:
+                self._profiler.disable()
+            stacks = self._sampler.stop() if self._sampler else None
+            wall = time.perf_counter() - self._wall
+            cpu = time.process_time() - self._cpu
+
+            snapshot, peak = None, None
+            if self._tracing:
+                import tracemalloc
+                snapshot = tracemalloc.take_snapshot().filter_traces([
+                    tracemalloc.Filter(False, tracemalloc.__file__),
+                    tracemalloc.Filter(False, __file__),
+                ])
+                peak = tracemalloc.get_traced_memory()[1]
+                _stop_tracing()
+                self._tracing = False
+            self._write(wall, cpu, stacks, snapshot, peak)
+        except Exception as e:
+            logger.warning("Could not write profile for %s: %s", self.label, e)
+        finally:
+            if self._tracing:
+                _stop_tracing()
+                self._tracing = False
+            _active.profile = None
+        return self.paths
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    # Output
+    def _write(self, wall: float, cpu: float, stacks: Optional[Counter], snapshot, peak: Optional[int]):
+        os.makedirs(self.config.output_dir, exist_ok=True)
+        safe_label = ''.join(c if c.isalnum() or c in '-_.' else '_' for c in self.label)[:80]
+        base = os.path.join(self.config.output_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{safe_label}"
+                                                    f"-{os.getpid()}-{next(_sequence)}")
+        summary = {
+            'label': self.label,
+            'pid': os.getpid(),
+            'wallMs': round(wall * 1000, 3),
+            'cpuMs': round(cpu * 1000, 3),
+        }
+
+        if self._profiler:
+            self.paths['pstats'] = base + '.pstats'
+            self._profiler.dump_stats(self.paths['pstats'])
+            summary['topFunctions'] = top_functions(self._profiler)
+        if stacks is not None:
+            self.paths['cpu'] = base + '.cpu.folded'
+            _write_folded(self.paths['cpu'], stacks)
+            summary['samples'] = sum(stacks.values())
+        if snapshot is not None:
+            allocations = Counter()
+            for stat in snapshot.statistics('traceback'):
+                allocations[';'.join(_alloc_frame(frame) for frame in stat.traceback)] += stat.size
+            self.paths['memory'] = base + '.alloc.folded'
+            _write_folded(self.paths['memory'], allocations)
+            summary['peakMemoryBytes'] = peak
+            summary['liveAllocatedBytes'] = sum(allocations.values())
+            summary['topAllocations'] = [
+                {'location': str(stat.traceback[-1]), 'sizeBytes': stat.size, 'count': stat.count}
+                for stat in snapshot.statistics('lineno')[:10]
+            ]
+
+        self.paths['summary'] = base + '.json'
+        summary['files'] = dict(self.paths)
+        with open(self.paths['summary'], 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2)
+        _prune(self.config.output_dir, self.config.keep)
+        logger.info("Profile written for %s", self.label,
+                    extra={'wall_ms': summary['wallMs'], 'cpu_ms': summary['cpuMs'], 'files': self.paths})
+
+
+class StackSampler:
+    """Samples one thread's Python stack on an interval, counting folded stacks"""
+
+    def __init__(self, thread_id: int, interval: float = 0.001):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self) -> 'StackSampler':
+        self._thread = threading.Thread(target=self._run, name='edunabha-profiler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> Counter:
+        self._stop.set()
+        self._thread.join()
+        return self.stacks
+
+    def _run(self):
+        import cProfile
+        own = {__file__, cProfile.__file__}
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                if frame.f_code.co_filename not in own:
+                    names.append(_cpu_frame(frame.f_code))
+                frame = frame.f_back
+            if names:
+                self.stacks[';'.join(reversed(names))] += 1
+
+
+def profile_command(label: str, force: bool = False, config: ProfileConfig = None):
+    """
+    Context manager profiling the block when it is sampled (or forced)
+
+    The sampling decision is made once, by the outermost call: inside the
+    block nested profile_command() calls and @profiled methods do nothing,
+    whether or not the outer call was sampled. Yields the CommandProfile, or
+    None when the block is not profiled.
+    """
+    if getattr(_active, 'profile', None) is not None:
+        return _Nested()
+    if should_profile(force, config):
+        return CommandProfile(label, config)
+    return _NotSampled()
+
+
+def start_profile(label: str, force: bool = False, config: ProfileConfig = None):
+    """profile_command() for code that cannot use a with block; call stop() on the result"""
+    profile = profile_command(label, force, config)
+    profile.__enter__()
+    return profile
+
+
+def profiled(label: str):
+    """Decorator profiling sampled calls (outermost profiled call wins)"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not CONFIG.enabled or getattr(_active, 'profile', None) is not None:
+                return func(*args, **kwargs)
+            with profile_command(label):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def profile_methods(cls):
+    """Class decorator making every public method profileable via EDUNABHA_PROFILE"""
+    for name, value in list(vars(cls).items()):
+        if not name.startswith('_') and isinstance(value, types.FunctionType):
+            setattr(cls, name, profiled(f"{cls.__name__}.{name}")(value))
+    return cls
+
+
+def top_functions(profiler: 'cProfile.Profile', limit: int = TOP_FUNCTIONS) -> List[Dict]:
+    """Functions with the most cumulative time"""
+    import pstats
+    stats = pstats.Stats(profiler, stream=io.StringIO())
+    rows = []
+    for (filename, line, name), (calls, _, own_time, cumulative, _) in stats.stats.items():
+        rows.append({
+            'function': f"{name} ({os.path.basename(filename)}:{line})",
+            'calls': calls,
+            'ownMs': round(own_time * 1000, 3),
+            'cumulativeMs': round(cumulative * 1000, 3)
+        })
+    rows.sort(key=lambda r: r['cumulativeMs'], reverse=True)
+    return rows[:limit]
+
+
+def _start_tracing():
+    import tracemalloc
+    global _tracemalloc_users
+    with _tracemalloc_lock:
+        if _tracemalloc_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(ALLOC_FRAMES)
+        _tracemalloc_users += 1
+        if _tracemalloc_users == 1:
+            tracemalloc.reset_peak()
+
+
+def _stop_tracing():
+    import tracemalloc
+    global _tracemalloc_users
+    with _tracemalloc_lock:
+        _tracemalloc_users -= 1
+        if _tracemalloc_users == 0:
+            tracemalloc.stop()
+
+
+class _NotSampled:
+    """Marks the thread as decided, so calls nested in an unsampled one are not sampled"""
+
+    paths = {}
+
+    def __enter__(self):
+        _active.profile = self
+        return None
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def stop(self) -> Dict[str, str]:
+        if getattr(_active, 'profile', None) is self:
+            _active.profile = None
+        return self.paths
+
+
+class _Nested:
+    paths = {}
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+    def stop(self) -> Dict[str, str]:
+        return self.paths
+
+
+def _cpu_frame(code) -> str:
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}:{code.co_firstlineno}"
+
+
+def _alloc_frame(frame) -> str:
+    return f"{os.path.basename(frame.filename)}:{frame.lineno}"
+
+
+def _write_folded(path: str, stacks: Counter):
+    with open(path, 'w', encoding='utf-8') as f:
+        for stack, value in stacks.most_common():
+            f.write(f"{stack.replace(' ', '_')} {value}\n")  # The count follows the last space
+
+
+def _prune(directory: str, keep: int):
+    """Delete the oldest profiles beyond keep (counted by summary files)"""
+    if keep <= 0:
+        return
+    summaries = sorted(
+        (entry for entry in os.scandir(directory) if entry.name.endswith('.json')),
+        key=lambda entry: entry.stat().st_mtime
+    )
+    for entry in summaries[:-keep]:
+        base = entry.path[:-len('.json')]
+        for suffix in ('.json', '.pstats', '.cpu.folded', '.alloc.folded'):
+            try:
+                os.remove(base + suffix)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,692 @@
+#!/usr/bin/env python3
+"""
+Query Advisor
+Records the SQL issued by VideoDatabase/StudentVideoManager, audits each
+statement's EXPLAIN QUERY PLAN for full scans and temp B-trees, and proposes
+covering, partial and expression indexes. Every proposal is checked against
+the planner before it is reported, and applied ones go through migrations
+with before/after timings.
+Usage: python query_advisor.py [--db student_videos.db] [--apply] [--repeat 5]
+"""
+
+import argparse
+import hashlib
+import json
+import re
+import sqlite3
+import statistics
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+from instrumentation import METRICS, configure_logging, get_logger
+from migrations import annotate_migration, apply_migration, format_migration
+
+
+logger = get_logger('query_advisor')
+
+
+ISSUE_WEIGHTS = {'full_scan': 4, 'temp_btree': 2, 'index_scan': 1}
+AUDITED_OPERATIONS = ('SELECT', 'WITH', 'UPDATE', 'DELETE')
+MAX_INDEX_COLUMNS = 6
+
+_SCAN_PATTERN = re.compile(
+    r'^(SCAN|SEARCH) (?:TABLE )?(\w+)(?: AS (\w+))?(?: USING (?:(COVERING) )?INDEX (\w+))?'
+)
+_SOURCE_PATTERN = re.compile(r'\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?', re.IGNORECASE)
+_JOIN_PATTERN = re.compile(r'\bJOIN\s+(\w+)', re.IGNORECASE)
+_PREDICATE_PATTERN = re.compile(
+    r"((?:\w+\.)?\w+)\s*(==|=|<=|>=|<|>|\bIS\b|\bIN\b|\bBETWEEN\b)\s*"
+    r"(\?|'[^']*'|-?\d+(?:\.\d+)?|\(|(?:\w+\.)?\w+)",
+    re.IGNORECASE
+)
+_COLUMN_REF_PATTERN = re.compile(r'\b(?:(\w+)\.)?(\w+)\b')
+_NOT_ALIASES = {
+    'WHERE', 'JOIN', 'LEFT', 'RIGHT', 'INNER', 'OUTER', 'CROSS', 'NATURAL', 'ON', 'USING',
+    'GROUP', 'ORDER', 'LIMIT', 'HAVING', 'UNION', 'SET', 'VALUES', 'WINDOW', 'AS'
+}
+
+
+class QueryAdvisor:
+    """
+    Audits captured statements and suggests indexes for them
+
+    Typical use::
+
+        advisor = QueryAdvisor(manager)
+        with advisor.capture():
+            run_workload(manager)
+        findings = advisor.audit()
+        suggestions = advisor.suggest(findings)
+        result = advisor.apply(suggestions)
+    """
+
+    def __init__(self, db, min_rows: int = 1000):
+        """
+        Args:
+            db: VideoDatabase (or StudentVideoManager) whose connection is audited
+            min_rows: Tables smaller than this get no index suggestions
+        """
+        self.db = db
+        self.min_rows = min_rows
+        self.statements = {}  # Normalized SQL -> {'sql', 'params', 'calls', 'totalSeconds'}
+        self._columns = {}
+        self._row_counts = {}
+
+    # Capture
+    @contextmanager
+    def capture(self):
+        """Record the statements executed (on any instrumented connection) inside the block"""
+        METRICS.add_listener(self._record)
+        try:
+            yield self
+        finally:
+            METRICS.remove_listener(self._record)
+
+    def add_statement(self, sql: str, params=()):
+        """Audit a statement that was not captured"""
+        self._record(sql, params, 0.0)
+
+    def _record(self, sql: str, params, seconds: float):
+        text = ' '.join(sql.split())
+        if params is None or text.split(' ', 1)[0].upper() not in AUDITED_OPERATIONS:
+            return
+        entry = self.statements.get(text)
+        if entry is None:
+            entry = self.statements[text] = {'sql': text, 'params': params, 'calls': 0, 'totalSeconds': 0.0}
+        entry['calls'] += 1
+        entry['totalSeconds'] += seconds
+
+    # Audit
+    def explain(self, sql: str, params=()) -> List[str]:
+        """EXPLAIN QUERY PLAN detail lines"""
+        cursor = self.db.conn.execute(f"EXPLAIN QUERY PLAN {sql}", params or ())
+        return [row[3] for row in cursor.fetchall()]
+
+    def plan_issues(self, sql: str, plan: List[str]) -> List[Dict]:
+        """Full table scans, full index scans and temp B-trees in a plan"""
+        sources = self._sources(sql)
+        issues = []
+        for detail in plan:
+            match = _SCAN_PATTERN.match(detail)
+            if match and match.group(1) == 'SCAN':
+                alias = match.group(3) or match.group(2)
+                table = sources.get(alias.lower())
+                if match.group(5) and _index_where(self.db.conn, match.group(5)):
+                    continue  # A partial index only holds the rows the query wants
+                if table:
+                    issues.append({
+                        'kind': 'index_scan' if match.group(5) else 'full_scan',
+                        'table': table,
+                        'alias': alias,
+                        'detail': detail
+                    })
+            elif detail.startswith('USE TEMP B-TREE'):
+                issues.append({'kind': 'temp_btree', 'table': None, 'alias': None, 'detail': detail})
+        return issues
+
+    def audit(self) -> List[Dict]:
+        """
+        Plan and issues for every captured statement
+
+        Returns:
+            Findings, most total time first
+        """
+        findings = []
+        for entry in self.statements.values():
+            try:
+                plan = self.explain(entry['sql'], entry['params'])
+            except sqlite3.Error as e:
+                logger.debug("Cannot explain %s: %s", entry['sql'], e)
+                continue
+            issues = self.plan_issues(entry['sql'], plan)
+            findings.append({
+                'sql': entry['sql'],
+                'params': entry['params'],
+                'calls': entry['calls'],
+                'totalMs': round(entry['totalSeconds'] * 1000, 3),
+                'plan': plan,
+                'issues': issues,
+                'score': _score(issues)
+            })
+        findings.sort(key=lambda f: (f['totalMs'], f['score']), reverse=True)
+        return findings
+
+    # Suggestions
+    def suggest(self, findings: List[Dict] = None) -> List[Dict]:
+        """
+        Indexes that remove scans or temp B-trees from the audited plans
+
+        Each candidate is created inside a savepoint, the statement is
+        re-planned and the savepoint rolled back; only candidates that lower
+        the plan's issue score are kept, the narrowest one per statement.
+        """
+        findings = self.audit() if findings is None else findings
+        suggestions = {}
+        for finding in findings:
+            if not finding['issues']:
+                continue
+            tables = {issue['table'] for issue in finding['issues'] if issue['table']}
+            if any(issue['kind'] == 'temp_btree' for issue in finding['issues']):
+                tables.update(self._sources(finding['sql']).values())
+            best = None
+            for table in sorted(t for t in tables if self._row_count(t) >= self.min_rows):
+                for columns, where in self._candidates(finding['sql'], table):
+                    score, plan = self._what_if(finding, table, columns, where)
+                    rank = (score, len(columns) + (0 if where else 1))
+                    if score < finding['score'] and (best is None or rank < best[0]):
+                        best = (rank, table, columns, where, plan)
+            if best is None:
+                continue
+            _, table, columns, where, plan = best
+            key = (table, tuple(columns), where)
+            suggestion = suggestions.get(key)
+            if suggestion is None:
+                suggestion = suggestions[key] = self._suggestion(table, columns, where)
+            suggestion['statements'].append(finding['sql'])
+            suggestion['improvements'].append({
+                'sql': finding['sql'],
+                'scoreBefore': finding['score'],
+                'scoreAfter': best[0][0],
+                'planBefore': finding['plan'],
+                'planAfter': plan,
+                'finding': finding
+            })
+        return self._without_conflicts(self._consolidate(list(suggestions.values())))
+
+    def _consolidate(self, suggestions: List[Dict]) -> List[Dict]:
+        """Fold each suggestion into a broader one on the same table that fixes its statements as well"""
+        kept = []
+        for suggestion in sorted(suggestions, key=lambda s: (-len(s['improvements']), -len(s['columns']))):
+            for host in kept:
+                if host['table'] != suggestion['table']:
+                    continue
+                replans = [self._what_if(i['finding'], host['table'], host['columns'], host['where'])
+                           for i in suggestion['improvements']]
+                if all(score <= i['scoreAfter'] for (score, _), i in zip(replans, suggestion['improvements'])):
+                    host['statements'].extend(suggestion['statements'])
+                    host['improvements'].extend(dict(i, planAfter=plan)
+                                                for (_, plan), i in zip(replans, suggestion['improvements']))
+                    break
+            else:
+                kept.append(suggestion)
+        for suggestion in kept:
+            for improvement in suggestion['improvements']:
+                del improvement['finding']
+        return kept
+
+    def _without_conflicts(self, suggestions: List[Dict]) -> List[Dict]:
+        """
+        Drop suggestions that steal another statement's plan once all of them exist
+
+        Candidates are verified one at a time, so an index that helps one
+        statement can still lure the planner away from a better one for
+        another; the interfering suggestion with the fewest fixes goes.
+        """
+        conn = self.db.conn
+        suggestions = list(suggestions)
+        while suggestions:
+            conn.execute("SAVEPOINT query_advisor")
+            try:
+                for suggestion in suggestions:
+                    conn.execute(suggestion['sql'])
+                culprits = set()
+                for suggestion in suggestions:
+                    for improvement in suggestion['improvements']:
+                        plan = self.explain(improvement['sql'], self.statements.get(improvement['sql'], {}).get('params'))
+                        if _score(self.plan_issues(improvement['sql'], plan)) > improvement['scoreAfter']:
+                            culprits.update(other['name'] for other in suggestions if other is not suggestion
+                                            and any(f"INDEX {other['name']} " in f"{line} " for line in plan))
+            finally:
+                conn.execute("ROLLBACK TO query_advisor")
+                conn.execute("RELEASE query_advisor")
+            if not culprits:
+                return suggestions
+            dropped = min((s for s in suggestions if s['name'] in culprits), key=lambda s: len(s['improvements']))
+            logger.info("Dropping index suggestion %s: it changes the plan of other statements", dropped['name'],
+                        extra={'index': dropped['sql']})
+            suggestions.remove(dropped)
+        return suggestions
+
+    def _candidates(self, sql: str, table: str) -> List[Tuple[List[str], Optional[str]]]:
+        refs = self._table_refs(sql, table)
+        if refs is None:
+            return []
+        equality, constants, ranges, order, referenced = refs
+        keyed = [c for c in equality if c not in constants]
+        where = ' AND '.join(constants.values()) or None
+
+        shapes = [equality + order, equality + ranges[:1], equality]
+        if where:
+            shapes += [(keyed + order, where), (keyed + ranges[:1], where), (keyed or list(constants), where)]
+        candidates = []
+        for shape in shapes:
+            columns, condition = shape if isinstance(shape, tuple) else (shape, None)
+            columns = _unique(columns)
+            if not columns:
+                continue
+            candidates.append((columns, condition))
+            if referenced is None:
+                continue  # SELECT * cannot be covered
+            extra = [c for c in referenced if c not in columns and not (condition and c in constants)]
+            if extra and len(columns) + len(extra) <= MAX_INDEX_COLUMNS:
+                candidates.append((columns + extra, condition))  # Covering variant
+
+        existing = self._existing_indexes(table)
+        unique = []
+        for candidate in candidates:
+            if candidate not in unique and (tuple(candidate[0]), candidate[1]) not in existing:
+                unique.append(candidate)
+        return unique
+
+    def _table_refs(self, sql: str, table: str):
+        """Columns of table used for equality, constants, ranges and ordering in sql"""
+        sources = self._sources(sql)
+        aliases = {alias for alias, name in sources.items() if name == table}
+        if not aliases:
+            return None
+        own = self._table_columns(table)
+        others = set()
+        for name in set(sources.values()) - {table}:
+            others.update(self._table_columns(name))
+
+        def column(token: str) -> Optional[str]:
+            qualifier, _, name = token.rpartition('.')
+            name = name.lower()
+            if qualifier:
+                return name if qualifier.lower() in aliases and name in own else None
+            return name if name in own and name not in others else None
+
+        # Join conditions only help the table being joined, not the one driving the join
+        joined = any(match.group(1).lower() == table for match in _JOIN_PATTERN.finditer(sql))
+        equality, ranges, constants = [], [], {}
+        for match in _PREDICATE_PATTERN.finditer(sql):
+            lhs, op, rhs = match.group(1), match.group(2).upper(), match.group(3)
+            left, right = column(lhs), column(rhs)
+            if left and right:
+                continue
+            col = left or right
+            join_condition = bool(right) or not (_is_literal(rhs) or rhs in ('?', '('))
+            if not col or (join_condition and (not joined or op not in ('=', '=='))):
+                continue
+            if op in ('=', '==', 'IS', 'IN'):
+                equality.append(col)
+                if left and _is_literal(rhs) and op in ('=', '==', 'IS'):
+                    constants[col] = f"{col} {'IS' if op == 'IS' else '='} {rhs}"
+            elif left:
+                ranges.append(col)
+
+        order = []
+        select_aliases = _select_aliases(sql)
+        for clause in ('GROUP BY', 'ORDER BY'):
+            for term in _split_top_level(_clause(sql, clause) or ''):
+                term, descending = _strip_direction(term)
+                term = select_aliases.get(term.lower(), term)
+                col = column(term)
+                if col:
+                    order.append(col + (' DESC' if descending else ''))
+                elif _only_references(term, column):
+                    order.append(_unqualify(term, aliases) + (' DESC' if descending else ''))
+
+        referenced = set()
+        star = re.search(r'(?:^|[\s,])(?:(\w+)\.)?\*', sql.split(' FROM ', 1)[0])
+        if star and (star.group(1) is None or star.group(1).lower() in aliases):
+            referenced = None
+        else:
+            for match in _COLUMN_REF_PATTERN.finditer(sql):
+                token = f"{match.group(1)}.{match.group(2)}" if match.group(1) else match.group(2)
+                col = column(token)
+                if col:
+                    referenced.add(col)
+        return (_unique(equality), constants, _unique(ranges), _unique(order),
+                sorted(referenced) if referenced is not None else None)
+
+    def _what_if(self, finding: Dict, table: str, columns: List[str], where: Optional[str]):
+        conn = self.db.conn
+        conn.execute("SAVEPOINT query_advisor")
+        try:
+            conn.execute(_index_sql('query_advisor_candidate', table, columns, where))
+            plan = self.explain(finding['sql'], finding['params'])
+            return _score(self.plan_issues(finding['sql'], plan)), plan
+        except sqlite3.Error as e:
+            logger.debug("Candidate index on %s(%s) rejected: %s", table, ', '.join(columns), e)
+            return finding['score'], finding['plan']
+        finally:
+            conn.execute("ROLLBACK TO query_advisor")
+            conn.execute("RELEASE query_advisor")
+
+    def _suggestion(self, table: str, columns: List[str], where: Optional[str]) -> Dict:
+        name = self._index_name(table, columns, where)
+        replaces = [
+            index for index, (existing_columns, existing_where) in self._droppable_indexes(table).items()
+            if existing_where == where and len(existing_columns) < len(columns)
+            and list(existing_columns) == columns[:len(existing_columns)]
+        ]
+        return {
+            'name': name,
+            'table': table,
+            'columns': columns,
+            'where': where,
+            'sql': _index_sql(name, table, columns, where),
+            'replaces': replaces,
+            'statements': [],
+            'improvements': []
+        }
+
+    # Benchmark and apply
+    def benchmark(self, statements: List[str], repeat: int = 5) -> Dict[str, float]:
+        """
+        Median execution time (ms) of each statement, fetching every row
+
+        Statements run inside a savepoint that is rolled back, so auditing
+        UPDATE or DELETE statements does not change any data.
+        """
+        conn = self.db.conn
+        timings = {}
+        for sql in statements:
+            params = self.statements.get(sql, {}).get('params', ())
+            samples = []
+            for _ in range(repeat):
+                conn.execute("SAVEPOINT query_advisor_benchmark")
+                try:
+                    started = time.perf_counter()
+                    conn.execute(sql, params or ()).fetchall()
+                    samples.append(time.perf_counter() - started)
+                finally:
+                    conn.execute("ROLLBACK TO query_advisor_benchmark")
+                    conn.execute("RELEASE query_advisor_benchmark")
+            timings[sql] = round(statistics.median(samples) * 1000, 3)
+        return timings
+
+    def apply(self, suggestions: List[Dict], name: str = None, repeat: int = 5) -> Dict:
+        """
+        Create the suggested indexes (dropping the ones they make redundant)
+        as one recorded migration
+
+        Returns:
+            Migration name, DDL run, per-statement before/after timings and the
+            MIGRATIONS entry that makes the change permanent
+        """
+        if not suggestions:
+            return {'migration': None, 'statements': [], 'benchmark': []}
+        statements = _unique([sql for s in suggestions for sql in s['statements']])
+        ddl = _unique([f"DROP INDEX IF EXISTS {index}" for s in suggestions for index in s['replaces']]
+                      + [s['sql'] for s in suggestions])
+        name = name or f"advisor_{time.strftime('%Y%m%d_%H%M%S')}_{_digest(' '.join(ddl))}"
+
+        before = self.benchmark(statements, repeat)
+        apply_migration(self.db.conn, name, ddl, details={'source': 'query_advisor'})
+        after = self.benchmark(statements, repeat)
+        benchmark = [{
+            'sql': sql,
+            'beforeMs': before[sql],
+            'afterMs': after[sql],
+            'speedup': round(before[sql] / after[sql], 1) if after[sql] else None
+        } for sql in statements]
+        annotate_migration(self.db.conn, name, benchmark=benchmark)
+        self._columns.clear()
+        return {
+            'migration': name,
+            'statements': ddl,
+            'benchmark': benchmark,
+            'source': format_migration(name, ddl, 'Suggested by query_advisor.py')
+        }
+
+    # Schema helpers
+    def _sources(self, sql: str) -> Dict[str, str]:
+        """Alias (and table name) -> table for every table the statement reads"""
+        tables = self._tables()
+        sources = {}
+        for match in _SOURCE_PATTERN.finditer(sql):
+            table = match.group(1).lower()
+            if table not in tables:
+                continue
+            sources[table] = table
+            alias = match.group(2)
+            if alias and alias.upper() not in _NOT_ALIASES:
+                sources[alias.lower()] = table
+        update = re.match(r'\s*(?:UPDATE|DELETE\s+FROM)\s+(\w+)', sql, re.IGNORECASE)
+        if update and update.group(1).lower() in tables:
+            sources[update.group(1).lower()] = update.group(1).lower()
+        return sources
+
+    def _tables(self) -> set:
+        if '' not in self._columns:
+            self._columns[''] = {row[0].lower() for row in self.db.conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table'"
+            )}
+        return self._columns['']
+
+    def _table_columns(self, table: str) -> set:
+        if table not in self._columns:
+            self._columns[table] = {row[1].lower() for row in self.db.conn.execute(
+                f"PRAGMA table_info({table})"
+            )}
+        return self._columns[table]
+
+    def _row_count(self, table: str) -> int:
+        if table not in self._row_counts:
+            self._row_counts[table] = self.db.conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        return self._row_counts[table]
+
+    def _existing_indexes(self, table: str) -> set:
+        """(columns, where) of every index on table; expressions are not compared"""
+        existing = set()
+        for row in self.db.conn.execute(f"PRAGMA index_list({table})").fetchall():
+            columns = tuple(info[2].lower() if info[2] else None
+                            for info in self.db.conn.execute(f"PRAGMA index_info({row[1]})"))
+            existing.add((columns, _index_where(self.db.conn, row[1]) if row[4] else None))
+        return existing
+
+    def _droppable_indexes(self, table: str) -> Dict[str, Tuple[tuple, Optional[str]]]:
+        """Plain, non-unique indexes created by the schema or migrations"""
+        indexes = {}
+        for row in self.db.conn.execute(f"PRAGMA index_list({table})").fetchall():
+            if row[2] or row[3] != 'c':
+                continue  # Unique and automatic indexes back constraints
+            columns = tuple(info[2].lower() if info[2] else None
+                            for info in self.db.conn.execute(f"PRAGMA index_info({row[1]})"))
+            if None not in columns:
+                indexes[row[1]] = (columns, _index_where(self.db.conn, row[1]) if row[4] else None)
+        return indexes
+
+    def _index_name(self, table: str, columns: List[str], where: Optional[str]) -> str:
+        parts = [c.split()[0] if re.fullmatch(r'\w+( DESC)?', c) else f"expr{_digest(c)}" for c in columns]
+        name = f"idx_{table}_{'_'.join(parts)}"[:56]
+        if where:
+            name += f"_where_{re.sub(r'[^a-z0-9]+', '_', where.lower()).strip('_')}"[:30]
+        existing = {row[0] for row in self.db.conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        base, counter = name, 2
+        while name in existing:
+            name = f"{base}_{counter}"
+            counter += 1
+        return name
+
+
+def report(findings: List[Dict], suggestions: List[Dict]) -> Dict:
+    """JSON-friendly summary of an audit"""
+    return {
+        'statements': len(findings),
+        'withIssues': sum(1 for f in findings if f['issues']),
+        'findings': [{
+            'sql': f['sql'],
+            'calls': f['calls'],
+            'totalMs': f['totalMs'],
+            'issues': [i['detail'] for i in f['issues']]
+        } for f in findings if f['issues']],
+        'suggestions': [{
+            'sql': s['sql'],
+            'replaces': s['replaces'],
+            'fixes': [{
+                'sql': i['sql'],
+                'planBefore': i['planBefore'],
+                'planAfter': i['planAfter']
+            } for i in s['improvements']]
+        } for s in suggestions]
+    }
+
+
+def run_workload(manager, repeat: int = 3):
+    """Exercise the read paths of a StudentVideoManager so their SQL is captured"""
+    tags = [t['name'] for t in manager.get_tags()]
+    categories = manager.get_categories()
+    playlists = manager.get_playlists()
+    for _ in range(repeat):
+        manager.get_pending_videos(limit=10)
+        manager.count_pending_videos()
+        manager.get_study_schedule()
+        manager.get_course_progress()
+        manager.get_stats()
+        manager.search_videos(search_term='math')
+        for tag in tags[:5]:
+            manager.get_tagged_videos(tag, limit=20)
+            manager.count_tagged_videos(tag)
+            manager.search_videos(tag_name=tag)
+        for category in categories[:3]:
+            manager.search_videos(category_id=category['id'])
+        for playlist in playlists[:5]:
+            manager.get_playlist_videos(playlist['id'])
+            manager.get_playlist_by_name(playlist['name'])
+
+
+def _score(issues: List[Dict]) -> int:
+    return sum(ISSUE_WEIGHTS[issue['kind']] for issue in issues)
+
+
+def _index_sql(name: str, table: str, columns: List[str], where: Optional[str]) -> str:
+    sql = f"CREATE INDEX IF NOT EXISTS {name} ON {table}({', '.join(columns)})"
+    return sql + (f" WHERE {where}" if where else '')
+
+
+def _index_where(conn: sqlite3.Connection, index: str) -> Optional[str]:
+    row = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'index' AND name = ?", (index,)).fetchone()
+    match = re.search(r'\bWHERE\s+(.+)$', row[0] or '', re.IGNORECASE | re.DOTALL) if row else None
+    return ' '.join(match.group(1).split()) if match else None
+
+
+def _clause(sql: str, keyword: str) -> Optional[str]:
+    """Text of the last top-level GROUP BY / ORDER BY clause"""
+    depth, start, upper = 0, None, sql.upper()
+    enders = ('LIMIT', 'HAVING', 'ORDER BY', 'WINDOW', 'UNION')
+    i = 0
+    while i < len(sql):
+        char = sql[i]
+        if char == "'":
+            i = sql.find("'", i + 1) + 1 or len(sql)
+            continue
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+            if depth < 0 and start is not None:
+                return sql[start:i].strip()
+        elif depth == 0 and upper.startswith(keyword, i) and (i == 0 or not sql[i - 1].isalnum()):
+            start = i + len(keyword)
+            i = start
+            continue
+        elif depth == 0 and start is not None and any(
+                upper.startswith(e, i) and not sql[i - 1].isalnum() for e in enders if e != keyword):
+            return sql[start:i].strip()
+        i += 1
+    return sql[start:].strip() if start is not None else None
+
+
+def _split_top_level(text: str) -> List[str]:
+    parts, depth, current = [], 0, ''
+    for char in text:
+        if char == ',' and depth == 0:
+            parts.append(current.strip())
+            current = ''
+            continue
+        depth += (char == '(') - (char == ')')
+        current += char
+    if current.strip():
+        parts.append(current.strip())
+    return parts
+
+
+def _select_aliases(sql: str) -> Dict[str, str]:
+    """'alias' -> expression for 'expression AS alias' items of the outer SELECT list"""
+    match = re.match(r'\s*SELECT\s+(?:DISTINCT\s+)?(.*?)\s+FROM\s', sql, re.IGNORECASE | re.DOTALL)
+    aliases = {}
+    for item in _split_top_level(match.group(1)) if match else []:
+        alias = re.match(r'(.+?)\s+AS\s+(\w+)$', item, re.IGNORECASE | re.DOTALL)
+        if alias:
+            aliases[alias.group(2).lower()] = alias.group(1).strip()
+    return aliases
+
+
+def _strip_direction(term: str) -> Tuple[str, bool]:
+    match = re.match(r'(.+?)\s+(ASC|DESC)$', term.strip(), re.IGNORECASE | re.DOTALL)
+    if match:
+        return match.group(1).strip(), match.group(2).upper() == 'DESC'
+    return term.strip(), False
+
+
+def _only_references(expression: str, column) -> bool:
+    """True for an expression whose column references all resolve through column()"""
+    if not expression.count('(') or expression.count('(') != expression.count(')'):
+        return False
+    stripped = re.sub(r"'[^']*'", "''", expression)
+    words = [m.group(0) for m in re.finditer(r'\b(?:\w+\.)?[A-Za-z_]\w*\b(?!\s*\()', stripped)]
+    keywords = {'CASE', 'WHEN', 'THEN', 'ELSE', 'END', 'AND', 'OR', 'NOT', 'LIKE', 'IS', 'NULL', 'IN', 'COLLATE',
+                'NOCASE', 'BETWEEN'}
+    found = False
+    for word in words:
+        if word.upper() in keywords:
+            continue
+        if not column(word):
+            return False
+        found = True
+    return found
+
+
+def _unqualify(expression: str, aliases: set) -> str:
+    for alias in aliases:
+        expression = re.sub(rf'\b{re.escape(alias)}\.', '', expression, flags=re.IGNORECASE)
+    return expression
+
+
+def _is_literal(token: str) -> bool:
+    return bool(re.fullmatch(r"'[^']*'|-?\d+(?:\.\d+)?", token))
+
+
+def _unique(items: list) -> list:
+    seen = []
+    for item in items:
+        if item not in seen:
+            seen.append(item)
+    return seen
+
+
+def _digest(text: str) -> str:
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:8]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Audit query plans and suggest indexes')
+    parser.add_argument('--db', default='student_videos.db')
+    parser.add_argument('--apply', action='store_true', help='Apply the suggestions as a migration')
+    parser.add_argument('--name', default=None, help='Migration name for --apply')
+    parser.add_argument('--repeat', type=int, default=5, help='Benchmark runs per statement')
+    args = parser.parse_args()
+    configure_logging()
+
+    from student_video_manager import StudentVideoManager
+    manager = StudentVideoManager(args.db)
+    try:
+        advisor = QueryAdvisor(manager)
+        with advisor.capture():
+            run_workload(manager)
+        findings = advisor.audit()
+        suggestions = advisor.suggest(findings)
+        result = report(findings, suggestions)
+        if args.apply:
+            result['applied'] = advisor.apply(suggestions, args.name, args.repeat)
+        print(json.dumps(result, indent=2))
+    finally:
+        manager.close()
+
+
+if __name__ == '__main__':
+    main()
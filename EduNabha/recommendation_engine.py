@@ -0,0 +1,332 @@
+"""
+Recommendation Engine
+Precomputed item-item index (co-watch counts and TF-IDF content similarity)
+that is refreshed incrementally from watch events and serves top-k lists
+without scanning the library
+"""
+
+import heapq
+import math
+import re
+from collections import defaultdict
+from typing import Dict, Iterable, List, Tuple
+
+
+STOPWORDS = {
+    'the', 'and', 'for', 'with', 'from', 'this', 'that', 'into', 'your', 'are',
+    'was', 'all', 'how', 'its', 'our', 'you', 'course', 'instructor', 'module',
+    'lecture', 'video', 'videos', 'part',
+}
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased word tokens of at least three characters, without stopwords"""
+    return [word for word in re.findall(r'\w+', (text or '').lower())
+            if len(word) >= 3 and not word.isdigit() and word not in STOPWORDS]
+
+
+class RecommendationEngine:
+    """Item-item recommendations backed by the cowatch_counts/video_terms/video_neighbors tables"""
+
+    def __init__(self, db, neighbors_per_video: int = 20, cowatch_weight: float = 0.7,
+                 max_document_frequency: float = 0.5, history_seeds: int = 10):
+        """
+        Args:
+            db: VideoDatabase instance
+            neighbors_per_video: Length of each stored neighbour list
+            cowatch_weight: Blend between co-watch (1.0) and content (0.0) similarity
+            max_document_frequency: Terms in a larger share of videos are ignored
+            history_seeds: Recently watched videos used to seed a student's list
+        """
+        self.db = db
+        self.neighbors_per_video = neighbors_per_video
+        self.cowatch_weight = cowatch_weight
+        self.max_document_frequency = max_document_frequency
+        self.history_seeds = history_seeds
+
+    def attach(self):
+        """
+        Keep the index up to date as videos are added and watched
+
+        Trashed videos keep their rows (they are only filtered out of results),
+        so a restored video gets its co-watch neighbours back; they are dropped
+        when the video is purged.
+        """
+        self.db.subscribe('video_watched', self.on_video_watched)
+        self.db.subscribe('video_added', self.on_video_changed)
+        self.db.subscribe('video_updated', self.on_video_changed)
+        self.db.subscribe('video_deleted', self.on_video_deleted)
+
+    # Serving
+    def recommend(self, student_id: str = 'local', k: int = 10) -> List[Dict]:
+        """
+        Top-k unwatched videos for a student
+
+        Scores from the neighbour lists of the student's recent videos are
+        merged and the best k selected with a heap; the library is not scanned.
+        """
+        watched = self._watched_videos(student_id)
+        seeds = self._recent_videos(student_id, self.history_seeds)
+        if not seeds:
+            return []
+
+        placeholders = ','.join('?' * len(seeds))
+        cursor = self.db.conn.execute(
+            f"""SELECT n.video_id, n.neighbor_id, n.source, n.score FROM video_neighbors n
+                JOIN videos v ON v.id = n.neighbor_id AND v.deleted_at IS NULL
+                WHERE n.video_id IN ({placeholders})""",
+            seeds
+        )
+        recency = {video_id: 1.0 / (1 + rank) for rank, video_id in enumerate(seeds)}
+        scores = defaultdict(float)
+        for row in cursor:
+            if row['neighbor_id'] in watched:
+                continue
+            weight = self.cowatch_weight if row['source'] == 'cowatch' else 1 - self.cowatch_weight
+            scores[row['neighbor_id']] += weight * row['score'] * recency[row['video_id']]
+
+        top = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [{'videoId': video_id, 'score': round(score, 4)} for video_id, score in top]
+
+    def similar_videos(self, video_id: int, k: int = 10) -> List[Dict]:
+        """Videos most similar to one video (uses the score index)"""
+        cursor = self.db.conn.execute(
+            """SELECT n.neighbor_id, n.source, n.score FROM video_neighbors n
+               JOIN videos v ON v.id = n.neighbor_id AND v.deleted_at IS NULL
+               WHERE n.video_id = ? ORDER BY n.score DESC""",
+            (video_id,)
+        )
+        scores = defaultdict(float)
+        for row in cursor:
+            weight = self.cowatch_weight if row['source'] == 'cowatch' else 1 - self.cowatch_weight
+            scores[row['neighbor_id']] += weight * row['score']
+        top = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [{'videoId': neighbor_id, 'score': round(score, 4)} for neighbor_id, score in top]
+
+    # Full rebuild
+    def rebuild(self):
+        """Recompute the whole index (e.g. nightly, to correct incremental drift)"""
+        conn = self.db.conn
+        with self.db.transaction():
+            conn.execute("DELETE FROM cowatch_counts")
+            conn.execute("DELETE FROM video_terms")
+            conn.execute("DELETE FROM video_neighbors")
+
+            # Co-watch counts: every pair of videos watched by the same student
+            pairs = defaultdict(int)
+            cursor = conn.execute(
+                "SELECT DISTINCT student_id, video_id FROM watch_events ORDER BY student_id, video_id"
+            )
+            current_student, history = None, []
+            for row in cursor:
+                if row['student_id'] != current_student:
+                    self._count_pairs(history, pairs)
+                    current_student, history = row['student_id'], []
+                history.append(row['video_id'])
+            self._count_pairs(history, pairs)
+            conn.executemany(
+                "INSERT INTO cowatch_counts (video_a, video_b, count) VALUES (?, ?, ?)",
+                [(a, b, count) for (a, b), count in pairs.items()]
+            )
+
+            # TF-IDF vectors
+            documents = {row['id']: self._document_terms(row['title'], row['description'])
+                         for row in conn.execute("SELECT id, title, description FROM videos WHERE deleted_at IS NULL")}
+            document_frequency = defaultdict(int)
+            for terms in documents.values():
+                for term in terms:
+                    document_frequency[term] += 1
+            total = len(documents)
+            rows = []
+            for video_id, terms in documents.items():
+                vector = self._tfidf(terms, document_frequency, total)
+                rows.extend((term, video_id, weight) for term, weight in vector.items())
+            conn.executemany("INSERT INTO video_terms (term, video_id, weight) VALUES (?, ?, ?)", rows)
+
+            for video_id in documents:
+                self._refresh_neighbors(video_id)
+
+    # Incremental updates
+    def on_video_watched(self, video_id: int, student_id: str = 'local', **kwargs):
+        """Update co-watch counts when a student watches a video for the first time"""
+        conn = self.db.conn
+        with self.db.transaction():
+            cursor = conn.execute(
+                "SELECT COUNT(*) FROM watch_events WHERE student_id = ? AND video_id = ?",
+                (student_id, video_id)
+            )
+            if cursor.fetchone()[0] != 1:
+                return  # Repeat views do not add co-watch evidence
+
+            others = [v for v in self._watched_videos(student_id) if v != video_id]
+            if not others:
+                return
+            conn.executemany(
+                """INSERT INTO cowatch_counts (video_a, video_b, count) VALUES (?, ?, 1)
+                   ON CONFLICT (video_a, video_b) DO UPDATE SET count = count + 1""",
+                [(min(video_id, other), max(video_id, other)) for other in others]
+            )
+            self._refresh_cowatch_neighbors(video_id)
+            for other in others:
+                self._refresh_cowatch_neighbors(other)
+
+    def on_video_changed(self, video_id: int, **kwargs):
+        """Index a new or edited video's text and link it to similar videos"""
+        fields = kwargs.get('fields')
+        if fields is not None and not {'title', 'description'} & set(fields):
+            return
+        conn = self.db.conn
+        with self.db.transaction():
+            row = conn.execute("SELECT title, description FROM videos WHERE id = ? AND deleted_at IS NULL",
+                               (video_id,)).fetchone()
+            if not row:
+                return
+            terms = self._document_terms(row['title'], row['description'])
+            total = conn.execute("SELECT COUNT(*) FROM videos WHERE deleted_at IS NULL").fetchone()[0]
+            document_frequency = {}
+            for term in set(terms):
+                cursor = conn.execute(
+                    "SELECT COUNT(*) FROM video_terms WHERE term = ? AND video_id != ?", (term, video_id)
+                )
+                document_frequency[term] = cursor.fetchone()[0] + 1
+            vector = self._tfidf(terms, document_frequency, total)
+
+            conn.execute("DELETE FROM video_terms WHERE video_id = ?", (video_id,))
+            conn.executemany(
+                "INSERT INTO video_terms (term, video_id, weight) VALUES (?, ?, ?)",
+                [(term, video_id, weight) for term, weight in vector.items()]
+            )
+            neighbors = self._refresh_content_neighbors(video_id)
+            # The new video may now belong in its neighbours' lists too
+            for neighbor_id, score in neighbors:
+                self._offer_neighbor(neighbor_id, video_id, 'content', score)
+
+    def on_video_deleted(self, video_id: int, **kwargs):
+        """Drop a deleted video from the index"""
+        conn = self.db.conn
+        with self.db.transaction():
+            conn.execute("DELETE FROM video_terms WHERE video_id = ?", (video_id,))
+            conn.execute("DELETE FROM cowatch_counts WHERE video_a = ? OR video_b = ?", (video_id, video_id))
+            conn.execute("DELETE FROM video_neighbors WHERE video_id = ? OR neighbor_id = ?", (video_id, video_id))
+
+    # Internal helpers
+    def _refresh_neighbors(self, video_id: int):
+        self._refresh_cowatch_neighbors(video_id)
+        self._refresh_content_neighbors(video_id)
+
+    def _refresh_cowatch_neighbors(self, video_id: int) -> List[Tuple[int, float]]:
+        """Cosine similarity of co-watch vectors: count(a, b) / sqrt(n_a * n_b)"""
+        conn = self.db.conn
+        cursor = conn.execute(
+            """SELECT video_b AS other, count FROM cowatch_counts WHERE video_a = ?
+               UNION ALL
+               SELECT video_a AS other, count FROM cowatch_counts WHERE video_b = ?""",
+            (video_id, video_id)
+        )
+        counts = {row['other']: row['count'] for row in cursor}
+        viewers = self._viewer_counts([video_id] + list(counts))
+        own = viewers.get(video_id, 0)
+        scored = [(other, count / math.sqrt(own * viewers[other]))
+                  for other, count in counts.items() if own and viewers.get(other)]
+        return self._store_neighbors(video_id, 'cowatch', scored)
+
+    def _refresh_content_neighbors(self, video_id: int) -> List[Tuple[int, float]]:
+        """Cosine similarity of TF-IDF vectors, accumulated through the term postings"""
+        conn = self.db.conn
+        vector = {row['term']: row['weight'] for row in conn.execute(
+            "SELECT term, weight FROM video_terms WHERE video_id = ?", (video_id,)
+        )}
+        scores = defaultdict(float)
+        for term, weight in vector.items():
+            for row in conn.execute(
+                "SELECT video_id, weight FROM video_terms WHERE term = ? AND video_id != ?",
+                (term, video_id)
+            ):
+                scores[row['video_id']] += weight * row['weight']
+        return self._store_neighbors(video_id, 'content', scores.items())
+
+    def _store_neighbors(self, video_id: int, source: str,
+                         scored: Iterable[Tuple[int, float]]) -> List[Tuple[int, float]]:
+        top = heapq.nlargest(self.neighbors_per_video, scored, key=lambda item: item[1])
+        self.db.conn.execute(
+            "DELETE FROM video_neighbors WHERE video_id = ? AND source = ?", (video_id, source)
+        )
+        self.db.conn.executemany(
+            "INSERT INTO video_neighbors (video_id, neighbor_id, source, score) VALUES (?, ?, ?, ?)",
+            [(video_id, neighbor_id, source, score) for neighbor_id, score in top if score > 0]
+        )
+        return top
+
+    def _offer_neighbor(self, video_id: int, candidate_id: int, source: str, score: float):
+        """Insert candidate into video_id's list if it beats the weakest entry"""
+        conn = self.db.conn
+        cursor = conn.execute(
+            """SELECT COUNT(*), MIN(score) FROM video_neighbors
+               WHERE video_id = ? AND source = ?""",
+            (video_id, source)
+        )
+        count, weakest = cursor.fetchone()
+        if count >= self.neighbors_per_video and score <= (weakest or 0):
+            return
+        conn.execute(
+            """INSERT OR REPLACE INTO video_neighbors (video_id, neighbor_id, source, score)
+               VALUES (?, ?, ?, ?)""",
+            (video_id, candidate_id, source, score)
+        )
+        if count >= self.neighbors_per_video:
+            conn.execute(
+                """DELETE FROM video_neighbors WHERE video_id = ? AND source = ? AND neighbor_id = (
+                       SELECT neighbor_id FROM video_neighbors WHERE video_id = ? AND source = ?
+                       ORDER BY score LIMIT 1)""",
+                (video_id, source, video_id, source)
+            )
+
+    def _viewer_counts(self, video_ids: List[int]) -> Dict[int, int]:
+        if not video_ids:
+            return {}
+        placeholders = ','.join('?' * len(video_ids))
+        cursor = self.db.conn.execute(
+            f"""SELECT video_id, COUNT(DISTINCT student_id) FROM watch_events
+                WHERE video_id IN ({placeholders}) GROUP BY video_id""",
+            video_ids
+        )
+        return {row[0]: row[1] for row in cursor}
+
+    def _watched_videos(self, student_id: str) -> set:
+        cursor = self.db.conn.execute(
+            "SELECT DISTINCT video_id FROM watch_events WHERE student_id = ?", (student_id,)
+        )
+        return {row[0] for row in cursor}
+
+    def _recent_videos(self, student_id: str, limit: int) -> List[int]:
+        cursor = self.db.conn.execute(
+            """SELECT video_id FROM watch_events WHERE student_id = ?
+               GROUP BY video_id ORDER BY MAX(id) DESC LIMIT ?""",
+            (student_id, limit)
+        )
+        return [row[0] for row in cursor]
+
+    @staticmethod
+    def _count_pairs(history: List[int], pairs: Dict):
+        for i, a in enumerate(history):
+            for b in history[i + 1:]:
+                pairs[(min(a, b), max(a, b))] += 1
+
+    @staticmethod
+    def _document_terms(title: str, description: str) -> List[str]:
+        # Title words count twice: they describe the video better than boilerplate
+        title_terms = tokenize(title)
+        return title_terms + title_terms + tokenize(description)
+
+    def _tfidf(self, terms: List[str], document_frequency: Dict, total: int) -> Dict[str, float]:
+        counts = defaultdict(int)
+        for term in terms:
+            counts[term] += 1
+        vector = {}
+        for term, count in counts.items():
+            df = document_frequency.get(term, 1)
+            if total > 2 and df / total > self.max_document_frequency:
+                continue
+            vector[term] = (1 + math.log(count)) * math.log((1 + total) / (1 + df) + 1)
+        norm = math.sqrt(sum(weight * weight for weight in vector.values()))
+        return {term: weight / norm for term, weight in vector.items()} if norm else {}
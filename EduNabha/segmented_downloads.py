@@ -0,0 +1,330 @@
+"""
+Segmented Downloads
+Tracks offline downloads as fixed-size segments with a compact completion
+bitmap, so interrupted downloads resume from the last good segment
+"""
+
+import hashlib
+import json
+import os
+from typing import Dict, Iterable, List, Optional
+
+
+class SegmentBitmap:
+    """Fixed-length bitset stored as bytes (least significant bit first)"""
+
+    def __init__(self, size: int, data: bytes = None):
+        self.size = size
+        length = (size + 7) // 8
+        self._bits = bytearray(data) if data is not None else bytearray(length)
+        if len(self._bits) < length:
+            self._bits.extend(bytes(length - len(self._bits)))
+
+    def set(self, index: int):
+        self._check(index)
+        self._bits[index >> 3] |= 1 << (index & 7)
+
+    def clear(self, index: int):
+        self._check(index)
+        self._bits[index >> 3] &= ~(1 << (index & 7)) & 0xFF
+
+    def test(self, index: int) -> bool:
+        self._check(index)
+        return bool(self._bits[index >> 3] & (1 << (index & 7)))
+
+    def count(self) -> int:
+        """Number of set bits"""
+        return bin(int.from_bytes(self._bits, 'little')).count('1')
+
+    def is_complete(self) -> bool:
+        return self.count() == self.size
+
+    def missing(self, start: int = 0, end: int = None) -> List[int]:
+        """Indexes of unset bits in [start, end)"""
+        end = self.size if end is None else min(end, self.size)
+        result = []
+        index = max(start, 0)
+        while index < end:
+            byte = self._bits[index >> 3]
+            if byte == 0xFF and (index & 7) == 0 and index + 8 <= end:
+                index += 8
+                continue
+            if not byte & (1 << (index & 7)):
+                result.append(index)
+            index += 1
+        return result
+
+    def to_bytes(self) -> bytes:
+        return bytes(self._bits)
+
+    def _check(self, index: int):
+        if not 0 <= index < self.size:
+            raise IndexError(f"Segment {index} out of range (0-{self.size - 1})")
+
+
+class DownloadTracker:
+    """Segment-level progress, resume and verification for offline downloads"""
+
+    DEFAULT_SEGMENT_SIZE = 4 * 1024 * 1024  # 4MB
+
+    def __init__(self, db):
+        """
+        Args:
+            db: VideoDatabase instance
+        """
+        self.db = db
+
+    def start_download(self, video_id: int, file_path: str = None, total_size: int = None,
+                       segment_size: int = None) -> Dict:
+        """
+        Register a download, or return the existing one so it can resume
+
+        Args:
+            video_id: Video being downloaded
+            file_path: Local file the segments are written to (defaults to the video's path)
+            total_size: Size in bytes (defaults to the video's file_size)
+            segment_size: Bytes per segment
+
+        Returns:
+            Download progress
+        """
+        existing = self._get_row(video_id)
+        if existing:
+            return self.get_progress(video_id)
+
+        video = self.db.get_video(video_id)
+        if not video:
+            raise ValueError(f"Video {video_id} not found")
+        file_path = file_path or video['file_path']
+        total_size = total_size if total_size is not None else video.get('file_size')
+        if not total_size:
+            raise ValueError(f"Unknown size for video {video_id}")
+        segment_size = segment_size or self.DEFAULT_SEGMENT_SIZE
+        segment_count = (total_size + segment_size - 1) // segment_size
+
+        with self.db.transaction():
+            self.db.conn.execute(
+                """INSERT INTO video_downloads (video_id, file_path, total_size, segment_size,
+                                                segment_count, completed_bitmap)
+                   VALUES (?, ?, ?, ?, ?, ?)""",
+                (video_id, file_path, total_size, segment_size, segment_count,
+                 SegmentBitmap(segment_count).to_bytes())
+            )
+        return self.get_progress(video_id)
+
+    def set_segment_hashes(self, video_id: int, hashes: Iterable[str]):
+        """Store the expected SHA-256 of each segment (e.g. from the server manifest)"""
+        with self.db.transaction():
+            self.db.conn.executemany(
+                """INSERT OR REPLACE INTO download_segment_hashes (video_id, segment_index, sha256)
+                   VALUES (?, ?, ?)""",
+                [(video_id, index, digest.lower()) for index, digest in enumerate(hashes)]
+            )
+
+    def write_segment(self, video_id: int, index: int, data: bytes) -> bool:
+        """
+        Write one segment into the local file and mark it complete
+
+        Returns:
+            True if the segment was stored, False if it failed verification
+        """
+        row = self._require_row(video_id)
+        start, end = self._segment_range(row, index)
+        if len(data) != end - start:
+            return False
+        expected = self._expected_hash(video_id, index)
+        if expected and hashlib.sha256(data).hexdigest() != expected:
+            return False
+
+        mode = 'r+b' if os.path.exists(row['file_path']) else 'w+b'
+        with open(row['file_path'], mode) as fh:
+            fh.seek(start)
+            fh.write(data)
+            fh.flush()
+            os.fsync(fh.fileno())
+        self.mark_segments_complete(video_id, [index])
+        return True
+
+    def mark_segments_complete(self, video_id: int, indexes: Iterable[int]) -> Dict:
+        """Set completion bits for segments the client has durably written"""
+        return self._update_bits(video_id, indexes, SegmentBitmap.set)
+
+    def invalidate_segments(self, video_id: int, indexes: Iterable[int]) -> Dict:
+        """Clear completion bits so the segments are downloaded again"""
+        return self._update_bits(video_id, indexes, SegmentBitmap.clear)
+
+    def get_progress(self, video_id: int) -> Optional[Dict]:
+        """Download progress, or None if the video has no segmented download"""
+        row = self._get_row(video_id)
+        return self._progress(row) if row else None
+
+    def get_progress_many(self, video_ids: Iterable[int]) -> Dict[int, Dict]:
+        """{video_id: progress} for the videos of a page that have a segmented download, in one query"""
+        cursor = self.db.conn.execute(
+            "SELECT * FROM video_downloads WHERE video_id IN (SELECT value FROM json_each(?))",
+            (json.dumps([int(i) for i in video_ids]),)
+        )
+        return {row['video_id']: self._progress(dict(row)) for row in cursor.fetchall()}
+
+    def get_resume_ranges(self, video_id: int) -> List[Dict]:
+        """Byte ranges still missing, coalesced for HTTP Range requests"""
+        row = self._require_row(video_id)
+        bitmap = SegmentBitmap(row['segment_count'], row['completed_bitmap'])
+        ranges = []
+        for index in bitmap.missing():
+            start, end = self._segment_range(row, index)
+            if ranges and ranges[-1]['lastSegment'] == index - 1:
+                ranges[-1]['end'] = end - 1
+                ranges[-1]['lastSegment'] = index
+            else:
+                ranges.append({'firstSegment': index, 'lastSegment': index,
+                               'start': start, 'end': end - 1})
+        return ranges
+
+    def prioritize_segments(self, video_id: int, playback_seconds: float = 0,
+                            duration: float = None, lookahead: int = 8,
+                            limit: int = None) -> List[int]:
+        """
+        Missing segments ordered for download around the playback position
+
+        The segments from the playhead forward (lookahead of them) come first,
+        then the rest of the video after the playhead, then what lies behind it.
+        """
+        row = self._require_row(video_id)
+        bitmap = SegmentBitmap(row['segment_count'], row['completed_bitmap'])
+        if duration is None:
+            video = self.db.get_video(video_id)
+            duration = (video or {}).get('duration') or 0
+
+        current = 0
+        if duration and playback_seconds:
+            byte_position = row['total_size'] * min(playback_seconds / duration, 1.0)
+            current = min(int(byte_position // row['segment_size']), row['segment_count'] - 1)
+
+        ordered = (bitmap.missing(current, current + lookahead)
+                   + bitmap.missing(current + lookahead)
+                   + bitmap.missing(0, current))
+        return ordered[:limit] if limit else ordered
+
+    def verify(self, video_id: int) -> Dict:
+        """
+        Re-check completed segments against the local file
+
+        Segments whose data is missing (file too short) or whose digest does not
+        match the expected hash are cleared so the next resume fetches them again.
+        """
+        row = self._require_row(video_id)
+        bitmap = SegmentBitmap(row['segment_count'], row['completed_bitmap'])
+        cursor = self.db.conn.execute(
+            "SELECT segment_index, sha256 FROM download_segment_hashes WHERE video_id = ?",
+            (video_id,)
+        )
+        expected = {r['segment_index']: r['sha256'] for r in cursor.fetchall()}
+        file_size = os.path.getsize(row['file_path']) if os.path.exists(row['file_path']) else 0
+
+        corrupted = []
+        checked = 0
+        with open(row['file_path'], 'rb') if file_size else _NullFile() as fh:
+            for index in range(row['segment_count']):
+                if not bitmap.test(index):
+                    continue
+                start, end = self._segment_range(row, index)
+                checked += 1
+                if end > file_size:
+                    corrupted.append(index)
+                    continue
+                if index in expected:
+                    fh.seek(start)
+                    if hashlib.sha256(fh.read(end - start)).hexdigest() != expected[index]:
+                        corrupted.append(index)
+
+        if corrupted:
+            self.invalidate_segments(video_id, corrupted)
+        return {
+            'videoId': str(video_id),
+            'checkedSegments': checked,
+            'hashVerified': bool(expected),
+            'corruptedSegments': corrupted,
+            'progress': self.get_progress(video_id)
+        }
+
+    def remove_download(self, video_id: int):
+        """Forget segment tracking for a video (the file itself is left alone)"""
+        with self.db.transaction():
+            self.db.conn.execute("DELETE FROM download_segment_hashes WHERE video_id = ?", (video_id,))
+            self.db.conn.execute("DELETE FROM video_downloads WHERE video_id = ?", (video_id,))
+
+    # Internal helpers
+    def _progress(self, row: Dict) -> Dict:
+        bitmap = SegmentBitmap(row['segment_count'], row['completed_bitmap'])
+        missing = bitmap.missing()
+        completed_bytes = sum(
+            end - start for start, end in
+            (self._segment_range(row, i) for i in range(row['segment_count']) if bitmap.test(i))
+        ) if missing else row['total_size']
+        return {
+            'videoId': str(row['video_id']),
+            'status': row['status'],
+            'segmentSize': row['segment_size'],
+            'segmentCount': row['segment_count'],
+            'completedSegments': row['completed_segments'],
+            'bytesDownloaded': completed_bytes,
+            'totalBytes': row['total_size'],
+            'progress': round(completed_bytes / row['total_size'] * 100, 1) if row['total_size'] else 100.0,
+            'resumeFromSegment': missing[0] if missing else None
+        }
+
+    def _update_bits(self, video_id: int, indexes: Iterable[int], operation) -> Dict:
+        # Read-modify-write under the write lock, so concurrent reports cannot drop each other's bits
+        with self.db.transaction():
+            row = self._require_row(video_id)
+            bitmap = SegmentBitmap(row['segment_count'], row['completed_bitmap'])
+            for index in indexes:
+                operation(bitmap, int(index))
+            completed = bitmap.count()
+            status = 'completed' if completed == row['segment_count'] else (
+                'downloading' if completed else 'pending')
+            self.db.conn.execute(
+                """UPDATE video_downloads
+                   SET completed_bitmap = ?, completed_segments = ?, status = ?,
+                       updated_at = CURRENT_TIMESTAMP
+                   WHERE video_id = ?""",
+                (bitmap.to_bytes(), completed, status, video_id)
+            )
+        return self.get_progress(video_id)
+
+    def _get_row(self, video_id: int) -> Optional[Dict]:
+        cursor = self.db.conn.execute("SELECT * FROM video_downloads WHERE video_id = ?", (video_id,))
+        row = cursor.fetchone()
+        return dict(row) if row else None
+
+    def _require_row(self, video_id: int) -> Dict:
+        row = self._get_row(video_id)
+        if not row:
+            raise ValueError(f"No segmented download for video {video_id}")
+        return row
+
+    def _expected_hash(self, video_id: int, index: int) -> Optional[str]:
+        cursor = self.db.conn.execute(
+            "SELECT sha256 FROM download_segment_hashes WHERE video_id = ? AND segment_index = ?",
+            (video_id, index)
+        )
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+    @staticmethod
+    def _segment_range(row: Dict, index: int) -> tuple:
+        if not 0 <= index < row['segment_count']:
+            raise IndexError(f"Segment {index} out of range (0-{row['segment_count'] - 1})")
+        start = index * row['segment_size']
+        return start, min(start + row['segment_size'], row['total_size'])
+
+
+class _NullFile:
+    """Stand-in for a missing local file in verify()"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
@@ -12,6 +12,7 @@ import fs from 'fs'
 import path from 'path'
 import { fileURLToPath } from 'url'
 import { spawn } from 'child_process'
+import http from 'http'
 
 const __filename = fileURLToPath(import.meta.url)
 const __dirname = path.dirname(__filename)
@@ -60,8 +61,66 @@ function getTwilio(){
 	return null
 }
 
+// Optional long-running Python API (python video_api_server.py), e.g. http://127.0.0.1:8765.
+// When set, requests reuse pooled keep-alive connections instead of spawning Python.
+const PYTHON_API_URL = process.env.PYTHON_API_URL
+const pythonApiAgent = new http.Agent({ keepAlive: true, maxSockets: 8 })
+
+// Wrapper commands and the matching video API requests: [method, path, body]
+const PYTHON_API_ROUTES = {
+	add_video: (data) => ['POST', '/videos', data],
+	get_offline_videos: () => ['GET', '/videos'],
+	get_storage_info: () => ['GET', '/storage'],
+	update_progress: (data) => ['POST', `/videos/${encodeURIComponent(data.videoId)}/progress`, data],
+	delete_video: (videoId) => ['DELETE', `/videos/${encodeURIComponent(videoId)}`],
+	get_study_dashboard: () => ['GET', '/study/dashboard'],
+	search_videos: (data) => ['POST', '/videos/search', data],
+	get_recommendations: (data) => ['GET', `/study/recommendations?studentId=${encodeURIComponent(data?.studentId || 'local')}`],
+	export_study_data: (data) => ['POST', '/study/export', data]
+}
+
+function callPythonApi(method, apiPath, body = null) {
+	return new Promise((resolve, reject) => {
+		const payload = body === null || body === undefined ? null : Buffer.from(JSON.stringify(body))
+		const request = http.request(new URL(apiPath, PYTHON_API_URL), {
+			method,
+			agent: pythonApiAgent,
+			timeout: 60000,
+			headers: payload
+				? { 'Content-Type': 'application/json', 'Content-Length': payload.length }
+				: {}
+		}, (response) => {
+			const chunks = []
+			response.on('data', (chunk) => chunks.push(chunk))
+			response.on('end', () => {
+				let parsed
+				try {
+					parsed = JSON.parse(Buffer.concat(chunks).toString())
+				} catch (parseError) {
+					return reject(new Error(`Failed to parse Python API response (${response.statusCode})`))
+				}
+				if (response.statusCode >= 400 && parsed && parsed.error && parsed.error.message) {
+					return reject(new Error(`Python API ${response.statusCode}: ${parsed.error.message}`))
+				}
+				resolve(parsed)
+			})
+		})
+		request.on('timeout', () => request.destroy(new Error('Python API request timed out')))
+		request.on('error', reject)
+		if (payload) {
+			request.write(payload)
+		}
+		request.end()
+	})
+}
+
 // Helper function to call Python video database integration
 function callPythonIntegration(command, data = null) {
+	if (PYTHON_API_URL && PYTHON_API_ROUTES[command]) {
+		const [method, apiPath, body] = PYTHON_API_ROUTES[command](data)
+		return callPythonApi(method, apiPath, body)
+	}
+
 	return new Promise((resolve, reject) => {
 		const args = [path.join(__dirname, '../video_integration_wrapper.py'), command]
 		if (data) {
@@ -582,7 +641,7 @@ app.get('/api/study/dashboard', auth, async (req, res) => {
 // Study recommendations endpoint
 app.get('/api/study/recommendations', auth, async (req, res) => {
 	try {
-		const recommendations = await callPythonIntegration('get_recommendations')
+		const recommendations = await callPythonIntegration('get_recommendations', { studentId: req.user.id })
 		res.json(recommendations)
 	} catch (error) {
 		console.error('Error getting recommendations:', error)
@@ -660,7 +719,7 @@ app.post('/api/videos/:videoId/progress/enhanced', auth, async (req, res) => {
 
 		// Then enhance with Python database
 		try {
-			const progressData = { videoId, watchTime, completed }
+			const progressData = { videoId, watchTime, completed, studentId: req.user.id }
 			const result = await callPythonIntegration('update_progress', progressData)
 			
 			if (result.success) {
@@ -4,18 +4,55 @@ Specialized database system for managing educational videos downloaded from stud
 """
 
 from video_database import VideoDatabase
+from video_export import StreamingExporter, QuerySource
+from instrumentation import configure_logging, get_logger, instrument_methods
 import os
 import json
+import sqlite3
 import datetime
+from functools import cached_property
 from typing import Dict, List, Optional
 
 
+logger = get_logger('student_video_manager')
+
+
+@instrument_methods
 class StudentVideoManager(VideoDatabase):
     """Extended video database specifically for educational content management"""
     
-    def __init__(self, db_path: str = "student_videos.db"):
+    PENDING_VIDEOS_QUERY = """
+        SELECT v.*, c.name as category_name 
+        FROM videos v 
+        LEFT JOIN categories c ON v.category_id = c.id 
+        WHERE v.watch_count = 0 AND v.deleted_at IS NULL
+        ORDER BY v.download_date DESC
+        """
+    
+    TAGGED_VIDEOS_QUERY = """
+        SELECT v.*, c.name as category_name 
+        FROM videos v 
+        LEFT JOIN categories c ON v.category_id = c.id
+        WHERE v.id IN (
+            SELECT vt.video_id FROM video_tags vt
+            JOIN tags t ON vt.tag_id = t.id
+            WHERE t.name = ?
+        ) AND v.deleted_at IS NULL
+        ORDER BY v.download_date DESC
+        """
+    
+    def __init__(self, db_path: str = "student_videos.db", read_only: bool = False):
+        """
+        Args:
+            db_path: SQLite database file
+            read_only: The caller only reads, so the default categories and
+                tags are not (re)seeded and close() does not persist metrics
+        """
         super().__init__(db_path)
-        self.setup_educational_structure()
+        self.read_only = read_only
+        self.persist_metrics = not read_only
+        if not read_only:
+            self.setup_educational_structure()
     
     def setup_educational_structure(self):
         """Setup educational-specific categories and tags"""
@@ -61,7 +98,7 @@ class StudentVideoManager(VideoDatabase):
             self.conn.commit()
             
         except Exception as e:
-            print(f"Error setting up educational structure: {e}")
+            logger.error("Error setting up educational structure: %s", e)
     
     def add_downloaded_video(self, title: str, download_path: str, **kwargs) -> int:
         """
@@ -97,8 +134,8 @@ class StudentVideoManager(VideoDatabase):
         # Auto-detect category based on title/keywords
         category_id = self._detect_category(title, description)
         
-        # Get file information if file exists
-        file_size = None
+        # Get file information if file exists, else trust the size reported by the dashboard
+        file_size = kwargs.get('file_size') or None
         if os.path.exists(download_path):
             file_size = os.path.getsize(download_path)
             
@@ -117,12 +154,19 @@ class StudentVideoManager(VideoDatabase):
             'notes': f"Downloaded from student dashboard on {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
         }
         
-        # Add the video
-        video_id = self.add_video(**video_data)
-        
-        # Auto-tag based on content
-        if video_id:
-            self._auto_tag_educational_content(video_id, title, description)
+        # Add the video and its auto-tags as one unit (a single commit)
+        try:
+            with self.transaction():
+                video_id = self.add_video(**video_data)
+                
+                # Auto-tag based on content
+                if video_id:
+                    self._auto_tag_educational_content(video_id, title, description)
+        except sqlite3.Error as e:
+            if self._transaction_depth:
+                raise
+            logger.error("Error adding downloaded video: %s", e)
+            return None
         
         return video_id
     
@@ -190,97 +234,155 @@ class StudentVideoManager(VideoDatabase):
     
     def add_to_course_playlist(self, course_name: str, video_id: int):
         """Add video to course-specific playlist"""
-        # Find or create course playlist
-        playlists = self.get_playlists()
-        course_playlist = next((p for p in playlists if p['name'].lower() == course_name.lower()), None)
-        
-        if not course_playlist:
-            playlist_id = self.create_course_playlist(course_name)
-        else:
-            playlist_id = course_playlist['id']
-        
-        self.add_to_playlist(playlist_id, video_id)
+        try:
+            with self.transaction():
+                # Find or create course playlist
+                course_playlist = self.get_playlist_by_name(course_name)
+                
+                if not course_playlist:
+                    playlist_id = self.create_course_playlist(course_name)
+                else:
+                    playlist_id = course_playlist['id']
+                
+                self.add_to_playlist(playlist_id, video_id)
+        except sqlite3.Error as e:
+            if self._transaction_depth:
+                raise
+            logger.error("Error adding video to course playlist: %s", e)
     
     def get_videos_by_course(self, course_name: str) -> List[Dict]:
         """Get all videos for a specific course"""
         return self.search_videos(search_term=course_name)
+
+    def match_video_ids(self, course: str = None, tag: str = None) -> List[int]:
+        """
+        Ids of the live videos of a course and/or carrying a tag
     
-    def get_pending_videos(self) -> List[Dict]:
-        """Get videos that haven't been watched yet"""
-        query = """
-        SELECT v.*, c.name as category_name 
-        FROM videos v 
-        LEFT JOIN categories c ON v.category_id = c.id 
-        WHERE v.watch_count = 0 
-        ORDER BY v.download_date DESC
+        Args:
+            course: Course name as stored by add_video ('Course: X | ...')
+            tag: Tag name
         """
+        # The CASE expression matches the idx_videos_course expression index (migrations.py)
+        query = "SELECT v.id FROM videos v WHERE v.deleted_at IS NULL"
+        params = []
+        if course is not None:
+            query += """ AND (CASE WHEN description LIKE 'Course:%'
+                THEN TRIM(SUBSTR(description, 8, INSTR(description||'|', '|') - 8))
+                ELSE 'Unknown Course' END) = ?"""
+            params.append(course)
+        if tag is not None:
+            query += """ AND v.id IN (SELECT vt.video_id FROM video_tags vt
+                JOIN tags t ON t.id = vt.tag_id WHERE t.name = ?)"""
+            params.append(tag)
+        return [row[0] for row in self.conn.execute(query + " ORDER BY v.id", params)]
+    
+    def get_pending_videos(self, limit: int = None) -> List[Dict]:
+        """Get videos that haven't been watched yet (newest first)"""
+        query = self.PENDING_VIDEOS_QUERY
+        params = ()
+        if limit is not None:
+            query += " LIMIT ?"
+            params = (limit,)
         try:
-            cursor = self.conn.execute(query)
+            cursor = self.conn.execute(query, params)
+            return [dict(row) for row in cursor.fetchall()]
+        except Exception as e:
+            logger.error("Error getting pending videos: %s", e)
+            return []
+    
+    def count_pending_videos(self) -> int:
+        """Number of videos that haven't been watched yet"""
+        cursor = self.conn.execute("SELECT COUNT(*) FROM videos WHERE watch_count = 0 AND deleted_at IS NULL")
+        return cursor.fetchone()[0]
+    
+    def get_tagged_videos(self, tag_name: str, limit: int = None) -> List[Dict]:
+        """Get videos carrying a tag (newest first)"""
+        query = self.TAGGED_VIDEOS_QUERY
+        params = (tag_name,)
+        if limit is not None:
+            query += " LIMIT ?"
+            params = (tag_name, limit)
+        try:
+            cursor = self.conn.execute(query, params)
             return [dict(row) for row in cursor.fetchall()]
         except Exception as e:
-            print(f"Error getting pending videos: {e}")
+            logger.error("Error getting tagged videos: %s", e)
             return []
     
-    def get_high_priority_videos(self) -> List[Dict]:
+    def count_tagged_videos(self, tag_name: str) -> int:
+        """Number of videos carrying a tag"""
+        cursor = self.conn.execute(
+            """SELECT COUNT(*) FROM video_tags vt JOIN tags t ON vt.tag_id = t.id
+               JOIN videos v ON v.id = vt.video_id
+               WHERE t.name = ? AND v.deleted_at IS NULL""",
+            (tag_name,)
+        )
+        return cursor.fetchone()[0]
+    
+    def get_high_priority_videos(self, limit: int = None) -> List[Dict]:
         """Get videos tagged as high priority"""
-        return self.search_videos(tag_name="High Priority")
+        return self.get_tagged_videos("High Priority", limit=limit)
     
     def mark_as_completed(self, video_id: int):
-        """Mark a video as completed"""
-        # Update watch info
-        self.update_watch_info(video_id)
-        
-        # Add completed tag
-        tags = self.get_tags()
-        completed_tag = next((t for t in tags if t['name'] == 'Completed'), None)
-        if completed_tag:
-            self.tag_video(video_id, completed_tag['id'])
-        
-        # Remove 'Review Later' tag if present
-        review_tag = next((t for t in tags if t['name'] == 'Review Later'), None)
-        if review_tag:
-            self.untag_video(video_id, review_tag['id'])
+        """Mark a video as completed (one commit)"""
+        try:
+            with self.transaction():
+                # Update watch info
+                self.update_watch_info(video_id)
+                
+                # Add completed tag
+                completed_tag = self._tag_id('Completed')
+                if completed_tag:
+                    self.tag_video(video_id, completed_tag)
+                
+                # Remove 'Review Later' tag if present
+                review_tag = self._tag_id('Review Later')
+                if review_tag and self.conn.execute(
+                        "SELECT 1 FROM video_tags WHERE video_id = ? AND tag_id = ?", (video_id, review_tag)
+                ).fetchone():
+                    self.untag_video(video_id, review_tag)
+        except sqlite3.Error as e:
+            if self._transaction_depth:
+                raise
+            logger.error("Error marking video as completed: %s", e)
     
     def mark_for_review(self, video_id: int):
         """Mark a video for later review"""
-        tags = self.get_tags()
-        review_tag = next((t for t in tags if t['name'] == 'Review Later'), None)
+        review_tag = self._tag_id('Review Later')
         if review_tag:
-            self.tag_video(video_id, review_tag['id'])
+            self.tag_video(video_id, review_tag)
     
-    def get_study_schedule(self) -> Dict:
-        """Generate study schedule based on video data"""
-        pending = self.get_pending_videos()
-        high_priority = self.get_high_priority_videos()
-        review_later = self.search_videos(tag_name="Review Later")
-        
-        # Calculate total study time (assuming average 45 min per video)
-        def estimate_duration(videos):
-            total_seconds = sum(v.get('duration', 2700) for v in videos)  # 45 min default
-            return total_seconds // 60  # minutes
+    def _tag_id(self, name: str) -> Optional[int]:
+        """ID of a tag by name (tags.name is unique, so this is one index lookup)"""
+        row = self.conn.execute("SELECT id FROM tags WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+    
+    @cached_property
+    def scheduler(self):
+        """Spaced-repetition scheduler, kept current by this connection's change events"""
+        from study_scheduler import StudyScheduler
+        scheduler = StudyScheduler(self)
+        scheduler.attach()
+        return scheduler
+    
+    def get_study_schedule(self, student_id: str = 'local', limit: int = 10) -> Dict:
+        """
+        Study schedule from the spaced-repetition scheduler (study_scheduler.py)
         
-        schedule = {
-            'urgent': {
-                'videos': high_priority,
-                'count': len(high_priority),
-                'estimated_minutes': estimate_duration(high_priority)
-            },
-            'pending': {
-                'videos': pending[:10],  # Next 10 pending
-                'count': len(pending),
-                'estimated_minutes': estimate_duration(pending)
-            },
-            'review': {
-                'videos': review_later,
-                'count': len(review_later),
-                'estimated_minutes': estimate_duration(review_later)
-            }
-        }
+        'urgent' holds the High Priority videos, 'pending' the unstudied ones and
+        'review' the due reviews, each in priority order with estimated_minutes
+        from the videos' running times; 'today' is the plan packed into the
+        student's daily study budget.
         
-        return schedule
+        Args:
+            student_id: Student to schedule for
+            limit: Videos listed per bucket (counts and minutes cover all)
+        """
+        return self.scheduler.schedule(student_id, limit=limit)
     
     def get_course_progress(self) -> Dict:
         """Get progress statistics by course"""
+        # The CASE expression matches the idx_videos_course expression index (migrations.py)
         query = """
         SELECT 
             CASE 
@@ -292,7 +394,7 @@ class StudentVideoManager(VideoDatabase):
             SUM(CASE WHEN watch_count > 0 THEN 1 ELSE 0 END) as watched_videos,
             AVG(rating) as avg_rating
         FROM videos 
-        WHERE description != ''
+        WHERE description != '' AND deleted_at IS NULL
         GROUP BY course
         ORDER BY total_videos DESC
         """
@@ -309,47 +411,76 @@ class StudentVideoManager(VideoDatabase):
                 results.append(course_data)
             return results
         except Exception as e:
-            print(f"Error getting course progress: {e}")
+            logger.error("Error getting course progress: %s", e)
             return []
     
-    def export_study_report(self, filename: str = None):
-        """Export detailed study report"""
-        if not filename:
-            filename = f"study_report_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    def study_report_sections(self, include_videos: bool = False) -> Dict:
+        """Sections of a study report; video lists are streamed from cursors"""
+        stats = self.get_stats()
+        pending = QuerySource(self.PENDING_VIDEOS_QUERY)
+        completed = QuerySource(self.TAGGED_VIDEOS_QUERY, ("Completed",))
         
-        report = {
+        sections = {
             'generated_at': datetime.datetime.now().isoformat(),
-            'summary': self.get_stats(),
+            'summary': stats,
             'course_progress': self.get_course_progress(),
             'study_schedule': self.get_study_schedule(),
-            'videos_by_category': self.get_stats()['videos_by_category'],
-            'pending_videos': len(self.get_pending_videos()),
-            'completed_videos': len(self.search_videos(tag_name="Completed"))
+            'videos_by_category': stats.get('videos_by_category', []),
+            'pending_videos': self.conn.execute(f"SELECT COUNT(*) FROM ({pending.query})").fetchone()[0],
+            'completed_videos': self.conn.execute(
+                f"SELECT COUNT(*) FROM ({completed.query})", completed.params
+            ).fetchone()[0]
         }
+        if include_videos:
+            sections['all_videos'] = self.export_sections()['videos']
+        return sections
+    
+    def export_study_report(self, filename: str = None, format: str = 'json',
+                            compress: bool = False, progress_callback=None,
+                            exporter: StreamingExporter = None) -> Optional[Dict]:
+        """
+        Export detailed study report
+        
+        Args:
+            filename: Output file (generated from the current time if omitted)
+            format: 'json', 'jsonl' or 'csv' (CSV exports the full video list)
+            compress: Write gzip-compressed output
+            progress_callback: Optional (section, rows_written, total) callback
+            exporter: Pre-built exporter, e.g. one the caller may cancel
+        
+        Returns:
+            Export summary, or None if the export failed
+        """
+        if not filename:
+            filename = f"study_report_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.{format}"
+            if compress:
+                filename += '.gz'
         
+        exporter = exporter or StreamingExporter(self, progress_callback=progress_callback)
         try:
-            with open(filename, 'w', encoding='utf-8') as f:
-                json.dump(report, f, indent=2, default=str)
-            print(f"Study report exported to {filename}")
+            sections = self.study_report_sections(include_videos=(format == 'csv'))
+            summary = exporter.export(filename, sections, format=format,
+                                      compress=compress, csv_section='all_videos')
+            logger.info("Study report exported", extra={'path': filename, 'format': format})
+            return summary
         except Exception as e:
-            print(f"Error exporting study report: {e}")
+            logger.error("Error exporting study report: %s", e)
+            return None
 
 
 # Convenience function for quick setup
 def setup_student_database(db_path: str = "student_videos.db"):
     """Quick setup for student video database"""
-    print("Setting up Student Video Database...")
     db = StudentVideoManager(db_path)
-    print(f"✓ Database created: {db_path}")
-    print("✓ Educational categories added")
-    print("✓ Educational tags configured") 
-    print("✓ Ready to manage your student videos!")
+    logger.info("Student video database ready (educational categories and tags configured)",
+                extra={'db_path': db_path})
     db.close()
     return db_path
 
 
 if __name__ == "__main__":
     # Demo the student video manager
+    configure_logging()
     with StudentVideoManager() as db:
         print("Student Video Manager Demo")
         print("=" * 30)
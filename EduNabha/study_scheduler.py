@@ -0,0 +1,665 @@
+"""
+Study Scheduler
+Spaced-repetition study plans: completions and reviews advance each
+student's SM-2 review intervals, and every day's plan is packed into the
+student's study budget from a priority queue weighing urgency tags, exam
+material and how far a course lags behind the student's other courses.
+Card state is kept in review_cards and advanced from a watch_events
+watermark, so only new events are read when the plan is refreshed.
+
+Usage: python study_scheduler.py --db edunabha_videos.db [--student local] [--days 7]
+"""
+
+import argparse
+import datetime
+import heapq
+import json
+from collections import defaultdict, deque
+from typing import Dict, List
+
+from instrumentation import configure_logging, get_logger
+
+
+logger = get_logger('study_scheduler')
+
+
+STATE_NAME = 'study_scheduler'  # rollup_state row holding the watch_events watermark
+LOCAL_STUDENT = 'local'  # The device's own student: videos.watch_count counts their viewing
+
+# Priority a video's tags add, for new lectures and reviews alike
+TAG_WEIGHTS = {
+    'High Priority': 3.0,
+    'Exam Material': 2.0,
+    'Important': 1.0,
+    'Review Later': 1.0,
+    'Difficult': 0.5,
+    'Optional': -2.0,
+}
+URGENT_TAG = 'High Priority'
+REVIEW_PRIORITY = 2.0  # Due reviews come before new material of the same weight
+NEW_PRIORITY = 1.0
+IN_PROGRESS_BONUS = 0.5  # Finish a started lecture before opening another
+
+COMPLETION_GRADE = 4  # SM-2 quality credited for watching a video to the end
+INITIAL_EASE = 2.5
+MIN_EASE = 1.3
+DEFAULT_MINUTES = 45  # Only when neither the duration nor the file size is known
+
+
+class ReviewCard:
+    """SM-2 state of one video for one student"""
+
+    __slots__ = ('repetitions', 'ease', 'interval', 'lapses', 'due', 'last_grade', 'reviewed')
+
+    def __init__(self, repetitions: int = 0, ease: float = INITIAL_EASE, interval: int = 0,
+                 lapses: int = 0, due: datetime.date = None, last_grade: int = None,
+                 reviewed: datetime.date = None):
+        self.repetitions = repetitions
+        self.ease = ease
+        self.interval = interval
+        self.lapses = lapses
+        self.due = due
+        self.last_grade = last_grade
+        self.reviewed = reviewed
+
+    def copy(self) -> 'ReviewCard':
+        return ReviewCard(self.repetitions, self.ease, self.interval, self.lapses,
+                          self.due, self.last_grade, self.reviewed)
+
+    def review(self, grade: int, day: datetime.date):
+        """Apply a review of quality grade (0-5) made on day"""
+        if grade >= 3:
+            if self.repetitions == 0:
+                self.interval = 1
+            elif self.repetitions == 1:
+                self.interval = 6
+            else:
+                self.interval = max(1, round(self.interval * self.ease))
+            self.repetitions += 1
+        else:
+            self.repetitions = 0
+            self.interval = 1
+            self.lapses += 1
+        self.ease = max(MIN_EASE, self.ease + 0.1 - (5 - grade) * (0.08 + (5 - grade) * 0.02))
+        self.last_grade = grade
+        self.reviewed = day
+        self.due = day + datetime.timedelta(days=self.interval)
+
+    def counts_as_review(self, day: datetime.date) -> bool:
+        """Whether re-watching on day is spaced enough to count (not same-day cramming)"""
+        return (day - self.reviewed).days * 2 >= self.interval
+
+
+class _Student:
+    """Cards, resume positions and study budget of one student"""
+
+    def __init__(self, cards: Dict[int, ReviewCard], progress: Dict[int, int],
+                 daily_minutes: int = None, weekday_minutes: List[int] = None):
+        self.cards = cards
+        self.progress = progress
+        self.daily_minutes = daily_minutes
+        self.weekday_minutes = weekday_minutes
+        self.changed = set()
+
+    def budget(self, day: datetime.date, default: int) -> int:
+        if self.weekday_minutes and self.weekday_minutes[day.weekday()] is not None:
+            return self.weekday_minutes[day.weekday()]
+        return self.daily_minutes if self.daily_minutes is not None else default
+
+
+class StudyScheduler:
+    """Review intervals and daily study plans backed by the review_cards table"""
+
+    def __init__(self, db, daily_minutes: int = 60, review_fraction: float = 0.3,
+                 lag_weight: float = 4.0, min_session_minutes: float = 10,
+                 batch_size: int = 5000):
+        """
+        Args:
+            db: VideoDatabase instance; a read-only StudentVideoManager folds
+                new events into memory without writing them back
+            daily_minutes: Budget of students who have not set one
+            review_fraction: Share of a video's length a review takes
+            lag_weight: Priority per unit of course lag (the gap between a
+                course's completion and the student's mean completion)
+            min_session_minutes: Shortest slice of a lecture too long for a
+                whole day that is still scheduled
+            batch_size: Watch events folded per transaction
+        """
+        self.db = db
+        self.daily_minutes = daily_minutes
+        self.review_fraction = review_fraction
+        self.lag_weight = lag_weight
+        self.min_session_minutes = min_session_minutes
+        self.batch_size = batch_size
+        self.persist = not getattr(db, 'read_only', False)
+        self.videos = {}
+        self._tag_names = {}
+        self._students = {}
+        self._sized_bytes = self._sized_seconds = 0
+        self._watermark = self._stored_watermark = 0
+        self._data_version = None
+
+    def attach(self):
+        """Keep the catalogue and cards up to date as videos change and are watched"""
+        self.db.subscribe('video_added', self.on_video_changed)
+        self.db.subscribe('video_updated', self.on_video_changed)
+        self.db.subscribe('video_trashed', self.on_video_deleted)
+        self.db.subscribe('video_deleted', self.on_video_deleted)
+        self.db.subscribe('video_tagged', self.on_video_tagged)
+        self.db.subscribe('video_untagged', self.on_video_untagged)
+        self.db.subscribe('video_watched', self.on_video_watched)
+
+    # Catalogue
+    def load(self):
+        """Read the live videos and their tags; student state is reloaded on demand"""
+        conn = self.db.conn
+        self._data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+        self._tag_names = {row[0]: row[1] for row in conn.execute("SELECT id, name FROM tags")}
+        tags = defaultdict(set)
+        for video_id, tag_id in conn.execute("SELECT video_id, tag_id FROM video_tags"):
+            tags[video_id].add(self._tag_names.get(tag_id))
+        self.videos = {}
+        self._sized_bytes = self._sized_seconds = 0
+        for row in conn.execute(self._video_query("v.deleted_at IS NULL")):
+            self._add_video(row, tags.get(row['id'], set()))
+        self._students = {}
+        self._watermark = self._stored_watermark = self._stored()
+
+    def refresh(self):
+        """Reload if another connection has committed, then fold in new watch events"""
+        version = self.db.conn.execute("PRAGMA data_version").fetchone()[0]
+        if self._data_version is None or version != self._data_version:
+            self.load()
+        self._catch_up()
+
+    @staticmethod
+    def _video_query(condition: str) -> str:
+        # Course name parsed as in StudentVideoManager.get_course_progress
+        return f"""
+            SELECT v.id, v.title, v.duration, v.file_size, v.watch_count,
+                   c.name AS category_name,
+                   CASE WHEN v.description LIKE 'Course:%'
+                        THEN TRIM(SUBSTR(v.description, 8, INSTR(v.description||'|', '|') - 8))
+                        ELSE 'Unknown Course' END AS course
+            FROM videos v LEFT JOIN categories c ON v.category_id = c.id
+            WHERE {condition}
+        """
+
+    def _add_video(self, row, tags: set):
+        self.videos[row['id']] = {
+            'id': row['id'],
+            'title': row['title'],
+            'category_name': row['category_name'],
+            'course': row['course'],
+            'duration': row['duration'],
+            'file_size': row['file_size'],
+            'watched': bool(row['watch_count']),
+            'tags': tags,
+        }
+        if row['duration'] and row['file_size']:
+            self._sized_bytes += row['file_size']
+            self._sized_seconds += row['duration']
+
+    def _remove_video(self, video_id: int) -> set:
+        video = self.videos.pop(video_id, None)
+        if video is None:
+            return set()
+        if video['duration'] and video['file_size']:
+            self._sized_bytes -= video['file_size']
+            self._sized_seconds -= video['duration']
+        return video['tags']
+
+    def minutes(self, video: Dict) -> float:
+        """Running time, estimated from the file size at the library's bitrate when unknown"""
+        if video['duration']:
+            return video['duration'] / 60
+        if video['file_size'] and self._sized_seconds:
+            return video['file_size'] * self._sized_seconds / self._sized_bytes / 60
+        return DEFAULT_MINUTES
+
+    # Change events
+    def on_video_changed(self, video_id: int, **kwargs):
+        if self._data_version is None:
+            return  # Not built yet; the first plan loads everything
+        tags = self._remove_video(video_id)
+        row = self.db.conn.execute(self._video_query("v.id = ? AND v.deleted_at IS NULL"),
+                                   (video_id,)).fetchone()
+        if row is not None:
+            if not tags:
+                tags = {self._tag_name(tag_id) for (tag_id,) in self.db.conn.execute(
+                    "SELECT tag_id FROM video_tags WHERE video_id = ?", (video_id,))}
+            self._add_video(row, tags)
+
+    def on_video_deleted(self, video_id: int, **kwargs):
+        # Cards are kept: a trashed video that is restored resumes its schedule
+        if self._data_version is not None:
+            self._remove_video(video_id)
+
+    def on_video_tagged(self, video_id: int, tag_id: int, **kwargs):
+        if self._data_version is not None and video_id in self.videos:
+            self.videos[video_id]['tags'].add(self._tag_name(tag_id))
+
+    def on_video_untagged(self, video_id: int, tag_id: int, **kwargs):
+        if self._data_version is not None and video_id in self.videos:
+            self.videos[video_id]['tags'].discard(self._tag_name(tag_id))
+
+    def on_video_watched(self, video_id: int, **kwargs):
+        if self._data_version is not None:
+            self.refresh()
+
+    def _tag_name(self, tag_id: int) -> str:
+        if tag_id not in self._tag_names:
+            row = self.db.conn.execute("SELECT name FROM tags WHERE id = ?", (tag_id,)).fetchone()
+            self._tag_names[tag_id] = row[0] if row else None
+        return self._tag_names[tag_id]
+
+    # Cards
+    def _stored(self) -> int:
+        row = self.db.conn.execute(
+            "SELECT last_event_id FROM rollup_state WHERE name = ?", (STATE_NAME,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def _catch_up(self) -> int:
+        """Fold watch events newer than the watermark into the cards"""
+        conn = self.db.conn
+        latest = conn.execute("SELECT MAX(id) FROM watch_events").fetchone()[0] or 0
+        if latest <= self._watermark:
+            return 0
+        if not self.persist:
+            return self._fold_events()
+
+        try:
+            with self.db.transaction():  # Its write lock serializes catch-up across processes
+                stored = self._stored()
+                if stored != self._stored_watermark:
+                    # Another process folded events since the cards were read
+                    self._students = {}
+                    self._watermark = self._stored_watermark = stored
+                processed = self._fold_events()
+                self._save_cards()
+                conn.execute("""
+                    INSERT INTO rollup_state (name, last_event_id, updated_at)
+                    VALUES (?, ?, CURRENT_TIMESTAMP)
+                    ON CONFLICT (name) DO UPDATE SET
+                        last_event_id = excluded.last_event_id,
+                        updated_at = excluded.updated_at
+                """, (STATE_NAME, self._watermark))
+        except Exception:
+            self._students = {}
+            self._watermark = self._stored_watermark = self._stored()
+            raise
+        self._stored_watermark = self._watermark
+        return processed
+
+    def _fold_events(self) -> int:
+        processed = 0
+        while True:
+            rows = self.db.conn.execute(
+                """SELECT id, video_id, student_id, event_type, watch_seconds, created_at
+                   FROM watch_events WHERE id > ? ORDER BY id LIMIT ?""",
+                (self._watermark, self.batch_size)
+            ).fetchall()
+            if not rows:
+                return processed
+            for row in rows:
+                student = self._student(row['student_id'])
+                self._apply_event(student, row['video_id'], row['event_type'],
+                                  row['watch_seconds'], _local_day(row['created_at']))
+                self._watermark = row['id']
+            processed += len(rows)
+
+    @staticmethod
+    def _apply_event(student: _Student, video_id: int, event_type: str, watch_seconds: int,
+                     day: datetime.date):
+        card = student.cards.get(video_id)
+        if event_type == 'completed':
+            student.progress.pop(video_id, None)
+            if card is None:
+                card = student.cards[video_id] = ReviewCard()
+            elif not card.counts_as_review(day):
+                return
+            card.review(COMPLETION_GRADE, day)
+            student.changed.add(video_id)
+        elif card is None and watch_seconds:
+            student.progress[video_id] = max(student.progress.get(video_id, 0), watch_seconds)
+
+    def _student(self, student_id: str) -> _Student:
+        """State of a student as of the watermark, read on first use"""
+        student = self._students.get(student_id)
+        if student is not None:
+            return student
+        conn = self.db.conn
+        cards = {}
+        for row in conn.execute(
+                """SELECT video_id, repetitions, ease, interval_days, lapses, due_date,
+                          last_grade, last_reviewed FROM review_cards WHERE student_id = ?""",
+                (student_id,)):
+            cards[row['video_id']] = ReviewCard(
+                row['repetitions'], row['ease'], row['interval_days'], row['lapses'],
+                _date(row['due_date']), row['last_grade'], _date(row['last_reviewed'])
+            )
+        progress = {row[0]: row[1] for row in conn.execute(
+            """SELECT video_id, MAX(watch_seconds) FROM watch_events
+               WHERE student_id = ? AND event_type = 'progress' AND id <= ? GROUP BY video_id""",
+            (student_id, self._watermark)
+        ) if row[0] not in cards and row[1]}
+        budget = conn.execute(
+            "SELECT daily_minutes, weekday_minutes FROM study_budgets WHERE student_id = ?",
+            (student_id,)
+        ).fetchone()
+        student = _Student(cards, progress, budget[0] if budget else None,
+                           json.loads(budget[1]) if budget and budget[1] else None)
+        self._students[student_id] = student
+        if self._watermark > self._stored_watermark:
+            # Only in memory (read-only): replay what the stored cards do not include yet
+            for row in conn.execute(
+                    """SELECT video_id, event_type, watch_seconds, created_at FROM watch_events
+                       WHERE student_id = ? AND id > ? AND id <= ? ORDER BY id""",
+                    (student_id, self._stored_watermark, self._watermark)):
+                self._apply_event(student, row['video_id'], row['event_type'],
+                                  row['watch_seconds'], _local_day(row['created_at']))
+        return student
+
+    def _save_cards(self):
+        rows = []
+        for student_id, student in self._students.items():
+            for video_id in student.changed:
+                card = student.cards[video_id]
+                rows.append((student_id, video_id, card.repetitions, card.ease, card.interval,
+                             card.lapses, card.due.isoformat(), card.last_grade,
+                             card.reviewed.isoformat()))
+            student.changed.clear()
+        self.db.conn.executemany("""
+            INSERT INTO review_cards (student_id, video_id, repetitions, ease, interval_days,
+                                      lapses, due_date, last_grade, last_reviewed)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (student_id, video_id) DO UPDATE SET
+                repetitions = excluded.repetitions, ease = excluded.ease,
+                interval_days = excluded.interval_days, lapses = excluded.lapses,
+                due_date = excluded.due_date, last_grade = excluded.last_grade,
+                last_reviewed = excluded.last_reviewed, updated_at = CURRENT_TIMESTAMP
+        """, rows)
+
+    def record_review(self, video_id: int, grade: int, student_id: str = LOCAL_STUDENT,
+                      day: datetime.date = None) -> Dict:
+        """
+        Grade how well a student remembered a video (SM-2 quality 0-5)
+
+        Returns:
+            The card's new state
+        """
+        if not isinstance(grade, int) or not 0 <= grade <= 5:
+            raise ValueError("grade must be an integer from 0 to 5")
+        self.refresh()
+        if video_id not in self.videos:
+            raise KeyError(video_id)
+        conn = self.db.conn
+        student = self._student(student_id)
+        card = student.cards.get(video_id)
+        if card is None:
+            card = student.cards[video_id] = ReviewCard()
+            student.progress.pop(video_id, None)
+        card.review(grade, day or datetime.date.today())
+        student.changed.add(video_id)
+        try:
+            with self.db.transaction():
+                self._save_cards()
+        except Exception:
+            self._students.pop(student_id, None)
+            raise
+        return self._card_state(video_id, card)
+
+    def set_budget(self, student_id: str, daily_minutes: int, weekday_minutes: List[int] = None):
+        """
+        Store a student's study budget
+
+        Args:
+            daily_minutes: Minutes available on a normal day
+            weekday_minutes: Optional 7 per-weekday overrides (Monday first, None = daily)
+        """
+        values = [daily_minutes] + [m for m in (weekday_minutes or []) if m is not None]
+        if any(not isinstance(m, int) or not 0 <= m <= 1440 for m in values):
+            raise ValueError("Study minutes must be integers from 0 to 1440")
+        if weekday_minutes is not None and len(weekday_minutes) != 7:
+            raise ValueError("weekday_minutes needs 7 entries, Monday first")
+        with self.db.transaction():
+            self.db.conn.execute("""
+                INSERT INTO study_budgets (student_id, daily_minutes, weekday_minutes)
+                VALUES (?, ?, ?)
+                ON CONFLICT (student_id) DO UPDATE SET
+                    daily_minutes = excluded.daily_minutes,
+                    weekday_minutes = excluded.weekday_minutes,
+                    updated_at = CURRENT_TIMESTAMP
+            """, (student_id, daily_minutes, json.dumps(weekday_minutes) if weekday_minutes else None))
+        if student_id in self._students:
+            self._students[student_id].daily_minutes = daily_minutes
+            self._students[student_id].weekday_minutes = weekday_minutes
+
+    # Planning
+    def plan(self, student_id: str = LOCAL_STUDENT, days: int = 1, start: datetime.date = None,
+             minutes: int = None) -> List[Dict]:
+        """
+        Day-by-day study plan
+
+        Each day, the due reviews and the next lecture of every course go
+        into a max-heap; the best entry that still fits the day's budget is
+        taken, and taking a lecture queues the course's next one. What is
+        studied is assumed to be completed on schedule, so later days hold
+        the reviews it makes due.
+
+        Args:
+            student_id: Student to plan for
+            days: Number of days
+            start: First day (default today)
+            minutes: Budget for every day, instead of the student's own
+
+        Returns:
+            [{'date', 'budget_minutes', 'planned_minutes', 'videos', 'deferred'}]
+        """
+        self.refresh()
+        student = self._student(student_id)
+        start = start or datetime.date.today()
+        cards = dict(student.cards)
+        progress = dict(student.progress)
+        due = [(card.due, video_id) for video_id, card in cards.items() if video_id in self.videos]
+        heapq.heapify(due)
+        queues, learned = self._new_queues(student_id, student)
+        carried = []
+
+        days_out = []
+        for offset in range(days):
+            day = start + datetime.timedelta(days=offset)
+            budget = minutes if minutes is not None else student.budget(day, self.daily_minutes)
+            lag = self._course_lag(learned)
+            while due and due[0][0] <= day:
+                carried.append(heapq.heappop(due)[1])
+            heap = [self._entry_key(self._review_entry(video_id, cards[video_id], day))
+                    for video_id in carried]
+            heap.extend(self._entry_key(self._new_entry(queue[0], progress, lag))
+                        for queue in queues.values() if queue)
+            heapq.heapify(heap)
+            carried = []
+
+            planned, remaining, deferred = [], budget, 0
+            while heap:
+                entry = heapq.heappop(heap)[2]
+                video_id = entry['id']
+                if entry['minutes'] <= remaining:
+                    planned.append(entry)
+                    remaining -= entry['minutes']
+                    card = cards[video_id].copy() if video_id in cards else ReviewCard()
+                    card.review(COMPLETION_GRADE, day)
+                    cards[video_id] = card
+                    heapq.heappush(due, (card.due, video_id))
+                    if entry['kind'] != 'review':
+                        progress.pop(video_id, None)
+                        queue = queues[entry['course']]
+                        queue.popleft()
+                        learned[entry['course']] += 1
+                        if queue:
+                            heapq.heappush(heap, self._entry_key(self._new_entry(queue[0], progress, lag)))
+                elif entry['kind'] != 'review' and entry['minutes'] > budget \
+                        and remaining >= self.min_session_minutes:
+                    # Longer than any whole day: watch a slice now and resume tomorrow
+                    planned.append(dict(entry, kind='part', minutes=round(float(remaining), 1)))
+                    progress[video_id] = progress.get(video_id, 0) + int(remaining * 60)
+                    remaining = 0
+                else:
+                    deferred += 1
+                    if entry['kind'] == 'review':
+                        carried.append(video_id)
+
+            days_out.append({
+                'date': day.isoformat(),
+                'budget_minutes': budget,
+                'planned_minutes': round(budget - remaining, 1),
+                'videos': planned,
+                'deferred': deferred
+            })
+        return days_out
+
+    def schedule(self, student_id: str = LOCAL_STUDENT, limit: int = 10) -> Dict:
+        """
+        Today's study schedule in the dashboard's urgent/pending/review buckets
+
+        Every bucket is in priority order with estimated_minutes from real
+        running times; 'today' is the plan packed into the day's budget.
+        """
+        today = self.plan(student_id)[0]
+        student = self._student(student_id)
+        day = datetime.date.today()
+        queues, learned = self._new_queues(student_id, student)
+        lag = self._course_lag(learned)
+        entries = [self._review_entry(video_id, card, day)
+                   for video_id, card in student.cards.items()
+                   if video_id in self.videos and card.due <= day]
+        entries.extend(self._new_entry(video_id, student.progress, lag)
+                       for queue in queues.values() for video_id in queue)
+        entries.sort(key=lambda entry: (-entry['priority'], entry['id']))
+
+        buckets = {'urgent': [], 'pending': [], 'review': []}
+        for entry in entries:
+            if URGENT_TAG in self.videos[entry['id']]['tags']:
+                buckets['urgent'].append(entry)
+            else:
+                buckets['review' if entry['kind'] == 'review' else 'pending'].append(entry)
+        schedule = {
+            name: {
+                'videos': bucket[:limit],
+                'count': len(bucket),
+                'estimated_minutes': int(sum(entry['minutes'] for entry in bucket))
+            }
+            for name, bucket in buckets.items()
+        }
+        schedule['today'] = today
+        return schedule
+
+    def card(self, video_id: int, student_id: str = LOCAL_STUDENT) -> Dict:
+        """A student's review state for one video (None if never studied)"""
+        self.refresh()
+        card = self._student(student_id).cards.get(video_id)
+        return self._card_state(video_id, card) if card else None
+
+    def _new_queues(self, student_id: str, student: _Student):
+        """Unstudied videos per course in lecture (download) order, and studied counts per course"""
+        queues, learned = defaultdict(deque), defaultdict(int)
+        for video_id in sorted(self.videos):
+            video = self.videos[video_id]
+            if video_id in student.cards or (student_id == LOCAL_STUDENT and video['watched']):
+                learned[video['course']] += 1
+            else:
+                queues[video['course']].append(video_id)
+        return queues, learned
+
+    def _course_lag(self, learned: Dict[str, int]) -> Dict[str, float]:
+        """How far each course's completion is below the student's mean completion"""
+        totals = defaultdict(int)
+        for video in self.videos.values():
+            totals[video['course']] += 1
+        completion = {course: learned.get(course, 0) / total for course, total in totals.items()}
+        if not completion:
+            return {}
+        mean = sum(completion.values()) / len(completion)
+        return {course: max(0.0, mean - value) for course, value in completion.items()}
+
+    def _tag_priority(self, video: Dict) -> float:
+        return sum(TAG_WEIGHTS.get(tag, 0) for tag in video['tags'])
+
+    def _review_entry(self, video_id: int, card: ReviewCard, day: datetime.date) -> Dict:
+        video = self.videos[video_id]
+        overdue = max(0, (day - card.due).days) / max(1, card.interval)
+        return self._entry(video, 'review', max(1.0, self.minutes(video) * self.review_fraction),
+                           REVIEW_PRIORITY + min(overdue, 3.0) + self._tag_priority(video),
+                           due_date=card.due.isoformat())
+
+    def _new_entry(self, video_id: int, progress: Dict[int, int], lag: Dict[str, float]) -> Dict:
+        video = self.videos[video_id]
+        watched = progress.get(video_id, 0) / 60
+        priority = NEW_PRIORITY + self._tag_priority(video) + self.lag_weight * lag.get(video['course'], 0)
+        if watched:
+            priority += IN_PROGRESS_BONUS
+        return self._entry(video, 'continue' if watched else 'new',
+                           max(1.0, self.minutes(video) - watched), priority)
+
+    @staticmethod
+    def _entry(video: Dict, kind: str, minutes: float, priority: float, **extra) -> Dict:
+        return {
+            'id': video['id'],
+            'title': video['title'],
+            'category_name': video['category_name'],
+            'course': video['course'],
+            'kind': kind,
+            'minutes': round(minutes, 1),
+            'priority': round(priority, 3),
+            **extra
+        }
+
+    @staticmethod
+    def _entry_key(entry: Dict) -> tuple:
+        return (-entry['priority'], entry['id'], entry)
+
+    @staticmethod
+    def _card_state(video_id: int, card: ReviewCard) -> Dict:
+        return {
+            'video_id': video_id,
+            'repetitions': card.repetitions,
+            'ease': round(card.ease, 3),
+            'interval_days': card.interval,
+            'lapses': card.lapses,
+            'due_date': card.due.isoformat(),
+            'last_grade': card.last_grade,
+            'last_reviewed': card.reviewed.isoformat()
+        }
+
+
+def _date(value: str) -> datetime.date:
+    return datetime.date.fromisoformat(value) if value else None
+
+
+def _local_day(created_at: str) -> datetime.date:
+    """Local calendar day of a watch_events timestamp (CURRENT_TIMESTAMP is UTC)"""
+    moment = datetime.datetime.strptime(created_at[:19], '%Y-%m-%d %H:%M:%S')
+    return moment.replace(tzinfo=datetime.timezone.utc).astimezone().date()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Print a spaced-repetition study plan')
+    parser.add_argument('--db', default='edunabha_videos.db')
+    parser.add_argument('--student', default=LOCAL_STUDENT)
+    parser.add_argument('--days', type=int, default=7)
+    parser.add_argument('--minutes', type=int, default=None, help='Daily budget for this plan only')
+    args = parser.parse_args()
+    configure_logging()
+
+    from video_database import VideoDatabase
+    db = VideoDatabase(args.db)
+    try:
+        plan = StudyScheduler(db).plan(args.student, days=args.days, minutes=args.minutes)
+        print(json.dumps(plan, indent=2))
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
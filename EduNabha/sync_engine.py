@@ -0,0 +1,519 @@
+"""
+Sync Engine
+Bidirectional catalog synchronization between two VideoDatabase instances (a
+student's device and the school server). Titles, ratings, notes, categories and
+tags are last-writer-wins registers stamped with a hybrid logical clock;
+watch counts are per-node grow-only counters that merge by taking each node's
+maximum, so watches made offline on both sides add up. Changes travel in
+batches ordered by a local sequence number, and each side's watermark for its
+peer only advances once a batch is applied, so an interrupted sync resumes
+where it stopped and re-sending a batch is harmless.
+
+Usage: python sync_engine.py --db device.db (--peer-db server.db | --peer-url http://host:8765)
+"""
+
+import argparse
+import hashlib
+import json
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+from instrumentation import configure_logging, get_logger
+
+
+logger = get_logger('sync_engine')
+
+REGISTER_FIELDS = ('title', 'rating', 'notes', 'category')
+MAX_FIELDS = ('last_watched',)  # Registers merged by keeping the larger value
+TAG_PREFIX = 'tag:'
+_MISSING = object()
+
+
+def video_uid(file_name: str, file_size: int) -> str:
+    """Identity of a video across databases: the same file has the same name and size everywhere"""
+    key = f"{(file_name or '').casefold()}\0{int(file_size or 0)}"
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:20]
+
+
+class HybridLogicalClock:
+    """
+    Physical milliseconds plus a logical counter, never going backwards and
+    always ahead of every stamp received. Stamps compare as strings and end in
+    the node id, which breaks ties deterministically.
+    """
+
+    def __init__(self, node: str, last: str = None):
+        self.node = node
+        self.wall, self.counter = self.parse(last) if last else (0, 0)
+
+    @staticmethod
+    def parse(stamp: str) -> Tuple[int, int]:
+        wall, counter, _ = stamp.split('.', 2)
+        return int(wall), int(counter)
+
+    def now(self) -> str:
+        wall = int(time.time() * 1000)
+        if wall > self.wall:
+            self.wall, self.counter = wall, 0
+        else:
+            self.counter += 1
+        return self.stamp()
+
+    def at(self, wall_ms: int, after: str = None) -> str:
+        """Stamp for an edit made at wall_ms that overwrote the value stamped after"""
+        wall, counter = wall_ms, 0
+        if after and (wall, counter) <= self.parse(after):
+            wall, counter = self.parse(after)
+            counter += 1
+        self.observe(f"{wall:015d}.{counter:06d}.{self.node}")
+        return f"{wall:015d}.{counter:06d}.{self.node}"
+
+    def initial(self) -> str:
+        """Lowest stamp, for values a video was catalogued with rather than edited to"""
+        return f"{0:015d}.{0:06d}.{self.node}"
+
+    def observe(self, stamp: str):
+        """Move past a stamp received from another node"""
+        self.wall, self.counter = max((self.wall, self.counter), self.parse(stamp))
+
+    def stamp(self) -> str:
+        return f"{self.wall:015d}.{self.counter:06d}.{self.node}"
+
+
+class SyncEngine:
+    """Change capture, change sets and merging for one VideoDatabase"""
+
+    def __init__(self, db, batch_size: int = 500):
+        """
+        Args:
+            db: VideoDatabase instance
+            batch_size: Rows per change set sent to a peer
+        """
+        self.db = db
+        self.batch_size = batch_size
+        state = self._state()
+        self.node_id = state.get('node_id')
+        if not self.node_id:
+            self.node_id = uuid.uuid4().hex[:12]
+            with self.db.transaction():
+                self.db.conn.execute("INSERT OR IGNORE INTO sync_state (key, value) VALUES ('node_id', ?)",
+                                     (self.node_id,))
+            self.node_id = self._state()['node_id']  # Another process may have won the insert
+        self.clock = HybridLogicalClock(self.node_id, state.get('clock'))
+        self._seq = 0
+        self._touched = set()  # Videos changed by the current transaction, notified after commit
+
+    # Sync sessions
+    def sync(self, peer, batch_size: int = None) -> Dict:
+        """
+        Exchange changes with a peer until both are up to date
+
+        Args:
+            peer: Another SyncEngine, or anything with the same exchange(message)
+                method (HttpSyncPeer for a server)
+            batch_size: Rows per change set in either direction
+
+        Returns:
+            Rows sent and received and the number of round trips
+        """
+        started = time.perf_counter()
+        limit = batch_size or self.batch_size
+        self.capture()
+        reply = peer.exchange({'node': self.node_id, 'hello': True, 'limit': limit})
+        peer_node = reply['node']
+        sent = received = round_trips = 0
+        while True:
+            round_trips += 1
+            incoming = reply.get('changes')
+            ack = None
+            if incoming and incoming['upto'] > incoming['since']:
+                received += self.apply(peer_node, incoming)
+                ack = incoming['upto']
+            outgoing = self.changes_for(peer_node, limit)
+            if ack is None and outgoing['upto'] == outgoing['since']:
+                break
+            reply = peer.exchange({'node': self.node_id, 'ack': ack, 'changes': outgoing, 'limit': limit})
+            if outgoing['upto'] > outgoing['since']:
+                self.acknowledge(peer_node, outgoing['upto'])  # The reply means it was applied
+                sent += len(outgoing['registers']) + len(outgoing['counters'])
+        summary = {'peer': peer_node, 'sent': sent, 'received': received, 'roundTrips': round_trips,
+                   'durationMs': round((time.perf_counter() - started) * 1000, 1)}
+        logger.info("Synced with %s", peer_node, extra=summary)
+        return summary
+
+    def exchange(self, message: Dict) -> Dict:
+        """
+        Serve one round trip of a peer's sync session
+
+        Args:
+            message: {'node': peer id, 'hello': first message of a session,
+                      'ack': our seq the peer has applied up to,
+                      'changes': the peer's change set, 'limit': batch size}
+
+        Returns:
+            {'node': our id, 'changes': our next change set for the peer}
+        """
+        peer_node = message['node']
+        if message.get('hello'):
+            self.capture()
+        if message.get('ack') is not None:
+            self.acknowledge(peer_node, int(message['ack']))
+        if message.get('changes'):
+            self.apply(peer_node, message['changes'])
+        limit = min(int(message.get('limit') or self.batch_size), self.batch_size * 10)
+        return {'node': self.node_id, 'changes': self.changes_for(peer_node, limit)}
+
+    # Capture
+    def capture(self) -> int:
+        """
+        Record local edits made since the last capture as new register and
+        counter values
+
+        Returns:
+            Number of changed registers and counters
+        """
+        with self.db.transaction():
+            self._load_state()
+            changed = self._capture()
+            self._save_state()
+        self._notify()
+        return changed
+
+    def _capture(self) -> int:
+        """
+        capture() inside the caller's transaction
+
+        Triggers record which videos were edited and when (sync_dirty), so only
+        those and videos added since the last capture are compared with their
+        registers. An edit is stamped with its own time, which lets the later
+        of two offline edits win; values a video was catalogued with get the
+        lowest possible stamp, so they never override an edit made elsewhere.
+        A new video whose registers already arrived from a peer takes their
+        values instead.
+        """
+        conn = self.db.conn
+        captured_id = int(self._state().get('captured_id', 0))
+        edited = dict(conn.execute("SELECT video_id, changed_ms FROM sync_dirty").fetchall())
+        videos, mapping = {}, []
+        for row in conn.execute("""
+            SELECT v.id, v.file_name, v.file_size, v.title, v.rating, v.notes,
+                   v.last_watched, v.watch_count, c.name
+            FROM videos v LEFT JOIN categories c ON c.id = v.category_id
+            WHERE v.id > ? OR v.id IN (SELECT video_id FROM sync_dirty)
+            ORDER BY v.id
+        """, (captured_id,)):
+            uid = video_uid(row[1], row[2])
+            mapping.append((row[0], uid))
+            videos.setdefault(uid, row)  # The same file catalogued twice: the first row speaks for both
+        if not videos:
+            return 0
+        conn.executemany("INSERT OR REPLACE INTO sync_videos (video_id, uid) VALUES (?, ?)", mapping)
+
+        uids = json.dumps(list(videos))
+        registers, tag_fields = {}, {}
+        for uid, field, value, hlc in conn.execute(
+                "SELECT uid, field, value, hlc FROM sync_registers WHERE uid IN (SELECT value FROM json_each(?))",
+                (uids,)):
+            registers[(uid, field)] = (json.loads(value), hlc)
+            if field.startswith(TAG_PREFIX):
+                tag_fields.setdefault(uid, []).append(field)
+        counters = {}
+        for uid, node, value in conn.execute(
+                "SELECT uid, node, value FROM sync_counters WHERE uid IN (SELECT value FROM json_each(?))",
+                (uids,)):
+            counters.setdefault(uid, {})[node] = value
+        tagged = {}
+        for video_id, name in conn.execute("""
+            SELECT vt.video_id, t.name FROM video_tags vt JOIN tags t ON t.id = vt.tag_id
+            WHERE vt.video_id IN (SELECT value FROM json_each(?))
+        """, (json.dumps([row[0] for row in videos.values()]),)):
+            tagged.setdefault(video_id, set()).add(name)
+
+        known = {uid for uid, _ in registers} | set(counters)
+        register_rows, counter_rows, adopt = [], [], []
+        for uid, row in videos.items():
+            changed_ms = edited.get(row[0])
+            if changed_ms is None and row[0] > captured_id and uid in known:
+                adopt.append(uid)
+                continue
+            current = {'title': row[3], 'rating': row[4], 'notes': row[5], 'category': row[8],
+                       'last_watched': row[6]}
+            current.update({field: False for field in tag_fields.get(uid, [])})
+            current.update({TAG_PREFIX + name: True for name in tagged.get(row[0], ())})
+            for field, value in current.items():
+                stored, hlc = registers.get((uid, field), (_MISSING, None))
+                if stored is _MISSING and value in (None, '', False):
+                    continue  # Nothing set yet; a blank must not clear other nodes' values
+                if field in MAX_FIELDS and stored not in (_MISSING, None) and (value is None or value <= stored):
+                    continue
+                if value != stored:
+                    if changed_ms is not None:
+                        stamp = self.clock.at(changed_ms, after=hlc)
+                    elif hlc is None:
+                        stamp = self.clock.initial()
+                    else:
+                        stamp = self.clock.now()
+                    register_rows.append((uid, field, json.dumps(value), stamp, self._next_seq(), None))
+
+            others = sum(v for node, v in counters.get(uid, {}).items() if node != self.node_id)
+            own = counters.get(uid, {}).get(self.node_id, 0)
+            if (row[7] or 0) - others > own:
+                counter_rows.append((uid, self.node_id, (row[7] or 0) - others, self._next_seq(), None))
+
+        self._write_registers(register_rows)
+        self._write_counters(counter_rows)
+        if adopt:
+            self._touched |= self._apply_to_videos(
+                conn.execute("SELECT uid, field, value, hlc, seq, source FROM sync_registers "
+                             "WHERE uid IN (SELECT value FROM json_each(?))", (json.dumps(adopt),)).fetchall(),
+                conn.execute("SELECT uid, node, value, seq, source FROM sync_counters "
+                             "WHERE uid IN (SELECT value FROM json_each(?))", (json.dumps(adopt),)).fetchall()
+            )
+        conn.execute("DELETE FROM sync_dirty")
+        conn.execute("INSERT OR REPLACE INTO sync_state (key, value) VALUES ('captured_id', ?)",
+                     (str(max(captured_id, max(row[0] for row in videos.values()))),))
+        if register_rows or counter_rows:
+            logger.debug("Captured local changes", extra={'registers': len(register_rows),
+                                                           'counters': len(counter_rows)})
+        return len(register_rows) + len(counter_rows)
+
+    # Change sets
+    def changes_for(self, peer_node: str, limit: int = None) -> Dict:
+        """
+        Our next batch of changes the peer has not applied, oldest first
+
+        Rows that originated on the peer or were received from it are skipped,
+        but still count towards the batch's upto so the watermark moves past them.
+        """
+        limit = limit or self.batch_size
+        since = self._peer(peer_node)['sent_seq']
+        rows = self.db.conn.execute("""
+            SELECT 'r', uid, field, value, hlc, seq, source FROM sync_registers WHERE seq > ?
+            UNION ALL
+            SELECT 'c', uid, node, value, NULL, seq, source FROM sync_counters WHERE seq > ?
+            ORDER BY 6 LIMIT ?
+        """, (since, since, limit)).fetchall()
+        suffix = '.' + peer_node
+        rows_out = [r for r in rows if r[6] != peer_node]
+        registers = [[r[1], r[2], r[3], r[4]] for r in rows_out if r[0] == 'r' and not r[4].endswith(suffix)]
+        counters = [[r[1], r[2], r[3]] for r in rows_out if r[0] == 'c' and r[2] != peer_node]
+        return {
+            'node': self.node_id,
+            'since': since,
+            'upto': rows[-1][5] if rows else since,
+            'more': len(rows) == limit,
+            'registers': registers,
+            'counters': counters
+        }
+
+    def apply(self, peer_node: str, changes: Dict) -> int:
+        """
+        Merge a peer's change set in one transaction
+
+        Registers win when their stamp is newer (last_watched when its value is
+        later); counters keep the larger value per node. Applying the same
+        change set twice changes nothing.
+
+        Returns:
+            Number of rows that changed local state
+        """
+        conn = self.db.conn
+        with self.db.transaction():
+            self._load_state()
+            self._capture()  # Local edits made since must be compared, not overwritten
+            register_rows, counter_rows = [], []
+            for uid, field, value, hlc in changes.get('registers', []):
+                self.clock.observe(hlc)
+                local = conn.execute("SELECT value, hlc FROM sync_registers WHERE uid = ? AND field = ?",
+                                     (uid, field)).fetchone()
+                if local is not None:
+                    if field in MAX_FIELDS:
+                        if json.loads(value) is None or (json.loads(local[0]) or '') >= json.loads(value):
+                            continue
+                    elif local[1] >= hlc:
+                        continue
+                register_rows.append((uid, field, value, hlc, self._next_seq(), peer_node))
+            for uid, node, value in changes.get('counters', []):
+                local = conn.execute("SELECT value FROM sync_counters WHERE uid = ? AND node = ?",
+                                     (uid, node)).fetchone()
+                if local is None or local[0] < value:
+                    counter_rows.append((uid, node, value, self._next_seq(), peer_node))
+
+            self._write_registers(register_rows)
+            self._write_counters(counter_rows)
+            self._touched |= self._apply_to_videos(register_rows, counter_rows)
+            conn.execute("""
+                INSERT INTO sync_peers (node, received_seq, last_sync) VALUES (?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT (node) DO UPDATE SET
+                    received_seq = MAX(received_seq, excluded.received_seq), last_sync = excluded.last_sync
+            """, (peer_node, changes.get('upto', 0)))
+            self._save_state()
+        self._notify()
+        return len(register_rows) + len(counter_rows)
+
+    def acknowledge(self, peer_node: str, seq: int):
+        """The peer has applied our changes up to seq"""
+        with self.db.transaction():
+            self.db.conn.execute("""
+                INSERT INTO sync_peers (node, sent_seq, last_sync) VALUES (?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT (node) DO UPDATE SET
+                    sent_seq = MAX(sent_seq, excluded.sent_seq), last_sync = excluded.last_sync
+            """, (peer_node, seq))
+
+    def status(self) -> Dict:
+        latest = self._state()
+        return {
+            'node': self.node_id,
+            'seq': int(latest.get('seq', 0)),
+            'peers': [dict(row) for row in self.db.conn.execute(
+                "SELECT node, sent_seq, received_seq, last_sync FROM sync_peers ORDER BY node")]
+        }
+
+    # Local rows
+    def _apply_to_videos(self, register_rows: List[Tuple], counter_rows: List[Tuple]) -> set:
+        """Write merged values into the videos they belong to; returns the video ids changed"""
+        conn = self.db.conn
+        uids = {row[0] for row in register_rows} | {row[0] for row in counter_rows}
+        if not uids:
+            return set()
+        videos = {}
+        for video_id, uid in conn.execute("""
+            SELECT s.video_id, s.uid FROM sync_videos s JOIN videos v ON v.id = s.video_id
+            WHERE s.uid IN (SELECT value FROM json_each(?))
+        """, (json.dumps(list(uids)),)):
+            videos.setdefault(uid, []).append(video_id)
+
+        updated = set()
+        for uid, field, value, *_ in register_rows:
+            value = json.loads(value)
+            for video_id in videos.get(uid, []):
+                if field.startswith(TAG_PREFIX):
+                    tag_id = self._named_id('tags', field[len(TAG_PREFIX):])
+                    if value:
+                        conn.execute("INSERT OR IGNORE INTO video_tags (video_id, tag_id) VALUES (?, ?)",
+                                     (video_id, tag_id))
+                    else:
+                        conn.execute("DELETE FROM video_tags WHERE video_id = ? AND tag_id = ?",
+                                     (video_id, tag_id))
+                elif field == 'category':
+                    conn.execute("UPDATE videos SET category_id = ? WHERE id = ?",
+                                 (self._named_id('categories', value) if value else None, video_id))
+                elif field == 'last_watched':
+                    conn.execute("UPDATE videos SET last_watched = ? WHERE id = ? AND "
+                                 "(last_watched IS NULL OR last_watched < ?)", (value, video_id, value))
+                elif field in REGISTER_FIELDS:
+                    conn.execute(f"UPDATE videos SET {field} = ? WHERE id = ?", (value, video_id))
+                updated.add(video_id)
+        for uid in {row[0] for row in counter_rows}:
+            for video_id in videos.get(uid, []):
+                conn.execute("""
+                    UPDATE videos SET watch_count = (SELECT SUM(value) FROM sync_counters WHERE uid = ?)
+                    WHERE id = ?
+                """, (uid, video_id))
+                updated.add(video_id)
+        return updated
+
+    def _named_id(self, table: str, name: str) -> int:
+        self.db.conn.execute(f"INSERT OR IGNORE INTO {table} (name) VALUES (?)", (name,))
+        return self.db.conn.execute(f"SELECT id FROM {table} WHERE name = ?", (name,)).fetchone()[0]
+
+    def _notify(self):
+        touched, self._touched = self._touched, set()
+        self.db.notify_updated(sorted(touched), ['sync'])
+
+    def _write_registers(self, rows: List[Tuple]):
+        self.db.conn.executemany("""
+            INSERT INTO sync_registers (uid, field, value, hlc, seq, source) VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (uid, field) DO UPDATE SET
+                value = excluded.value, hlc = excluded.hlc, seq = excluded.seq, source = excluded.source
+        """, rows)
+
+    def _write_counters(self, rows: List[Tuple]):
+        self.db.conn.executemany("""
+            INSERT INTO sync_counters (uid, node, value, seq, source) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (uid, node) DO UPDATE SET
+                value = excluded.value, seq = excluded.seq, source = excluded.source
+        """, rows)
+
+    # State
+    def _load_state(self):
+        """
+        Reload the clock and sequence at the start of a db.transaction()
+
+        The unit's write lock serializes capture/apply across processes.
+        """
+        self._touched = set()
+        state = self._state()
+        if state.get('clock'):
+            self.clock.observe(state['clock'])
+        self._seq = int(state.get('seq', 0))
+
+    def _next_seq(self) -> int:
+        self._seq += 1
+        return self._seq
+
+    def _save_state(self):
+        self.db.conn.executemany(
+            "INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)",
+            [('clock', self.clock.stamp()), ('seq', str(self._seq))]
+        )
+
+    def _state(self) -> Dict[str, str]:
+        return {row[0]: row[1] for row in self.db.conn.execute("SELECT key, value FROM sync_state")}
+
+    def _peer(self, peer_node: str) -> Dict:
+        row = self.db.conn.execute("SELECT sent_seq, received_seq FROM sync_peers WHERE node = ?",
+                                   (peer_node,)).fetchone()
+        return {'sent_seq': row[0], 'received_seq': row[1]} if row else {'sent_seq': 0, 'received_seq': 0}
+
+
+class HttpSyncPeer:
+    """A SyncEngine behind video_api_server's POST /sync"""
+
+    def __init__(self, base_url: str, timeout: float = 30.0):
+        self.url = base_url.rstrip('/') + '/sync'
+        self.timeout = timeout
+
+    def exchange(self, message: Dict) -> Dict:
+        import urllib.request
+        request = urllib.request.Request(
+            self.url, data=json.dumps(message).encode('utf-8'),
+            headers={'Content-Type': 'application/json'}, method='POST'
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            reply = json.loads(response.read())
+        if 'node' not in reply:
+            raise RuntimeError(f"Sync peer refused the exchange: {reply.get('error', reply)}")
+        return reply
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Synchronize the video catalog with another database')
+    parser.add_argument('--db', default='edunabha_videos.db')
+    peer = parser.add_mutually_exclusive_group(required=True)
+    peer.add_argument('--peer-db', help='Another database file (e.g. a device copy)')
+    peer.add_argument('--peer-url', help='Base URL of a video_api_server')
+    parser.add_argument('--batch-size', type=int, default=500)
+    args = parser.parse_args()
+    configure_logging()
+
+    from video_database import VideoDatabase
+    db = VideoDatabase(args.db)
+    peer_db: Optional[VideoDatabase] = None
+    try:
+        engine = SyncEngine(db, args.batch_size)
+        if args.peer_db:
+            peer_db = VideoDatabase(args.peer_db)
+            remote = SyncEngine(peer_db, args.batch_size)
+        else:
+            remote = HttpSyncPeer(args.peer_url)
+        print(json.dumps(engine.sync(remote), indent=2))
+    finally:
+        db.close()
+        if peer_db:
+            peer_db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,495 @@
+"""
+Tag Index
+In-memory bitmap index of videos by tag, category and rating, answering
+boolean filter expressions ("Exam Material AND Difficult AND NOT Completed")
+and the sidebar facet counts of a result set without going back to SQLite
+"""
+
+import array
+import bisect
+import re
+from typing import Dict, Iterable, Iterator, Optional, Tuple, Union
+
+from instrumentation import get_logger
+
+
+logger = get_logger('tag_index')
+
+ARRAY_LIMIT = 4096  # Containers holding more ids switch to a 65536-bit bitmap
+BITMAP_BYTES = 65536 // 8
+
+Container = Union[array.array, int]
+
+
+def _popcount(mask: int) -> int:
+    return bin(mask).count('1')
+
+
+def _mask(lows: Iterable[int]) -> int:
+    bits = bytearray(BITMAP_BYTES)
+    for low in lows:
+        bits[low >> 3] |= 1 << (low & 7)
+    return int.from_bytes(bits, 'little')
+
+
+def _lows(mask: int) -> array.array:
+    lows = array.array('H')
+    for index, byte in enumerate(mask.to_bytes(BITMAP_BYTES, 'little')):
+        if byte:
+            base = index << 3
+            lows.extend(base | bit for bit in range(8) if byte >> bit & 1)
+    return lows
+
+
+def _as_mask(container: Container) -> int:
+    return container if isinstance(container, int) else _mask(container)
+
+
+def _from_sorted(lows) -> Optional[Container]:
+    if not lows:
+        return None
+    return array.array('H', lows) if len(lows) <= ARRAY_LIMIT else _mask(lows)
+
+
+def _shrink(mask: int) -> Optional[Container]:
+    """Bitmap container back to an array once it is sparse enough"""
+    if not mask:
+        return None
+    return mask if _popcount(mask) > ARRAY_LIMIT else _lows(mask)
+
+
+def _and(a: Container, b: Container) -> Optional[Container]:
+    if isinstance(a, int) and isinstance(b, int):
+        return _shrink(a & b)
+    if isinstance(a, int):
+        a, b = b, a
+    if isinstance(b, int):
+        bits = b.to_bytes(BITMAP_BYTES, 'little')
+        return array.array('H', (low for low in a if bits[low >> 3] >> (low & 7) & 1)) or None
+    return _from_sorted(sorted(set(a).intersection(b)))
+
+
+def _or(a: Container, b: Container) -> Container:
+    if isinstance(a, int) or isinstance(b, int):
+        return _as_mask(a) | _as_mask(b)
+    return _from_sorted(sorted(set(a).union(b)))
+
+
+def _and_not(a: Container, b: Container) -> Optional[Container]:
+    if isinstance(a, int):
+        return _shrink(a & ~_as_mask(b))
+    if isinstance(b, int):
+        bits = b.to_bytes(BITMAP_BYTES, 'little')
+        return array.array('H', (low for low in a if not bits[low >> 3] >> (low & 7) & 1)) or None
+    return _from_sorted(sorted(set(a).difference(b)))
+
+
+def _and_count(a: Container, b: Container) -> int:
+    if isinstance(a, int) and isinstance(b, int):
+        return _popcount(a & b)
+    if isinstance(a, int):
+        a, b = b, a
+    if isinstance(b, int):
+        bits = b.to_bytes(BITMAP_BYTES, 'little')
+        return sum(bits[low >> 3] >> (low & 7) & 1 for low in a)
+    return len(set(a).intersection(b))
+
+
+class RoaringBitmap:
+    """
+    Compressed set of video ids (non-negative ints below 2**32)
+
+    Ids are grouped by their high 16 bits. A group is stored as a sorted
+    array of its low halves while it holds at most ARRAY_LIMIT ids and as a
+    65536-bit int once denser, as in Roaring bitmaps; set operations go group
+    by group and use int arithmetic on the dense ones.
+    """
+
+    __slots__ = ('_containers',)
+
+    def __init__(self, values: Iterable[int] = ()):
+        self._containers = {}
+        groups = {}
+        for value in values:
+            groups.setdefault(value >> 16, set()).add(value & 0xFFFF)
+        for high, lows in groups.items():
+            self._containers[high] = _from_sorted(sorted(lows))
+
+    @classmethod
+    def _wrap(cls, containers: Dict[int, Container]) -> 'RoaringBitmap':
+        bitmap = cls()
+        bitmap._containers = containers
+        return bitmap
+
+    def add(self, value: int):
+        high, low = value >> 16, value & 0xFFFF
+        container = self._containers.get(high)
+        if container is None:
+            self._containers[high] = array.array('H', [low])
+        elif isinstance(container, int):
+            self._containers[high] = container | (1 << low)
+        else:
+            index = bisect.bisect_left(container, low)
+            if index == len(container) or container[index] != low:
+                container.insert(index, low)
+                if len(container) > ARRAY_LIMIT:
+                    self._containers[high] = _mask(container)
+
+    def discard(self, value: int):
+        high, low = value >> 16, value & 0xFFFF
+        container = self._containers.get(high)
+        if container is None:
+            return
+        if isinstance(container, int):
+            container = _shrink(container & ~(1 << low))
+        else:
+            index = bisect.bisect_left(container, low)
+            if index < len(container) and container[index] == low:
+                del container[index]
+        if container:
+            self._containers[high] = container
+        else:
+            del self._containers[high]
+
+    def __contains__(self, value: int) -> bool:
+        container = self._containers.get(value >> 16)
+        if container is None:
+            return False
+        low = value & 0xFFFF
+        if isinstance(container, int):
+            return bool(container >> low & 1)
+        index = bisect.bisect_left(container, low)
+        return index < len(container) and container[index] == low
+
+    def __len__(self) -> int:
+        return sum(_popcount(c) if isinstance(c, int) else len(c) for c in self._containers.values())
+
+    def __bool__(self) -> bool:
+        return bool(self._containers)
+
+    def __iter__(self) -> Iterator[int]:
+        """Ids in ascending order"""
+        for high in sorted(self._containers):
+            container = self._containers[high]
+            base = high << 16
+            for low in (_lows(container) if isinstance(container, int) else container):
+                yield base | low
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, RoaringBitmap):
+            return NotImplemented
+        if self._containers.keys() != other._containers.keys():
+            return False
+        return all(_as_mask(c) == _as_mask(other._containers[high]) for high, c in self._containers.items())
+
+    def __repr__(self) -> str:
+        return f"RoaringBitmap({len(self)} ids)"
+
+    def __and__(self, other: 'RoaringBitmap') -> 'RoaringBitmap':
+        containers = {}
+        for high in self._containers.keys() & other._containers.keys():
+            container = _and(self._containers[high], other._containers[high])
+            if container is not None:
+                containers[high] = container
+        return self._wrap(containers)
+
+    def __or__(self, other: 'RoaringBitmap') -> 'RoaringBitmap':
+        containers = {}
+        for high in self._containers.keys() | other._containers.keys():
+            a, b = self._containers.get(high), other._containers.get(high)
+            containers[high] = _or(a, b) if a is not None and b is not None else _copy(a if b is None else b)
+        return self._wrap(containers)
+
+    def __sub__(self, other: 'RoaringBitmap') -> 'RoaringBitmap':
+        containers = {}
+        for high, container in self._containers.items():
+            if high in other._containers:
+                container = _and_not(container, other._containers[high])
+            else:
+                container = _copy(container)
+            if container is not None:
+                containers[high] = container
+        return self._wrap(containers)
+
+    def intersection_count(self, other: 'RoaringBitmap') -> int:
+        """len(self & other) without building the intersection"""
+        return sum(_and_count(self._containers[high], other._containers[high])
+                   for high in self._containers.keys() & other._containers.keys())
+
+    def copy(self) -> 'RoaringBitmap':
+        return self._wrap({high: _copy(c) for high, c in self._containers.items()})
+
+
+def _copy(container: Container) -> Container:
+    return container if isinstance(container, int) else array.array('H', container)
+
+
+# Filter expressions
+#
+#   expression := term | NOT expression | expression AND expression
+#               | expression OR expression | ( expression )
+#   term       := [tag: | category: | rating:] name
+#
+# Operators are upper case and bind NOT > AND > OR. A name is a quoted string
+# or the words up to the next operator or parenthesis, so tag names with
+# spaces need no quotes: Exam Material AND Difficult AND NOT Completed
+OPERATORS = ('AND', 'OR', 'NOT')
+FIELDS = ('tag', 'category', 'rating')
+_TOKEN = re.compile(r'\s*(?:(\()|(\))|"([^"]*)"|([^\s()"]+))')
+
+Node = Tuple
+
+
+def _tokenize(expression: str) -> list:
+    tokens, position = [], 0
+    expression = expression.strip()
+    while position < len(expression):
+        match = _TOKEN.match(expression, position)
+        if not match:
+            raise ValueError(f"Invalid filter expression near: {expression[position:]!r}")
+        position = match.end()
+        if match.group(1):
+            tokens.append(('(', None))
+        elif match.group(2):
+            tokens.append((')', None))
+        elif match.group(3) is not None:
+            tokens.append(('quoted', match.group(3)))
+        elif match.group(4) in OPERATORS:
+            tokens.append((match.group(4), None))
+        else:
+            tokens.append(('word', match.group(4)))
+    return tokens
+
+
+class _Parser:
+    def __init__(self, expression: str):
+        self.tokens = _tokenize(expression)
+        self.position = 0
+
+    def peek(self) -> Optional[str]:
+        return self.tokens[self.position][0] if self.position < len(self.tokens) else None
+
+    def take(self, kind: str = None) -> Tuple:
+        if self.position >= len(self.tokens) or (kind and self.peek() != kind):
+            raise ValueError(f"Invalid filter expression: expected {kind or 'a term'}")
+        token = self.tokens[self.position]
+        self.position += 1
+        return token
+
+    def parse(self) -> Node:
+        if not self.tokens:
+            raise ValueError("Empty filter expression")
+        node = self.parse_or()
+        if self.position < len(self.tokens):
+            raise ValueError(f"Invalid filter expression: unexpected {self.tokens[self.position][1] or self.peek()!r}")
+        return node
+
+    def parse_or(self) -> Node:
+        node = self.parse_and()
+        while self.peek() == 'OR':
+            self.take()
+            node = ('or', node, self.parse_and())
+        return node
+
+    def parse_and(self) -> Node:
+        node = self.parse_not()
+        while self.peek() == 'AND':
+            self.take()
+            node = ('and', node, self.parse_not())
+        return node
+
+    def parse_not(self) -> Node:
+        if self.peek() == 'NOT':
+            self.take()
+            return ('not', self.parse_not())
+        if self.peek() == '(':
+            self.take()
+            node = self.parse_or()
+            self.take(')')
+            return node
+        return self.parse_term()
+
+    def parse_term(self) -> Node:
+        kind, value = self.take()
+        if kind not in ('word', 'quoted'):
+            raise ValueError(f"Invalid filter expression: expected a term, got {kind!r}")
+        field = 'tag'
+        if kind == 'word' and ':' in value and value.split(':', 1)[0].lower() in FIELDS:
+            field, value = value.split(':', 1)
+            field = field.lower()
+            if not value:
+                value = self.take('quoted')[1]
+        words = [value]
+        if kind == 'word':
+            while self.peek() == 'word':
+                words.append(self.take()[1])
+        return ('term', field, ' '.join(words))
+
+
+def parse_filter(expression: str) -> Node:
+    """Parse a filter expression into nested ('and'|'or'|'not'|'term', ...) tuples"""
+    return _Parser(expression).parse()
+
+
+class TagIndex:
+    """Tag, category and rating bitmaps for one VideoDatabase, kept in sync with its change events"""
+
+    def __init__(self, db):
+        """
+        Args:
+            db: VideoDatabase instance
+        """
+        self.db = db
+        self.videos = RoaringBitmap()
+        self.tags = {}        # tag id -> RoaringBitmap
+        self.categories = {}  # category id -> RoaringBitmap
+        self.ratings = {}     # rating -> RoaringBitmap
+        self._tag_names = {}
+        self._category_names = {}
+        self._data_version = None
+
+    def attach(self):
+        """Keep the bitmaps up to date as videos are added, changed and tagged"""
+        self.db.subscribe('video_added', self.on_video_changed)
+        self.db.subscribe('video_updated', self.on_video_changed)
+        self.db.subscribe('video_trashed', self.on_video_deleted)
+        self.db.subscribe('video_deleted', self.on_video_deleted)
+        self.db.subscribe('video_tagged', self.on_video_tagged)
+        self.db.subscribe('video_untagged', self.on_video_untagged)
+
+    def load(self):
+        """Rebuild every bitmap from the database"""
+        conn = self.db.conn
+        self._data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+        self._tag_names = {row[0]: row[1] for row in conn.execute("SELECT id, name FROM tags")}
+        self._category_names = {row[0]: row[1] for row in conn.execute("SELECT id, name FROM categories")}
+
+        videos, categories, ratings, tags = [], {}, {}, {}
+        for video_id, category_id, rating in conn.execute(
+                "SELECT id, category_id, rating FROM videos WHERE deleted_at IS NULL"):
+            videos.append(video_id)
+            if category_id is not None:
+                categories.setdefault(category_id, []).append(video_id)
+            if rating is not None:
+                ratings.setdefault(rating, []).append(video_id)
+        for video_id, tag_id in conn.execute("SELECT video_id, tag_id FROM video_tags"):
+            tags.setdefault(tag_id, []).append(video_id)
+
+        self.videos = RoaringBitmap(videos)
+        self.categories = {key: RoaringBitmap(ids) for key, ids in categories.items()}
+        self.ratings = {key: RoaringBitmap(ids) for key, ids in ratings.items()}
+        self.tags = {key: RoaringBitmap(ids) & self.videos for key, ids in tags.items()}  # Minus the trash
+        logger.debug("Tag index loaded", extra={'videos': len(videos), 'tags': len(self.tags)})
+
+    def refresh(self):
+        """Reload if the index was never built or another connection has committed since"""
+        if self._data_version is None or \
+                self.db.conn.execute("PRAGMA data_version").fetchone()[0] != self._data_version:
+            self.load()
+
+    # Queries
+    def query(self, expression: Union[str, Node]) -> RoaringBitmap:
+        """Ids of the videos matching a filter expression (see parse_filter)"""
+        self.refresh()
+        node = parse_filter(expression) if isinstance(expression, str) else expression
+        return self._evaluate(node)
+
+    def facet_counts(self, matches: RoaringBitmap = None) -> Dict[str, Dict[str, int]]:
+        """
+        Matching videos per tag, category and rating (all videos if matches is None)
+
+        Every facet value with at least one video is listed, with a zero count
+        when none of the matches have it.
+        """
+        self.refresh()
+        matches = self.videos if matches is None else matches
+        return {
+            'tags': self._named_counts(self.tags, self._tag_names, matches),
+            'categories': self._named_counts(self.categories, self._category_names, matches),
+            'ratings': {str(rating): matches.intersection_count(self.ratings[rating])
+                        for rating in sorted(self.ratings)}
+        }
+
+    def _named_counts(self, bitmaps: Dict[int, RoaringBitmap], names: Dict[int, str],
+                      matches: RoaringBitmap) -> Dict[str, int]:
+        counts = {}
+        for key, bitmap in bitmaps.items():
+            if bitmap:
+                name = names.get(key, str(key))
+                counts[name] = counts.get(name, 0) + matches.intersection_count(bitmap)
+        return dict(sorted(counts.items()))
+
+    def _evaluate(self, node: Node) -> RoaringBitmap:
+        op = node[0]
+        if op == 'and':
+            return self._evaluate(node[1]) & self._evaluate(node[2])
+        if op == 'or':
+            return self._evaluate(node[1]) | self._evaluate(node[2])
+        if op == 'not':
+            return self.videos - self._evaluate(node[1])
+        return self._term(node[1], node[2])
+
+    def _term(self, field: str, value: str) -> RoaringBitmap:
+        if field == 'rating':
+            try:
+                return self.ratings.get(int(value), RoaringBitmap())
+            except ValueError:
+                raise ValueError(f"Invalid rating in filter expression: {value!r}")
+        bitmaps, names = (self.tags, self._tag_names) if field == 'tag' else (self.categories, self._category_names)
+        wanted = value.casefold()
+        keys = [key for key, name in names.items() if name.casefold() == wanted]
+        if not keys and value.isdigit():
+            keys = [int(value)]
+        result = RoaringBitmap()
+        for key in keys:
+            if key in bitmaps:
+                result = result | bitmaps[key]
+        return result
+
+    # Change events
+    def on_video_changed(self, video_id: int, **kwargs):
+        """Re-read a video's category, rating and tags"""
+        if self._data_version is None:
+            return  # Not built yet; the first query loads everything
+        self._remove(video_id)
+        row = self.db.conn.execute("SELECT category_id, rating FROM videos WHERE id = ? AND deleted_at IS NULL",
+                                   (video_id,)).fetchone()
+        if row is None:
+            return
+        self.videos.add(video_id)
+        if row[0] is not None:
+            self._category(row[0]).add(video_id)
+        if row[1] is not None:
+            self.ratings.setdefault(row[1], RoaringBitmap()).add(video_id)
+        for (tag_id,) in self.db.conn.execute("SELECT tag_id FROM video_tags WHERE video_id = ?", (video_id,)):
+            self._tag(tag_id).add(video_id)
+
+    def on_video_deleted(self, video_id: int, **kwargs):
+        if self._data_version is not None:
+            self._remove(video_id)
+
+    def on_video_tagged(self, video_id: int, tag_id: int, **kwargs):
+        if self._data_version is not None:
+            self._tag(tag_id).add(video_id)
+
+    def on_video_untagged(self, video_id: int, tag_id: int, **kwargs):
+        if self._data_version is not None and tag_id in self.tags:
+            self.tags[tag_id].discard(video_id)
+
+    def _remove(self, video_id: int):
+        self.videos.discard(video_id)
+        for bitmaps in (self.tags, self.categories, self.ratings):
+            for bitmap in bitmaps.values():
+                bitmap.discard(video_id)
+
+    def _tag(self, tag_id: int) -> RoaringBitmap:
+        if tag_id not in self._tag_names:
+            row = self.db.conn.execute("SELECT name FROM tags WHERE id = ?", (tag_id,)).fetchone()
+            self._tag_names[tag_id] = row[0] if row else str(tag_id)
+        return self.tags.setdefault(tag_id, RoaringBitmap())
+
+    def _category(self, category_id: int) -> RoaringBitmap:
+        if category_id not in self._category_names:
+            row = self.db.conn.execute("SELECT name FROM categories WHERE id = ?", (category_id,)).fetchone()
+            self._category_names[category_id] = row[0] if row else str(category_id)
+        return self.categories.setdefault(category_id, RoaringBitmap())
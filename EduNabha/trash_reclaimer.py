@@ -0,0 +1,190 @@
+"""
+Trash Reclaimer
+Purges trashed videos once their restore window has passed. Files are removed
+here instead of inside the delete request; large ones are truncated a step at
+a time under a byte-rate limit, so freeing hundreds of megabytes of extents
+does not stall other disk I/O. The rows of each batch are deleted in one
+transaction before its files are touched.
+
+Usage: python trash_reclaimer.py --db edunabha_videos.db [--retention-hours 72] [--all]
+"""
+
+import argparse
+import datetime
+import json
+import os
+import threading
+import time
+from typing import Dict
+
+from instrumentation import configure_logging, get_logger
+from prefetch_scheduler import TokenBucket
+
+
+logger = get_logger('trash_reclaimer')
+
+
+class TrashReclaimer:
+    """Deletes the files and rows of videos trashed longer than the restore window"""
+
+    def __init__(self, db, retention_hours: float = 72, bytes_per_second: float = 64 * 1024 * 1024,
+                 truncate_step: int = 16 * 1024 * 1024, batch_size: int = 50,
+                 rendition_root: str = None):
+        """
+        Args:
+            db: VideoDatabase instance
+            retention_hours: Restore window; trashed videos younger than this are kept
+            bytes_per_second: Rate at which file data is released
+            truncate_step: Bytes cut off a large file per step before it is unlinked
+            batch_size: Videos purged per transaction
+            rendition_root: Where RenditionManager keeps per-video folders, also removed
+        """
+        self.db = db
+        self.retention_hours = retention_hours
+        self.truncate_step = truncate_step
+        self.batch_size = batch_size
+        self.rendition_root = rendition_root
+        self.bucket = TokenBucket(bytes_per_second, burst_bytes=truncate_step)
+
+    def cutoff(self) -> str:
+        """deleted_at before which a video may be purged (CURRENT_TIMESTAMP is UTC)"""
+        moment = datetime.datetime.utcnow() - datetime.timedelta(hours=self.retention_hours)
+        return moment.strftime('%Y-%m-%d %H:%M:%S')
+
+    def reclaim(self, purge_all: bool = False, limit: int = None,
+                stop: threading.Event = None) -> Dict:
+        """
+        Purge trashed videos past the restore window
+
+        Args:
+            purge_all: Ignore the restore window (empty the trash)
+            limit: Maximum number of videos to purge this call
+            stop: Stops between batches when set
+
+        Returns:
+            {'purgedVideos', 'freedBytes', 'errors'}; the rows of a batch are
+            deleted before its files, so a restore racing the purge either
+            wins or finds the video gone. A file that could not be removed is
+            listed in errors and left for the integrity scanner, which
+            reports it as orphaned
+        """
+        started = time.perf_counter()
+        cutoff = None if purge_all else self.cutoff()
+        purged, freed, errors = 0, 0, []
+        while limit is None or purged < limit:
+            if stop is not None and stop.is_set():
+                break
+            size = self.batch_size if limit is None else min(self.batch_size, limit - purged)
+            batch = self.db.get_trash(older_than=cutoff, limit=size)
+            if not batch:
+                break
+            # Claim the batch: rows restored since get_trash are skipped, and the
+            # next get_trash no longer returns them. Inside a unit of work a
+            # database error raises instead of looking like an empty claim.
+            with self.db.transaction():
+                claimed = set(self.db.purge_trash([video['id'] for video in batch], older_than=cutoff))
+            if not claimed:
+                continue
+            purged += len(claimed)
+            for video in batch:
+                if video['id'] not in claimed:
+                    continue
+                try:
+                    freed += self._remove_video_files(video)
+                except OSError as e:
+                    logger.warning("Could not reclaim %s: %s", video['file_path'], e)
+                    errors.append({'videoId': str(video['id']), 'path': video['file_path'], 'error': str(e)})
+
+        if purged or errors:
+            logger.info("Reclaimed trash", extra={
+                'purged': purged, 'freed_bytes': freed, 'errors': len(errors),
+                'duration_ms': round((time.perf_counter() - started) * 1000, 1)
+            })
+        return {'purgedVideos': purged, 'freedBytes': freed, 'errors': errors}
+
+    def _remove_video_files(self, video: Dict) -> int:
+        """Remove a video's file and renditions; returns the bytes released"""
+        freed = 0
+        if video.get('file_path') and os.path.lexists(video['file_path']):
+            freed += self._remove_file(video['file_path'])
+        if self.rendition_root:
+            video_dir = os.path.join(self.rendition_root, str(video['id']))
+            if os.path.isdir(video_dir):
+                for root, dirs, files in os.walk(video_dir, topdown=False):
+                    for name in files:
+                        freed += self._remove_file(os.path.join(root, name))
+                    for name in dirs:
+                        os.rmdir(os.path.join(root, name))
+                os.rmdir(video_dir)
+        return freed
+
+    def _remove_file(self, path: str) -> int:
+        """Unlink a file, shrinking it in rate-limited steps first if it is large"""
+        size = os.lstat(path).st_size
+        if size > self.truncate_step and not os.path.islink(path):
+            with open(path, 'r+b') as f:
+                remaining = size
+                while remaining > self.truncate_step:
+                    self.bucket.consume(self.truncate_step)
+                    remaining -= self.truncate_step
+                    f.truncate(remaining)
+        self.bucket.consume(min(size, self.truncate_step))
+        os.remove(path)
+        return size
+
+
+class ReclaimerThread(threading.Thread):
+    """Runs TrashReclaimer.reclaim periodically with its own connection"""
+
+    def __init__(self, db_path: str, upload_dir: str = None, interval: float = 600, **options):
+        super().__init__(name='edunabha-trash-reclaimer', daemon=True)
+        self.db_path = db_path
+        self.upload_dir = upload_dir
+        self.interval = interval
+        self.options = options
+        self._stop_event = threading.Event()
+
+    def run(self):
+        from video_database import VideoDatabase
+        db = VideoDatabase(self.db_path)
+        rendition_root = os.path.join(self.upload_dir, 'renditions') if self.upload_dir else None
+        reclaimer = TrashReclaimer(db, rendition_root=rendition_root, **self.options)
+        try:
+            while not self._stop_event.is_set():
+                try:
+                    reclaimer.reclaim(stop=self._stop_event)
+                except Exception as e:
+                    logger.exception("Trash reclamation failed: %s", e)
+                self._stop_event.wait(self.interval)
+        finally:
+            db.close()
+
+    def stop(self, timeout: float = None):
+        self._stop_event.set()
+        self.join(timeout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Purge trashed videos past their restore window')
+    parser.add_argument('--db', default='edunabha_videos.db')
+    parser.add_argument('--upload-dir', default=None, help='To remove renditions as well')
+    parser.add_argument('--retention-hours', type=float, default=72)
+    parser.add_argument('--mb-per-second', type=float, default=64)
+    parser.add_argument('--all', action='store_true', help='Ignore the restore window')
+    args = parser.parse_args()
+    configure_logging()
+
+    from video_database import VideoDatabase
+    db = VideoDatabase(args.db)
+    try:
+        reclaimer = TrashReclaimer(
+            db, retention_hours=args.retention_hours, bytes_per_second=args.mb_per_second * 1024 * 1024,
+            rendition_root=os.path.join(args.upload_dir, 'renditions') if args.upload_dir else None
+        )
+        print(json.dumps(reclaimer.reclaim(purge_all=args.all), indent=2))
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
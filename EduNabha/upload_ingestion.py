@@ -0,0 +1,399 @@
+"""
+Resumable Upload Ingestion
+tus-style chunked uploads: chunks are appended to a temp file, offsets are
+recorded in the database and the content hash is computed as data arrives
+"""
+
+import base64
+import binascii
+import datetime
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import uuid
+from typing import Dict
+
+
+class UploadError(Exception):
+    """Upload protocol error; status_code follows the tus HTTP conventions"""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class ResumableUploadService:
+    """Chunked, resumable video ingestion for EduNabhaVideoIntegration"""
+
+    COPY_BUFFER_SIZE = 1024 * 1024  # 1MB
+    SPOOL_MEMORY_SIZE = 8 * 1024 * 1024  # Larger network chunks are spooled to disk
+
+    def __init__(self, integration, temp_dir: str = None):
+        """
+        Args:
+            integration: EduNabhaVideoIntegration the finished uploads are registered with
+            temp_dir: Where partial files live; defaults to a hidden folder inside the
+                upload directory so the final rename stays on one filesystem
+        """
+        self.integration = integration
+        self.db = integration.db
+        self.temp_dir = temp_dir or os.path.join(integration.upload_dir, '.partial')
+        os.makedirs(self.temp_dir, exist_ok=True)
+        # Running hash per upload: {upload_id: (hasher, hashed_offset)}
+        self._hashers = {}
+
+    def create_upload(self, file_name: str, upload_length: int, metadata: dict = None,
+                      checksum: str = None) -> Dict:
+        """
+        Start a new upload session
+
+        Args:
+            file_name: Original file name
+            upload_length: Total size in bytes
+            metadata: Video data for add_downloaded_video (title, course, ...)
+            checksum: Optional whole-file checksum, e.g. 'sha256 <hex or base64>'
+
+        Returns:
+            Upload status
+        """
+        if upload_length is None or int(upload_length) < 0:
+            raise UploadError("Upload length must be a non-negative integer")
+
+        algorithm, expected = self._parse_checksum(checksum) if checksum else ('sha256', None)
+        upload_id = uuid.uuid4().hex
+        temp_path = os.path.join(self.temp_dir, f"{upload_id}.part")
+        open(temp_path, 'wb').close()
+
+        with self.db.transaction():
+            self.db.conn.execute(
+                """INSERT INTO upload_sessions (id, file_name, upload_length, temp_path,
+                                                checksum_algorithm, expected_checksum, metadata)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                (upload_id, os.path.basename(file_name), int(upload_length), temp_path,
+                 algorithm, expected, json.dumps(metadata or {}))
+            )
+        self._hashers[upload_id] = (hashlib.new(algorithm), 0)
+
+        if int(upload_length) == 0:
+            return self._complete_upload(self._get_session(upload_id))
+        return self.get_status(upload_id)
+
+    def get_status(self, upload_id: str) -> Dict:
+        """Current offset and state of an upload (the tus HEAD request)"""
+        return self._format_status(self._get_session(upload_id))
+
+    def append_chunk(self, upload_id: str, offset: int, data, checksum: str = None) -> Dict:
+        """
+        Append a chunk at the given offset
+
+        Args:
+            upload_id: Upload session ID
+            offset: Byte offset the client believes it is writing at
+            data: bytes or a readable binary file object
+            checksum: Optional per-chunk checksum ('sha256 <hex or base64>')
+
+        Returns:
+            Upload status; includes the registered video once the upload completes
+        """
+        session = self._get_session(upload_id)
+        if session['status'] == 'finalizing' and int(offset) == session['upload_length']:
+            return self._complete_upload(session)  # Retry of a completion cut short after the rename
+        self._check_offset(session, offset)  # Refuse early, before reading the body
+        chunk_algorithm, chunk_expected = self._parse_checksum(checksum) if checksum else (None, None)
+        spool = None
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            stream = _BytesReader(data)
+        elif hasattr(data, 'fileno'):
+            stream = data  # A local file (e.g. the wrapper's chunkPath) is read while holding the lock
+        else:
+            # Received into a spool first so a slow client does not hold the write lock
+            stream = spool = self._spool(data)
+
+        try:
+            # The write lock serializes appends to one upload across threads and processes
+            with self.db.transaction():
+                session = self._get_session(upload_id)
+                self._check_offset(session, offset)
+                new_offset, file_hasher = self._write_chunk(session, stream, chunk_algorithm, chunk_expected)
+                self.db.conn.execute(
+                    """UPDATE upload_sessions SET upload_offset = ?, updated_at = CURRENT_TIMESTAMP
+                       WHERE id = ?""",
+                    (new_offset, upload_id)
+                )
+        finally:
+            if spool is not None:
+                spool.close()
+        if file_hasher is not None:
+            self._hashers[upload_id] = (file_hasher, new_offset)
+        else:
+            self._hashers.pop(upload_id, None)
+
+        session = self._get_session(upload_id)
+        if new_offset == session['upload_length']:
+            return self._complete_upload(session)
+        return self._format_status(session)
+
+    def abort_upload(self, upload_id: str) -> Dict:
+        """Abort an upload and remove its partial file"""
+        session = self._get_session(upload_id)
+        if session['status'] == 'active':
+            self._remove_temp(session['temp_path'])
+            self._set_status(upload_id, 'aborted')
+        self._hashers.pop(upload_id, None)
+        return self.get_status(upload_id)
+
+    def cleanup_stale_uploads(self, max_age_hours: int = 24) -> int:
+        """
+        Abort active uploads that have not received data recently, and finish
+        the ones whose completion was interrupted
+
+        Returns:
+            Number of uploads aborted
+        """
+        cutoff = (datetime.datetime.utcnow() - datetime.timedelta(hours=max_age_hours))
+        cursor = self.db.conn.execute(
+            "SELECT * FROM upload_sessions WHERE status IN ('active', 'finalizing') AND updated_at < ?",
+            (cutoff.strftime('%Y-%m-%d %H:%M:%S'),)
+        )
+        aborted = 0
+        for session in [dict(row) for row in cursor.fetchall()]:
+            if session['status'] == 'active':
+                self.abort_upload(session['id'])
+                aborted += 1
+                continue
+            try:
+                self._complete_upload(session)
+            except UploadError:
+                pass  # Left finalizing (or marked failed) with the reason in the session
+        return aborted
+
+    # Internal helpers
+    def _get_session(self, upload_id: str) -> Dict:
+        cursor = self.db.conn.execute("SELECT * FROM upload_sessions WHERE id = ?", (upload_id,))
+        row = cursor.fetchone()
+        if not row:
+            raise UploadError(f"Upload {upload_id} not found", 404)
+        return dict(row)
+
+    @staticmethod
+    def _check_offset(session: Dict, offset: int):
+        if session['status'] != 'active':
+            raise UploadError(f"Upload {session['id']} is {session['status']}", 410)
+        if int(offset) != session['upload_offset']:
+            raise UploadError(
+                f"Offset mismatch: expected {session['upload_offset']}, got {offset}", 409
+            )
+
+    def _spool(self, stream):
+        spool = tempfile.SpooledTemporaryFile(max_size=self.SPOOL_MEMORY_SIZE, dir=self.temp_dir)
+        try:
+            shutil.copyfileobj(stream, spool, self.COPY_BUFFER_SIZE)
+            spool.seek(0)
+        except BaseException:
+            spool.close()
+            raise
+        return spool
+
+    def _write_chunk(self, session: Dict, stream, chunk_algorithm: str, chunk_expected: str) -> tuple:
+        """
+        Append a chunk to the partial file at the session's offset
+
+        Returns:
+            (new offset, running file hash or None when this process has none)
+        """
+        chunk_hasher = hashlib.new(chunk_algorithm) if chunk_algorithm else None
+        file_hasher = self._running_hasher(session)
+        start = session['upload_offset']
+        remaining = session['upload_length'] - start
+        written = 0
+        with open(session['temp_path'], 'r+b') as fh:
+            fh.seek(start)
+            fh.truncate()
+            while True:
+                block = stream.read(self.COPY_BUFFER_SIZE)
+                if not block:
+                    break
+                if written + len(block) > remaining:
+                    fh.truncate(start)
+                    raise UploadError("Chunk exceeds the declared upload length", 413)
+                fh.write(block)
+                if file_hasher:
+                    file_hasher.update(block)
+                if chunk_hasher:
+                    chunk_hasher.update(block)
+                written += len(block)
+
+            if chunk_hasher and chunk_hasher.hexdigest() != chunk_expected:
+                fh.truncate(start)
+                raise UploadError("Chunk checksum mismatch", 460)
+
+            fh.flush()
+            os.fsync(fh.fileno())
+        return start + written, file_hasher
+
+    def _running_hasher(self, session: Dict):
+        """
+        Copy of this process's running hash at the session's offset, or None
+
+        A hash object cannot be stored, so a process that did not receive the
+        earlier chunks (e.g. each one-shot wrapper call) does not re-read them
+        per chunk; _complete_upload hashes the whole file once instead. The
+        API server keeps the running hash, so completing there costs nothing.
+        """
+        if session['upload_offset'] == 0:
+            return hashlib.new(session['checksum_algorithm'] or 'sha256')
+        hasher, hashed_offset = self._hashers.get(session['id'], (None, -1))
+        if hasher is not None and hashed_offset == session['upload_offset']:
+            return hasher.copy()
+        return None
+
+    def _hasher_for(self, session: Dict):
+        """
+        Running hash for a session. Without one in this process (see
+        _running_hasher) the bytes already received are hashed once.
+        """
+        upload_id = session['id']
+        hasher, hashed_offset = self._hashers.get(upload_id, (None, -1))
+        if hasher is not None and hashed_offset == session['upload_offset']:
+            return hasher
+
+        hasher = hashlib.new(session['checksum_algorithm'] or 'sha256')
+        remaining = session['upload_offset']
+        with open(session['temp_path'], 'rb') as fh:
+            while remaining > 0:
+                block = fh.read(min(self.COPY_BUFFER_SIZE, remaining))
+                if not block:
+                    raise UploadError(f"Partial file for upload {upload_id} is truncated", 500)
+                hasher.update(block)
+                remaining -= len(block)
+        self._hashers[upload_id] = (hasher, session['upload_offset'])
+        return hasher
+
+    def _complete_upload(self, session: Dict) -> Dict:
+        """
+        Verify the digest, move the file into place and register the video
+
+        The final path is recorded (status 'finalizing') before the rename, so
+        a completion interrupted by a crash or a failed registration is
+        finished by the next call instead of leaving the file unregistered.
+        """
+        upload_id = session['id']
+        if session['status'] == 'active':
+            digest = self._hasher_for(session).hexdigest()
+            if session['expected_checksum'] and digest != session['expected_checksum']:
+                self._remove_temp(session['temp_path'])
+                self._set_status(upload_id, 'failed', final_checksum=digest)
+                raise UploadError("Upload checksum mismatch", 460)
+
+            final_path = os.path.join(
+                self.integration.upload_dir,
+                f"{int(datetime.datetime.now().timestamp() * 1000)}-{session['file_name']}"
+            )
+            self._set_status(upload_id, 'finalizing', final_checksum=digest, final_path=final_path)
+            self._hashers.pop(upload_id, None)
+            session = self._get_session(upload_id)
+
+        final_path = session['final_path']
+        if os.path.exists(session['temp_path']):
+            os.replace(session['temp_path'], final_path)
+            self._fsync_directory(self.integration.upload_dir)
+        elif not os.path.exists(final_path):
+            self._set_status(upload_id, 'failed')
+            raise UploadError(f"File for upload {upload_id} is missing", 500)
+
+        video = self._register_video(session)
+        if not video.get('id'):
+            raise UploadError(f"Could not register the video for upload {upload_id}", 500)
+        self._set_status(upload_id, 'completed', video_id=int(video['id']))
+
+        status = self.get_status(upload_id)
+        status['video'] = video
+        return status
+
+    def _register_video(self, session: Dict) -> Dict:
+        """Add the finished file to the catalog, or return it if an earlier attempt already did"""
+        row = self.db.conn.execute(
+            "SELECT id FROM videos WHERE file_path = ? AND deleted_at IS NULL", (session['final_path'],)
+        ).fetchone()
+        if row:
+            return self.integration.format_for_react(self.db.get_video(row['id']))
+
+        video_data = json.loads(session['metadata'] or '{}')
+        video_data.setdefault('title', os.path.splitext(session['file_name'])[0])
+        video_data['filePath'] = session['final_path']
+        video_data['fileSize'] = session['upload_length']
+        return self.integration.add_downloaded_video(video_data) or {}
+
+    def _set_status(self, upload_id: str, status: str, **fields):
+        assignments = ["status = ?", "updated_at = CURRENT_TIMESTAMP"]
+        values = [status]
+        for field, value in fields.items():
+            assignments.append(f"{field} = ?")
+            values.append(value)
+        values.append(upload_id)
+        with self.db.transaction():
+            self.db.conn.execute(
+                f"UPDATE upload_sessions SET {', '.join(assignments)} WHERE id = ?", values
+            )
+
+    @staticmethod
+    def _format_status(session: Dict) -> Dict:
+        return {
+            'uploadId': session['id'],
+            'fileName': session['file_name'],
+            'offset': session['upload_offset'],
+            'length': session['upload_length'],
+            'status': session['status'],
+            'checksum': session['final_checksum'],
+            'videoId': session['video_id']
+        }
+
+    @staticmethod
+    def _parse_checksum(value: str) -> tuple:
+        """Parse 'sha256 <hex|base64>' (tus Upload-Checksum style) into (algorithm, hex)"""
+        parts = re.split(r'[\s:]+', value.strip(), maxsplit=1)
+        algorithm, encoded = (parts[0].lower(), parts[1]) if len(parts) == 2 else ('sha256', parts[0])
+        if algorithm not in hashlib.algorithms_guaranteed:
+            raise UploadError(f"Unsupported checksum algorithm: {algorithm}", 400)
+
+        digest_size = hashlib.new(algorithm).digest_size
+        if re.fullmatch(r'[0-9a-fA-F]+', encoded) and len(encoded) == digest_size * 2:
+            return algorithm, encoded.lower()
+        try:
+            return algorithm, base64.b64decode(encoded, validate=True).hex()
+        except (binascii.Error, ValueError):
+            raise UploadError("Checksum must be hex or base64 encoded", 400)
+
+    @staticmethod
+    def _remove_temp(temp_path: str):
+        try:
+            os.remove(temp_path)
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def _fsync_directory(path: str):
+        """Persist the rename itself (not supported on Windows)"""
+        if not hasattr(os, 'O_DIRECTORY'):
+            return
+        fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+class _BytesReader:
+    """Minimal file-like reader over an in-memory chunk"""
+
+    def __init__(self, data):
+        self._view = memoryview(data)
+        self._pos = 0
+
+    def read(self, size: int) -> bytes:
+        block = self._view[self._pos:self._pos + size].tobytes()
+        self._pos += len(block)
+        return block
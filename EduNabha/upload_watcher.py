@@ -0,0 +1,495 @@
+"""
+Upload Watcher
+Catalogues video files that appear in the upload directory by other means
+(USB copies, rsync) without anyone calling add_downloaded_video. Changes come
+from inotify on Linux and from polling directory mtimes elsewhere; files are
+ingested once they stop changing, in batches, and the directory checkpoint is
+persisted so a restart only lists directories that changed.
+
+Usage: python upload_watcher.py --db edunabha_videos.db --upload-dir <dir>
+"""
+
+import argparse
+import os
+import re
+import select
+import shutil
+import struct
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Set, Tuple
+
+from instrumentation import configure_logging, get_logger
+from integrity_scanner import SKIP_DIRS, normalize_path
+
+
+logger = get_logger('upload_watcher')
+
+VIDEO_EXTENSIONS = {'.mp4', '.m4v', '.mkv', '.webm', '.mov', '.avi', '.wmv', '.flv'}
+TEMP_SUFFIXES = ('.part', '.partial', '.tmp', '.crdownload', '.download', '~')
+
+# inotify(7) event bits
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+_EVENT = struct.Struct('iIII')
+
+
+def is_candidate(name: str) -> bool:
+    """Video files only; hidden names (rsync temp files) and partial downloads are skipped"""
+    lower = name.lower()
+    if name.startswith('.') or lower.endswith(TEMP_SUFFIXES):
+        return False
+    return os.path.splitext(lower)[1] in VIDEO_EXTENSIONS
+
+
+class InotifyBackend:
+    """Directory change notifications from Linux inotify, through ctypes"""
+
+    @staticmethod
+    def available() -> bool:
+        return sys.platform.startswith('linux')
+
+    def __init__(self):
+        import ctypes
+        import ctypes.util
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._get_errno = ctypes.get_errno
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | getattr(os, 'O_CLOEXEC', 0))
+        if self.fd < 0:
+            error = self._get_errno()
+            raise OSError(error, os.strerror(error))
+        self._directories = {}  # watch descriptor -> directory
+        self._watches = {}  # directory -> watch descriptor
+
+    def watch(self, directory: str):
+        if directory in self._watches:
+            return
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            logger.warning("Could not watch %s: %s", directory, os.strerror(self._get_errno()))
+            return
+        self._directories[wd] = directory
+        self._watches[directory] = wd
+
+    def read(self, timeout: float) -> Optional[List[Tuple[str, str, int]]]:
+        """
+        (directory, name, mask) events, waiting up to timeout seconds
+
+        Returns None when the kernel queue overflowed and events were lost.
+        """
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events, offset = [], 0
+        while offset + _EVENT.size <= len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            name = data[offset + _EVENT.size:offset + _EVENT.size + length].rstrip(b'\0')
+            offset += _EVENT.size + length
+            if mask & IN_Q_OVERFLOW:
+                return None
+            if mask & IN_IGNORED:
+                self._watches.pop(self._directories.pop(wd, None), None)
+                continue
+            if wd in self._directories:
+                events.append((self._directories[wd], os.fsdecode(name), mask))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class UploadWatcher:
+    """Incremental ingestion of files dropped into EduNabhaVideoIntegration.upload_dir"""
+
+    def __init__(self, integration, settle_seconds: float = 5.0, batch_size: int = 20,
+                 batch_window: float = 10.0, poll_interval: float = 2.0,
+                 rescan_interval: float = 300.0, backend: str = 'auto', probe_workers: int = 4):
+        """
+        Args:
+            integration: EduNabhaVideoIntegration the files are added to; the
+                watcher must run on the thread that created it
+            settle_seconds: A file is ingested once its size and mtime have not
+                changed for this long (it may still be being copied before)
+            batch_size: Settled files ingested together
+            batch_window: Longest a settled file waits for its batch to fill up
+            poll_interval: Seconds between checks (and the inotify wait)
+            rescan_interval: With inotify, directories are still re-stat'ed this
+                often in case events were missed
+            backend: 'inotify', 'poll' or 'auto' (inotify where available)
+            probe_workers: Parallel ffprobe runs per batch
+        """
+        self.integration = integration
+        self.db = integration.db
+        self.upload_dir = integration.upload_dir
+        self.settle_seconds = settle_seconds
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.poll_interval = poll_interval
+        self.rescan_interval = rescan_interval
+        self.probe_workers = probe_workers
+        self.backend = None
+        if backend == 'inotify' or (backend == 'auto' and InotifyBackend.available()):
+            try:
+                self.backend = InotifyBackend()
+            except OSError as e:
+                if backend == 'inotify':
+                    raise
+                logger.warning("inotify unavailable (%s), polling instead", e)
+        self.skip = {normalize_path(os.path.join(self.upload_dir, name)) for name in SKIP_DIRS}
+
+        self._directories = {}  # normalized directory -> mtime_ns when last listed
+        self._paths = {}  # normalized directory -> path as found on disk
+        self._saved = {}  # normalized directory -> mtime_ns in watched_directories
+        self._unsaved = set()  # Directories whose checkpoint row may be out of date
+        self._pending = {}  # path -> (size, mtime_ns, last change)
+        self._batch = []  # Settled paths waiting to be ingested
+        self._batch_started = None
+        self._failed = set()
+        self._catalogued = set()
+        self._last_rescan = 0.0
+        self._started = False
+
+    # Lifecycle
+    def start(self):
+        """Load the checkpoint and catch up with changes made while not running"""
+        if self._started:
+            return
+        self._started = True
+        self._catalogued = {normalize_path(row[0]) for row in
+                            self.db.conn.execute("SELECT file_path FROM videos WHERE file_path != ''")}
+        self._directories = {row[0]: row[1] for row in
+                             self.db.conn.execute("SELECT path, mtime_ns FROM watched_directories")}
+        self._saved = dict(self._directories)
+        self._paths = {key: key for key in self._directories}
+        root = normalize_path(self.upload_dir)
+        if root not in self._directories and os.path.isdir(self.upload_dir):
+            self._directories[root] = 0
+            self._paths[root] = self.upload_dir
+        if self.backend:
+            for key in list(self._directories):
+                self.backend.watch(self._paths[key])
+        self._rescan()
+        logger.info("Watching %s", self.upload_dir, extra={
+            'directories': len(self._directories), 'backend': 'inotify' if self.backend else 'poll'
+        })
+
+    def run(self, stop: threading.Event = None):
+        """Watch until stop is set"""
+        stop = stop or threading.Event()
+        self.start()
+        try:
+            while not stop.is_set():
+                self.poll(stop)
+        finally:
+            self.flush()
+            self.close()
+
+    def close(self):
+        if self.backend:
+            self.backend.close()
+            self.backend = None
+
+    def poll(self, stop: threading.Event = None) -> int:
+        """
+        One round: collect changes, settle pending files and ingest a full or
+        overdue batch
+
+        Returns:
+            Number of videos ingested this round
+        """
+        self.start()
+        if self.backend:
+            events = self.backend.read(self.poll_interval)
+            if events is None:
+                logger.warning("inotify queue overflowed; rescanning")
+                self._rescan()
+            else:
+                self._apply_events(events)
+            if time.monotonic() - self._last_rescan >= self.rescan_interval:
+                self._rescan()
+        else:
+            if stop is not None:
+                stop.wait(self.poll_interval)
+            else:
+                time.sleep(self.poll_interval)
+            self._rescan()
+
+        self._settle()
+        ingested = 0
+        if self._batch and (len(self._batch) >= self.batch_size or
+                            time.monotonic() - self._batch_started >= self.batch_window):
+            ingested = self.flush()
+        self._checkpoint()
+        return ingested
+
+    def catch_up(self) -> int:
+        """Ingest everything that changed while not running and has already settled"""
+        self.start()
+        self._settle()
+        return self.flush()
+
+    def flush(self) -> int:
+        """Ingest every settled file now"""
+        ingested = 0
+        while self._batch:
+            batch, self._batch = self._batch[:self.batch_size], self._batch[self.batch_size:]
+            ingested += self._ingest(batch)
+        self._batch_started = None
+        self._checkpoint()
+        return ingested
+
+    # Change detection
+    def _rescan(self):
+        """Re-stat every known directory and list those whose mtime moved"""
+        self._last_rescan = time.monotonic()
+        changed = []
+        for key in list(self._directories):
+            try:
+                mtime_ns = os.stat(self._paths[key]).st_mtime_ns
+            except OSError:
+                self._forget_directory(key)
+                continue
+            if mtime_ns != self._directories[key]:
+                changed.append(key)
+        for key in changed:
+            self._list(key)
+
+    def _apply_events(self, events: List[Tuple[str, str, int]]):
+        listed = set()
+        for directory, name, mask in events:
+            key = normalize_path(directory)
+            path = os.path.join(directory, name)
+            if mask & IN_ISDIR or (mask & (IN_CREATE | IN_MOVED_TO) and path not in self._pending):
+                if key not in listed:
+                    listed.add(key)
+                    self._list(key)
+            elif path in self._pending:
+                self._pending[path] = self._pending[path][:2] + (time.monotonic(),)
+
+    def _list(self, key: str):
+        """List one directory: note new subdirectories and new candidate files"""
+        directory = self._paths.get(key, key)
+        try:
+            mtime_ns = os.stat(directory).st_mtime_ns
+            with os.scandir(directory) as iterator:
+                entries = list(iterator)
+        except OSError:
+            self._forget_directory(key)
+            return
+        self._directories[key] = mtime_ns
+        self._unsaved.add(key)
+        now = time.monotonic()
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    child = normalize_path(entry.path)
+                    if child not in self._directories and child not in self.skip and not entry.name.startswith('.'):
+                        self._directories[child] = 0
+                        self._paths[child] = entry.path
+                        if self.backend:
+                            self.backend.watch(entry.path)
+                        self._list(child)
+                elif entry.is_file() and is_candidate(entry.name):
+                    normalized = normalize_path(entry.path)
+                    if normalized in self._catalogued or entry.path in self._pending \
+                            or entry.path in self._batch or entry.path in self._failed:
+                        continue
+                    info = entry.stat()
+                    # A file last written long ago (found on restart) needs no settling wait
+                    age = max(0.0, time.time() - info.st_mtime_ns / 1e9)
+                    self._pending[entry.path] = (info.st_size, info.st_mtime_ns, now - age)
+            except OSError:
+                continue
+
+    def _settle(self):
+        """Move files that stopped changing from pending to the batch"""
+        now = time.monotonic()
+        for path, (size, mtime_ns, changed_at) in list(self._pending.items()):
+            try:
+                info = os.stat(path)
+            except OSError:
+                del self._pending[path]  # Moved away or deleted before it settled
+                self._unsaved.add(normalize_path(os.path.dirname(path)))
+                continue
+            if (info.st_size, info.st_mtime_ns) != (size, mtime_ns):
+                self._pending[path] = (info.st_size, info.st_mtime_ns, now)
+            elif now - changed_at >= self.settle_seconds and info.st_size > 0:
+                del self._pending[path]
+                if not self._batch:
+                    self._batch_started = now
+                self._batch.append(path)
+
+    def _forget_directory(self, key: str):
+        self._directories.pop(key, None)
+        self._paths.pop(key, None)
+        self._unsaved.add(key)
+
+    # Ingestion
+    def _ingest(self, paths: List[str]) -> int:
+        started = time.perf_counter()
+        # Something else (an upload, the dashboard) may have registered a file meanwhile
+        placeholders = ','.join('?' * len(paths))
+        known = {normalize_path(row[0]) for row in self.db.conn.execute(
+            f"SELECT file_path FROM videos WHERE file_path IN ({placeholders})", paths
+        )}
+        paths = [path for path in paths if normalize_path(path) not in known]
+        self._catalogued.update(known)
+        if shutil.which('ffprobe') and paths:
+            from video_renditions import probe_video
+            with ThreadPoolExecutor(self.probe_workers, thread_name_prefix='edunabha-probe') as executor:
+                probes = list(executor.map(probe_video, paths))
+        else:
+            probes = [{} for _ in paths]
+
+        ingested = 0
+        for path, probe in zip(paths, probes):
+            try:
+                self.integration.add_downloaded_video(self.describe(path, probe))
+                self._catalogued.add(normalize_path(path))
+                ingested += 1
+            except Exception as e:
+                logger.exception("Could not ingest %s: %s", path, e)
+                self._failed.add(path)
+            self._unsaved.add(normalize_path(os.path.dirname(path)))
+        if paths:
+            logger.info("Ingested %d new videos", ingested, extra={
+                'count': ingested, 'failed': len(paths) - ingested,
+                'duration_ms': round((time.perf_counter() - started) * 1000, 1)
+            })
+        return ingested
+
+    def describe(self, path: str, probe: Dict = None) -> Dict:
+        """
+        Video data for add_downloaded_video, from the file's place in the tree
+
+        <upload_dir>/<course>/<module...>/<file>: the first folder is the course
+        and the folders below it the module, which also feed category detection
+        """
+        probe = probe or {}
+        relative = os.path.relpath(path, self.upload_dir)
+        parts = relative.split(os.sep)
+        stem = os.path.splitext(parts[-1])[0]
+        match = re.search(r'(?<!\d)(2160|1440|1080|720|480|360|240)p\b', stem, re.IGNORECASE)
+        resolution = probe.get('resolution') or (f"{match.group(1)}p" if match else 'HD')
+        if match:
+            stem = stem[:match.start()] + stem[match.end():]
+        title = re.sub(r'[_.\s]+|\s+-\s+', ' ', stem).strip(' -') or parts[-1]
+        return {
+            'title': title,
+            'course': {'title': parts[0] if len(parts) > 1 else 'Unknown Course'},
+            'module': ' / '.join(parts[1:-1]),
+            'filePath': path,
+            'fileSize': os.path.getsize(path),
+            'duration': probe.get('duration', 0),
+            'quality': resolution
+        }
+
+    # Checkpoint
+    def _checkpoint(self):
+        """Persist listed directories; one with unresolved files is saved as never listed"""
+        if not self._unsaved:
+            return
+        waiting = {normalize_path(os.path.dirname(path))
+                   for path in list(self._pending) + self._batch + list(self._failed)}
+        rows, removed = [], []
+        for key in self._unsaved:
+            if key in self._directories:
+                mtime_ns = 0 if key in waiting else self._directories[key]
+                if self._saved.get(key) != mtime_ns:
+                    rows.append((key, mtime_ns))
+            elif key in self._saved:
+                removed.append((key,))
+        if not rows and not removed:
+            self._unsaved = {key for key in self._unsaved if key in waiting}
+            return
+        conn = self.db.conn
+        with self.db.transaction():
+            conn.executemany(
+                """INSERT INTO watched_directories (path, mtime_ns, scanned_at)
+                   VALUES (?, ?, CURRENT_TIMESTAMP)
+                   ON CONFLICT (path) DO UPDATE SET
+                       mtime_ns = excluded.mtime_ns, scanned_at = excluded.scanned_at""",
+                rows
+            )
+            conn.executemany("DELETE FROM watched_directories WHERE path = ?", removed)
+        self._saved.update(rows)
+        for (key,) in removed:
+            del self._saved[key]
+        self._unsaved = {key for key in self._unsaved if key in waiting}
+
+    def status(self) -> Dict:
+        return {
+            'backend': 'inotify' if self.backend else 'poll',
+            'directories': len(self._directories),
+            'pending': len(self._pending),
+            'batched': len(self._batch),
+            'failed': sorted(self._failed)
+        }
+
+
+class WatcherThread(threading.Thread):
+    """Runs an UploadWatcher with its own integration (and connection) in the background"""
+
+    def __init__(self, db_path: str, upload_dir: str = None, **options):
+        super().__init__(name='edunabha-upload-watcher', daemon=True)
+        self.db_path = db_path
+        self.upload_dir = upload_dir
+        self.options = options
+        self._stop_event = threading.Event()
+
+    def run(self):
+        from video_database_integration import EduNabhaVideoIntegration
+        integration = EduNabhaVideoIntegration(self.db_path, self.upload_dir)
+        try:
+            UploadWatcher(integration, **self.options).run(self._stop_event)
+        except Exception as e:
+            logger.exception("Upload watcher stopped: %s", e)
+        finally:
+            integration.close()
+
+    def stop(self, timeout: float = None):
+        self._stop_event.set()
+        self.join(timeout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Catalogue videos copied into the upload directory')
+    parser.add_argument('--db', default='edunabha_videos.db')
+    parser.add_argument('--upload-dir', default=None)
+    parser.add_argument('--backend', choices=['auto', 'inotify', 'poll'], default='auto')
+    parser.add_argument('--settle', type=float, default=5.0, help='Seconds a file must stay unchanged')
+    parser.add_argument('--batch-size', type=int, default=20)
+    parser.add_argument('--once', action='store_true', help='Catch up, ingest what has settled and exit')
+    args = parser.parse_args()
+    configure_logging()
+
+    from video_database_integration import EduNabhaVideoIntegration
+    integration = EduNabhaVideoIntegration(args.db, args.upload_dir)
+    watcher = UploadWatcher(integration, settle_seconds=args.settle, batch_size=args.batch_size,
+                            backend='poll' if args.once else args.backend)
+    try:
+        if args.once:
+            watcher.catch_up()
+        else:
+            watcher.run()
+    except KeyboardInterrupt:
+        logger.info("Shutting down")
+    finally:
+        watcher.close()
+        integration.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,406 @@
+"""
+Video Analytics
+Teacher and district reports (engagement curves, completion funnels, watch time
+distributions, cohort retention) computed from columnar snapshots of the videos
+and watch history, memory-mapped from a cache file
+"""
+
+import array
+import bisect
+import datetime
+import json
+import mmap
+import os
+import struct
+from typing import Dict, List, Optional
+
+try:
+    import numpy as np
+except ImportError:  # Pure-Python group-bys are used instead
+    np = None
+
+from instrumentation import get_logger
+
+
+logger = get_logger('video_analytics')
+
+
+EPOCH = datetime.date(1970, 1, 1)
+CACHE_MAGIC = b'EDNACOL1'
+WATCH_TIME_BUCKETS = [0, 5, 10, 20, 30, 45, 60]  # Minutes; last bucket is open-ended
+
+
+def course_from_description(description: str) -> str:
+    """Course name stored by add_downloaded_video ('Course: X | ...')"""
+    for part in (description or '').split(' | '):
+        if part.startswith('Course: '):
+            return part[len('Course: '):]
+    return 'Unknown Course'
+
+
+def week_start(week: int) -> str:
+    """ISO date of the Monday starting a week index (weeks since 1970-01-05)"""
+    return (EPOCH + datetime.timedelta(days=week * 7 - 3)).isoformat()
+
+
+class ColumnarSnapshot:
+    """Column arrays of videos and watch events, with dictionary-encoded courses and students"""
+
+    VIDEO_COLUMNS = [('video_id', 'q'), ('course', 'i'), ('duration', 'q')]
+    EVENT_COLUMNS = [('video', 'i'), ('student', 'i'), ('day', 'i'),
+                     ('watch_seconds', 'q'), ('completed', 'b')]
+
+    def __init__(self, columns: Dict, courses: List[str], students: List[str], signature: List):
+        self.columns = columns
+        self.courses = courses
+        self.students = students
+        self.signature = signature
+        self._mmap = None
+
+    @property
+    def video_count(self) -> int:
+        return len(self.columns['video_id'])
+
+    @property
+    def event_count(self) -> int:
+        return len(self.columns['video'])
+
+    @staticmethod
+    def source_signature(db) -> List:
+        """Cheap fingerprint of the source tables used to invalidate the cache"""
+        events = db.conn.execute("SELECT COUNT(*), COALESCE(MAX(id), 0) FROM watch_events").fetchone()
+        videos = db.conn.execute(
+            "SELECT COUNT(*), COALESCE(MAX(id), 0), COALESCE(SUM(LENGTH(description)), 0) FROM videos "
+            "WHERE deleted_at IS NULL"
+        ).fetchone()
+        return [events[0], events[1], videos[0], videos[1], videos[2]]
+
+    @classmethod
+    def build(cls, db) -> 'ColumnarSnapshot':
+        """Read the tables into typed arrays in a single pass each"""
+        columns = {name: array.array(code) for name, code in cls.VIDEO_COLUMNS + cls.EVENT_COLUMNS}
+        courses, course_codes = [], {}
+        video_index = {}
+        for row in db.conn.execute("SELECT id, description, duration FROM videos WHERE deleted_at IS NULL ORDER BY id"):
+            course = course_from_description(row['description'])
+            if course not in course_codes:
+                course_codes[course] = len(courses)
+                courses.append(course)
+            video_index[row['id']] = len(columns['video_id'])
+            columns['video_id'].append(row['id'])
+            columns['course'].append(course_codes[course])
+            columns['duration'].append(row['duration'] or 0)
+
+        students, student_codes = [], {}
+        cursor = db.conn.execute("""
+            SELECT video_id, student_id, watch_seconds, event_type,
+                   CAST(julianday(created_at) - 2440587.5 AS INTEGER) AS day
+            FROM watch_events ORDER BY id
+        """)
+        for row in cursor:
+            index = video_index.get(row['video_id'])
+            if index is None:
+                continue  # Event for a deleted video
+            student = row['student_id']
+            if student not in student_codes:
+                student_codes[student] = len(students)
+                students.append(student)
+            columns['video'].append(index)
+            columns['student'].append(student_codes[student])
+            columns['day'].append(row['day'])
+            columns['watch_seconds'].append(row['watch_seconds'] or 0)
+            columns['completed'].append(1 if row['event_type'] == 'completed' else 0)
+
+        return cls(columns, courses, students, cls.source_signature(db))
+
+    def save(self, path: str):
+        """Write the snapshot as an 8-byte aligned columnar file"""
+        layout, offset = {}, 0
+        for name, code in self.VIDEO_COLUMNS + self.EVENT_COLUMNS:
+            size = len(self.columns[name]) * self.columns[name].itemsize
+            layout[name] = [code, offset, len(self.columns[name])]
+            offset += (size + 7) // 8 * 8
+        header = json.dumps({
+            'layout': layout, 'courses': self.courses,
+            'students': self.students, 'signature': self.signature
+        }).encode('utf-8')
+        header += b' ' * (-(len(CACHE_MAGIC) + 8 + len(header)) % 8)
+
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(CACHE_MAGIC + struct.pack('<Q', len(header)) + header)
+            for name, _ in self.VIDEO_COLUMNS + self.EVENT_COLUMNS:
+                data = self.columns[name].tobytes()
+                f.write(data + b'\0' * (-len(data) % 8))
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional['ColumnarSnapshot']:
+        """Memory-map a cache file; columns are zero-copy views into the mapping"""
+        with open(path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if mapped[:len(CACHE_MAGIC)] != CACHE_MAGIC:
+            mapped.close()
+            return None
+        header_length = struct.unpack_from('<Q', mapped, len(CACHE_MAGIC))[0]
+        data_start = len(CACHE_MAGIC) + 8 + header_length
+        header = json.loads(mapped[len(CACHE_MAGIC) + 8:data_start].decode('utf-8'))
+
+        view = memoryview(mapped)
+        columns = {}
+        for name, (code, offset, length) in header['layout'].items():
+            itemsize = array.array(code).itemsize
+            start = data_start + offset
+            columns[name] = view[start:start + length * itemsize].cast(code)
+        snapshot = cls(columns, header['courses'], header['students'], header['signature'])
+        snapshot._mmap = mapped
+        return snapshot
+
+    def close(self):
+        if self._mmap is not None:
+            self.columns = {}
+            try:
+                self._mmap.close()
+            except BufferError:
+                pass  # A caller still holds a column view; the mapping closes with it
+            self._mmap = None
+
+
+class VideoAnalytics:
+    """Aggregate reports for teachers and district dashboards"""
+
+    def __init__(self, db, cache_path: str = None):
+        """
+        Args:
+            db: VideoDatabase instance
+            cache_path: Columnar cache file (defaults to '<db_path>.analytics')
+        """
+        self.db = db
+        self.cache_path = cache_path or f"{db.db_path}.analytics"
+        self._snapshot = None
+
+    def snapshot(self, refresh: bool = False) -> ColumnarSnapshot:
+        """Current snapshot: the memory-mapped cache if still valid, else rebuilt"""
+        signature = ColumnarSnapshot.source_signature(self.db)
+        if not refresh and self._snapshot and self._snapshot.signature == signature:
+            return self._snapshot
+        if self._snapshot:
+            self._snapshot.close()
+            self._snapshot = None
+
+        if not refresh and os.path.exists(self.cache_path):
+            try:
+                cached = ColumnarSnapshot.load(self.cache_path)
+                if cached and cached.signature == signature:
+                    self._snapshot = cached
+                    return cached
+                if cached:
+                    cached.close()
+            except (OSError, ValueError):
+                pass
+
+        snapshot = ColumnarSnapshot.build(self.db)
+        try:
+            snapshot.save(self.cache_path)
+        except OSError as e:
+            logger.warning("Could not write analytics cache %s: %s", self.cache_path, e)
+        self._snapshot = snapshot
+        return snapshot
+
+    def close(self):
+        if self._snapshot:
+            self._snapshot.close()
+            self._snapshot = None
+
+    # Reports
+    def engagement_curve(self, days: int = 30, end_date: datetime.date = None) -> List[Dict]:
+        """Events, active students and watch minutes per day"""
+        snap = self.snapshot()
+        end_day = ((end_date or datetime.date.today()) - EPOCH).days
+        start_day = end_day - days + 1
+
+        day = _column(snap, 'day')
+        student = _column(snap, 'student')
+        seconds = _column(snap, 'watch_seconds')
+        if np is not None and snap.event_count:
+            mask = (day >= start_day) & (day <= end_day)
+            offsets = day[mask] - start_day
+            events = np.bincount(offsets, minlength=days)
+            watch = np.bincount(offsets, weights=seconds[mask], minlength=days)
+            pairs = np.unique(offsets.astype(np.int64) * max(len(snap.students), 1) + student[mask])
+            active = np.bincount(pairs // max(len(snap.students), 1), minlength=days)
+            events, watch, active = events.tolist(), watch.tolist(), active.tolist()
+        else:
+            events, watch = [0] * days, [0] * days
+            active_sets = [set() for _ in range(days)]
+            for d, s, w in zip(day, student, seconds):
+                if start_day <= d <= end_day:
+                    events[d - start_day] += 1
+                    watch[d - start_day] += w
+                    active_sets[d - start_day].add(s)
+            active = [len(students) for students in active_sets]
+
+        return [{
+            'date': (EPOCH + datetime.timedelta(days=start_day + i)).isoformat(),
+            'events': int(events[i]),
+            'activeStudents': int(active[i]),
+            'watchMinutes': round(watch[i] / 60, 1)
+        } for i in range(days)]
+
+    def completion_funnel(self) -> List[Dict]:
+        """Per course: videos available, started, watched past halfway and completed"""
+        snap = self.snapshot()
+        videos = snap.video_count
+        started, halfway, completed = self._video_progress(snap)
+
+        course = _column(snap, 'course', events=False)
+        stages = {'videos': [0] * len(snap.courses), 'started': [0] * len(snap.courses),
+                  'halfway': [0] * len(snap.courses), 'completed': [0] * len(snap.courses)}
+        for v in range(videos):
+            c = int(course[v])
+            stages['videos'][c] += 1
+            stages['started'][c] += started[v]
+            stages['halfway'][c] += halfway[v]
+            stages['completed'][c] += completed[v]
+
+        funnel = []
+        for c, name in enumerate(snap.courses):
+            total = stages['videos'][c]
+            funnel.append({
+                'course': name,
+                'videos': total,
+                'started': stages['started'][c],
+                'halfway': stages['halfway'][c],
+                'completed': stages['completed'][c],
+                'completionRate': round(stages['completed'][c] / total * 100, 1) if total else 0
+            })
+        funnel.sort(key=lambda row: -row['videos'])
+        return funnel
+
+    def watch_time_distribution(self) -> Dict:
+        """Histogram of furthest playback position per student and video, in minutes"""
+        snap = self.snapshot()
+        furthest = self._furthest_positions(snap)
+
+        if np is not None:
+            minutes = np.sort(np.asarray(furthest, dtype=np.float64) / 60)
+            buckets = np.searchsorted(WATCH_TIME_BUCKETS, minutes, side='right') - 1
+            counts = np.bincount(buckets, minlength=len(WATCH_TIME_BUCKETS)).tolist()
+            total = float(minutes.sum())
+        else:
+            minutes = sorted(value / 60 for value in furthest)
+            counts = [0] * len(WATCH_TIME_BUCKETS)
+            for value in minutes:
+                counts[bisect.bisect_right(WATCH_TIME_BUCKETS, value) - 1] += 1
+            total = sum(minutes)
+
+        def percentile(p):
+            if not len(minutes):
+                return 0
+            return round(float(minutes[min(len(minutes) - 1, int(p / 100 * len(minutes)))]), 1)
+
+        labels = [f"{low}-{high}" for low, high in zip(WATCH_TIME_BUCKETS, WATCH_TIME_BUCKETS[1:])]
+        labels.append(f"{WATCH_TIME_BUCKETS[-1]}+")
+        return {
+            'buckets': [{'minutes': label, 'count': int(count)} for label, count in zip(labels, counts)],
+            'sessions': len(minutes),
+            'p50': percentile(50),
+            'p90': percentile(90),
+            'mean': round(total / len(minutes), 1) if len(minutes) else 0
+        }
+
+    def cohort_retention(self, weeks: int = 8) -> List[Dict]:
+        """Share of each weekly cohort (week of first activity) active N weeks later"""
+        snap = self.snapshot()
+        student_count = len(snap.students)
+        day = _column(snap, 'day')
+        student = _column(snap, 'student')
+
+        if np is not None and snap.event_count:
+            week = (day + 3) // 7
+            first = np.full(student_count, np.iinfo(np.int64).max, dtype=np.int64)
+            np.minimum.at(first, student, week)
+            pairs = np.unique(student.astype(np.int64) * (1 << 32) + (week - first[student]))
+            active = list(zip((pairs >> 32).tolist(), (pairs & 0xFFFFFFFF).tolist()))
+            first = first.tolist()
+        else:
+            first = [None] * student_count
+            weeks_of_event = [(d + 3) // 7 for d in day]
+            for s, w in zip(student, weeks_of_event):
+                if first[s] is None or w < first[s]:
+                    first[s] = w
+            active = {(s, w - first[s]) for s, w in zip(student, weeks_of_event)}
+
+        cohorts = {}
+        for s, offset in active:
+            cohort = cohorts.setdefault(first[s], {'size': 0, 'active': [0] * weeks})
+            if offset < weeks:
+                cohort['active'][offset] += 1
+        for s in range(student_count):
+            cohorts[first[s]]['size'] += 1
+
+        return [{
+            'cohortWeek': week_start(cohort_week),
+            'students': data['size'],
+            'retention': [round(count / data['size'] * 100, 1) if data['size'] else 0
+                          for count in data['active']]
+        } for cohort_week, data in sorted(cohorts.items())]
+
+    # Internal helpers
+    def _furthest_positions(self, snap: ColumnarSnapshot):
+        """Max watch_seconds per (student, video) pair"""
+        video = _column(snap, 'video')
+        student = _column(snap, 'student')
+        seconds = _column(snap, 'watch_seconds')
+        if np is not None and snap.event_count:
+            keys = student.astype(np.int64) * max(snap.video_count, 1) + video
+            order = np.lexsort((seconds, keys))
+            keys, values = keys[order], seconds[order]
+            last = np.append(keys[1:] != keys[:-1], True)
+            return values[last]
+        furthest = {}
+        for key, w in zip(zip(student, video), seconds):
+            if w > furthest.get(key, -1):
+                furthest[key] = w
+        return list(furthest.values())
+
+    def _video_progress(self, snap: ColumnarSnapshot) -> tuple:
+        """Per video: started / reached halfway / completed flags (0 or 1)"""
+        videos = snap.video_count
+        started, halfway, completed = [0] * videos, [0] * videos, [0] * videos
+        duration = _column(snap, 'duration', events=False)
+        video = _column(snap, 'video')
+        seconds = _column(snap, 'watch_seconds')
+        done = _column(snap, 'completed')
+
+        if np is not None and snap.event_count:
+            started = (np.bincount(video, minlength=videos) > 0).astype(int).tolist()
+            furthest = np.zeros(videos, dtype=np.int64)
+            np.maximum.at(furthest, video, seconds)
+            halfway = ((furthest * 2 >= duration) & (duration > 0)).astype(int).tolist()
+            completed = (np.bincount(video, weights=done, minlength=videos) > 0).astype(int).tolist()
+        else:
+            furthest = [0] * videos
+            for v, w, c in zip(video, seconds, done):
+                started[v] = 1
+                if w > furthest[v]:
+                    furthest[v] = w
+                if c:
+                    completed[v] = 1
+            halfway = [1 if duration[v] and furthest[v] * 2 >= duration[v] else 0 for v in range(videos)]
+
+        # A completed video has necessarily been started and passed the halfway point
+        for v in range(videos):
+            if completed[v]:
+                started[v] = halfway[v] = 1
+        return started, halfway, completed
+
+
+def _column(snap: ColumnarSnapshot, name: str, events: bool = True):
+    """A snapshot column as a NumPy array when available, else the raw array/memoryview"""
+    data = snap.columns[name]
+    if np is None:
+        return data
+    codes = dict(ColumnarSnapshot.EVENT_COLUMNS if events else ColumnarSnapshot.VIDEO_COLUMNS)
+    dtype = {'q': np.int64, 'i': np.int32, 'b': np.int8}[codes[name]]
+    return np.frombuffer(data, dtype=dtype)
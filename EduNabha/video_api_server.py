@@ -0,0 +1,654 @@
+#!/usr/bin/env python3
+"""
+Video API Server
+Long-running HTTP/1.1 service exposing EduNabhaVideoIntegration as REST
+endpoints, so the Node server can proxy over keep-alive connections instead
+of spawning video_integration_wrapper.py for every request
+Usage: python video_api_server.py [--host 127.0.0.1] [--port 8765] [--db edunabha_videos.db]
+"""
+
+import argparse
+import gzip
+import json
+import re
+import threading
+import time
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Optional
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+try:
+    import brotli
+except ImportError:  # br is only offered when the brotli package is installed
+    brotli = None
+
+from instrumentation import METRICS, configure_logging, get_logger
+from profiling import profile_command
+from upload_ingestion import UploadError
+from video_database_integration import EduNabhaVideoIntegration
+
+
+MAX_JSON_BODY = 5 * 1024 * 1024  # Same limit as the Node server's JSON parser
+MAX_CHUNK_BODY = 64 * 1024 * 1024
+MIN_COMPRESS_SIZE = 1024
+
+ROUTES = []
+
+logger = get_logger('api')
+
+
+def route(method: str, pattern: str):
+    """Register a handler for METHOD /path; {name} segments become request.params"""
+    regex = re.compile('^' + re.sub(r'\{(\w+)\}', r'(?P<\1>[^/]+)', pattern) + '$')
+
+    def decorator(func: Callable):
+        ROUTES.append((method, regex, func))
+        return func
+    return decorator
+
+
+class APIError(Exception):
+    """Error returned to the client as {'error': {'status', 'code', 'message'}}"""
+
+    def __init__(self, status: int, message: str, code: str = None):
+        super().__init__(message)
+        self.status = status
+        self.code = code or HTTPStatus(status).phrase.lower().replace(' ', '_')
+
+
+class TextResponse(str):
+    """Handler result sent as text/plain instead of JSON"""
+
+
+class APIRequest:
+    """Parsed request passed to route handlers"""
+
+    def __init__(self, params: Dict, query: Dict, body, headers):
+        self.params = params
+        self.query = query
+        self.body = body
+        self.headers = headers
+
+    def json(self) -> Dict:
+        if not isinstance(self.body, dict):
+            raise APIError(400, 'Expected a JSON object body', 'invalid_body')
+        return self.body
+
+    def arg(self, name: str, default=None, cast: Callable = None):
+        """Query-string value, falling back to the JSON body"""
+        value = self.query.get(name)
+        if value is None and isinstance(self.body, dict):
+            value = self.body.get(name)
+        if value is None:
+            return default
+        try:
+            return cast(value) if cast else value
+        except (TypeError, ValueError):
+            raise APIError(400, f"Invalid value for {name}: {value!r}", 'invalid_parameter')
+
+
+# Videos
+@route('GET', '/health')
+def health(integration, request):
+    return {'status': 'ok'}
+
+
+@route('GET', '/metrics')
+def metrics(integration, request):
+    return TextResponse(integration.get_metrics())
+
+
+@route('GET', '/videos')
+def list_videos(integration, request):
+    return integration.get_offline_videos_for_react()
+
+
+@route('POST', '/videos')
+def add_video(integration, request):
+    return 201, integration.add_downloaded_video(request.json())
+
+
+@route('GET', '/videos/search')
+@route('POST', '/videos/search')
+def search_videos(integration, request):
+    """Filters come from the query string (GET) or a {'query', 'filters'} body (POST)"""
+    filters = dict(request.body.get('filters') or {}) if isinstance(request.body, dict) else {}
+    filters.update({k: v for k, v in request.query.items() if k != 'q'})
+    return integration.search_videos_enhanced(request.arg('q', request.arg('query', '')), filters)
+
+
+@route('DELETE', '/videos/{video_id}')
+def delete_video(integration, request):
+    return integration.delete_video_enhanced(request.params['video_id'])
+
+
+@route('POST', '/videos/delete')
+def delete_videos(integration, request):
+    """Bulk delete by {'videoIds', 'course', 'tag', 'expression'}"""
+    return integration.delete_videos_bulk(request.json())
+
+
+@route('POST', '/videos/{video_id}/progress')
+def update_progress(integration, request):
+    data = request.json()
+    return integration.update_video_progress(
+        request.params['video_id'], data.get('watchTime', 0), bool(data.get('completed')),
+        data.get('studentId', 'local')
+    )
+
+
+@route('GET', '/videos/{video_id}/similar')
+def similar_videos(integration, request):
+    return integration.get_similar_videos(request.params['video_id'], request.arg('limit', 5, int))
+
+
+@route('POST', '/videos/{video_id}/renditions')
+def package_renditions(integration, request):
+    return integration.package_video_renditions(request.params['video_id'])
+
+
+@route('GET', '/videos/{video_id}/rendition')
+def select_rendition(integration, request):
+    device = {k: v for k, v in request.query.items()}
+    return integration.select_rendition_for_device(request.params['video_id'], device)
+
+
+@route('POST', '/videos/{video_id}/download')
+def start_download(integration, request):
+    options = request.body if isinstance(request.body, dict) else {}
+    return integration.start_segmented_download(request.params['video_id'], options)
+
+
+@route('POST', '/videos/{video_id}/download/segments')
+def download_segments_done(integration, request):
+    return integration.record_downloaded_segments(
+        request.params['video_id'], request.json().get('segments', [])
+    )
+
+
+@route('GET', '/videos/{video_id}/download/plan')
+def download_plan(integration, request):
+    return integration.get_download_plan(
+        request.params['video_id'], request.arg('playbackSeconds', 0, float), request.arg('limit', None, int)
+    )
+
+
+@route('POST', '/videos/{video_id}/download/verify')
+def verify_download(integration, request):
+    return integration.verify_download(request.params['video_id'])
+
+
+# Resumable uploads
+@route('POST', '/uploads')
+def create_upload(integration, request):
+    return 201, integration.create_upload(request.json())
+
+
+@route('GET', '/uploads/{upload_id}')
+def upload_status(integration, request):
+    return integration.get_upload_status(request.params['upload_id'])
+
+
+@route('PATCH', '/uploads/{upload_id}')
+def upload_chunk(integration, request):
+    """Raw chunk bytes in the body, offset in the Upload-Offset header (tus-style)"""
+    try:
+        offset = int(request.headers.get('Upload-Offset', 0))
+    except ValueError:
+        raise APIError(400, f"Invalid Upload-Offset: {request.headers.get('Upload-Offset')!r}", 'invalid_header')
+    try:
+        status = integration.uploads.append_chunk(
+            request.params['upload_id'], offset,
+            request.body, checksum=request.headers.get('Upload-Checksum')
+        )
+        return {'success': True, **status}
+    except UploadError as e:
+        return {'success': False, 'error': str(e), 'statusCode': e.status_code}
+
+
+@route('DELETE', '/uploads/{upload_id}')
+def abort_upload(integration, request):
+    return integration.abort_upload(request.params['upload_id'])
+
+
+# Study tools
+@route('GET', '/storage')
+def storage_info(integration, request):
+    return integration.get_storage_info_enhanced()
+
+
+@route('GET', '/study/dashboard')
+def study_dashboard(integration, request):
+    return integration.get_study_dashboard()
+
+
+@route('GET', '/study/plan')
+def study_plan(integration, request):
+    return integration.get_study_plan({
+        'studentId': request.arg('studentId', 'local'),
+        'days': request.arg('days', 7),
+        'minutes': request.arg('minutes'),
+        'start': request.arg('start')
+    })
+
+
+@route('POST', '/study/budget')
+def study_budget(integration, request):
+    return integration.set_study_budget(request.json())
+
+
+@route('POST', '/videos/{video_id}/review')
+def study_review(integration, request):
+    return integration.record_study_review({**request.json(), 'videoId': request.params['video_id']})
+
+
+@route('GET', '/study/recommendations')
+def recommendations(integration, request):
+    return integration.get_recommendations(request.arg('studentId', 'local'))
+
+
+@route('POST', '/study/recommendations/rebuild')
+def rebuild_recommendations(integration, request):
+    return integration.rebuild_recommendations()
+
+
+@route('POST', '/study/export')
+def export_study_data(integration, request):
+    return integration.export_study_data(request.arg('format', 'json'))
+
+
+@route('POST', '/prefetch/plan')
+def plan_prefetch(integration, request):
+    return integration.plan_prefetch(request.body if isinstance(request.body, dict) else {})
+
+
+# Playlists
+@route('GET', '/playlists/course/{course_name}')
+def course_playlist(integration, request):
+    return integration.get_course_playlist(request.params['course_name'])
+
+
+@route('POST', '/playlists/{playlist_id}/reorder')
+def reorder_playlist(integration, request):
+    return integration.reorder_playlist(request.params['playlist_id'], request.json().get('moves', []))
+
+
+@route('DELETE', '/playlists/{playlist_id}/videos/{video_id}')
+def remove_from_playlist(integration, request):
+    return integration.remove_from_playlist(request.params['playlist_id'], request.params['video_id'])
+
+
+# Analytics
+@route('GET', '/analytics/engagement')
+def engagement_curve(integration, request):
+    return integration.get_engagement_curve(request.arg('days', 30, int), request.arg('snapshot'))
+
+
+@route('GET', '/analytics/funnel')
+def completion_funnel(integration, request):
+    return integration.get_completion_funnel(request.arg('snapshot'))
+
+
+@route('GET', '/analytics/watch-time')
+def watch_time_distribution(integration, request):
+    return integration.get_watch_time_distribution(request.arg('snapshot'))
+
+
+@route('GET', '/analytics/cohorts')
+def cohort_retention(integration, request):
+    return integration.get_cohort_retention(request.arg('weeks', 8, int), request.arg('snapshot'))
+
+
+@route('GET', '/analytics/series')
+def watch_series(integration, request):
+    return integration.get_watch_series(dict(request.query))
+
+
+@route('POST', '/analytics/rollups')
+def rollup_maintenance(integration, request):
+    return integration.run_rollup_maintenance(request.body if isinstance(request.body, dict) else {})
+
+
+@route('GET', '/integrity')
+def integrity_scan(integration, request):
+    return integration.scan_library({'verify': request.arg('verify') == '1'})
+
+
+@route('POST', '/integrity/repair')
+def integrity_repair(integration, request):
+    return integration.repair_library(request.body if isinstance(request.body, dict) else {})
+
+
+# Backups
+@route('GET', '/backups')
+def list_backups(integration, request):
+    return integration.list_backups()
+
+
+@route('POST', '/backups')
+def create_backup(integration, request):
+    return integration.create_backup(request.body if isinstance(request.body, dict) else {})
+
+
+@route('POST', '/backups/restore')
+def restore_backup(integration, request):
+    return integration.restore_backup(request.body if isinstance(request.body, dict) else {})
+
+
+# Trash
+@route('GET', '/trash')
+def trash_list(integration, request):
+    return integration.get_trash_listing(request.arg('limit', None, int))
+
+
+@route('POST', '/trash/restore')
+def trash_restore(integration, request):
+    return integration.restore_deleted_videos(request.json().get('videoIds', []))
+
+
+@route('POST', '/trash/reclaim')
+def trash_reclaim(integration, request):
+    return integration.reclaim_trash(request.body if isinstance(request.body, dict) else {})
+
+
+# Catalog sync
+@route('POST', '/sync')
+def sync_exchange(integration, request):
+    return integration.sync_exchange(request.json())
+
+
+@route('GET', '/sync')
+def sync_status(integration, request):
+    return integration.get_sync_status()
+
+
+class VideoAPIServer(ThreadingHTTPServer):
+    """Threaded HTTP server; each keep-alive connection gets its own database connection"""
+
+    daemon_threads = True
+
+    def __init__(self, address: tuple, db_path: str = "edunabha_videos.db", upload_dir: str = None,
+                 request_timeout: float = 30.0, idle_timeout: float = 75.0):
+        """
+        Args:
+            address: (host, port) to listen on
+            db_path: Video database path
+            upload_dir: Upload directory (see EduNabhaVideoIntegration)
+            request_timeout: Seconds a request may spend in the database before it is aborted
+            idle_timeout: Seconds an idle keep-alive connection is held open
+        """
+        self.db_path = db_path
+        self.upload_dir = upload_dir
+        self.request_timeout = request_timeout
+        self.idle_timeout = idle_timeout
+        super().__init__(address, VideoAPIHandler)
+
+    def open_integration(self) -> EduNabhaVideoIntegration:
+        return EduNabhaVideoIntegration(self.db_path, self.upload_dir)
+
+
+class VideoAPIHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep-alive
+    server_version = 'EduNabhaVideoAPI/1.0'
+    disable_nagle_algorithm = True  # Headers and body go out as separate writes
+
+    def setup(self):
+        self.timeout = self.server.idle_timeout
+        super().setup()
+        self._integration = None
+        self._deadline = None
+        self._timed_out = False
+        self._body = None
+
+    def finish(self):
+        try:
+            super().finish()
+        finally:
+            if self._integration:
+                self._integration.close()
+                self._integration = None
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_PATCH(self):
+        self._dispatch('PATCH')
+
+    def do_DELETE(self):
+        self._dispatch('DELETE')
+
+    def log_request(self, code='-', size='-'):
+        pass  # _dispatch logs every request with its timing
+
+    def log_message(self, format, *args):
+        logger.warning(format % args, extra={'client': self.address_string()})
+
+    # Request handling
+    def _dispatch(self, method: str):
+        started = time.monotonic()
+        self._body = None
+        handler = None
+        status = 500
+        try:
+            url = urlsplit(self.path)
+            handler, params = self._match(method, url.path)
+            body = self._read_body(raw=handler is upload_chunk)
+            request = APIRequest(params, dict(parse_qsl(url.query)), body, self.headers)
+            result = self._call(handler, request)
+            status, payload = result if isinstance(result, tuple) else (200, result)
+            if isinstance(payload, dict) and payload.get('success') is False and payload.get('statusCode'):
+                status = payload['statusCode']
+            if isinstance(payload, TextResponse):
+                self._send_body(status, payload.encode('utf-8'), 'text/plain; version=0.0.4; charset=utf-8')
+            else:
+                self._send_json(status, payload)
+        except APIError as e:
+            status = e.status
+            self._send_error(e.status, e.code, str(e))
+        except Exception as e:
+            status = 500
+            logger.exception("Error handling %s %s: %s", method, self.path, e)
+            self._send_error(500, 'internal_error', str(e))
+        finally:
+            self._deadline = None
+            elapsed = time.monotonic() - started
+            route_name = handler.__name__ if handler else 'unmatched'
+            METRICS.observe('edunabha_http_request_duration_seconds',
+                            (('route', route_name), ('method', method), ('status', str(status))), elapsed)
+            fields = {'client': self.address_string(), 'method': method, 'path': self.path,
+                      'route': route_name, 'status': status, 'duration_ms': round(elapsed * 1000, 2)}
+            if elapsed > 1:
+                logger.warning("Slow request %s %s", method, self.path, extra=fields)
+            else:
+                logger.debug("%s %s %s", method, self.path, status, extra=fields)
+
+    def _match(self, method: str, path: str) -> tuple:
+        path_matched = False
+        for route_method, regex, handler in ROUTES:
+            match = regex.match(path)
+            if match:
+                path_matched = True
+                if route_method == method:
+                    return handler, {k: unquote(v) for k, v in match.groupdict().items()}
+        if path_matched:
+            raise APIError(405, f"{method} is not allowed on {path}")
+        raise APIError(404, f"No endpoint {method} {path}")
+
+    def _read_body(self, raw: bool = False):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            raise APIError(411, 'Chunked request bodies are not supported; send Content-Length')
+        length = int(self.headers.get('Content-Length') or 0)
+        limit = MAX_CHUNK_BODY if raw else MAX_JSON_BODY
+        if length > limit:
+            raise APIError(413, f"Request body exceeds {limit} bytes")
+        self._body = _BodyReader(self.rfile, length)
+        if raw:
+            return self._body
+        if not length:
+            return None
+        try:
+            return json.loads(self._body.read())
+        except (UnicodeDecodeError, json.JSONDecodeError) as e:
+            raise APIError(400, f"Invalid JSON body: {e}", 'invalid_json')
+
+    def _call(self, handler: Callable, request: APIRequest):
+        integration = self._get_integration()
+        self._deadline = time.monotonic() + self.server.request_timeout
+        self._timed_out = False
+        # ?profile=1 or an X-EduNabha-Profile: 1 header forces a profile of this request
+        force_profile = request.query.get('profile') == '1' or request.headers.get('X-EduNabha-Profile') == '1'
+        try:
+            with profile_command(f"api.{handler.__name__}", force=force_profile):
+                result = handler(integration, request)
+        except Exception:
+            if not self._timed_out:
+                raise
+        if self._timed_out:
+            # The database layer logs an interrupted statement and returns an empty
+            # result, so the flag set by the progress handler is what marks a timeout
+            if integration.db.conn.in_transaction:
+                integration.db.conn.rollback()
+            raise APIError(504, f"Request exceeded {self.server.request_timeout}s", 'timeout')
+        return result
+
+    def _get_integration(self) -> EduNabhaVideoIntegration:
+        if self._integration is None:
+            self._integration = self.server.open_integration()
+            # Abort statements that run past the request deadline
+            self._integration.db.conn.set_progress_handler(self._past_deadline, 10000)
+        return self._integration
+
+    def _past_deadline(self) -> int:
+        if self._deadline and time.monotonic() > self._deadline:
+            self._timed_out = True
+            return 1
+        return 0
+
+    # Responses
+    def _send_error(self, status: int, code: str, message: str):
+        self._send_json(status, {'error': {'status': status, 'code': code, 'message': message}})
+
+    def _send_json(self, status: int, payload):
+        self._send_body(status, json.dumps(payload, default=str).encode('utf-8'),
+                        'application/json; charset=utf-8')
+
+    def _send_body(self, status: int, body: bytes, content_type: str):
+        if self._body is None or self._body.remaining:
+            # Unread request bytes would be parsed as the next request
+            if int(self.headers.get('Content-Length') or 0):
+                self.close_connection = True
+        encoding = self._choose_encoding() if len(body) >= MIN_COMPRESS_SIZE else None
+        if encoding == 'br':
+            body = brotli.compress(body, quality=5)
+        elif encoding == 'gzip':
+            body = gzip.compress(body, compresslevel=6)
+
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Vary', 'Accept-Encoding')
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        if self.close_connection:
+            self.send_header('Connection', 'close')
+        else:
+            self.send_header('Keep-Alive', f"timeout={int(self.server.idle_timeout)}")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _choose_encoding(self) -> Optional[str]:
+        accepted = {}
+        for item in self.headers.get('Accept-Encoding', '').split(','):
+            name, _, params = item.strip().partition(';')
+            quality = 1.0
+            if params.strip().startswith('q='):
+                try:
+                    quality = float(params.strip()[2:])
+                except ValueError:
+                    quality = 0.0
+            if name:
+                accepted[name.lower()] = quality
+        candidates = (['br'] if brotli else []) + ['gzip']
+        candidates = [c for c in candidates if accepted.get(c, accepted.get('*', 0)) > 0]
+        return max(candidates, key=lambda c: accepted.get(c, 0), default=None)
+
+
+class _BodyReader:
+    """File-like view of exactly length bytes of the request body"""
+
+    def __init__(self, stream, length: int):
+        self.stream = stream
+        self.remaining = length
+
+    def read(self, size: int = -1) -> bytes:
+        if self.remaining <= 0:
+            return b''
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.stream.read(size)
+        self.remaining -= len(data)
+        return data
+
+
+def serve(host: str = '127.0.0.1', port: int = 8765, db_path: str = "edunabha_videos.db",
+          upload_dir: str = None, request_timeout: float = 30.0,
+          ready: threading.Event = None) -> VideoAPIServer:
+    """Start the API server and block until it is shut down"""
+    server = VideoAPIServer((host, port), db_path, upload_dir, request_timeout)
+    logger.info("EduNabha video API listening on http://%s:%s", host, server.server_address[1])
+    if ready:
+        ready.set()
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='EduNabha video API server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--db', default='edunabha_videos.db')
+    parser.add_argument('--upload-dir', default=None)
+    parser.add_argument('--request-timeout', type=float, default=30.0)
+    parser.add_argument('--watch-uploads', action='store_true',
+                        help='Catalogue videos copied into the upload directory (see upload_watcher.py)')
+    parser.add_argument('--backup-every', type=float, default=None, metavar='HOURS',
+                        help='Snapshot the database on this schedule (see database_backup.py)')
+    parser.add_argument('--reclaim-every', type=float, default=None, metavar='MINUTES',
+                        help='Purge expired trash on this schedule (see trash_reclaimer.py)')
+    args = parser.parse_args()
+    configure_logging()
+    watcher = backups = reclaimer = None
+    if args.reclaim_every:
+        from trash_reclaimer import ReclaimerThread
+        reclaimer = ReclaimerThread(args.db, args.upload_dir, interval=args.reclaim_every * 60)
+        reclaimer.start()
+    if args.backup_every:
+        from database_backup import BackupThread
+        backups = BackupThread(args.db, interval_hours=args.backup_every)
+        backups.start()
+    if args.watch_uploads:
+        from upload_watcher import WatcherThread
+        watcher = WatcherThread(args.db, args.upload_dir)
+        watcher.start()
+    try:
+        serve(args.host, args.port, args.db, args.upload_dir, args.request_timeout)
+    except KeyboardInterrupt:
+        logger.info("Shutting down")
+    finally:
+        if watcher:
+            watcher.stop(timeout=10)
+        if backups:
+            backups.stop(timeout=60)
+        if reclaimer:
+            reclaimer.stop(timeout=60)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,26 +6,55 @@ A Python class to manage offline video storage database using SQLite
 import sqlite3
 import os
 import datetime
-from typing import List, Dict, Optional, Tuple
+from contextlib import contextmanager
+from typing import Iterable, List, Dict, Optional, Tuple
 import json
+from instrumentation import METRICS, configure_logging, connect, get_logger, instrument_methods
+from migrations import migrate, schema_version
+from video_export import StreamingExporter, QuerySource
 
 
+logger = get_logger('video_database')
+
+# Rows referencing the videos in a JSON id array, deleted along with them. The
+# connection leaves foreign keys off, so the schema's ON DELETE clauses never fire.
+VIDEO_DEPENDENT_DELETES = [
+    "DELETE FROM rendition_segments WHERE rendition_id IN "
+    "(SELECT id FROM video_renditions WHERE video_id IN (SELECT value FROM json_each(?)))",
+    "DELETE FROM video_renditions WHERE video_id IN (SELECT value FROM json_each(?))",
+    "DELETE FROM download_segment_hashes WHERE video_id IN (SELECT value FROM json_each(?))",
+    "DELETE FROM video_downloads WHERE video_id IN (SELECT value FROM json_each(?))",
+    "DELETE FROM watch_events WHERE video_id IN (SELECT value FROM json_each(?))",
+    "DELETE FROM video_tags WHERE video_id IN (SELECT value FROM json_each(?))",
+    "DELETE FROM playlist_videos WHERE video_id IN (SELECT value FROM json_each(?))",
+    "DELETE FROM review_cards WHERE video_id IN (SELECT value FROM json_each(?))",
+    "UPDATE upload_sessions SET video_id = NULL WHERE video_id IN (SELECT value FROM json_each(?))",
+]
+
+
+@instrument_methods
 class VideoDatabase:
+    PLAYLIST_POSITION_GAP = 1024  # Spacing between playlist position keys
+    persist_metrics = True  # Whether close() may write this process's metrics to the database
+    
     def __init__(self, db_path: str = "video_database.db"):
         """Initialize the video database connection"""
         self.db_path = db_path
         self.conn = None
+        self._listeners = {}
+        self._transaction_depth = 0
+        self._pending_events = []
         self.connect()
         self.initialize_database()
     
     def connect(self):
         """Establish database connection"""
         try:
-            self.conn = sqlite3.connect(self.db_path)
+            self.conn = connect(self.db_path)
             self.conn.row_factory = sqlite3.Row  # Enable dict-like access to rows
-            print(f"Connected to database: {self.db_path}")
+            logger.debug("Connected to database", extra={'db_path': self.db_path})
         except sqlite3.Error as e:
-            print(f"Error connecting to database: {e}")
+            logger.error("Error connecting to database: %s", e)
     
     def initialize_database(self):
         """Initialize database with schema"""
@@ -33,20 +62,117 @@ class VideoDatabase:
         if os.path.exists(schema_file):
             with open(schema_file, 'r', encoding='utf-8') as f:
                 schema = f.read()
+            version = schema_version(schema)
             try:
+                if self.conn.execute("PRAGMA user_version").fetchone()[0] == version:
+                    return  # Already initialized from this schema and migration list
                 self.conn.executescript(schema)
                 self.conn.commit()
-                print("Database initialized successfully")
+                migrate(self.conn)
+                self.conn.execute(f"PRAGMA user_version = {version}")
+                logger.debug("Database initialized", extra={'db_path': self.db_path})
             except sqlite3.Error as e:
-                print(f"Error initializing database: {e}")
+                logger.error("Error initializing database: %s", e)
         else:
-            print(f"Schema file {schema_file} not found. Please ensure it exists.")
+            logger.error("Schema file %s not found. Please ensure it exists.", schema_file)
     
     def close(self):
         """Close database connection"""
         if self.conn:
+            if self.persist_metrics and METRICS.flush_due():
+                try:
+                    METRICS.flush(self.conn)
+                except sqlite3.Error as e:
+                    logger.debug("Could not persist metrics: %s", e)
             self.conn.close()
-            print("Database connection closed")
+            logger.debug("Database connection closed", extra={'db_path': self.db_path})
+    
+    # Change Notifications
+    def subscribe(self, event: str, callback):
+        """
+        Register a callback for a change event
+        
+        Events: video_added, video_updated, video_trashed, video_deleted,
+        video_tagged, video_untagged, video_watched. Callbacks receive keyword arguments
+        (always including video_id) and should accept **kwargs.
+        """
+        self._listeners.setdefault(event, []).append(callback)
+    
+    def unsubscribe(self, event: str, callback):
+        """Remove a previously registered callback"""
+        if callback in self._listeners.get(event, []):
+            self._listeners[event].remove(callback)
+    
+    def _emit(self, event: str, **payload):
+        """
+        Notify subscribers; a failing subscriber never breaks the caller
+        
+        Inside transaction() the event is held until the outermost block
+        commits, so subscribers only ever see committed changes.
+        """
+        if self._transaction_depth:
+            self._pending_events.append((event, payload))
+            return
+        for callback in list(self._listeners.get(event, [])):
+            try:
+                callback(**payload)
+            except Exception as e:
+                logger.exception("Error in %s subscriber: %s", event, e)
+    
+    # Units of work
+    @property
+    def in_unit_of_work(self) -> bool:
+        """True inside a transaction() block"""
+        return self._transaction_depth > 0
+    
+    @contextmanager
+    def transaction(self):
+        """
+        Make a group of writes atomic, with a single commit
+        
+        The mutators of this class run inside their own transaction() block,
+        so when they are called inside an outer block they join it instead of
+        committing (each commit is an fsync). Blocks nest as savepoints: an
+        exception leaving an inner block undoes only that block's writes,
+        one leaving the outermost block rolls everything back. Change events
+        are delivered after the outermost commit and dropped with the writes
+        of a block that is rolled back. Inside a block the mutators raise
+        sqlite3.Error instead of logging it and returning a fallback value,
+        so a failed step aborts the unit rather than committing the rest.
+        
+        Usage:
+            with db.transaction():
+                video_id = db.add_video(...)
+                db.tag_video(video_id, tag_id)
+        """
+        depth = self._transaction_depth
+        savepoint = f"unit_of_work_{depth}"
+        if depth:
+            self.conn.execute(f"SAVEPOINT {savepoint}")
+        elif not self.conn.in_transaction:
+            # Take the write lock up front so a read-then-write unit cannot deadlock another writer
+            self.conn.execute("BEGIN IMMEDIATE")
+        events = len(self._pending_events)
+        self._transaction_depth += 1
+        try:
+            yield self
+        except BaseException:
+            self._transaction_depth -= 1
+            del self._pending_events[events:]
+            if depth:
+                self.conn.execute(f"ROLLBACK TO {savepoint}")
+                self.conn.execute(f"RELEASE {savepoint}")
+            else:
+                self.conn.rollback()
+            raise
+        self._transaction_depth -= 1
+        if depth:
+            self.conn.execute(f"RELEASE {savepoint}")
+            return
+        self.conn.commit()
+        pending, self._pending_events = self._pending_events, []
+        for event, payload in pending:
+            self._emit(event, **payload)
     
     # Video Management Methods
     def add_video(self, title: str, file_path: str, **kwargs) -> int:
@@ -91,41 +217,62 @@ class VideoDatabase:
         )
         
         try:
-            cursor = self.conn.execute(query, values)
-            self.conn.commit()
+            with self.transaction():
+                # A trashed video's row still holds the path; re-adding the file purges it for good
+                trashed = self.conn.execute(
+                    "SELECT id FROM videos WHERE file_path = ? AND deleted_at IS NOT NULL", (file_path,)
+                ).fetchall()
+                if trashed:
+                    self.purge_trash([row[0] for row in trashed])
+                cursor = self.conn.execute(query, values)
             video_id = cursor.lastrowid
-            print(f"Video '{title}' added successfully with ID: {video_id}")
+            logger.info("Video added", extra={'video_id': video_id, 'title': title})
+            self._emit('video_added', video_id=video_id)
             return video_id
         except sqlite3.Error as e:
-            print(f"Error adding video: {e}")
+            if self._transaction_depth:
+                # Inside a caller's unit of work the failure must abort the whole unit
+                raise
+            logger.error("Error adding video: %s", e)
             return None
     
-    def get_video(self, video_id: int) -> Optional[Dict]:
-        """Get a video by ID"""
+    def get_video(self, video_id: int, include_deleted: bool = False) -> Optional[Dict]:
+        """Get a video by ID (videos in the trash only with include_deleted)"""
         query = """
         SELECT v.*, c.name as category_name 
         FROM videos v 
         LEFT JOIN categories c ON v.category_id = c.id 
         WHERE v.id = ?
         """
+        if not include_deleted:
+            query += " AND v.deleted_at IS NULL"
         try:
             cursor = self.conn.execute(query, (video_id,))
             row = cursor.fetchone()
             return dict(row) if row else None
         except sqlite3.Error as e:
-            print(f"Error getting video: {e}")
+            logger.error("Error getting video: %s", e)
             return None
     
     def search_videos(self, search_term: str = "", category_id: int = None, 
-                     tag_name: str = None, rating: int = None) -> List[Dict]:
-        """Search videos with various filters"""
+                     tag_name: str = None, rating: int = None,
+                     video_ids: Iterable[int] = None) -> List[Dict]:
+        """
+        Search videos with various filters
+        
+        Args:
+            video_ids: Only these videos (e.g. the matches of a TagIndex expression)
+        """
+        if video_ids is not None:
+            video_ids = list(video_ids)
+            if not video_ids:
+                return []
+        
         query = """
-        SELECT DISTINCT v.*, c.name as category_name 
-        FROM videos v 
+        SELECT v.*, c.name as category_name
+        FROM videos v
         LEFT JOIN categories c ON v.category_id = c.id
-        LEFT JOIN video_tags vt ON v.id = vt.video_id
-        LEFT JOIN tags t ON vt.tag_id = t.id
-        WHERE 1=1
+        WHERE v.deleted_at IS NULL
         """
         params = []
         
@@ -138,20 +285,27 @@ class VideoDatabase:
             params.append(category_id)
         
         if tag_name:
-            query += " AND t.name = ?"
+            # Semi-join instead of a DISTINCT over the video/tag join
+            query += """ AND v.id IN (SELECT vt.video_id FROM video_tags vt
+                                      JOIN tags t ON vt.tag_id = t.id WHERE t.name = ?)"""
             params.append(tag_name)
         
         if rating:
             query += " AND v.rating = ?"
             params.append(rating)
         
+        if video_ids is not None:
+            # One JSON parameter instead of thousands of placeholders
+            query += " AND v.id IN (SELECT value FROM json_each(?))"
+            params.append(json.dumps(video_ids))
+        
         query += " ORDER BY v.download_date DESC"
         
         try:
             cursor = self.conn.execute(query, params)
             return [dict(row) for row in cursor.fetchall()]
         except sqlite3.Error as e:
-            print(f"Error searching videos: {e}")
+            logger.error("Error searching videos: %s", e)
             return []
     
     def get_all_videos(self) -> List[Dict]:
@@ -174,27 +328,170 @@ class VideoDatabase:
                 values.append(value)
         
         if not fields:
-            print("No valid fields to update")
+            logger.warning("No valid fields to update", extra={'video_id': video_id})
             return
         
         values.append(video_id)
         query = f"UPDATE videos SET {', '.join(fields)} WHERE id = ?"
         
         try:
-            self.conn.execute(query, values)
-            self.conn.commit()
-            print(f"Video {video_id} updated successfully")
+            with self.transaction():
+                self.conn.execute(query, values)
+            logger.debug("Video updated", extra={'video_id': video_id})
+            self._emit('video_updated', video_id=video_id, fields=list(kwargs))
         except sqlite3.Error as e:
-            print(f"Error updating video: {e}")
+            if self._transaction_depth:
+                raise
+            logger.error("Error updating video: %s", e)
     
     def delete_video(self, video_id: int):
         """Delete a video from database"""
         try:
-            self.conn.execute("DELETE FROM videos WHERE id = ?", (video_id,))
-            self.conn.commit()
-            print(f"Video {video_id} deleted successfully")
+            with self.transaction():
+                self._delete_video_rows([video_id])
+            logger.info("Video deleted", extra={'video_id': video_id})
+            self._emit('video_deleted', video_id=video_id)
+        except sqlite3.Error as e:
+            if self._transaction_depth:
+                raise
+            logger.error("Error deleting video: %s", e)
+    
+    def delete_videos(self, video_ids: Iterable[int]) -> int:
+        """
+        Delete several videos in one transaction
+        
+        Returns:
+            Number of videos deleted
+        """
+        video_ids = list(video_ids)
+        if not video_ids:
+            return 0
+        try:
+            with self.transaction():
+                deleted = self._delete_video_rows(video_ids)
+        except sqlite3.Error as e:
+            if self._transaction_depth:
+                raise
+            logger.error("Error deleting videos: %s", e)
+            return 0
+        logger.info("Videos deleted", extra={'count': deleted})
+        for video_id in video_ids:
+            self._emit('video_deleted', video_id=video_id)
+        return deleted
+    
+    def _delete_video_rows(self, video_ids: List[int]) -> int:
+        """Delete videos and every row referencing them; runs inside the caller's transaction"""
+        ids = json.dumps([int(i) for i in video_ids])
+        for statement in VIDEO_DEPENDENT_DELETES:
+            self.conn.execute(statement, (ids,))
+        cursor = self.conn.execute("DELETE FROM videos WHERE id IN (SELECT value FROM json_each(?))", (ids,))
+        return cursor.rowcount
+    
+    # Trash: soft deletion, undone by restore_videos until the reclaimer purges it
+    def trash_videos(self, video_ids: Iterable[int]) -> List[int]:
+        """
+        Move videos to the trash in one transaction; files stay on disk
+        
+        Returns:
+            Ids actually trashed (ones already in the trash or unknown are skipped)
+        """
+        ids = json.dumps([int(i) for i in video_ids])
+        try:
+            with self.transaction():
+                trashed = [row[0] for row in self.conn.execute(
+                    "SELECT id FROM videos WHERE id IN (SELECT value FROM json_each(?)) AND deleted_at IS NULL",
+                    (ids,)
+                )]
+                self.conn.execute(
+                    "UPDATE videos SET deleted_at = CURRENT_TIMESTAMP "
+                    "WHERE id IN (SELECT value FROM json_each(?)) AND deleted_at IS NULL", (ids,)
+                )
+        except sqlite3.Error as e:
+            if self._transaction_depth:
+                raise
+            logger.error("Error trashing videos: %s", e)
+            return []
+        logger.info("Videos moved to trash", extra={'count': len(trashed)})
+        for video_id in trashed:
+            self._emit('video_trashed', video_id=video_id)
+        return trashed
+    
+    def restore_videos(self, video_ids: Iterable[int]) -> List[int]:
+        """Take videos back out of the trash; returns the ids restored"""
+        ids = json.dumps([int(i) for i in video_ids])
+        try:
+            with self.transaction():
+                restored = [row[0] for row in self.conn.execute(
+                    "SELECT id FROM videos WHERE id IN (SELECT value FROM json_each(?)) AND deleted_at IS NOT NULL",
+                    (ids,)
+                )]
+                self.conn.execute(
+                    "UPDATE videos SET deleted_at = NULL WHERE id IN (SELECT value FROM json_each(?))", (ids,)
+                )
+        except sqlite3.Error as e:
+            if self._transaction_depth:
+                raise
+            logger.error("Error restoring videos: %s", e)
+            return []
+        logger.info("Videos restored from trash", extra={'count': len(restored)})
+        for video_id in restored:
+            self._emit('video_added', video_id=video_id)
+        return restored
+    
+    def purge_trash(self, video_ids: Iterable[int], older_than: str = None) -> List[int]:
+        """
+        Delete trashed videos for good, skipping any restored in the meantime
+        
+        Args:
+            video_ids: Candidates (e.g. from get_trash)
+            older_than: Only videos still trashed before this SQLite datetime
+        
+        Returns:
+            Ids deleted; their files can be removed once this returns
+        """
+        ids = json.dumps([int(i) for i in video_ids])
+        query = "SELECT id FROM videos WHERE id IN (SELECT value FROM json_each(?)) AND deleted_at IS NOT NULL"
+        params = [ids]
+        if older_than:
+            query += " AND deleted_at < ?"
+            params.append(older_than)
+        try:
+            with self.transaction():
+                purged = [row[0] for row in self.conn.execute(query, params)]
+                self._delete_video_rows(purged)
         except sqlite3.Error as e:
-            print(f"Error deleting video: {e}")
+            if self._transaction_depth:
+                raise
+            logger.error("Error purging trash: %s", e)
+            return []
+        logger.info("Trash purged", extra={'count': len(purged)})
+        for video_id in purged:
+            self._emit('video_deleted', video_id=video_id)
+        return purged
+    
+    def get_trash(self, older_than: str = None, limit: int = None) -> List[Dict]:
+        """
+        Trashed videos, oldest deletion first
+        
+        Args:
+            older_than: Only videos trashed before this SQLite datetime
+            limit: Maximum number of rows
+        """
+        query = "SELECT * FROM videos WHERE deleted_at IS NOT NULL"
+        params = []
+        if older_than:
+            query += " AND deleted_at < ?"
+            params.append(older_than)
+        query += " ORDER BY deleted_at, id"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        return [dict(row) for row in self.conn.execute(query, params)]
+    
+    def notify_updated(self, video_ids: Iterable[int], fields: List[str]):
+        """Emit video_updated for rows a subsystem changed with its own SQL (e.g. a sync batch)"""
+        for video_id in video_ids:
+            self._emit('video_updated', video_id=video_id, fields=list(fields))
     
     def update_watch_info(self, video_id: int):
         """Update last watched time and increment watch count"""
@@ -204,24 +501,59 @@ class VideoDatabase:
         WHERE id = ?
         """
         try:
-            self.conn.execute(query, (video_id,))
-            self.conn.commit()
-            print(f"Watch info updated for video {video_id}")
+            with self.transaction():
+                self.conn.execute(query, (video_id,))
+            logger.debug("Watch info updated", extra={'video_id': video_id})
         except sqlite3.Error as e:
-            print(f"Error updating watch info: {e}")
+            if self._transaction_depth:
+                raise
+            logger.error("Error updating watch info: %s", e)
+    
+    def record_watch_event(self, video_id: int, student_id: str = 'local',
+                           event_type: str = 'progress', watch_seconds: int = 0) -> int:
+        """
+        Append an event to the watch history
+        
+        Args:
+            video_id: Video that was watched
+            student_id: Student (defaults to 'local' on single-student devices)
+            event_type: 'progress' or 'completed'
+            watch_seconds: Playback position reported by the player
+        
+        Returns:
+            Event ID
+        """
+        try:
+            with self.transaction():
+                cursor = self.conn.execute(
+                    """INSERT INTO watch_events (video_id, student_id, event_type, watch_seconds)
+                       VALUES (?, ?, ?, ?)""",
+                    (video_id, str(student_id), event_type, watch_seconds or 0)
+                )
+            event_id = cursor.lastrowid
+            self._emit('video_watched', video_id=video_id, student_id=str(student_id),
+                       event_type=event_type, watch_seconds=watch_seconds or 0, event_id=event_id)
+            return event_id
+        except sqlite3.Error as e:
+            if self._transaction_depth:
+                raise
+            logger.error("Error recording watch event: %s", e)
+            return None
     
     # Category Management
     def add_category(self, name: str, description: str = None) -> int:
         """Add a new category"""
         try:
-            cursor = self.conn.execute(
-                "INSERT INTO categories (name, description) VALUES (?, ?)",
-                (name, description)
-            )
-            self.conn.commit()
+            with self.transaction():
+                cursor = self.conn.execute(
+                    "INSERT INTO categories (name, description) VALUES (?, ?)",
+                    (name, description)
+                )
             return cursor.lastrowid
         except sqlite3.Error as e:
-            print(f"Error adding category: {e}")
+            if self._transaction_depth:
+                raise
+            logger.error("Error adding category: %s", e)
             return None
     
     def get_categories(self) -> List[Dict]:
@@ -230,21 +562,23 @@ class VideoDatabase:
             cursor = self.conn.execute("SELECT * FROM categories ORDER BY name")
             return [dict(row) for row in cursor.fetchall()]
         except sqlite3.Error as e:
-            print(f"Error getting categories: {e}")
+            logger.error("Error getting categories: %s", e)
             return []
     
     # Tag Management
     def add_tag(self, name: str, color: str = None) -> int:
         """Add a new tag"""
         try:
-            cursor = self.conn.execute(
-                "INSERT INTO tags (name, color) VALUES (?, ?)",
-                (name, color)
-            )
-            self.conn.commit()
+            with self.transaction():
+                cursor = self.conn.execute(
+                    "INSERT INTO tags (name, color) VALUES (?, ?)",
+                    (name, color)
+                )
             return cursor.lastrowid
         except sqlite3.Error as e:
-            print(f"Error adding tag: {e}")
+            if self._transaction_depth:
+                raise
+            logger.error("Error adding tag: %s", e)
             return None
     
     def get_tags(self) -> List[Dict]:
@@ -253,32 +587,38 @@ class VideoDatabase:
             cursor = self.conn.execute("SELECT * FROM tags ORDER BY name")
             return [dict(row) for row in cursor.fetchall()]
         except sqlite3.Error as e:
-            print(f"Error getting tags: {e}")
+            logger.error("Error getting tags: %s", e)
             return []
     
     def tag_video(self, video_id: int, tag_id: int):
         """Add a tag to a video"""
         try:
-            self.conn.execute(
-                "INSERT OR IGNORE INTO video_tags (video_id, tag_id) VALUES (?, ?)",
-                (video_id, tag_id)
-            )
-            self.conn.commit()
-            print(f"Tag {tag_id} added to video {video_id}")
+            with self.transaction():
+                self.conn.execute(
+                    "INSERT OR IGNORE INTO video_tags (video_id, tag_id) VALUES (?, ?)",
+                    (video_id, tag_id)
+                )
+            logger.debug("Tag added to video", extra={'video_id': video_id, 'tag_id': tag_id})
+            self._emit('video_tagged', video_id=video_id, tag_id=tag_id)
         except sqlite3.Error as e:
-            print(f"Error tagging video: {e}")
+            if self._transaction_depth:
+                raise
+            logger.error("Error tagging video: %s", e)
     
     def untag_video(self, video_id: int, tag_id: int):
         """Remove a tag from a video"""
         try:
-            self.conn.execute(
-                "DELETE FROM video_tags WHERE video_id = ? AND tag_id = ?",
-                (video_id, tag_id)
-            )
-            self.conn.commit()
-            print(f"Tag {tag_id} removed from video {video_id}")
+            with self.transaction():
+                self.conn.execute(
+                    "DELETE FROM video_tags WHERE video_id = ? AND tag_id = ?",
+                    (video_id, tag_id)
+                )
+            logger.debug("Tag removed from video", extra={'video_id': video_id, 'tag_id': tag_id})
+            self._emit('video_untagged', video_id=video_id, tag_id=tag_id)
         except sqlite3.Error as e:
-            print(f"Error removing tag: {e}")
+            if self._transaction_depth:
+                raise
+            logger.error("Error removing tag: %s", e)
     
     def get_video_tags(self, video_id: int) -> List[Dict]:
         """Get all tags for a video"""
@@ -292,21 +632,40 @@ class VideoDatabase:
             cursor = self.conn.execute(query, (video_id,))
             return [dict(row) for row in cursor.fetchall()]
         except sqlite3.Error as e:
-            print(f"Error getting video tags: {e}")
+            logger.error("Error getting video tags: %s", e)
             return []
     
+    def get_tags_for_videos(self, video_ids: Iterable[int]) -> Dict[int, List[Dict]]:
+        """{video_id: tags} for several videos in one query (videos without tags are absent)"""
+        query = """
+        SELECT vt.video_id, t.* FROM tags t
+        JOIN video_tags vt ON t.id = vt.tag_id
+        WHERE vt.video_id IN (SELECT value FROM json_each(?))
+        ORDER BY t.name
+        """
+        tags = {}
+        try:
+            for row in self.conn.execute(query, (json.dumps([int(i) for i in video_ids]),)):
+                tag = dict(row)
+                tags.setdefault(tag.pop('video_id'), []).append(tag)
+        except sqlite3.Error as e:
+            logger.error("Error getting video tags: %s", e)
+        return tags
+    
     # Playlist Management
     def create_playlist(self, name: str, description: str = None) -> int:
         """Create a new playlist"""
         try:
-            cursor = self.conn.execute(
-                "INSERT INTO playlists (name, description) VALUES (?, ?)",
-                (name, description)
-            )
-            self.conn.commit()
+            with self.transaction():
+                cursor = self.conn.execute(
+                    "INSERT INTO playlists (name, description) VALUES (?, ?)",
+                    (name, description)
+                )
             return cursor.lastrowid
         except sqlite3.Error as e:
-            print(f"Error creating playlist: {e}")
+            if self._transaction_depth:
+                raise
+            logger.error("Error creating playlist: %s", e)
             return None
     
     def get_playlists(self) -> List[Dict]:
@@ -315,29 +674,113 @@ class VideoDatabase:
             cursor = self.conn.execute("SELECT * FROM playlists ORDER BY name")
             return [dict(row) for row in cursor.fetchall()]
         except sqlite3.Error as e:
-            print(f"Error getting playlists: {e}")
+            logger.error("Error getting playlists: %s", e)
             return []
     
-    def add_to_playlist(self, playlist_id: int, video_id: int, position: int = None):
-        """Add video to playlist"""
-        if position is None:
-            # Get next position
+    def get_playlist_by_name(self, name: str) -> Optional[Dict]:
+        """Find a playlist by name, ignoring case"""
+        try:
             cursor = self.conn.execute(
-                "SELECT MAX(position) FROM playlist_videos WHERE playlist_id = ?",
-                (playlist_id,)
+                "SELECT * FROM playlists WHERE lower(name) = lower(?) ORDER BY id LIMIT 1", (name,)
             )
-            max_pos = cursor.fetchone()[0]
-            position = (max_pos or 0) + 1
+            row = cursor.fetchone()
+            return dict(row) if row else None
+        except sqlite3.Error as e:
+            logger.error("Error getting playlist: %s", e)
+            return None
+    
+    def add_to_playlist(self, playlist_id: int, video_id: int, position: int = None):
+        """Add video to playlist (at the end unless an explicit position key is given)"""
+        try:
+            with self.transaction():
+                if position is None:
+                    position = self._playlist_position(playlist_id)
+                self.conn.execute(
+                    "INSERT OR IGNORE INTO playlist_videos (playlist_id, video_id, position) VALUES (?, ?, ?)",
+                    (playlist_id, video_id, position)
+                )
+            logger.debug("Video added to playlist", extra={'video_id': video_id, 'playlist_id': playlist_id})
+        except sqlite3.Error as e:
+            if self._transaction_depth:
+                raise
+            logger.error("Error adding video to playlist: %s", e)
+    
+    def insert_into_playlist(self, playlist_id: int, video_id: int, index: int = None,
+                             after_video_id: int = None) -> bool:
+        """
+        Insert a video at an ordinal index, or right after another video
         
+        Args:
+            playlist_id: Playlist ID
+            video_id: Video to insert
+            index: 0-based position in the playlist (None appends)
+            after_video_id: Insert after this video instead of at an index
+        """
         try:
-            self.conn.execute(
-                "INSERT OR IGNORE INTO playlist_videos (playlist_id, video_id, position) VALUES (?, ?, ?)",
-                (playlist_id, video_id, position)
-            )
-            self.conn.commit()
-            print(f"Video {video_id} added to playlist {playlist_id}")
+            with self.transaction():
+                position = self._playlist_position(playlist_id, index, after_video_id, video_id)
+                self.conn.execute(
+                    "INSERT OR IGNORE INTO playlist_videos (playlist_id, video_id, position) VALUES (?, ?, ?)",
+                    (playlist_id, video_id, position)
+                )
+            return True
+        except (sqlite3.Error, ValueError) as e:
+            if self._transaction_depth:
+                raise
+            logger.error("Error inserting video into playlist: %s", e)
+            return False
+    
+    def move_in_playlist(self, playlist_id: int, video_id: int, index: int = None,
+                         after_video_id: int = None) -> bool:
+        """Move a video to an ordinal index or after another video (updates one row)"""
+        return self.reorder_playlist(playlist_id, [
+            {'videoId': video_id, 'index': index, 'afterVideoId': after_video_id}
+        ])
+    
+    def reorder_playlist(self, playlist_id: int, moves: List[Dict]) -> bool:
+        """
+        Apply several moves in one transaction
+        
+        Args:
+            playlist_id: Playlist ID
+            moves: [{'videoId', 'index' or 'afterVideoId'}] applied in order;
+                   an index of None with no afterVideoId moves to the end
+        """
+        try:
+            with self.transaction():
+                for move in moves:
+                    video_id = int(move['videoId'])
+                    after = move.get('afterVideoId')
+                    position = self._playlist_position(
+                        playlist_id, move.get('index'), int(after) if after is not None else None, video_id
+                    )
+                    cursor = self.conn.execute(
+                        "UPDATE playlist_videos SET position = ? WHERE playlist_id = ? AND video_id = ?",
+                        (position, playlist_id, video_id)
+                    )
+                    if cursor.rowcount == 0:
+                        raise ValueError(f"Video {video_id} is not in playlist {playlist_id}")
+            return True
+        except (sqlite3.Error, ValueError) as e:
+            if self._transaction_depth:
+                raise
+            logger.error("Error reordering playlist: %s", e)
+            return False
+    
+    def remove_from_playlist(self, playlist_id: int, video_id: int) -> bool:
+        """Remove a video from a playlist (the other positions are left as they are)"""
+        try:
+            with self.transaction():
+                cursor = self.conn.execute(
+                    "DELETE FROM playlist_videos WHERE playlist_id = ? AND video_id = ?",
+                    (playlist_id, video_id)
+                )
+            return cursor.rowcount > 0
         except sqlite3.Error as e:
-            print(f"Error adding video to playlist: {e}")
+            if self._transaction_depth:
+                raise
+            logger.error("Error removing video from playlist: %s", e)
+            return False
     
     def get_playlist_videos(self, playlist_id: int) -> List[Dict]:
         """Get videos in a playlist"""
@@ -345,16 +788,91 @@ class VideoDatabase:
         SELECT v.*, pv.position, pv.added_at
         FROM videos v
         JOIN playlist_videos pv ON v.id = pv.video_id
-        WHERE pv.playlist_id = ?
+        WHERE pv.playlist_id = ? AND v.deleted_at IS NULL
         ORDER BY pv.position
         """
         try:
             cursor = self.conn.execute(query, (playlist_id,))
             return [dict(row) for row in cursor.fetchall()]
         except sqlite3.Error as e:
-            print(f"Error getting playlist videos: {e}")
+            logger.error("Error getting playlist videos: %s", e)
             return []
     
+    def _playlist_position(self, playlist_id: int, index: int = None, after_video_id: int = None,
+                           moving_video_id: int = None) -> int:
+        """
+        Position key for a slot in a playlist
+        
+        Keys are spaced PLAYLIST_POSITION_GAP apart, so a new key is normally
+        picked halfway between the neighbours without touching other rows. When
+        repeated inserts at one spot use up a gap the playlist is renumbered
+        once, which keeps edits amortised O(1).
+        """
+        for _ in range(2):
+            lower, upper = self._playlist_neighbours(playlist_id, index, after_video_id, moving_video_id)
+            if lower is None and upper is None:
+                return self.PLAYLIST_POSITION_GAP
+            if upper is None:
+                return lower + self.PLAYLIST_POSITION_GAP
+            if lower is None:
+                return upper - self.PLAYLIST_POSITION_GAP
+            if upper - lower >= 2:
+                return (lower + upper) // 2
+            self._renumber_playlist(playlist_id)
+        raise ValueError(f"Could not find a free position in playlist {playlist_id}")
+    
+    def _playlist_neighbours(self, playlist_id: int, index: int, after_video_id: int,
+                             moving_video_id: int) -> Tuple[Optional[int], Optional[int]]:
+        """Position keys just before and after the target slot (None at either end)"""
+        exclude = moving_video_id if moving_video_id is not None else -1
+        if after_video_id is not None:
+            row = self.conn.execute(
+                "SELECT position FROM playlist_videos WHERE playlist_id = ? AND video_id = ?",
+                (playlist_id, after_video_id)
+            ).fetchone()
+            if not row:
+                raise ValueError(f"Video {after_video_id} is not in playlist {playlist_id}")
+            upper = self.conn.execute(
+                """SELECT MIN(position) FROM playlist_videos
+                   WHERE playlist_id = ? AND position > ? AND video_id != ?""",
+                (playlist_id, row[0], exclude)
+            ).fetchone()[0]
+            return row[0], upper
+        
+        if index is None:
+            lower = self.conn.execute(
+                "SELECT MAX(position) FROM playlist_videos WHERE playlist_id = ? AND video_id != ?",
+                (playlist_id, exclude)
+            ).fetchone()[0]
+            return lower, None
+        
+        # Indexes count the items get_playlist_videos shows, so trashed videos are skipped
+        index = max(int(index), 0)
+        cursor = self.conn.execute(
+            """SELECT pv.position FROM playlist_videos pv
+               JOIN videos v ON v.id = pv.video_id AND v.deleted_at IS NULL
+               WHERE pv.playlist_id = ? AND pv.video_id != ?
+               ORDER BY pv.position LIMIT 2 OFFSET ?""",
+            (playlist_id, exclude, max(index - 1, 0))
+        )
+        keys = [row[0] for row in cursor.fetchall()]
+        if index == 0:
+            return None, keys[0] if keys else None
+        if not keys:
+            # Past the last item: append
+            return self._playlist_neighbours(playlist_id, None, None, moving_video_id)
+        return keys[0], (keys[1] if len(keys) > 1 else None)
+    
+    def _renumber_playlist(self, playlist_id: int):
+        """Respace every position key in a playlist by PLAYLIST_POSITION_GAP"""
+        self.conn.execute("""
+            UPDATE playlist_videos
+            SET position = ranked.rank * ?
+            FROM (SELECT video_id, ROW_NUMBER() OVER (ORDER BY position, video_id) AS rank
+                  FROM playlist_videos WHERE playlist_id = ?) AS ranked
+            WHERE playlist_videos.playlist_id = ? AND playlist_videos.video_id = ranked.video_id
+        """, (self.PLAYLIST_POSITION_GAP, playlist_id, playlist_id))
+    
     # Statistics and Reports
     def get_stats(self) -> Dict:
         """Get database statistics"""
@@ -362,20 +880,26 @@ class VideoDatabase:
         
         try:
             # Total videos
-            cursor = self.conn.execute("SELECT COUNT(*) FROM videos")
+            cursor = self.conn.execute("SELECT COUNT(*) FROM videos WHERE deleted_at IS NULL")
             stats['total_videos'] = cursor.fetchone()[0]
             
-            # Total storage used
-            cursor = self.conn.execute("SELECT SUM(file_size) FROM videos WHERE file_size IS NOT NULL")
-            total_size = cursor.fetchone()[0] or 0
+            # Total storage used (trashed files stay on disk until reclaimed)
+            cursor = self.conn.execute("""
+                SELECT SUM(file_size), COUNT(deleted_at), SUM(CASE WHEN deleted_at IS NOT NULL THEN file_size END)
+                FROM videos
+            """)
+            total_size, trash_count, trash_size = cursor.fetchone()
+            total_size = total_size or 0
             stats['total_storage_bytes'] = total_size
             stats['total_storage_gb'] = round(total_size / (1024**3), 2)
+            stats['trash_videos'] = trash_count
+            stats['trash_bytes'] = trash_size or 0
             
             # Videos by category
             cursor = self.conn.execute("""
                 SELECT c.name, COUNT(v.id) as count 
                 FROM categories c 
-                LEFT JOIN videos v ON c.id = v.category_id 
+                LEFT JOIN videos v ON c.id = v.category_id AND v.deleted_at IS NULL
                 GROUP BY c.id, c.name
                 ORDER BY count DESC
             """)
@@ -385,7 +909,7 @@ class VideoDatabase:
             cursor = self.conn.execute("""
                 SELECT title, rating, watch_count 
                 FROM videos 
-                WHERE rating IS NOT NULL 
+                WHERE rating IS NOT NULL AND deleted_at IS NULL
                 ORDER BY rating DESC, watch_count DESC 
                 LIMIT 10
             """)
@@ -395,32 +919,56 @@ class VideoDatabase:
             cursor = self.conn.execute("""
                 SELECT title, watch_count, rating 
                 FROM videos 
+                WHERE deleted_at IS NULL
                 ORDER BY watch_count DESC, rating DESC 
                 LIMIT 10
             """)
             stats['most_watched_videos'] = [dict(row) for row in cursor.fetchall()]
             
         except sqlite3.Error as e:
-            print(f"Error getting statistics: {e}")
+            logger.error("Error getting statistics: %s", e)
         
         return stats
     
-    def export_data(self, export_path: str):
-        """Export all data to JSON file"""
-        data = {
-            'videos': self.get_all_videos(),
-            'categories': self.get_categories(),
-            'tags': self.get_tags(),
-            'playlists': self.get_playlists(),
+    def export_sections(self) -> Dict:
+        """Sections of a full data export, with the video library streamed from a cursor"""
+        return {
+            'videos': QuerySource("""
+                SELECT v.*, c.name as category_name
+                FROM videos v
+                LEFT JOIN categories c ON v.category_id = c.id
+                WHERE v.deleted_at IS NULL
+                ORDER BY v.download_date DESC
+            """),
+            'categories': QuerySource("SELECT * FROM categories ORDER BY name"),
+            'tags': QuerySource("SELECT * FROM tags ORDER BY name"),
+            'playlists': QuerySource("SELECT * FROM playlists ORDER BY name"),
             'stats': self.get_stats()
         }
+    
+    def export_data(self, export_path: str, format: str = 'json', compress: bool = False,
+                    progress_callback=None) -> Optional[Dict]:
+        """
+        Export all data to a file without loading the whole library in memory
+        
+        Args:
+            export_path: Destination file
+            format: 'json', 'jsonl' or 'csv' (CSV exports the videos table)
+            compress: Write gzip-compressed output
+            progress_callback: Optional (section, rows_written, total) callback
         
+        Returns:
+            Export summary, or None if the export failed
+        """
+        exporter = StreamingExporter(self, progress_callback=progress_callback)
         try:
-            with open(export_path, 'w', encoding='utf-8') as f:
-                json.dump(data, f, indent=2, default=str)
-            print(f"Data exported to {export_path}")
+            summary = exporter.export(export_path, self.export_sections(),
+                                      format=format, compress=compress)
+            logger.info("Data exported", extra={'path': export_path})
+            return summary
         except Exception as e:
-            print(f"Error exporting data: {e}")
+            logger.error("Error exporting data: %s", e)
+            return None
     
     def __enter__(self):
         """Context manager entry"""
@@ -436,11 +984,12 @@ def create_database(db_path: str = "video_database.db"):
     """Create and initialize a new video database"""
     db = VideoDatabase(db_path)
     db.close()
-    print(f"Video database created at: {db_path}")
+    logger.info("Video database created", extra={'db_path': db_path})
 
 
 if __name__ == "__main__":
     # Example usage
+    configure_logging()
     with VideoDatabase() as db:
         print("Video Database Manager initialized successfully!")
         print("\nDatabase Statistics:")
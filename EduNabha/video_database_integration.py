@@ -6,23 +6,112 @@ Connects your existing React frontend with enhanced offline video management
 import sqlite3
 import json
 import os
-import shutil
-from datetime import datetime
-from pathlib import Path
+from datetime import datetime, timedelta
+from functools import cached_property
 from student_video_manager import StudentVideoManager
+from video_export import StreamingExporter, parse_export_format, export_extension
+from instrumentation import METRICS, configure_logging, get_logger, instrument_methods
+from profiling import profile_methods
 
 
+logger = get_logger('integration')
+
+
+@instrument_methods
+@profile_methods
 class EduNabhaVideoIntegration:
     """Integration layer between your React app and the video database"""
     
-    def __init__(self, db_path: str = "edunabha_videos.db", upload_dir: str = None):
-        self.db = StudentVideoManager(db_path)
+    def __init__(self, db_path: str = "edunabha_videos.db", upload_dir: str = None,
+                 read_only: bool = False):
+        """
+        Args:
+            db_path: SQLite database file
+            upload_dir: Where uploaded and packaged videos are stored
+            read_only: Only query methods will be called (e.g. a one-shot wrapper
+                command): the upload directory is not created, default
+                categories and tags are not seeded and the recommendation
+                index is not kept up to date
+        """
+        self.db_path = db_path
         self.upload_dir = upload_dir or r"C:\nabha\edunabha\server\uploads\videos"
-        self.ensure_upload_directory()
+        self.read_only = read_only
+        if not read_only:
+            self.ensure_upload_directory()
+            self.recommender.attach()
+            self.search_index.attach()
+    
+    # The database and subsystems are opened/imported on first use, so a
+    # short-lived process only pays for what its command touches
+    @cached_property
+    def db(self) -> StudentVideoManager:
+        return StudentVideoManager(self.db_path, read_only=self.read_only)
+    
+    @cached_property
+    def uploads(self):
+        from upload_ingestion import ResumableUploadService
+        return ResumableUploadService(self)
+    
+    @cached_property
+    def renditions(self):
+        from video_renditions import RenditionManager
+        return RenditionManager(self.db, os.path.join(self.upload_dir, 'renditions'))
+    
+    @cached_property
+    def downloads(self):
+        from segmented_downloads import DownloadTracker
+        return DownloadTracker(self.db)
+    
+    @cached_property
+    def recommender(self):
+        from recommendation_engine import RecommendationEngine
+        return RecommendationEngine(self.db)
+    
+    @cached_property
+    def tag_index(self):
+        from tag_index import TagIndex
+        index = TagIndex(self.db)
+        index.attach()
+        return index
+    
+    @cached_property
+    def search_index(self):
+        from fuzzy_search import FuzzySearchIndex
+        return FuzzySearchIndex(self.db, read_only=self.read_only)
+    
+    @cached_property
+    def integrity(self):
+        from integrity_scanner import IntegrityScanner
+        return IntegrityScanner(self.db, self.upload_dir)
+    
+    @cached_property
+    def analytics(self):
+        from video_analytics import VideoAnalytics
+        return VideoAnalytics(self.db)
+    
+    @cached_property
+    def rollups(self):
+        from watch_rollups import WatchRollups
+        return WatchRollups(self.db)
+    
+    @cached_property
+    def backups(self):
+        from database_backup import BackupManager
+        return BackupManager(self.db, f"{self.db_path}.backups")
+    
+    @cached_property
+    def sync(self):
+        from sync_engine import SyncEngine
+        return SyncEngine(self.db)
+    
+    @cached_property
+    def reclaimer(self):
+        from trash_reclaimer import TrashReclaimer
+        return TrashReclaimer(self.db, rendition_root=os.path.join(self.upload_dir, 'renditions'))
     
     def ensure_upload_directory(self):
         """Ensure upload directory exists"""
-        Path(self.upload_dir).mkdir(parents=True, exist_ok=True)
+        os.makedirs(self.upload_dir, exist_ok=True)
     
     def add_downloaded_video(self, video_data: dict) -> dict:
         """
@@ -47,22 +136,33 @@ class EduNabhaVideoIntegration:
         # Convert file path to absolute path if relative
         if file_path and not os.path.isabs(file_path):
             file_path = os.path.join(self.upload_dir, file_path.lstrip('/'))
+        if file_path and not os.path.exists(file_path):
+            # Still recorded (the file may arrive later); scan_library reports it as missing
+            logger.warning("Video file %s does not exist", file_path, extra={'title': title})
         
-        # Add to enhanced database
-        video_id = self.db.add_downloaded_video(
-            title=title,
-            download_path=file_path,
-            course=course_title,
-            description=description,
-            duration=duration,
-            format=os.path.splitext(file_path)[1][1:] if file_path else 'mp4',
-            resolution=quality,
-            file_size=file_size
-        )
-        
-        # Auto-create course playlist
-        if course_title != 'Unknown Course':
-            self.db.add_to_course_playlist(course_title, video_id)
+        # Add to enhanced database, with its tags and playlist entry in one commit
+        try:
+            with self.db.transaction():
+                video_id = self.db.add_downloaded_video(
+                    title=title,
+                    download_path=file_path,
+                    course=course_title,
+                    module=video_data.get('module', ''),
+                    description=description,
+                    duration=duration,
+                    format=os.path.splitext(file_path)[1][1:] if file_path else 'mp4',
+                    resolution=quality,
+                    file_size=file_size
+                )
+                
+                # Auto-create course playlist
+                if video_id and course_title != 'Unknown Course':
+                    self.db.add_to_course_playlist(course_title, video_id)
+        except sqlite3.Error as e:
+            if self.db.in_unit_of_work:
+                raise
+            logger.error("Error adding downloaded video: %s", e, extra={'title': title})
+            return video_data
         
         # Return enhanced data for your React app
         enhanced_video = self.db.get_video(video_id)
@@ -71,13 +171,191 @@ class EduNabhaVideoIntegration:
         
         return video_data
     
+    def create_upload(self, upload_data: dict) -> dict:
+        """
+        Start a resumable upload
+        
+        Args:
+            upload_data: {'fileName', 'length', 'checksum' (optional),
+                          'video': video data for add_downloaded_video}
+        """
+        from upload_ingestion import UploadError
+        try:
+            status = self.uploads.create_upload(
+                upload_data.get('fileName', 'upload.mp4'),
+                upload_data.get('length'),
+                metadata=upload_data.get('video'),
+                checksum=upload_data.get('checksum')
+            )
+            return {'success': True, **status}
+        except UploadError as e:
+            return {'success': False, 'error': str(e), 'statusCode': e.status_code}
+    
+    def upload_chunk(self, chunk_data: dict) -> dict:
+        """
+        Append a chunk to a resumable upload
+        
+        Args:
+            chunk_data: {'uploadId', 'offset', 'chunkPath', 'checksum' (optional)}
+        """
+        from upload_ingestion import UploadError
+        try:
+            with open(chunk_data['chunkPath'], 'rb') as chunk:
+                status = self.uploads.append_chunk(
+                    chunk_data['uploadId'], chunk_data.get('offset', 0), chunk,
+                    checksum=chunk_data.get('checksum')
+                )
+            return {'success': True, **status}
+        except UploadError as e:
+            return {'success': False, 'error': str(e), 'statusCode': e.status_code}
+    
+    def get_upload_status(self, upload_id: str) -> dict:
+        """Offset and state of a resumable upload"""
+        from upload_ingestion import UploadError
+        try:
+            return {'success': True, **self.uploads.get_status(upload_id)}
+        except UploadError as e:
+            return {'success': False, 'error': str(e), 'statusCode': e.status_code}
+    
+    def abort_upload(self, upload_id: str) -> dict:
+        """Abort a resumable upload and discard its partial data"""
+        from upload_ingestion import UploadError
+        try:
+            return {'success': True, **self.uploads.abort_upload(upload_id)}
+        except UploadError as e:
+            return {'success': False, 'error': str(e), 'statusCode': e.status_code}
+    
+    def package_video_renditions(self, video_id: str) -> dict:
+        """Encode and segment a video into its adaptive bitrate ladder"""
+        try:
+            renditions = self.renditions.package_video(int(video_id))
+            return {'success': True, 'videoId': str(video_id), 'renditions': renditions}
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+    
+    def select_rendition_for_device(self, video_id: str, device: dict = None) -> dict:
+        """
+        Choose the rendition a device should download or stream
+        
+        Args:
+            video_id: Video ID
+            device: {'screenHeight', 'bandwidthKbps', 'maxBytes'} (all optional)
+        """
+        device = device or {}
+        try:
+            rendition = self.renditions.select_rendition(
+                int(video_id),
+                screen_height=device.get('screenHeight'),
+                bandwidth_kbps=device.get('bandwidthKbps'),
+                max_bytes=device.get('maxBytes')
+            )
+            if not rendition:
+                return {'success': False, 'error': 'No renditions packaged for this video'}
+            return {
+                'success': True,
+                'rendition': rendition,
+                'segments': self.renditions.get_segments(rendition['id'])
+            }
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+    
+    def start_segmented_download(self, video_id: str, options: dict = None) -> dict:
+        """
+        Begin (or resume) a segmented offline download
+        
+        Args:
+            video_id: Video ID
+            options: {'filePath', 'totalSize', 'segmentSize', 'segmentHashes'} (all optional)
+        """
+        options = options or {}
+        try:
+            video_id_int = int(video_id)
+            progress = self.downloads.start_download(
+                video_id_int,
+                file_path=options.get('filePath'),
+                total_size=options.get('totalSize'),
+                segment_size=options.get('segmentSize')
+            )
+            if options.get('segmentHashes'):
+                self.downloads.set_segment_hashes(video_id_int, options['segmentHashes'])
+            return {
+                'success': True,
+                'download': progress,
+                'resumeRanges': self.downloads.get_resume_ranges(video_id_int)
+            }
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+    
+    def record_downloaded_segments(self, video_id: str, segments: list) -> dict:
+        """Mark segments the client has finished writing"""
+        try:
+            progress = self.downloads.mark_segments_complete(int(video_id), segments)
+            return {'success': True, 'download': progress}
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+    
+    def get_download_plan(self, video_id: str, playback_seconds: float = 0, limit: int = None) -> dict:
+        """Missing segments ordered around the current playback position"""
+        try:
+            video_id_int = int(video_id)
+            return {
+                'success': True,
+                'download': self.downloads.get_progress(video_id_int),
+                'segments': self.downloads.prioritize_segments(
+                    video_id_int, playback_seconds=playback_seconds, limit=limit
+                )
+            }
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+    
+    def verify_download(self, video_id: str) -> dict:
+        """Re-check downloaded segments and clear the ones that are corrupt"""
+        try:
+            return {'success': True, **self.downloads.verify(int(video_id))}
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+    
+    def plan_prefetch(self, options: dict = None) -> dict:
+        """
+        Plan overnight pre-downloads
+        
+        Args:
+            options: {'storageBudgetMB', 'bandwidthKbps', 'window': ['22:00', '06:00'],
+                      'maxItems'} (all optional; the budget defaults to 2GB)
+        """
+        from prefetch_scheduler import PrefetchPlanner
+        options = options or {}
+        planner = PrefetchPlanner(self.db)
+        window = options.get('window')
+        return planner.plan(
+            storage_budget_bytes=int(options.get('storageBudgetMB', 2048) * 1024 * 1024),
+            bandwidth_kbps=options.get('bandwidthKbps'),
+            window=tuple(window) if window else None,
+            max_items=options.get('maxItems')
+        )
+    
     def get_offline_videos_for_react(self) -> list:
         """Get offline videos in the format your React app expects"""
         videos = self.db.get_all_videos()
-        return [self.format_for_react(video) for video in videos]
+        return self.format_videos_for_react(videos)
     
-    def format_for_react(self, db_video: dict) -> dict:
-        """Convert database video format to your React app format"""
+    def format_videos_for_react(self, videos: list) -> list:
+        """format_for_react for a page of videos, loading their downloads and tags in two queries"""
+        video_ids = [video['id'] for video in videos]
+        preloaded = {
+            'downloads': self.downloads.get_progress_many(video_ids),
+            'tags': self.db.get_tags_for_videos(video_ids)
+        }
+        return [self.format_for_react(video, preloaded) for video in videos]
+    
+    def format_for_react(self, db_video: dict, preloaded: dict = None) -> dict:
+        """
+        Convert database video format to your React app format
+        
+        Args:
+            db_video: Video row
+            preloaded: {'downloads', 'tags'} maps from format_videos_for_react
+        """
         # Extract course name from description
         course_name = "Unknown Course"
         if db_video.get('description'):
@@ -87,9 +365,18 @@ class EduNabhaVideoIntegration:
                     course_name = part.replace('Course: ', '')
                     break
         
+        # Videos without segment tracking were stored as whole files
+        if preloaded is None:
+            download = self.downloads.get_progress(db_video['id'])
+            tags = self.db.get_video_tags(db_video['id'])
+        else:
+            download = preloaded['downloads'].get(db_video['id'])
+            tags = preloaded['tags'].get(db_video['id'], [])
+        
         return {
             'id': str(db_video['id']),
-            'status': 'completed',
+            'status': download['status'] if download else 'completed',
+            'progress': download['progress'] if download else 100,
             'downloadedAt': db_video.get('download_date', datetime.now().isoformat()),
             'video': {
                 'id': str(db_video['id']),
@@ -107,21 +394,28 @@ class EduNabhaVideoIntegration:
                 'watchCount': db_video.get('watch_count', 0),
                 'lastWatched': db_video.get('last_watched'),
                 'rating': db_video.get('rating'),
-                'tags': self.db.get_video_tags(db_video['id'])
+                'tags': tags
             }
         }
     
-    def update_video_progress(self, video_id: str, watch_time: int, completed: bool) -> dict:
+    def update_video_progress(self, video_id: str, watch_time: int, completed: bool,
+                              student_id: str = 'local') -> dict:
         """Update video progress (enhanced version of your current function)"""
         try:
             video_id_int = int(video_id)
             
-            # Update watch info
-            self.db.update_watch_info(video_id_int)
-            
-            # Mark as completed if needed
-            if completed:
-                self.db.mark_as_completed(video_id_int)
+            with self.db.transaction():
+                self.db.record_watch_event(
+                    video_id_int, student_id=student_id or 'local',
+                    event_type='completed' if completed else 'progress',
+                    watch_seconds=watch_time
+                )
+                
+                # Mark as completed if needed (which updates the watch info too)
+                if completed:
+                    self.db.mark_as_completed(video_id_int)
+                else:
+                    self.db.update_watch_info(video_id_int)
             
             # Get updated video
             updated_video = self.db.get_video(video_id_int)
@@ -164,89 +458,285 @@ class EduNabhaVideoIntegration:
         }
     
     def delete_video_enhanced(self, video_id: str) -> dict:
-        """Enhanced video deletion with file cleanup"""
+        """
+        Move a video to the trash; its file is removed by the reclaimer once
+        the restore window has passed
+        """
         try:
             video_id_int = int(video_id)
             
-            # Get video info before deletion
             video = self.db.get_video(video_id_int)
             if not video:
                 return {'success': False, 'error': 'Video not found'}
             
-            # Delete physical file if it exists
-            file_path = video.get('file_path')
-            if file_path and os.path.exists(file_path):
-                try:
-                    os.remove(file_path)
-                except Exception as e:
-                    print(f"Warning: Could not delete file {file_path}: {e}")
-            
-            # Delete from database
-            self.db.delete_video(video_id_int)
+            self.db.trash_videos([video_id_int])
             
             return {
                 'success': True,
-                'message': f"Video '{video['title']}' deleted successfully",
-                'deletedVideo': self.format_for_react(video)
+                'message': f"Video '{video['title']}' moved to trash",
+                'deletedVideo': self.format_for_react(video),
+                'restorableUntil': self._restorable_until()
             }
             
         except Exception as e:
             return {'success': False, 'error': str(e)}
     
+    def delete_videos_bulk(self, options: dict) -> dict:
+        """
+        Move every video matching a selector to the trash in one transaction
+        
+        Args:
+            options: {'videoIds': [...], 'course': name, 'tag': name,
+                      'expression': tag index filter, e.g. 'Optional AND Completed'};
+                the given selectors are intersected, at least one is required
+        """
+        selected = None
+        try:
+            if options.get('videoIds') is not None:
+                selected = {int(i) for i in options['videoIds']}
+            if options.get('course') is not None or options.get('tag') is not None:
+                matched = set(self.db.match_video_ids(course=options.get('course'), tag=options.get('tag')))
+                selected = matched if selected is None else selected & matched
+            if options.get('expression'):
+                matched = set(self.tag_index.query(options['expression']))
+                selected = matched if selected is None else selected & matched
+        except ValueError as e:
+            return {'success': False, 'error': str(e), 'statusCode': 400}
+        if selected is None:
+            return {'success': False, 'error': 'videoIds, course, tag or expression is required',
+                    'statusCode': 400}
+        trashed = self.db.trash_videos(sorted(selected))
+        return {
+            'success': True,
+            'deletedIds': [str(i) for i in trashed],
+            'deleted': len(trashed),
+            'restorableUntil': self._restorable_until()
+        }
+    
+    def restore_deleted_videos(self, video_ids: list) -> dict:
+        """Take videos back out of the trash before they are reclaimed"""
+        restored = self.db.restore_videos(int(i) for i in video_ids)
+        return {'success': True, 'restoredIds': [str(i) for i in restored], 'restored': len(restored)}
+    
+    def get_trash_listing(self, limit: int = None) -> dict:
+        """Trashed videos, oldest first, with when each will be reclaimed"""
+        trash = self.db.get_trash(limit=limit)
+        videos = self.format_videos_for_react(trash)
+        for entry, video in zip(videos, trash):
+            entry['deletedAt'] = video['deleted_at']
+            entry['restorableUntil'] = self._restorable_until(video['deleted_at'])
+        return {'success': True, 'videos': videos, 'total': len(videos),
+                'retentionHours': self.reclaimer.retention_hours}
+    
+    def reclaim_trash(self, options: dict = None) -> dict:
+        """
+        Purge trashed videos past the restore window now
+        
+        Args:
+            options: {'all': ignore the restore window, 'limit': max videos}
+        """
+        options = options or {}
+        limit = options.get('limit')
+        result = self.reclaimer.reclaim(purge_all=bool(options.get('all')),
+                                        limit=int(limit) if limit is not None else None)
+        return {'success': not result['errors'], **result}
+    
+    def _restorable_until(self, deleted_at: str = None) -> str:
+        """UTC time after which a video trashed at deleted_at (default now) may be purged"""
+        deleted = datetime.strptime(deleted_at, '%Y-%m-%d %H:%M:%S') if deleted_at else datetime.utcnow()
+        return (deleted + timedelta(hours=self.reclaimer.retention_hours)).strftime('%Y-%m-%d %H:%M:%S')
+    
+    # Independent queries behind the study dashboard, run one after another here
+    # and concurrently by AsyncEduNabhaVideoIntegration
+    DASHBOARD_QUERIES = {
+        'schedule': lambda db: db.get_study_schedule(),
+        'progress': lambda db: db.get_course_progress(),
+        'stats': lambda db: db.get_stats(),
+        'completedCount': lambda db: db.count_tagged_videos("Completed"),
+        'pendingCount': lambda db: db.count_pending_videos(),
+        'videos': lambda db: db.get_all_videos(),
+        'highPriority': lambda db: db.get_high_priority_videos()
+    }
+    
     def get_study_dashboard(self) -> dict:
         """Get comprehensive study dashboard data"""
-        schedule = self.db.get_study_schedule()
-        progress = self.db.get_course_progress()
-        stats = self.db.get_stats()
+        parts = {name: query(self.db) for name, query in self.DASHBOARD_QUERIES.items()}
+        return self.build_study_dashboard(parts)
+    
+    @staticmethod
+    def build_study_dashboard(parts: dict) -> dict:
+        """Assemble the dashboard from the results of DASHBOARD_QUERIES"""
+        stats = parts['stats']
+        videos = parts['videos']
         
         return {
             'summary': {
                 'totalVideos': stats.get('total_videos', 0),
-                'completedVideos': len(self.db.search_videos(tag_name="Completed")),
-                'pendingVideos': len(self.db.get_pending_videos()),
-                'totalWatchTime': sum(v.get('duration', 0) for v in self.db.get_all_videos() if v.get('watch_count', 0) > 0),
+                'completedVideos': parts['completedCount'],
+                'pendingVideos': parts['pendingCount'],
+                'totalWatchTime': sum(v.get('duration', 0) for v in videos if v.get('watch_count', 0) > 0),
                 'storageUsed': stats.get('total_storage_gb', 0)
             },
-            'studySchedule': schedule,
-            'courseProgress': progress,
-            'recentVideos': self.db.get_all_videos()[:5],  # Last 5 videos
-            'highPriority': self.db.get_high_priority_videos()
+            'studySchedule': parts['schedule'],
+            'courseProgress': parts['progress'],
+            'recentVideos': videos[:5],  # Last 5 videos
+            'highPriority': parts['highPriority']
         }
     
-    def search_videos_enhanced(self, query: str = "", filters: dict = None) -> list:
-        """Enhanced video search with multiple filters"""
+    def get_study_plan(self, options: dict = None) -> dict:
+        """
+        Day-by-day spaced-repetition study plan
+    
+        Args:
+            options: {'studentId': 'local', 'days': 7, 'minutes': daily budget
+                      for this plan only, 'start': 'YYYY-MM-DD'}
+        """
+        options = options or {}
+        try:
+            days = int(options.get('days', 7))
+            if not 1 <= days <= 60:
+                raise ValueError("days must be between 1 and 60")
+            start = datetime.strptime(options['start'], '%Y-%m-%d').date() if options.get('start') else None
+            minutes = int(options['minutes']) if options.get('minutes') is not None else None
+        except ValueError as e:
+            return {'success': False, 'error': str(e), 'statusCode': 400}
+        student_id = str(options.get('studentId', 'local'))
+        return {
+            'success': True,
+            'studentId': student_id,
+            'days': self.db.scheduler.plan(student_id, days=days, start=start, minutes=minutes)
+        }
+    
+    def set_study_budget(self, options: dict) -> dict:
+        """
+        Store how long a student can study each day
+    
+        Args:
+            options: {'studentId': 'local', 'dailyMinutes': 60,
+                      'weekdayMinutes': [Mon..Sun, null = dailyMinutes] (optional)}
+        """
+        try:
+            self.db.scheduler.set_budget(str(options.get('studentId', 'local')),
+                                         options.get('dailyMinutes'), options.get('weekdayMinutes'))
+        except ValueError as e:
+            return {'success': False, 'error': str(e), 'statusCode': 400}
+        return {'success': True}
+    
+    def record_study_review(self, options: dict) -> dict:
+        """
+        Grade a review of a video (SM-2 quality: 0 forgot ... 5 perfect recall)
+    
+        Args:
+            options: {'videoId', 'grade', 'studentId': 'local'}
+        """
+        if options.get('videoId') is None:
+            return {'success': False, 'error': 'videoId is required', 'statusCode': 400}
+        try:
+            card = self.db.scheduler.record_review(int(options['videoId']), options.get('grade'),
+                                                   str(options.get('studentId', 'local')))
+        except ValueError as e:
+            return {'success': False, 'error': str(e), 'statusCode': 400}
+        except KeyError:
+            return {'success': False, 'error': 'Video not found', 'statusCode': 404}
+        return {'success': True, 'card': card}
+    
+    def search_videos_enhanced(self, query: str = "", filters: dict = None):
+        """
+        Enhanced video search with multiple filters
+        
+        Args:
+            query: Text matched against titles and descriptions, tolerating typos
+                and romanized Hindi/Punjabi (see fuzzy_search.py); results are
+                ranked by how well they match
+            filters: {'category_id', 'tag', 'rating', 'expression', 'facets', 'fuzzy'}
+                (all optional). 'expression' is a boolean filter over tags,
+                categories and ratings answered from the tag index, e.g.
+                'Exam Material AND Difficult AND NOT (Completed OR category:Webinars)';
+                'facets' adds per-tag, category and rating counts of the matches;
+                'fuzzy': false matches query as a plain substring instead
+        
+        Returns:
+            List of videos, or {'videos', 'total', 'facets'} when facets are requested
+        """
         filters = filters or {}
+        video_ids = None
+        if filters.get('expression'):
+            video_ids = self.tag_index.query(filters['expression'])
+        
+        # Substring matching is the fallback when no word matches even fuzzily
+        ranking = None
+        if query and filters.get('fuzzy') not in (False, '0', 'false'):
+            ranked = self.search_index.search(query)
+            if ranked:
+                ranking = {video_id: position for position, (video_id, _) in enumerate(ranked)}
+                video_ids = [video_id for video_id in ranking if video_ids is None or video_id in video_ids]
         
         results = self.db.search_videos(
-            search_term=query,
+            search_term=query if ranking is None else "",
             category_id=filters.get('category_id'),
             tag_name=filters.get('tag'),
-            rating=filters.get('rating')
+            rating=filters.get('rating'),
+            video_ids=video_ids
         )
+        if ranking is not None:
+            results.sort(key=lambda video: ranking[video['id']])
+        videos = self.format_videos_for_react(results)
         
-        return [self.format_for_react(video) for video in results]
+        if filters.get('facets') in (None, False, '', '0', 'false'):
+            return videos
+        if ranking is None and video_ids is not None and len(results) == len(video_ids):
+            matches = video_ids  # No other filter narrowed the expression's matches
+        else:
+            from tag_index import RoaringBitmap
+            matches = RoaringBitmap(video['id'] for video in results)
+        return {'videos': videos, 'total': len(videos), 'facets': self.tag_index.facet_counts(matches)}
     
-    def export_study_data(self, format: str = 'json') -> str:
-        """Export study data for backup/analysis"""
+    def export_study_data(self, format: str = 'json', progress_callback=None,
+                          exporter: StreamingExporter = None) -> str:
+        """
+        Export study data for backup/analysis
+        
+        Args:
+            format: 'json', 'jsonl' or 'csv', optionally with a '.gz' suffix
+                (e.g. 'jsonl.gz') for gzip-compressed output
+            progress_callback: Optional (section, rows_written, total) callback
+            exporter: Pre-built exporter, so long exports can be cancelled
+        
+        Returns:
+            Export filename, or None if the format is unsupported or the export failed
+        """
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        base_format, compress = parse_export_format(format)
         
-        if format == 'json':
-            filename = f"edunabha_study_export_{timestamp}.json"
-            self.db.export_study_report(filename)
-            return filename
+        if base_format not in StreamingExporter.FORMATS:
+            return None
         
-        # Could add other formats like CSV, PDF etc.
-        return None
+        filename = f"edunabha_study_export_{timestamp}{export_extension(base_format, compress)}"
+        summary = self.db.export_study_report(
+            filename, format=base_format, compress=compress,
+            progress_callback=progress_callback, exporter=exporter
+        )
+        return filename if summary else None
     
-    def get_recommendations(self) -> dict:
+    def get_recommendations(self, student_id: str = 'local') -> dict:
         """Get personalized study recommendations"""
-        pending = self.db.get_pending_videos()
-        high_priority = self.db.get_high_priority_videos()
+        pending_count = self.db.count_pending_videos()
+        high_priority_count = self.db.count_tagged_videos("High Priority")
         course_progress = self.db.get_course_progress()
         
+        # Served from the precomputed item-item index; newest pending videos on a cold start
+        next_to_watch = []
+        for item in self.recommender.recommend(student_id or 'local', k=3):
+            video = self.db.get_video(item['videoId'])
+            if video:
+                video['recommendationScore'] = item['score']
+                next_to_watch.append(video)
+        if not next_to_watch:
+            next_to_watch = self.db.get_pending_videos(limit=3)
+        
         recommendations = {
-            'nextToWatch': pending[:3] if pending else [],
-            'urgent': high_priority[:3] if high_priority else [],
+            'nextToWatch': next_to_watch,
+            'urgent': self.db.get_high_priority_videos(limit=3),
             'courseToFocus': None,
             'studyTips': []
         }
@@ -259,9 +749,9 @@ class EduNabhaVideoIntegration:
         
         # Generate study tips
         tips = []
-        if len(pending) > 10:
+        if pending_count > 10:
             tips.append("You have many unwatched videos. Consider setting a daily viewing goal.")
-        if len(high_priority) > 0:
+        if high_priority_count > 0:
             tips.append("You have high priority videos waiting. These might be exam-related!")
         if any(c['completion_percentage'] < 50 for c in course_progress):
             tips.append("Some courses need attention. Focus on completing one course at a time.")
@@ -270,9 +760,237 @@ class EduNabhaVideoIntegration:
         
         return recommendations
     
+    def get_similar_videos(self, video_id: str, limit: int = 5) -> list:
+        """Videos similar to one video, from the recommendation index"""
+        similar = []
+        for item in self.recommender.similar_videos(int(video_id), k=limit):
+            video = self.db.get_video(item['videoId'])
+            if video:
+                similar.append(video)
+        return self.format_videos_for_react(similar)
+    
+    def rebuild_recommendations(self) -> dict:
+        """Recompute the recommendation index from scratch"""
+        self.recommender.rebuild()
+        return {'success': True}
+    
+    def get_course_playlist(self, course_name: str) -> dict:
+        """Lectures of a course playlist in order"""
+        playlist = self.db.get_playlist_by_name(course_name)
+        if not playlist:
+            return {'success': False, 'error': f'No playlist for course {course_name}'}
+        videos = self.db.get_playlist_videos(playlist['id'])
+        return {
+            'success': True,
+            'playlistId': str(playlist['id']),
+            'name': playlist['name'],
+            'videos': self.format_videos_for_react(videos)
+        }
+    
+    def reorder_playlist(self, playlist_id: str, moves: list) -> dict:
+        """Apply drag-and-drop moves ([{'videoId', 'index' or 'afterVideoId'}])"""
+        success = self.db.reorder_playlist(int(playlist_id), moves)
+        return {'success': success}
+    
+    def remove_from_playlist(self, playlist_id: str, video_id: str) -> dict:
+        success = self.db.remove_from_playlist(int(playlist_id), int(video_id))
+        return {'success': success}
+    
+    # Analytics reports take snapshot=<name> | 'latest' to read a backup
+    # snapshot instead of the live database
+    def get_engagement_curve(self, days: int = 30, snapshot: str = None) -> list:
+        """Daily events, active students and watch minutes for the last days"""
+        return self._report(snapshot, lambda analytics: analytics.engagement_curve(days))
+    
+    def get_completion_funnel(self, snapshot: str = None) -> list:
+        """Per-course counts of started, half-watched and completed videos"""
+        return self._report(snapshot, lambda analytics: analytics.completion_funnel())
+    
+    def get_watch_time_distribution(self, snapshot: str = None) -> dict:
+        """Histogram of how far students get into videos"""
+        return self._report(snapshot, lambda analytics: analytics.watch_time_distribution())
+    
+    def get_cohort_retention(self, weeks: int = 8, snapshot: str = None) -> list:
+        """Weekly retention of students grouped by the week they started"""
+        return self._report(snapshot, lambda analytics: analytics.cohort_retention(weeks))
+    
+    def _report(self, snapshot, report):
+        if not snapshot:
+            return report(self.analytics)
+        from database_backup import BackupError
+        from video_analytics import VideoAnalytics
+        try:
+            reader = self.backups.open(snapshot)
+        except BackupError as e:
+            return {'success': False, 'error': str(e), 'statusCode': e.status_code}
+        with reader:
+            analytics = VideoAnalytics(reader)
+            try:
+                return report(analytics)
+            finally:
+                analytics.close()
+    
+    def get_watch_series(self, options: dict = None) -> dict:
+        """
+        Watch statistics over time from the rollup tables
+        
+        Args:
+            options: {'granularity': 'day' | 'hour', 'days': int, 'course': str, 'videoId': str}
+        """
+        options = options or {}
+        self.rollups.run_pending()
+        days = int(options.get('days', 30))
+        granularity = options.get('granularity', 'day')
+        
+        if granularity == 'hour':
+            end = datetime.utcnow().replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+            video_id = int(options['videoId']) if options.get('videoId') else None
+            series = self.rollups.hourly_series(end - timedelta(days=days), end,
+                                                video_id=video_id, course=options.get('course'))
+        else:
+            end_date = datetime.utcnow().date()
+            series = self.rollups.daily_series(end_date - timedelta(days=days - 1), end_date,
+                                               course=options.get('course'))
+        
+        return {
+            'granularity': granularity,
+            'series': series,
+            'courses': self.rollups.courses()
+        }
+    
+    def run_rollup_maintenance(self, options: dict = None) -> dict:
+        """Bring the rollups up to date and downsample old raw events"""
+        options = options or {}
+        processed = self.rollups.run_pending()
+        removed = self.rollups.apply_retention(
+            raw_days=int(options.get('rawDays', 180)),
+            hourly_days=int(options.get('hourlyDays', 35))
+        )
+        return {'success': True, 'eventsProcessed': processed, 'removed': removed}
+    
+    def scan_library(self, options: dict = None) -> dict:
+        """
+        Check the videos table against the files on disk
+        
+        Args:
+            options: {'verify': hash changed files and compare digests (default False)}
+        """
+        options = options or {}
+        return {'success': True, **self.integrity.scan(verify=bool(options.get('verify')))}
+    
+    def repair_library(self, options: dict = None) -> dict:
+        """
+        Scan and fix what was found
+        
+        Args:
+            options: {'missing': 'remove', 'orphaned': 'quarantine' | 'delete',
+                      'corrupted': 'accept' | 'quarantine'}; omitted categories are left alone
+        """
+        options = options or {}
+        try:
+            return self.integrity.repair(
+                missing=options.get('missing'),
+                orphaned=options.get('orphaned'),
+                corrupted=options.get('corrupted')
+            )
+        except ValueError as e:
+            return {'success': False, 'error': str(e), 'statusCode': 400}
+    
+    def create_backup(self, options: dict = None) -> dict:
+        """Snapshot the database now (options: {'label': str})"""
+        options = options or {}
+        return {'success': True, 'snapshot': self.backups.create(label=options.get('label', 'manual'))}
+    
+    def list_backups(self) -> dict:
+        """Manifests of the stored snapshots, newest first"""
+        return {'success': True, 'snapshots': self.backups.list()}
+    
+    def run_scheduled_backup(self, options: dict = None) -> dict:
+        """
+        Snapshot if the newest snapshot is too old, then apply retention
+        
+        Args:
+            options: {'intervalHours': 24, 'keepLast': 7, 'keepDaily': 14}
+        """
+        options = options or {}
+        result = self.backups.run_scheduled(
+            interval_hours=float(options.get('intervalHours', 24)),
+            keep_last=int(options.get('keepLast', 7)),
+            keep_daily=int(options.get('keepDaily', 14))
+        )
+        return {'success': True, **result}
+    
+    def restore_backup(self, options: dict = None) -> dict:
+        """
+        Restore the database from a snapshot
+        
+        Args:
+            options: {'name': snapshot name (default 'latest'),
+                      'safetySnapshot': snapshot the current data first (default True)}
+        """
+        from database_backup import BackupError
+        options = options or {}
+        try:
+            result = self.backups.restore(options.get('name', 'latest'),
+                                          safety_snapshot=options.get('safetySnapshot', True))
+        except BackupError as e:
+            return {'success': False, 'error': str(e), 'statusCode': e.status_code}
+        # Derived state was built from the replaced contents
+        self.recommender.rebuild()
+        if 'tag_index' in self.__dict__:
+            self.tag_index.load()
+        return {'success': True, **result}
+    
+    def sync_exchange(self, message: dict) -> dict:
+        """One round trip of a device's sync session (see SyncEngine.exchange)"""
+        if not message.get('node'):
+            return {'success': False, 'error': 'node is required', 'statusCode': 400}
+        return self.sync.exchange(message)
+    
+    def sync_with_server(self, options: dict) -> dict:
+        """
+        Synchronize the catalog with a server's video API
+        
+        Args:
+            options: {'url': server base URL, 'batchSize': rows per change set}
+        """
+        from sync_engine import HttpSyncPeer
+        peer = HttpSyncPeer(options['url'], timeout=float(options.get('timeout', 30)))
+        try:
+            return {'success': True, **self.sync.sync(peer, options.get('batchSize'))}
+        except OSError as e:
+            # Watermarks only move once a batch is applied: the next sync resumes from here
+            return {'success': False, 'error': f"Sync interrupted: {e}", 'statusCode': 502}
+    
+    def get_sync_status(self) -> dict:
+        return {'success': True, **self.sync.status()}
+    
+    def get_metrics(self, format: str = 'prometheus'):
+        """
+        Timing histograms, row counters and slow queries from every process
+        using this database
+        
+        A writer adds its own metrics first; a read-only integration (e.g. the
+        wrapper's get_metrics command) only reads what has been persisted.
+        
+        Args:
+            format: 'prometheus' for the text exposition format, 'json' for a dict
+        """
+        if not self.read_only:
+            METRICS.flush(self.db.conn)
+        if format == 'json':
+            return {
+                'prometheus': METRICS.render_prometheus(self.db.conn),
+                'slowQueries': METRICS.slow_queries(self.db.conn)
+            }
+        return METRICS.render_prometheus(self.db.conn)
+    
     def close(self):
-        """Close database connection"""
-        self.db.close()
+        """Close database connection (nothing to do if no command opened it)"""
+        if 'analytics' in self.__dict__:
+            self.analytics.close()
+        if 'db' in self.__dict__:
+            self.db.close()
 
 
 # Flask/Express.js integration helpers
@@ -454,6 +1172,7 @@ if __name__ == '__main__':
 
 if __name__ == "__main__":
     # Demo the integration
+    configure_logging()
     integration = EduNabhaVideoIntegration()
     
     print("EduNabha Video Database Integration")
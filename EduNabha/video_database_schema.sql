@@ -58,20 +58,357 @@ CREATE TABLE IF NOT EXISTS playlists (
 CREATE TABLE IF NOT EXISTS playlist_videos (
     playlist_id INTEGER,
     video_id INTEGER,
-    position INTEGER, -- Order in playlist
+    position INTEGER, -- Sort key, spaced out so items can be moved without renumbering
     added_at DATETIME DEFAULT CURRENT_TIMESTAMP,
     PRIMARY KEY (playlist_id, video_id),
     FOREIGN KEY (playlist_id) REFERENCES playlists (id) ON DELETE CASCADE,
     FOREIGN KEY (video_id) REFERENCES videos (id) ON DELETE CASCADE
 );
 
+-- Resumable (tus-style) upload sessions; chunks are appended to temp_path
+CREATE TABLE IF NOT EXISTS upload_sessions (
+    id TEXT PRIMARY KEY,
+    file_name TEXT NOT NULL,
+    upload_length INTEGER NOT NULL, -- Total size in bytes
+    upload_offset INTEGER NOT NULL DEFAULT 0, -- Bytes durably received so far
+    temp_path TEXT NOT NULL,
+    checksum_algorithm TEXT DEFAULT 'sha256',
+    expected_checksum TEXT, -- Whole-file digest announced by the client (hex)
+    final_checksum TEXT, -- Digest computed while the chunks arrived (hex)
+    metadata TEXT, -- JSON video data passed to add_downloaded_video
+    status TEXT DEFAULT 'active', -- active, finalizing, completed, failed, aborted
+    video_id INTEGER,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (video_id) REFERENCES videos (id) ON DELETE SET NULL
+);
+
+-- Encoded variants of a video for adaptive bitrate delivery
+CREATE TABLE IF NOT EXISTS video_renditions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    video_id INTEGER NOT NULL,
+    label TEXT NOT NULL, -- Ladder rung (240p, 360p, 720p, etc.)
+    width INTEGER,
+    height INTEGER NOT NULL,
+    bitrate_kbps INTEGER NOT NULL,
+    codec TEXT,
+    playlist_path TEXT, -- HLS media playlist for this rendition
+    total_size INTEGER DEFAULT 0, -- Sum of segment sizes in bytes
+    segment_duration INTEGER, -- Target segment length in seconds
+    segment_count INTEGER DEFAULT 0,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (video_id, label),
+    FOREIGN KEY (video_id) REFERENCES videos (id) ON DELETE CASCADE
+);
+
+-- Segment index of each rendition
+CREATE TABLE IF NOT EXISTS rendition_segments (
+    rendition_id INTEGER NOT NULL,
+    sequence INTEGER NOT NULL,
+    file_path TEXT NOT NULL,
+    byte_size INTEGER NOT NULL,
+    duration REAL NOT NULL, -- Seconds
+    PRIMARY KEY (rendition_id, sequence),
+    FOREIGN KEY (rendition_id) REFERENCES video_renditions (id) ON DELETE CASCADE
+);
+
+-- Offline downloads tracked as fixed-size segments
+CREATE TABLE IF NOT EXISTS video_downloads (
+    video_id INTEGER PRIMARY KEY,
+    file_path TEXT NOT NULL, -- Local (partial) file the segments are written to
+    total_size INTEGER NOT NULL, -- Size in bytes
+    segment_size INTEGER NOT NULL, -- Bytes per segment (the last may be shorter)
+    segment_count INTEGER NOT NULL,
+    completed_bitmap BLOB NOT NULL, -- One bit per segment, least significant bit first
+    completed_segments INTEGER DEFAULT 0,
+    status TEXT DEFAULT 'pending', -- pending, downloading, completed
+    started_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (video_id) REFERENCES videos (id) ON DELETE CASCADE
+);
+
+-- Expected segment digests, used to verify downloaded data
+CREATE TABLE IF NOT EXISTS download_segment_hashes (
+    video_id INTEGER NOT NULL,
+    segment_index INTEGER NOT NULL,
+    sha256 TEXT NOT NULL,
+    PRIMARY KEY (video_id, segment_index),
+    FOREIGN KEY (video_id) REFERENCES video_downloads (video_id) ON DELETE CASCADE
+);
+
+-- Watch history, one row per progress or completion event
+CREATE TABLE IF NOT EXISTS watch_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    video_id INTEGER NOT NULL,
+    student_id TEXT NOT NULL DEFAULT 'local', -- 'local' on single-student devices
+    event_type TEXT NOT NULL DEFAULT 'progress', -- progress, completed
+    watch_seconds INTEGER DEFAULT 0, -- Playback position reported with the event
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (video_id) REFERENCES videos (id) ON DELETE CASCADE
+);
+
+-- Recommendation index: co-watch counts between video pairs (video_a < video_b)
+CREATE TABLE IF NOT EXISTS cowatch_counts (
+    video_a INTEGER NOT NULL,
+    video_b INTEGER NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (video_a, video_b)
+) WITHOUT ROWID;
+
+-- Recommendation index: TF-IDF weights of title/description terms
+CREATE TABLE IF NOT EXISTS video_terms (
+    term TEXT NOT NULL,
+    video_id INTEGER NOT NULL,
+    weight REAL NOT NULL,
+    PRIMARY KEY (term, video_id)
+) WITHOUT ROWID;
+
+-- Recommendation index: precomputed top neighbours of each video
+CREATE TABLE IF NOT EXISTS video_neighbors (
+    video_id INTEGER NOT NULL,
+    neighbor_id INTEGER NOT NULL,
+    source TEXT NOT NULL, -- cowatch, content
+    score REAL NOT NULL,
+    PRIMARY KEY (video_id, source, neighbor_id)
+) WITHOUT ROWID;
+
+-- Watch statistics rollups, built incrementally from watch_events
+CREATE TABLE IF NOT EXISTS watch_rollups_hourly (
+    bucket TEXT NOT NULL, -- 'YYYY-MM-DD HH:00:00' (UTC)
+    video_id INTEGER NOT NULL,
+    course TEXT NOT NULL,
+    events INTEGER DEFAULT 0,
+    watch_seconds INTEGER DEFAULT 0,
+    completions INTEGER DEFAULT 0,
+    PRIMARY KEY (bucket, video_id)
+);
+
+CREATE TABLE IF NOT EXISTS watch_rollups_daily (
+    day TEXT NOT NULL, -- 'YYYY-MM-DD' (UTC)
+    course TEXT NOT NULL, -- '*' holds the totals across courses
+    events INTEGER DEFAULT 0,
+    watch_seconds INTEGER DEFAULT 0,
+    completions INTEGER DEFAULT 0,
+    active_videos INTEGER DEFAULT 0,
+    active_students INTEGER DEFAULT 0,
+    PRIMARY KEY (day, course)
+);
+
+-- Videos and students already counted in a daily rollup row
+CREATE TABLE IF NOT EXISTS watch_rollup_members (
+    day TEXT NOT NULL,
+    course TEXT NOT NULL,
+    kind TEXT NOT NULL, -- video, student
+    member TEXT NOT NULL,
+    PRIMARY KEY (day, course, kind, member)
+) WITHOUT ROWID;
+
+-- Last watch event folded into the rollups
+CREATE TABLE IF NOT EXISTS rollup_state (
+    name TEXT PRIMARY KEY,
+    last_event_id INTEGER DEFAULT 0,
+    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Instrumentation: metrics added in by every process when it closes the database
+CREATE TABLE IF NOT EXISTS metric_histograms (
+    name TEXT NOT NULL,
+    labels TEXT NOT NULL, -- JSON object
+    bucket_counts TEXT NOT NULL, -- JSON list, one count per bucket plus +Inf
+    sum REAL DEFAULT 0,
+    count INTEGER DEFAULT 0,
+    PRIMARY KEY (name, labels)
+);
+
+CREATE TABLE IF NOT EXISTS metric_counters (
+    name TEXT NOT NULL,
+    labels TEXT NOT NULL, -- JSON object
+    value REAL DEFAULT 0,
+    PRIMARY KEY (name, labels)
+);
+
+-- Recent statements slower than the slow-query threshold
+CREATE TABLE IF NOT EXISTS slow_queries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    sql TEXT NOT NULL,
+    params TEXT, -- JSON, long values truncated
+    duration_ms REAL NOT NULL,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Schema changes applied by migrations.py (and the query advisor)
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL UNIQUE,
+    statements TEXT NOT NULL, -- JSON list of the SQL run
+    details TEXT, -- JSON, e.g. duration and before/after benchmarks
+    applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Files seen by the integrity scanner. A file whose (size, mtime_ns) is unchanged
+-- keeps its digest, so re-scans only stat the tree and hash what changed
+CREATE TABLE IF NOT EXISTS file_fingerprints (
+    path TEXT PRIMARY KEY, -- Normalized absolute path
+    size INTEGER NOT NULL, -- Bytes
+    mtime_ns INTEGER NOT NULL,
+    sha256 TEXT, -- Digest at this size/mtime (hex), computed on demand
+    reference_sha256 TEXT, -- Known-good digest: upload checksum or first verification
+    scanned_at DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Directories under the upload directory known to the upload watcher. A restart
+-- only lists directories whose mtime changed (0 = files were still pending)
+CREATE TABLE IF NOT EXISTS watched_directories (
+    path TEXT PRIMARY KEY, -- Normalized absolute path
+    mtime_ns INTEGER NOT NULL,
+    scanned_at DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Catalog sync between devices and the server (sync_engine.py). Videos are
+-- identified across databases by video_uid(file_name, file_size)
+CREATE TABLE IF NOT EXISTS sync_state (
+    key TEXT PRIMARY KEY, -- node_id, clock (last HLC stamp), seq (last change sequence)
+    value TEXT NOT NULL
+);
+
+-- Last-writer-wins registers: the winning value of each synced field
+CREATE TABLE IF NOT EXISTS sync_registers (
+    uid TEXT NOT NULL,
+    field TEXT NOT NULL, -- title, rating, notes, category, last_watched or tag:<name>
+    value TEXT, -- JSON
+    hlc TEXT NOT NULL, -- Hybrid logical clock stamp of the write, ending in its node id
+    seq INTEGER NOT NULL, -- Local change sequence; peers are sent rows past their watermark
+    source TEXT, -- Node it was received from (NULL = edited here), never sent back there
+    PRIMARY KEY (uid, field)
+);
+
+-- Grow-only watch counters, one per video and node; watch_count is their sum
+CREATE TABLE IF NOT EXISTS sync_counters (
+    uid TEXT NOT NULL,
+    node TEXT NOT NULL,
+    value INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    source TEXT,
+    PRIMARY KEY (uid, node)
+);
+
+CREATE TABLE IF NOT EXISTS sync_videos (
+    video_id INTEGER PRIMARY KEY,
+    uid TEXT NOT NULL
+);
+
+-- Videos edited since the last change capture, and when (ms since the epoch)
+CREATE TABLE IF NOT EXISTS sync_dirty (
+    video_id INTEGER PRIMARY KEY,
+    changed_ms INTEGER NOT NULL
+);
+
+CREATE TRIGGER IF NOT EXISTS trg_sync_video_edited
+AFTER UPDATE OF title, rating, notes, category_id, watch_count, last_watched ON videos
+BEGIN
+    INSERT OR REPLACE INTO sync_dirty (video_id, changed_ms)
+    VALUES (NEW.id, CAST((julianday('now') - 2440587.5) * 86400000 AS INTEGER));
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_sync_video_tagged AFTER INSERT ON video_tags
+BEGIN
+    INSERT OR REPLACE INTO sync_dirty (video_id, changed_ms)
+    VALUES (NEW.video_id, CAST((julianday('now') - 2440587.5) * 86400000 AS INTEGER));
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_sync_video_untagged AFTER DELETE ON video_tags
+BEGIN
+    INSERT OR REPLACE INTO sync_dirty (video_id, changed_ms)
+    VALUES (OLD.video_id, CAST((julianday('now') - 2440587.5) * 86400000 AS INTEGER));
+END;
+
+CREATE TABLE IF NOT EXISTS sync_peers (
+    node TEXT PRIMARY KEY,
+    sent_seq INTEGER NOT NULL DEFAULT 0, -- The peer has applied our changes up to here
+    received_seq INTEGER NOT NULL DEFAULT 0, -- We have applied the peer's changes up to here
+    last_sync DATETIME
+);
+
+-- Spaced-repetition state (SM-2) per student and video, kept by study_scheduler.py
+CREATE TABLE IF NOT EXISTS review_cards (
+    student_id TEXT NOT NULL,
+    video_id INTEGER NOT NULL,
+    repetitions INTEGER NOT NULL DEFAULT 0, -- Successful reviews in a row
+    ease REAL NOT NULL DEFAULT 2.5,
+    interval_days INTEGER NOT NULL DEFAULT 0,
+    lapses INTEGER NOT NULL DEFAULT 0,
+    due_date DATE NOT NULL, -- Local calendar day the next review is due
+    last_grade INTEGER, -- SM-2 quality 0-5
+    last_reviewed DATE,
+    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (student_id, video_id),
+    FOREIGN KEY (video_id) REFERENCES videos (id) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS study_budgets (
+    student_id TEXT PRIMARY KEY,
+    daily_minutes INTEGER NOT NULL,
+    weekday_minutes TEXT, -- JSON list of 7 overrides (Monday first, null = daily_minutes)
+    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Fuzzy title search (fuzzy_search.py). Terms are normalized, transliterated
+-- (Devanagari/Gurmukhi to Latin) and spelling-folded words of titles and descriptions
+CREATE TABLE IF NOT EXISTS search_postings (
+    term TEXT NOT NULL,
+    video_id INTEGER NOT NULL,
+    weight REAL NOT NULL, -- 1 for a title word, less for a description word
+    PRIMARY KEY (term, video_id)
+) WITHOUT ROWID;
+
+-- Padded trigrams of every indexed term, to find the terms close to a query word
+CREATE TABLE IF NOT EXISTS search_trigrams (
+    trigram TEXT NOT NULL,
+    term TEXT NOT NULL,
+    PRIMARY KEY (trigram, term)
+) WITHOUT ROWID;
+
+-- Videos whose title or description changed since they were last indexed
+CREATE TABLE IF NOT EXISTS search_dirty (
+    video_id INTEGER PRIMARY KEY
+);
+
+CREATE TRIGGER IF NOT EXISTS trg_search_video_added AFTER INSERT ON videos
+BEGIN
+    INSERT OR IGNORE INTO search_dirty (video_id) VALUES (NEW.id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_search_video_edited AFTER UPDATE OF title, description ON videos
+BEGIN
+    INSERT OR IGNORE INTO search_dirty (video_id) VALUES (NEW.id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_search_video_deleted AFTER DELETE ON videos
+BEGIN
+    INSERT OR IGNORE INTO search_dirty (video_id) VALUES (OLD.id);
+END;
+
 -- Indexes for better performance
 CREATE INDEX IF NOT EXISTS idx_videos_title ON videos(title);
-CREATE INDEX IF NOT EXISTS idx_videos_category ON videos(category_id);
 CREATE INDEX IF NOT EXISTS idx_videos_download_date ON videos(download_date);
 CREATE INDEX IF NOT EXISTS idx_videos_rating ON videos(rating);
 CREATE INDEX IF NOT EXISTS idx_video_tags_video ON video_tags(video_id);
 CREATE INDEX IF NOT EXISTS idx_video_tags_tag ON video_tags(tag_id);
+CREATE INDEX IF NOT EXISTS idx_playlist_videos_position ON playlist_videos(playlist_id, position);
+CREATE INDEX IF NOT EXISTS idx_playlists_name ON playlists(lower(name));
+CREATE INDEX IF NOT EXISTS idx_upload_sessions_status ON upload_sessions(status, updated_at);
+CREATE INDEX IF NOT EXISTS idx_video_renditions_video ON video_renditions(video_id, bitrate_kbps);
+CREATE INDEX IF NOT EXISTS idx_watch_events_student ON watch_events(student_id, video_id);
+CREATE INDEX IF NOT EXISTS idx_watch_events_video ON watch_events(video_id);
+CREATE INDEX IF NOT EXISTS idx_video_terms_video ON video_terms(video_id);
+CREATE INDEX IF NOT EXISTS idx_video_neighbors_score ON video_neighbors(video_id, score DESC);
+CREATE INDEX IF NOT EXISTS idx_watch_events_created ON watch_events(created_at);
+CREATE INDEX IF NOT EXISTS idx_watch_rollups_hourly_video ON watch_rollups_hourly(video_id, bucket);
+CREATE INDEX IF NOT EXISTS idx_sync_registers_seq ON sync_registers(seq);
+CREATE INDEX IF NOT EXISTS idx_sync_counters_seq ON sync_counters(seq);
+CREATE INDEX IF NOT EXISTS idx_sync_videos_uid ON sync_videos(uid);
+CREATE INDEX IF NOT EXISTS idx_search_postings_video ON search_postings(video_id);
+-- Indexes that replace or extend these are created by migrations.py
 
 -- Insert some default categories
 INSERT OR IGNORE INTO categories (name, description) VALUES
@@ -0,0 +1,219 @@
+"""
+Streaming Video Export
+Writes video library exports (JSON, JSON Lines, CSV, optionally gzip-compressed)
+incrementally from database cursors so memory stays bounded for any library size
+"""
+
+import csv
+import gzip
+import json
+import os
+import threading
+from typing import Callable, Dict, List, Optional
+
+
+class ExportCancelled(Exception):
+    """Raised when an export is cancelled before it finishes"""
+
+
+class QuerySource:
+    """A section of an export that is streamed row by row from a SQL query"""
+
+    def __init__(self, query: str, params: tuple = ()):
+        self.query = query
+        self.params = params
+
+
+class StreamingExporter:
+    """Incremental exporter for a VideoDatabase (or StudentVideoManager)"""
+
+    FORMATS = ('json', 'jsonl', 'csv')
+
+    def __init__(self, db, batch_size: int = 500,
+                 progress_callback: Callable[[str, int, int], None] = None):
+        """
+        Args:
+            db: VideoDatabase instance to read from
+            batch_size: Rows fetched from the cursor per round trip
+            progress_callback: Called as (section, rows_written, section_total)
+                after every batch
+        """
+        self.db = db
+        self.batch_size = batch_size
+        self.progress_callback = progress_callback
+        self._cancel_event = threading.Event()
+
+    def cancel(self):
+        """Request cancellation; the running export stops after the current batch"""
+        self._cancel_event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel_event.is_set()
+
+    def export(self, export_path: str, sections: Dict, format: str = 'jsonl',
+               compress: bool = False, csv_section: str = None) -> Dict:
+        """
+        Export sections to a file
+
+        Args:
+            export_path: Destination file path
+            sections: Ordered mapping of section name to either a plain value
+                (written as-is) or a QuerySource (streamed). Plain dict values
+                may themselves contain QuerySource entries.
+            format: 'json', 'jsonl' or 'csv'
+            compress: Write gzip-compressed output
+            csv_section: Section written in CSV mode (defaults to the first
+                streamed section)
+
+        Returns:
+            Summary with the output path and rows written per section
+        """
+        if format not in self.FORMATS:
+            raise ValueError(f"Unsupported export format: {format}")
+
+        self._cancel_event.clear()
+        summary = {'path': export_path, 'format': format, 'compressed': compress, 'rows': {}}
+        temp_path = export_path + '.part'
+
+        opener = gzip.open if compress else open
+        try:
+            with opener(temp_path, 'wt', encoding='utf-8', newline='') as fh:
+                if format == 'json':
+                    self._write_json(fh, sections, summary)
+                elif format == 'jsonl':
+                    self._write_jsonl(fh, sections, summary)
+                else:
+                    self._write_csv(fh, sections, summary, csv_section)
+            os.replace(temp_path, export_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        return summary
+
+    # Row streaming
+    def _iter_batches(self, name: str, source: QuerySource, summary: Dict):
+        """Yield lists of row dicts for a streamed section, reporting progress"""
+        total = self._count_rows(source)
+        written = 0
+        cursor = self.db.conn.execute(source.query, source.params)
+        self._report(name, written, total)
+        while True:
+            if self.cancelled:
+                raise ExportCancelled(f"Export cancelled during section '{name}'")
+            rows = cursor.fetchmany(self.batch_size)
+            if not rows:
+                break
+            yield [dict(row) for row in rows]
+            written += len(rows)
+            summary['rows'][name] = written
+            self._report(name, written, total)
+        summary['rows'].setdefault(name, 0)
+
+    def _count_rows(self, source: QuerySource) -> int:
+        cursor = self.db.conn.execute(f"SELECT COUNT(*) FROM ({source.query})", source.params)
+        return cursor.fetchone()[0]
+
+    def _report(self, name: str, written: int, total: int):
+        if self.progress_callback:
+            self.progress_callback(name, written, total)
+
+    # JSON: same document shape as json.dump, but arrays are streamed
+    def _write_json(self, fh, sections: Dict, summary: Dict):
+        self._write_json_value(fh, sections, summary, path='')
+        fh.write('\n')
+
+    def _write_json_value(self, fh, value, summary: Dict, path: str):
+        if isinstance(value, QuerySource):
+            fh.write('[')
+            first = True
+            for batch in self._iter_batches(path, value, summary):
+                for row in batch:
+                    if not first:
+                        fh.write(', ')
+                    fh.write(json.dumps(row, default=str))
+                    first = False
+            fh.write(']')
+        elif isinstance(value, dict) and self._contains_source(value):
+            fh.write('{')
+            for i, (key, item) in enumerate(value.items()):
+                if i:
+                    fh.write(', ')
+                fh.write(json.dumps(str(key)) + ': ')
+                self._write_json_value(fh, item, summary, f"{path}.{key}" if path else str(key))
+            fh.write('}')
+        else:
+            fh.write(json.dumps(value, default=str))
+
+    # JSON Lines: one record per line, tagged with its section
+    def _write_jsonl(self, fh, sections: Dict, summary: Dict, prefix: str = ''):
+        for key, value in sections.items():
+            name = f"{prefix}.{key}" if prefix else str(key)
+            if isinstance(value, QuerySource):
+                for batch in self._iter_batches(name, value, summary):
+                    fh.writelines(
+                        json.dumps({'section': name, 'data': row}, default=str) + '\n'
+                        for row in batch
+                    )
+            elif isinstance(value, dict) and self._contains_source(value):
+                self._write_jsonl(fh, value, summary, prefix=name)
+            else:
+                fh.write(json.dumps({'section': name, 'data': value}, default=str) + '\n')
+
+    # CSV: a single streamed section with columns taken from the cursor
+    def _write_csv(self, fh, sections: Dict, summary: Dict, csv_section: str = None):
+        streamed = self._streamed_sections(sections)
+        if not streamed:
+            raise ValueError("CSV export requires at least one streamed section")
+        if csv_section is None:
+            name, source = streamed[0]
+        else:
+            matches = [item for item in streamed if item[0] == csv_section]
+            if not matches:
+                raise ValueError(f"Unknown CSV section: {csv_section}")
+            name, source = matches[0]
+
+        writer = None
+        for batch in self._iter_batches(name, source, summary):
+            if writer is None:
+                writer = csv.DictWriter(fh, fieldnames=list(batch[0].keys()))
+                writer.writeheader()
+            writer.writerows(batch)
+        if writer is None:
+            cursor = self.db.conn.execute(f"SELECT * FROM ({source.query}) LIMIT 0", source.params)
+            csv.writer(fh).writerow([column[0] for column in cursor.description])
+
+    @classmethod
+    def _streamed_sections(cls, sections: Dict, prefix: str = '') -> List:
+        found = []
+        for key, value in sections.items():
+            name = f"{prefix}.{key}" if prefix else str(key)
+            if isinstance(value, QuerySource):
+                found.append((name, value))
+            elif isinstance(value, dict):
+                found.extend(cls._streamed_sections(value, prefix=name))
+        return found
+
+    @classmethod
+    def _contains_source(cls, value: Dict) -> bool:
+        return bool(cls._streamed_sections(value))
+
+
+def parse_export_format(format: str) -> tuple:
+    """
+    Split a requested format such as 'jsonl.gz' into (format, compress)
+
+    Returns:
+        Tuple of base format and whether gzip compression was requested
+    """
+    format = (format or 'json').lower()
+    compress = format.endswith('.gz') or format.endswith('+gzip')
+    base = format.replace('+gzip', '').replace('.gz', '')
+    return base, compress
+
+
+def export_extension(format: str, compress: bool) -> str:
+    """File extension for an export format"""
+    return f".{format}.gz" if compress else f".{format}"
@@ -1,72 +1,372 @@
 #!/usr/bin/env python3
 """
 Wrapper script for Node.js to Python integration
-Usage: python video_integration_wrapper.py <command> [json_data]
+Usage: python video_integration_wrapper.py [--profile] <command> [json_data]
+
+Node starts a new process for every call, so startup time is paid on each
+request. Commands are looked up in COMMANDS before anything heavy is imported,
+the integration opens the database and its subsystems only when the command
+touches them, and read-only commands skip seeding and the upload directory
+mkdir. Check where startup time goes with
+
+    python -X importtime video_integration_wrapper.py get_offline_videos 2> imports.log
+
+A read-only command that takes longer than COLD_START_BUDGET_MS logs a warning.
 """
 
 import sys
 import json
-from video_database_integration import EduNabhaVideoIntegration
+import time
+
+STARTED = time.perf_counter()
+
+# Wall time from the wrapper starting to execute until the command's output is
+# written, for read-only commands with a warm bytecode cache (interpreter
+# startup itself adds ~20ms on top)
+COLD_START_BUDGET_MS = 100
+
+# {name: (handler(integration, args), read_only)}
+COMMANDS = {}
+
+
+class RawOutput(str):
+    """Command output written to stdout as-is instead of as JSON"""
+
+
+def command(name: str, read_only: bool = False):
+    """Register a handler for a wrapper command; read_only commands never write"""
+    def decorator(func):
+        COMMANDS[name] = (func, read_only)
+        return func
+    return decorator
+
+
+def _data(args: list) -> dict:
+    """Required JSON argument"""
+    return json.loads(args[0])
+
+
+def _options(args: list) -> dict:
+    """Optional JSON argument"""
+    return json.loads(args[0]) if args else {}
+
+
+# Library
+@command('add_video')
+def add_video(integration, args):
+    return integration.add_downloaded_video(_data(args))
+
+
+@command('get_offline_videos', read_only=True)
+def get_offline_videos(integration, args):
+    return integration.get_offline_videos_for_react()
+
+
+@command('get_storage_info', read_only=True)
+def get_storage_info(integration, args):
+    return integration.get_storage_info_enhanced()
+
+
+@command('update_progress')
+def update_progress(integration, args):
+    data = _data(args)
+    return integration.update_video_progress(
+        data['videoId'], data['watchTime'], data['completed'],
+        data.get('studentId', 'local')
+    )
+
+
+@command('delete_video')
+def delete_video(integration, args):
+    return integration.delete_video_enhanced(args[0])
+
+
+@command('delete_videos')
+def delete_videos(integration, args):
+    return integration.delete_videos_bulk(_data(args))
+
+
+@command('restore_videos')
+def restore_videos(integration, args):
+    return integration.restore_deleted_videos(_data(args)['videoIds'])
+
+
+@command('trash_list', read_only=True)
+def trash_list(integration, args):
+    return integration.get_trash_listing(_options(args).get('limit'))
+
+
+@command('reclaim_trash')
+def reclaim_trash(integration, args):
+    return integration.reclaim_trash(_options(args))
+
+
+@command('get_study_dashboard', read_only=True)
+def get_study_dashboard(integration, args):
+    return integration.get_study_dashboard()
+
+
+@command('study_plan', read_only=True)
+def study_plan(integration, args):
+    return integration.get_study_plan(_options(args))
+
+
+@command('study_budget')
+def study_budget(integration, args):
+    return integration.set_study_budget(_data(args))
+
+
+@command('study_review')
+def study_review(integration, args):
+    return integration.record_study_review(_data(args))
+
+
+@command('search_videos', read_only=True)
+def search_videos(integration, args):
+    data = _data(args)
+    return integration.search_videos_enhanced(data.get('query', ''), data.get('filters', {}))
+
+
+@command('export_study_data', read_only=True)
+def export_study_data(integration, args):
+    return integration.export_study_data(_options(args).get('format', 'json'))
+
+
+# Recommendations
+@command('get_recommendations', read_only=True)
+def get_recommendations(integration, args):
+    return integration.get_recommendations(_options(args).get('studentId', 'local'))
+
+
+@command('get_similar_videos', read_only=True)
+def get_similar_videos(integration, args):
+    data = _data(args)
+    return integration.get_similar_videos(data['videoId'], data.get('limit', 5))
+
+
+@command('rebuild_recommendations')
+def rebuild_recommendations(integration, args):
+    return integration.rebuild_recommendations()
+
+
+# Uploads and renditions
+@command('upload_create')
+def upload_create(integration, args):
+    return integration.create_upload(_data(args))
+
+
+@command('upload_chunk')
+def upload_chunk(integration, args):
+    return integration.upload_chunk(_data(args))
+
+
+@command('upload_status', read_only=True)
+def upload_status(integration, args):
+    return integration.get_upload_status(args[0])
+
+
+@command('upload_abort')
+def upload_abort(integration, args):
+    return integration.abort_upload(args[0])
+
+
+@command('package_renditions')
+def package_renditions(integration, args):
+    return integration.package_video_renditions(args[0])
+
+
+@command('select_rendition', read_only=True)
+def select_rendition(integration, args):
+    data = _data(args)
+    return integration.select_rendition_for_device(data['videoId'], data.get('device', {}))
+
+
+# Downloads
+@command('download_start')
+def download_start(integration, args):
+    data = _data(args)
+    return integration.start_segmented_download(data['videoId'], data)
+
+
+@command('download_segments_done')
+def download_segments_done(integration, args):
+    data = _data(args)
+    return integration.record_downloaded_segments(data['videoId'], data['segments'])
+
+
+@command('download_plan', read_only=True)
+def download_plan(integration, args):
+    data = _data(args)
+    return integration.get_download_plan(
+        data['videoId'], data.get('playbackSeconds', 0), data.get('limit')
+    )
+
+
+@command('download_verify')
+def download_verify(integration, args):
+    return integration.verify_download(args[0])
+
+
+@command('plan_prefetch', read_only=True)
+def plan_prefetch(integration, args):
+    return integration.plan_prefetch(_options(args))
+
+
+# Analytics
+@command('engagement_curve', read_only=True)
+def engagement_curve(integration, args):
+    options = _options(args)
+    return integration.get_engagement_curve(int(options.get('days', 30)), options.get('snapshot'))
+
+
+@command('completion_funnel', read_only=True)
+def completion_funnel(integration, args):
+    return integration.get_completion_funnel(_options(args).get('snapshot'))
+
+
+@command('watch_time_distribution', read_only=True)
+def watch_time_distribution(integration, args):
+    return integration.get_watch_time_distribution(_options(args).get('snapshot'))
+
+
+@command('cohort_retention', read_only=True)
+def cohort_retention(integration, args):
+    options = _options(args)
+    return integration.get_cohort_retention(int(options.get('weeks', 8)), options.get('snapshot'))
+
+
+@command('watch_series')
+def watch_series(integration, args):
+    return integration.get_watch_series(_options(args))
+
+
+@command('rollup_maintenance')
+def rollup_maintenance(integration, args):
+    return integration.run_rollup_maintenance(_options(args))
+
+
+# Library integrity
+@command('integrity_scan')
+def integrity_scan(integration, args):
+    return integration.scan_library(_options(args))
+
+
+@command('integrity_repair')
+def integrity_repair(integration, args):
+    return integration.repair_library(_options(args))
+
+
+@command('ingest_uploads')
+def ingest_uploads(integration, args):
+    from upload_watcher import UploadWatcher
+    options = _options(args)
+    watcher = UploadWatcher(integration, settle_seconds=options.get('settleSeconds', 5.0), backend='poll')
+    ingested = watcher.catch_up()
+    return {'success': True, 'ingested': ingested, **watcher.status()}
+
+
+# Backups
+@command('backup_create')
+def backup_create(integration, args):
+    return integration.create_backup(_options(args))
+
+
+@command('backup_list', read_only=True)
+def backup_list(integration, args):
+    return integration.list_backups()
+
+
+@command('backup_scheduled')
+def backup_scheduled(integration, args):
+    return integration.run_scheduled_backup(_options(args))
+
+
+@command('backup_restore')
+def backup_restore(integration, args):
+    return integration.restore_backup(_options(args))
+
+
+# Catalog sync
+@command('sync_with_server')
+def sync_with_server(integration, args):
+    return integration.sync_with_server(_data(args))
+
+
+@command('sync_status', read_only=True)
+def sync_status(integration, args):
+    return integration.get_sync_status()
+
+
+@command('get_metrics', read_only=True)
+def get_metrics(integration, args):
+    if _options(args).get('format') == 'json':
+        return integration.get_metrics('json')
+    return RawOutput(integration.get_metrics())
+
+
+# Playlists
+@command('course_playlist', read_only=True)
+def course_playlist(integration, args):
+    return integration.get_course_playlist(args[0])
+
+
+@command('playlist_reorder')
+def playlist_reorder(integration, args):
+    data = _data(args)
+    return integration.reorder_playlist(data['playlistId'], data.get('moves', []))
+
+
+@command('playlist_remove')
+def playlist_remove(integration, args):
+    data = _data(args)
+    return integration.remove_from_playlist(data['playlistId'], data['videoId'])
+
 
 def main():
+    # --profile forces a CPU/allocation profile of this command (see profiling.py)
+    force_profile = '--profile' in sys.argv
+    if force_profile:
+        sys.argv.remove('--profile')
     if len(sys.argv) < 2:
         print(json.dumps({"error": "No command provided"}))
         sys.exit(1)
-    
-    command = sys.argv[1]
-    integration = EduNabhaVideoIntegration()
-    
+
+    name, args = sys.argv[1], sys.argv[2:]
+    if name not in COMMANDS:
+        print(json.dumps({"error": f"Unknown command: {name}"}))
+        sys.exit(1)
+    handler, read_only = COMMANDS[name]
+
+    # Imported only once the command is known to be valid
+    from instrumentation import configure_logging, get_logger
+    from profiling import start_profile
+    from video_database_integration import EduNabhaVideoIntegration
+
+    configure_logging()  # Logs go to stderr (or $EDUNABHA_LOG_FILE); stdout carries only the result
+    profile = start_profile(f"wrapper.{name}", force=force_profile)
+    integration = EduNabhaVideoIntegration(read_only=read_only)
+
     try:
-        if command == 'add_video':
-            video_data = json.loads(sys.argv[2])
-            result = integration.add_downloaded_video(video_data)
-            print(json.dumps(result))
-        
-        elif command == 'get_offline_videos':
-            result = integration.get_offline_videos_for_react()
-            print(json.dumps(result))
-        
-        elif command == 'get_storage_info':
-            result = integration.get_storage_info_enhanced()
-            print(json.dumps(result))
-        
-        elif command == 'update_progress':
-            data = json.loads(sys.argv[2])
-            result = integration.update_video_progress(
-                data['videoId'], data['watchTime'], data['completed']
-            )
-            print(json.dumps(result))
-        
-        elif command == 'delete_video':
-            video_id = sys.argv[2]
-            result = integration.delete_video_enhanced(video_id)
-            print(json.dumps(result))
-        
-        elif command == 'get_study_dashboard':
-            result = integration.get_study_dashboard()
-            print(json.dumps(result))
-        
-        elif command == 'search_videos':
-            data = json.loads(sys.argv[2])
-            result = integration.search_videos_enhanced(
-                data.get('query', ''), data.get('filters', {})
-            )
-            print(json.dumps(result))
-        
-        elif command == 'get_recommendations':
-            result = integration.get_recommendations()
-            print(json.dumps(result))
-        
+        result = handler(integration, args)
+        if isinstance(result, RawOutput):
+            print(result, end='')
         else:
-            print(json.dumps({"error": f"Unknown command: {command}"}))
-            sys.exit(1)
-    
+            print(json.dumps(result))
+
     except Exception as e:
         print(json.dumps({"error": str(e)}))
         sys.exit(1)
-    
+
     finally:
         integration.close()
+        profile.stop()
+        elapsed_ms = (time.perf_counter() - STARTED) * 1000
+        if read_only and elapsed_ms > COLD_START_BUDGET_MS and not force_profile:
+            get_logger('wrapper').warning(
+                "Read-only command %s took %.1fms, over the %dms cold-start budget",
+                name, elapsed_ms, COLD_START_BUDGET_MS,
+                extra={'command': name, 'duration_ms': round(elapsed_ms, 1)}
+            )
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
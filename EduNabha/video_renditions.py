@@ -0,0 +1,344 @@
+"""
+Video Renditions
+Adaptive bitrate ladder: packages a video into several encoded, segmented
+renditions and picks the smallest one that satisfies a device's constraints
+"""
+
+import os
+import re
+import shutil
+from typing import Dict, List, Optional
+
+
+# Default encoding ladder, smallest first
+DEFAULT_LADDER = [
+    {'label': '240p', 'width': 426, 'height': 240, 'bitrate_kbps': 400},
+    {'label': '360p', 'width': 640, 'height': 360, 'bitrate_kbps': 700},
+    {'label': '480p', 'width': 854, 'height': 480, 'bitrate_kbps': 1200},
+    {'label': '720p', 'width': 1280, 'height': 720, 'bitrate_kbps': 2500},
+    {'label': '1080p', 'width': 1920, 'height': 1080, 'bitrate_kbps': 5000},
+]
+
+RESOLUTION_ALIASES = {
+    'sd': 480,
+    'hd': 720,
+    'fhd': 1080,
+    'full hd': 1080,
+    'qhd': 1440,
+    '2k': 1440,
+    'uhd': 2160,
+    '4k': 2160,
+}
+
+
+def parse_resolution_label(label: str) -> Optional[int]:
+    """Convert a resolution label such as '1080p', 'HD' or '1280x720' to a pixel height"""
+    if not label:
+        return None
+    text = str(label).strip().lower()
+    if text in RESOLUTION_ALIASES:
+        return RESOLUTION_ALIASES[text]
+    match = re.fullmatch(r'(\d+)\s*x\s*(\d+)', text)
+    if match:
+        return int(match.group(2))
+    match = re.fullmatch(r'(\d+)\s*[pi]?', text)
+    if match:
+        return int(match.group(1))
+    return None
+
+
+def probe_video(path: str, ffprobe_path: str = None) -> Dict:
+    """
+    Duration and resolution of a video file via ffprobe
+
+    Returns:
+        {'duration': seconds, 'resolution': e.g. '720p'}, or {} when ffprobe is
+        not installed or cannot read the file
+    """
+    ffprobe_path = ffprobe_path or shutil.which('ffprobe')
+    if not ffprobe_path:
+        return {}
+    import json
+    import subprocess
+    command = [
+        ffprobe_path, '-v', 'error', '-print_format', 'json', '-select_streams', 'v:0',
+        '-show_entries', 'format=duration:stream=height', path
+    ]
+    try:
+        output = json.loads(subprocess.run(command, capture_output=True, check=True, timeout=60).stdout)
+    except (OSError, ValueError, subprocess.SubprocessError):
+        return {}
+    info = {}
+    duration = output.get('format', {}).get('duration')
+    if duration:
+        info['duration'] = int(round(float(duration)))
+    streams = output.get('streams') or [{}]
+    if streams[0].get('height'):
+        info['resolution'] = f"{streams[0]['height']}p"
+    return info
+
+
+class StubEncoder:
+    """
+    Local stand-in for a real encoder. Produces segments whose sizes match the
+    rung's bitrate by slicing the source bytes, so the ladder, playlists and
+    selection logic can be exercised without ffmpeg.
+    """
+
+    codec = 'stub'
+    extension = 'ts'
+
+    def encode_segments(self, source_path: str, output_dir: str, rung: Dict,
+                        duration: float, segment_duration: int) -> List[Dict]:
+        bytes_per_second = rung['bitrate_kbps'] * 1000 / 8
+        source_size = os.path.getsize(source_path)
+        if bytes_per_second * duration > source_size:
+            # Never produce more bytes than the source holds
+            bytes_per_second = source_size / duration
+
+        segments = []
+        sequence = 0
+        elapsed = 0.0
+        with open(source_path, 'rb') as source:
+            while elapsed < duration:
+                seg_duration = min(segment_duration, duration - elapsed)
+                path = os.path.join(output_dir, f"segment_{sequence:05d}.{self.extension}")
+                with open(path, 'wb') as out:
+                    remaining = int(bytes_per_second * seg_duration)
+                    while remaining > 0:
+                        block = source.read(min(remaining, 1024 * 1024))
+                        if not block:
+                            break
+                        out.write(block)
+                        remaining -= len(block)
+                segments.append({
+                    'sequence': sequence,
+                    'file_path': path,
+                    'byte_size': os.path.getsize(path),
+                    'duration': round(seg_duration, 3)
+                })
+                elapsed += seg_duration
+                sequence += 1
+        return segments
+
+
+class FfmpegEncoder:
+    """Encodes and segments renditions with ffmpeg's HLS muxer"""
+
+    codec = 'h264'
+    extension = 'ts'
+
+    def __init__(self, ffmpeg_path: str = None):
+        self.ffmpeg_path = ffmpeg_path or shutil.which('ffmpeg')
+
+    def encode_segments(self, source_path: str, output_dir: str, rung: Dict,
+                        duration: float, segment_duration: int) -> List[Dict]:
+        playlist = os.path.join(output_dir, 'ffmpeg.m3u8')
+        command = [
+            self.ffmpeg_path, '-y', '-loglevel', 'error', '-i', source_path,
+            '-vf', f"scale=-2:{rung['height']}",
+            '-c:v', 'libx264', '-b:v', f"{rung['bitrate_kbps']}k",
+            '-maxrate', f"{rung['bitrate_kbps']}k", '-bufsize', f"{rung['bitrate_kbps'] * 2}k",
+            '-c:a', 'aac', '-b:a', '96k',
+            '-f', 'hls', '-hls_time', str(segment_duration), '-hls_playlist_type', 'vod',
+            '-hls_segment_filename', os.path.join(output_dir, 'segment_%05d.ts'),
+            playlist
+        ]
+        import subprocess  # Deferred: selecting a rendition never encodes
+        subprocess.run(command, check=True)
+
+        segments = []
+        seg_duration = None
+        with open(playlist, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line.startswith('#EXTINF:'):
+                    seg_duration = float(line[8:].split(',')[0])
+                elif line and not line.startswith('#'):
+                    path = os.path.join(output_dir, line)
+                    segments.append({
+                        'sequence': len(segments),
+                        'file_path': path,
+                        'byte_size': os.path.getsize(path),
+                        'duration': seg_duration or segment_duration
+                    })
+        os.remove(playlist)
+        return segments
+
+
+def default_encoder():
+    """ffmpeg when it is installed, otherwise the local stub"""
+    return FfmpegEncoder() if shutil.which('ffmpeg') else StubEncoder()
+
+
+class RenditionManager:
+    """Packages videos into renditions and selects one per device"""
+
+    def __init__(self, db, output_root: str, encoder=None, ladder: List[Dict] = None,
+                 segment_duration: int = 6):
+        """
+        Args:
+            db: VideoDatabase instance
+            output_root: Directory renditions are written under (one folder per video)
+            encoder: Object with encode_segments(); defaults to default_encoder()
+            ladder: Rungs to package, smallest first
+            segment_duration: Target segment length in seconds
+        """
+        self.db = db
+        self.output_root = output_root
+        self.encoder = encoder or default_encoder()
+        self.ladder = ladder or DEFAULT_LADDER
+        self.segment_duration = segment_duration
+
+    def package_video(self, video_id: int) -> List[Dict]:
+        """
+        Encode and segment every ladder rung up to the source resolution
+
+        Returns:
+            The renditions now stored for the video
+        """
+        video = self.db.get_video(video_id)
+        if not video:
+            raise ValueError(f"Video {video_id} not found")
+        if not video.get('file_path') or not os.path.exists(video['file_path']):
+            raise FileNotFoundError(f"Source file missing for video {video_id}")
+
+        source_height = parse_resolution_label(video.get('resolution')) or self.ladder[-1]['height']
+        duration = video.get('duration') or self._estimate_duration(video, source_height)
+        rungs = [rung for rung in self.ladder if rung['height'] <= source_height] or self.ladder[:1]
+
+        video_dir = os.path.join(self.output_root, str(video_id))
+        for rung in rungs:
+            rung_dir = os.path.join(video_dir, rung['label'])
+            if os.path.isdir(rung_dir):
+                shutil.rmtree(rung_dir)
+            os.makedirs(rung_dir)
+
+            segments = self.encoder.encode_segments(
+                video['file_path'], rung_dir, rung, duration, self.segment_duration
+            )
+            playlist_path = os.path.join(rung_dir, 'index.m3u8')
+            self._write_media_playlist(playlist_path, segments)
+            self._store_rendition(video_id, rung, playlist_path, segments)
+
+        renditions = self.get_renditions(video_id)
+        self._write_master_playlist(os.path.join(video_dir, 'master.m3u8'), renditions)
+        return renditions
+
+    def get_renditions(self, video_id: int) -> List[Dict]:
+        """Renditions of a video, smallest bitrate first"""
+        cursor = self.db.conn.execute(
+            "SELECT * FROM video_renditions WHERE video_id = ? ORDER BY bitrate_kbps",
+            (video_id,)
+        )
+        return [dict(row) for row in cursor.fetchall()]
+
+    def get_segments(self, rendition_id: int) -> List[Dict]:
+        """Segment index of a rendition in playback order"""
+        cursor = self.db.conn.execute(
+            "SELECT * FROM rendition_segments WHERE rendition_id = ? ORDER BY sequence",
+            (rendition_id,)
+        )
+        return [dict(row) for row in cursor.fetchall()]
+
+    def select_rendition(self, video_id: int, screen_height: int = None,
+                         bandwidth_kbps: float = None, max_bytes: int = None,
+                         headroom: float = 0.8) -> Optional[Dict]:
+        """
+        Pick the smallest rendition that meets the device's constraints
+
+        Args:
+            video_id: Video to choose a rendition for
+            screen_height: Device display height; larger renditions are wasted bytes
+            bandwidth_kbps: Measured connection speed; the rendition bitrate must fit
+                within bandwidth * headroom to play without stalling
+            max_bytes: Storage or data budget for the whole rendition
+            headroom: Fraction of the bandwidth the rendition may use
+
+        Returns:
+            The chosen rendition with a 'constrained' flag (True when no rendition
+            satisfied every constraint and the smallest one was returned), or None
+            if the video has no renditions
+        """
+        renditions = self.get_renditions(video_id)
+        if not renditions:
+            return None
+
+        def fits(rendition):
+            if bandwidth_kbps is not None and rendition['bitrate_kbps'] > bandwidth_kbps * headroom:
+                return False
+            if max_bytes is not None and rendition['total_size'] > max_bytes:
+                return False
+            return True
+
+        feasible = [r for r in renditions if fits(r)]
+        if not feasible:
+            choice, constrained = renditions[0], True
+        else:
+            # Smallest feasible rendition that fills the screen, else the best below it;
+            # without a screen height nothing says a larger rendition is worth its bytes
+            filling = [r for r in feasible if r['height'] >= (screen_height or 0)]
+            choice = filling[0] if filling else feasible[-1]
+            constrained = False
+
+        result = dict(choice)
+        result['constrained'] = constrained
+        if bandwidth_kbps:
+            result['estimated_download_seconds'] = round(
+                result['total_size'] * 8 / (bandwidth_kbps * 1000), 1
+            )
+        return result
+
+    # Internal helpers
+    def _estimate_duration(self, video: Dict, source_height: int) -> float:
+        """Guess the duration from file size and a typical bitrate for the resolution"""
+        rung = min(self.ladder, key=lambda r: abs(r['height'] - source_height))
+        size = video.get('file_size') or os.path.getsize(video['file_path'])
+        return max(1.0, size * 8 / (rung['bitrate_kbps'] * 1000))
+
+    def _store_rendition(self, video_id: int, rung: Dict, playlist_path: str, segments: List[Dict]):
+        with self.db.transaction():
+            self.db.conn.execute(
+                "DELETE FROM rendition_segments WHERE rendition_id IN "
+                "(SELECT id FROM video_renditions WHERE video_id = ? AND label = ?)",
+                (video_id, rung['label'])
+            )
+            self.db.conn.execute(
+                "DELETE FROM video_renditions WHERE video_id = ? AND label = ?",
+                (video_id, rung['label'])
+            )
+            cursor = self.db.conn.execute(
+                """INSERT INTO video_renditions (video_id, label, width, height, bitrate_kbps, codec,
+                                                 playlist_path, total_size, segment_duration, segment_count)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                (video_id, rung['label'], rung.get('width'), rung['height'], rung['bitrate_kbps'],
+                 getattr(self.encoder, 'codec', None), playlist_path,
+                 sum(s['byte_size'] for s in segments), self.segment_duration, len(segments))
+            )
+            rendition_id = cursor.lastrowid
+            self.db.conn.executemany(
+                """INSERT INTO rendition_segments (rendition_id, sequence, file_path, byte_size, duration)
+                   VALUES (?, ?, ?, ?, ?)""",
+                [(rendition_id, s['sequence'], s['file_path'], s['byte_size'], s['duration'])
+                 for s in segments]
+            )
+
+    def _write_media_playlist(self, path: str, segments: List[Dict]):
+        target = max([int(s['duration'] + 0.999) for s in segments] or [self.segment_duration])
+        lines = ['#EXTM3U', '#EXT-X-VERSION:3', f'#EXT-X-TARGETDURATION:{target}',
+                 '#EXT-X-MEDIA-SEQUENCE:0', '#EXT-X-PLAYLIST-TYPE:VOD']
+        for segment in segments:
+            lines.append(f"#EXTINF:{segment['duration']:.3f},")
+            lines.append(os.path.basename(segment['file_path']))
+        lines.append('#EXT-X-ENDLIST')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+
+    def _write_master_playlist(self, path: str, renditions: List[Dict]):
+        lines = ['#EXTM3U', '#EXT-X-VERSION:3']
+        for rendition in renditions:
+            resolution = f",RESOLUTION={rendition['width']}x{rendition['height']}" if rendition['width'] else ''
+            lines.append(f"#EXT-X-STREAM-INF:BANDWIDTH={rendition['bitrate_kbps'] * 1000}{resolution}")
+            lines.append(f"{rendition['label']}/index.m3u8")
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
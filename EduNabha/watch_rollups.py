@@ -0,0 +1,253 @@
+"""
+Watch Rollups
+Hourly and daily aggregates of watch events, built incrementally from a
+watermark so dashboards read a few rollup rows instead of the raw history
+"""
+
+import datetime
+import threading
+from collections import defaultdict
+from typing import Dict, List
+
+from instrumentation import get_logger
+from video_analytics import course_from_description
+
+
+logger = get_logger('watch_rollups')
+
+
+ALL_COURSES = '*'  # Daily rows holding the totals across courses
+STATE_NAME = 'watch_events'
+
+
+class WatchRollups:
+    """Maintains the watch_rollups_* tables and serves range queries from them"""
+
+    def __init__(self, db, batch_size: int = 5000):
+        """
+        Args:
+            db: VideoDatabase instance
+            batch_size: Watch events folded per transaction
+        """
+        self.db = db
+        self.batch_size = batch_size
+
+    def watermark(self) -> int:
+        """ID of the last watch event included in the rollups"""
+        row = self.db.conn.execute(
+            "SELECT last_event_id FROM rollup_state WHERE name = ?", (STATE_NAME,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def status(self) -> Dict:
+        last_event_id = self.watermark()
+        pending = self.db.conn.execute(
+            "SELECT COUNT(*) FROM watch_events WHERE id > ?", (last_event_id,)
+        ).fetchone()[0]
+        return {'lastEventId': last_event_id, 'pendingEvents': pending}
+
+    def run_pending(self, max_batches: int = None) -> int:
+        """
+        Fold watch events newer than the watermark into the rollups
+
+        Each batch and the watermark advance are committed together, so an
+        interrupted run resumes after the last committed batch.
+
+        Returns:
+            Number of watch events processed
+        """
+        processed = 0
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            count = self._run_batch()
+            if not count:
+                break
+            processed += count
+            batches += 1
+        return processed
+
+    def run(self, interval: float = 60, stop_event: threading.Event = None):
+        """Run the rollups every interval seconds until stop_event is set"""
+        stop_event = stop_event or threading.Event()
+        while not stop_event.is_set():
+            try:
+                self.run_pending()
+            except Exception as e:
+                logger.exception("Error updating watch rollups: %s", e)
+            stop_event.wait(interval)
+
+    def apply_retention(self, raw_days: int = 180, hourly_days: int = 35,
+                        now: datetime.datetime = None) -> Dict:
+        """
+        Downsample old data that is already covered by the rollups
+
+        Raw events older than raw_days are reduced to the latest event per
+        student and video (the recommendation index and resume positions only
+        need that one), and hourly rollups older than hourly_days are dropped
+        in favour of the daily ones.
+
+        Returns:
+            Rows removed per table
+        """
+        self.run_pending()
+        now = now or datetime.datetime.utcnow()
+        raw_cutoff = (now - datetime.timedelta(days=raw_days)).strftime('%Y-%m-%d %H:%M:%S')
+        hourly_cutoff = (now - datetime.timedelta(days=hourly_days)).strftime('%Y-%m-%d %H:00:00')
+        last_event_id = self.watermark()
+
+        conn = self.db.conn
+        with self.db.transaction():
+            events = conn.execute("""
+                DELETE FROM watch_events
+                WHERE created_at < ? AND id <= ?
+                  AND id NOT IN (SELECT MAX(id) FROM watch_events
+                                 WHERE created_at < ? GROUP BY student_id, video_id)
+            """, (raw_cutoff, last_event_id, raw_cutoff)).rowcount
+            hourly = conn.execute(
+                "DELETE FROM watch_rollups_hourly WHERE bucket < ?", (hourly_cutoff,)
+            ).rowcount
+            members = conn.execute(
+                "DELETE FROM watch_rollup_members WHERE day < ?", (raw_cutoff[:10],)
+            ).rowcount
+        return {'watchEvents': events, 'hourlyRollups': hourly, 'rollupMembers': members}
+
+    # Range queries
+    def daily_series(self, start_date: datetime.date, end_date: datetime.date,
+                     course: str = None) -> List[Dict]:
+        """Daily totals between two dates (inclusive), with empty days filled in"""
+        cursor = self.db.conn.execute("""
+            SELECT day, events, watch_seconds, completions, active_videos, active_students
+            FROM watch_rollups_daily
+            WHERE course = ? AND day BETWEEN ? AND ?
+        """, (course or ALL_COURSES, start_date.isoformat(), end_date.isoformat()))
+        rows = {row['day']: row for row in cursor.fetchall()}
+
+        series = []
+        day = start_date
+        while day <= end_date:
+            row = rows.get(day.isoformat())
+            series.append({
+                'date': day.isoformat(),
+                'events': row['events'] if row else 0,
+                'watchMinutes': round(row['watch_seconds'] / 60, 1) if row else 0.0,
+                'completions': row['completions'] if row else 0,
+                'activeVideos': row['active_videos'] if row else 0,
+                'activeStudents': row['active_students'] if row else 0
+            })
+            day += datetime.timedelta(days=1)
+        return series
+
+    def hourly_series(self, start: datetime.datetime, end: datetime.datetime,
+                      video_id: int = None, course: str = None) -> List[Dict]:
+        """Hourly totals in [start, end), optionally for one video or course"""
+        query = """
+            SELECT bucket, SUM(events) as events, SUM(watch_seconds) as watch_seconds,
+                   SUM(completions) as completions, COUNT(*) as active_videos
+            FROM watch_rollups_hourly
+            WHERE bucket >= ? AND bucket < ?
+        """
+        params = [start.strftime('%Y-%m-%d %H:00:00'), end.strftime('%Y-%m-%d %H:00:00')]
+        if video_id is not None:
+            query += " AND video_id = ?"
+            params.append(video_id)
+        if course:
+            query += " AND course = ?"
+            params.append(course)
+        query += " GROUP BY bucket ORDER BY bucket"
+
+        return [{
+            'hour': row['bucket'],
+            'events': row['events'],
+            'watchMinutes': round(row['watch_seconds'] / 60, 1),
+            'completions': row['completions'],
+            'activeVideos': row['active_videos']
+        } for row in self.db.conn.execute(query, params).fetchall()]
+
+    def courses(self) -> List[str]:
+        cursor = self.db.conn.execute(
+            "SELECT DISTINCT course FROM watch_rollups_daily WHERE course != ? ORDER BY course",
+            (ALL_COURSES,)
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+    # Internal helpers
+    def _run_batch(self) -> int:
+        conn = self.db.conn
+        latest = conn.execute("SELECT MAX(id) FROM watch_events").fetchone()[0] or 0
+        if latest <= self.watermark():
+            return 0  # Nothing pending: readers do not take the write lock
+        with self.db.transaction():
+            # Re-read under the write lock: a concurrent run may have folded these events already
+            last_event_id = self.watermark()
+            cursor = conn.execute("""
+                SELECT e.id, e.video_id, e.student_id, e.event_type, e.watch_seconds,
+                       strftime('%Y-%m-%d %H:00:00', e.created_at) as bucket,
+                       date(e.created_at) as day, v.description
+                FROM watch_events e
+                LEFT JOIN videos v ON v.id = e.video_id
+                WHERE e.id > ?
+                ORDER BY e.id
+                LIMIT ?
+            """, (last_event_id, self.batch_size))
+            rows = cursor.fetchall()
+            if not rows:
+                return 0
+
+            hourly = defaultdict(lambda: [0, 0, 0])
+            daily = defaultdict(lambda: [0, 0, 0])
+            members = set()
+            for row in rows:
+                course = course_from_description(row['description'])
+                completed = 1 if row['event_type'] == 'completed' else 0
+                seconds = row['watch_seconds'] or 0
+                totals = hourly[(row['bucket'], row['video_id'], course)]
+                totals[0] += 1
+                totals[1] += seconds
+                totals[2] += completed
+                for name in (course, ALL_COURSES):
+                    totals = daily[(row['day'], name)]
+                    totals[0] += 1
+                    totals[1] += seconds
+                    totals[2] += completed
+                    members.add((row['day'], name, 'video', str(row['video_id'])))
+                    members.add((row['day'], name, 'student', row['student_id']))
+
+            new_members = defaultdict(lambda: {'video': 0, 'student': 0})
+            for member in members:
+                inserted = conn.execute(
+                    """INSERT OR IGNORE INTO watch_rollup_members (day, course, kind, member)
+                       VALUES (?, ?, ?, ?)""", member
+                ).rowcount
+                if inserted:
+                    new_members[(member[0], member[1])][member[2]] += 1
+
+            conn.executemany("""
+                INSERT INTO watch_rollups_hourly (bucket, video_id, course, events, watch_seconds, completions)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (bucket, video_id) DO UPDATE SET
+                    events = events + excluded.events,
+                    watch_seconds = watch_seconds + excluded.watch_seconds,
+                    completions = completions + excluded.completions
+            """, [key + tuple(totals) for key, totals in hourly.items()])
+
+            conn.executemany("""
+                INSERT INTO watch_rollups_daily (day, course, events, watch_seconds, completions,
+                                                 active_videos, active_students)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (day, course) DO UPDATE SET
+                    events = events + excluded.events,
+                    watch_seconds = watch_seconds + excluded.watch_seconds,
+                    completions = completions + excluded.completions,
+                    active_videos = active_videos + excluded.active_videos,
+                    active_students = active_students + excluded.active_students
+            """, [key + tuple(totals) + (new_members[key]['video'], new_members[key]['student'])
+                  for key, totals in daily.items()])
+
+            conn.execute("""
+                INSERT INTO rollup_state (name, last_event_id, updated_at)
+                VALUES (?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT (name) DO UPDATE SET
+                    last_event_id = excluded.last_event_id,
+                    updated_at = excluded.updated_at
+            """, (STATE_NAME, rows[-1]['id']))
+        return len(rows)